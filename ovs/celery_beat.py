@@ -18,18 +18,16 @@
 Celery beat module
 """
 
-import os
-import imp
 import time
 import cPickle
-import inspect
-from celery import current_app
+from calendar import timegm
+from datetime import datetime
 from celery.beat import Scheduler
+from celery.utils.timeutils import maybe_make_aware, timezone
 from ovs_extensions.db.arakoon.pyrakoon.pyrakoon.compat import ArakoonSockNotReadable
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.system import System
-from ovs.extensions.generic.volatilemutex import volatile_mutex
-from ovs_extensions.storage.exceptions import KeyNotFoundException
+from ovs_extensions.storage.exceptions import AssertException
 from ovs.extensions.storage.persistentfactory import PersistentFactory
 from ovs.lib.helpers.toolbox import Schedule
 
@@ -37,18 +35,26 @@ from ovs.lib.helpers.toolbox import Schedule
 class DistributedScheduler(Scheduler):
     """
     Distributed scheduler that can run on multiple nodes at the same time.
+    Only the node holding the lease executes the schedule. The lease is acquired and renewed using compare-and-swap
+    transactions and carries a fencing token which is incremented on every change of leadership. Every write of the
+    schedule asserts the lease, so a node which lost its lease can no longer overwrite the schedule.
+    The last run information of every entry is stored in a separate key, only changed entries are written.
     """
     TIMEOUT = 60 * 30
+    RENEW_INTERVAL = 60
 
     def __init__(self, *args, **kwargs):
         """
         Initializes the distributed scheduler
         """
-        self._mutex = volatile_mutex('celery_beat', 10)
         self._logger = Logger('celery')
         self._has_lock = False
+        self._lock = None
         self._lock_name = 'ovs_celery_beat_lock'
-        self._entry_name = 'ovs_celery_beat_entries'
+        self._entry_name = 'ovs_celery_beat_entries'  # Single pickled schedule, as written by older versions
+        self._entry_prefix = 'ovs_celery_beat_entry_'
+        self._persisted = {}
+        self._legacy = False
         self._persistent = PersistentFactory.get_client()
         self._schedule_info = {}
         super(DistributedScheduler, self).__init__(*args, **kwargs)
@@ -59,103 +65,158 @@ class DistributedScheduler(Scheduler):
         Setups the schedule
         """
         self._logger.debug('DS setting up schedule')
-        self._load_schedule()
         self.merge_inplace(self._discover_schedule())
         self.install_default_entries(self.schedule)
+        self._load_schedule()
         for schedule, source in self._schedule_info.iteritems():
             self._logger.debug('* {0} ({1})'.format(schedule, source))
         self._logger.debug('DS setting up schedule - done')
 
     def _discover_schedule(self):
+        """
+        Discovers the scheduled tasks from the task registry of the application
+        The ovs.lib modules are imported once by the application (see ovs.celery_run) and every ovs_task with a schedule
+        is registered with its Schedule, so the modules don't have to be loaded again.
+        """
         schedules = {}
         self._schedule_info = {}
-        path = '/'.join([os.path.dirname(__file__), 'lib'])
-        for filename in os.listdir(path):
-            if os.path.isfile('/'.join([path, filename])) and filename.endswith('.py') and filename != '__init__.py':
-                name = filename.replace('.py', '')
-                mod = imp.load_source(name, '/'.join([path, filename]))
-                for member in inspect.getmembers(mod, predicate=inspect.isclass):
-                    if member[1].__module__ == name:
-                        for submember in inspect.getmembers(member[1]):
-                            if hasattr(submember[1], 'schedule') and isinstance(submember[1].schedule, Schedule):
-                                schedule, source = submember[1].schedule.generate_schedule(submember[1].name)
-                                if schedule is not None:
-                                    schedules[submember[1].name] = {'task': submember[1].name,
-                                                                    'schedule': schedule,
-                                                                    'args': []}
-                                self._schedule_info[submember[1].name] = source
+        self.app.loader.import_default_modules()
+        for name, task in sorted(self.app.tasks.iteritems()):
+            if isinstance(getattr(task, 'schedule', None), Schedule):
+                schedule, source = task.schedule.generate_schedule(name)
+                if schedule is not None:
+                    schedules[name] = {'task': name,
+                                       'schedule': schedule,
+                                       'args': []}
+                self._schedule_info[name] = source
         return schedules
 
+    @staticmethod
+    def _serialize_entry(entry):
+        """
+        Serializes the last run information of a schedule entry
+        """
+        last_run_at = None
+        if entry.last_run_at is not None:
+            last_run_at = maybe_make_aware(entry.last_run_at)
+            last_run_at = timegm(last_run_at.utctimetuple()) + last_run_at.microsecond / 1000000.0
+        return {'last_run_at': last_run_at,
+                'total_run_count': entry.total_run_count}
+
     def _load_schedule(self):
         """
-        Loads the most recent schedule from the persistent store
+        Loads the last run information of the schedule entries from the persistent store
         """
-        self.schedule = {}
+        self._logger.debug('DS loading schedule entries')
+        persisted = {}
         try:
-            self._logger.debug('DS loading schedule entries')
-            self._mutex.acquire(wait=10)
-            try:
-                self.schedule = cPickle.loads(str(self._persistent.get(self._entry_name)))
-            except:
-                # In case an exception occurs during loading the schedule, it is ignored and the default schedule
-                # will be used/restored.
-                pass
-        finally:
-            self._mutex.release()
+            for key, value in self._persistent.prefix_entries(self._entry_prefix):
+                persisted[key.replace(self._entry_prefix, '', 1)] = value
+        except Exception:
+            # In case an exception occurs during loading the schedule, it is ignored and the default schedule
+            # will be used/restored.
+            self._logger.exception('DS could not load the schedule entries')
+        self._persisted = dict(persisted)
+        try:
+            legacy = list(self._persistent.get_multi([self._entry_name], must_exist=False))[0]
+            if legacy is not None:
+                self._legacy = True
+                for name, entry in cPickle.loads(str(legacy)).iteritems():
+                    if name not in persisted:
+                        persisted[name] = DistributedScheduler._serialize_entry(entry)
+        except Exception:
+            pass
+        for name, entry in self.schedule.iteritems():
+            if name in persisted:
+                last_run_at = persisted[name]['last_run_at']
+                entry.last_run_at = None if last_run_at is None else datetime.fromtimestamp(last_run_at, timezone.utc)
+                entry.total_run_count = persisted[name]['total_run_count']
+
+    def _acquire_lock(self):
+        """
+        Acquires or renews the lease
+        :return: Whether this node holds the lease
+        :rtype: bool
+        """
+        now = time.time()
+        node_name = System.get_my_machine_id()
+        lock = list(self._persistent.get_multi([self._lock_name], must_exist=False))[0]
+        leader = self._lock is not None and lock == self._lock
+        if lock is None:
+            self._logger.debug('DS there was no lock in tick')
+        elif leader is True:
+            if now - lock['timestamp'] < DistributedScheduler.RENEW_INTERVAL:
+                return True
+            self._logger.debug('DS keeps own lock')
+        elif now - lock['timestamp'] > DistributedScheduler.TIMEOUT:
+            # The current lock is timed out, so the lock is stolen
+            self._logger.debug('DS last lock refresh is {0}s old'.format(now - lock['timestamp']))
+            self._logger.debug('DS stealing lock from {0}'.format(lock['name']))
+        elif lock['name'] == node_name and self._lock is None:
+            self._logger.debug('DS taking over the lock of a previous run on this node')
+        else:
+            self._logger.debug('DS lock is not ours')
+            self._lock = None
+            return False
+
+        token = lock.get('token', 0) if lock is not None else 0
+        new_lock = {'name': node_name,
+                    'timestamp': now,
+                    'token': token if leader is True else token + 1}
+        transaction = self._persistent.begin_transaction()
+        self._persistent.assert_value(self._lock_name, lock, transaction=transaction)
+        self._persistent.set(self._lock_name, new_lock, transaction=transaction)
+        try:
+            self._persistent.apply_transaction(transaction)
+        except AssertException:
+            self._logger.debug('DS lock was taken by another node')
+            self._lock = None
+            return False
+        self._lock = new_lock
+        if leader is False:
+            self._logger.debug('DS acquired lock with token {0}'.format(new_lock['token']))
+            self._load_schedule()  # Another node might have executed the schedule in the meantime
+        return True
 
     def sync(self):
+        """
+        Persists the last run information of the changed schedule entries. Only allowed for the holder of the lease
+        """
         if self._has_lock is True:
+            changes = {}
+            for name, entry in self.schedule.iteritems():
+                state = DistributedScheduler._serialize_entry(entry)
+                if self._persisted.get(name) != state:
+                    changes[name] = state
+            if len(changes) == 0:
+                return
             try:
-                self._logger.debug('DS syncing schedule entries')
-                self._mutex.acquire(wait=10)
-                self._persistent.set(key=self._entry_name,
-                                     value=cPickle.dumps(self.schedule))
+                self._logger.debug('DS syncing {0} schedule entries'.format(len(changes)))
+                transaction = self._persistent.begin_transaction()
+                self._persistent.assert_value(self._lock_name, self._lock, transaction=transaction)  # Fencing
+                for name, state in changes.iteritems():
+                    self._persistent.set('{0}{1}'.format(self._entry_prefix, name), state, transaction=transaction)
+                if self._legacy is True:
+                    self._persistent.delete(self._entry_name, must_exist=False, transaction=transaction)
+                self._persistent.apply_transaction(transaction)
+                self._persisted.update(changes)
+                self._legacy = False
+            except AssertException:
+                self._logger.warning('DS lost the lock, the schedule entries are not synced')
+                self._has_lock = False
+                self._lock = None
             except ArakoonSockNotReadable:
                 self._logger.exception('Syncing the schedule failed this iteration')
-            finally:
-                self._mutex.release()
         else:
             self._logger.debug('DS skipping sync: lock is not ours')
 
     def tick(self):
         """
-        Runs one iteration of the scheduler. This is guarded with a distributed lock
+        Runs one iteration of the scheduler. This is guarded with a distributed lease
         """
         self._logger.debug('DS executing tick')
         try:
-            self._has_lock = False
-            with self._mutex:
-                # noinspection PyProtectedMember
-                node_now = current_app._get_current_object().now()
-                node_timestamp = time.mktime(node_now.timetuple())
-                node_name = System.get_my_machine_id()
-                try:
-                    lock = self._persistent.get(self._lock_name)
-                except KeyNotFoundException:
-                    lock = None
-                if lock is None:
-                    # There is no lock yet, so the lock is acquired
-                    self._has_lock = True
-                    self._logger.debug('DS there was no lock in tick')
-                else:
-                    if lock['name'] == node_name:
-                        # The current node holds the lock
-                        self._logger.debug('DS keeps own lock')
-                        self._has_lock = True
-                    elif node_timestamp - lock['timestamp'] > DistributedScheduler.TIMEOUT:
-                        # The current lock is timed out, so the lock is stolen
-                        self._logger.debug('DS last lock refresh is {0}s old'.format(node_timestamp - lock['timestamp']))
-                        self._logger.debug('DS stealing lock from {0}'.format(lock['name']))
-                        self._load_schedule()
-                        self._has_lock = True
-                    else:
-                        self._logger.debug('DS lock is not ours')
-                if self._has_lock is True:
-                    lock = {'name': node_name,
-                            'timestamp': node_timestamp}
-                    self._logger.debug('DS refreshing lock')
-                    self._persistent.set(self._lock_name, lock)
-
+            self._has_lock = self._acquire_lock()
             if self._has_lock is True:
                 self._logger.debug('DS executing tick workload')
                 remaining_times = []
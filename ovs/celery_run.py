@@ -27,20 +27,20 @@ import threading
 import traceback
 from celery import Celery
 from celery.backends import BACKEND_ALIASES
-from celery.signals import task_postrun, worker_process_init, after_setup_logger, after_setup_task_logger
+from celery.signals import before_task_publish, task_postrun, worker_process_init, worker_ready, after_setup_logger, after_setup_task_logger
 from celery.task.control import inspect
 from kombu import Queue
 from kombu.serialization import register
 from threading import Thread
 from ovs.extensions.celery.extendedyaml import YamlExtender
+from ovs.extensions.celery.workerstate import WorkerState, WorkerStateAggregator
 from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.system import System
-from ovs.extensions.generic.volatilemutex import volatile_mutex
-from ovs_extensions.storage.exceptions import KeyNotFoundException
 from ovs.extensions.storage.persistentfactory import PersistentFactory
 from ovs.extensions.storage.volatilefactory import VolatileFactory
 from ovs.lib.helpers.exceptions import EnsureSingleTimeoutReached
+from ovs.lib.helpers.taskmetrics import TaskMetrics
 from ovs.lib.messaging import MessageController
 
 
@@ -101,8 +101,8 @@ class InspectMockup(object):
     """
     Mockup class for the inspect module
     """
-    states = {'active': []}
-    state_keys = ['active']
+    states = {'active': [], 'reserved': [], 'scheduled': []}
+    state_keys = ['active', 'reserved', 'scheduled']
 
     def __init__(self):
         pass
@@ -161,6 +161,21 @@ else:
     celery.conf.CELERY_TRACK_STARTED = True  # http://docs.celeryproject.org/en/latest/configuration.html#std:setting-CELERY_TRACK_STARTED
     celery.conf.CELERYD_HIJACK_ROOT_LOGGER = False
     celery.conf.CELERY_RESULT_SERIALIZER = 'ovsyaml'  # Change default pickle to ovsyaml as it support more typing than JSON
+    celery.conf.CELERY_SEND_EVENTS = True  # The worker events are aggregated by the WorkerStateAggregator
+
+
+@before_task_publish.connect
+def before_task_publish_handler(sender=None, body=None, **kwds):
+    """
+    Hook for celery before-publish event
+    Registers the publish time, so the queue latency of the task can be measured when it starts
+    """
+    _ = sender, kwds
+    try:
+        if body is not None and 'id' in body:
+            TaskMetrics.register_sent(body['id'])
+    except Exception:
+        ovs_logger.exception('Caught error during before-publish handler')
 
 
 @task_postrun.connect
@@ -176,6 +191,19 @@ def task_postrun_handler(sender=None, task_id=None, task=None, args=None, kwargs
         ovs_logger.exception('Caught error during post-run handler')
 
 
+@worker_ready.connect
+def worker_ready_handler(sender=None, **kwds):
+    """
+    Hook for worker ready
+    Starts the aggregator of the worker state, which stands by as long as another worker is aggregating
+    """
+    _ = sender, kwds
+    try:
+        WorkerStateAggregator.start(celery)
+    except Exception:
+        ovs_logger.exception('Caught error during worker-ready handler')
+
+
 @worker_process_init.connect
 def worker_process_init_handler(args=None, kwargs=None, **kwds):
     """
@@ -197,31 +225,30 @@ def load_ovs_logger(**kwargs):
 def _clean_cache():
     ovs_logger.info('Executing celery "clear_cache" startup script...')
     from ovs.lib.helpers.decorators import ENSURE_SINGLE_KEY
-    active = inspect().active()
+    from ovs.lib.helpers.ensuresingle import EnsureSingleCoordinator
     active_tasks = []
-    if active is not None:
-        for tasks in active.itervalues():
-            active_tasks += [task['id'] for task in tasks]
+    # The aggregated view of the celery events is likely stale at startup, so the workers are inspected as well
+    task_views = [WorkerState.get_tasks(live=True)]
+    try:
+        task_views.append(WorkerState.get_tasks())
+    except Exception:
+        ovs_logger.exception('Could not load the aggregated worker state')
+    for tasks in task_views:
+        for state in ['active', 'reserved', 'scheduled']:  # Scheduled tasks include the tasks parked by the ensure single decorator
+            tasks_per_worker = tasks[state]
+            if tasks_per_worker is not None:
+                for worker_tasks in tasks_per_worker.itervalues():
+                    active_tasks += [task['request']['id'] if 'request' in task else task['id'] for task in worker_tasks]
     cache = PersistentFactory.get_client()
     for key in cache.prefix(ENSURE_SINGLE_KEY):
-        try:
-            with volatile_mutex(name=key, wait=5):
-                entry = cache.get(key)
-                values = entry.get('values', [])
-                new_values = []
-                for v in values:
-                    task_id = v.get('task_id')
-                    if task_id is not None and task_id in active_tasks:
-                        new_values.append(v)
-                if len(new_values) > 0:
-                    entry['values'] = new_values
-                    cache.set(key, entry)
-                    ovs_logger.info('Updated key {0}'.format(key))
-                else:
-                    cache.delete(key)
-                    ovs_logger.info('Deleted key {0}'.format(key))
-        except KeyNotFoundException:
-            pass
+        # Entries are removed using the same compare-and-swap update as the ensure single decorator, so no lock is required
+        value = EnsureSingleCoordinator(key=key, mode=None).update(
+            lambda entry: dict(entry, values=[v for v in entry['values'] if v.get('task_id') is not None and v['task_id'] in active_tasks])
+        )
+        if value is not None:
+            ovs_logger.info('Updated key {0}'.format(key))
+        else:
+            ovs_logger.info('Deleted key {0}'.format(key))
     ovs_logger.info('Executing celery "clear_cache" startup script... done')
 
 
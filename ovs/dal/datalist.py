@@ -268,7 +268,7 @@ class DataList(object):
                     self.from_index = 'partial'
             else:
                 # Item consists of: ( <field>, <operator>, <value>, <ignore_case>(optional) )
-                if item[0] in indexed_properties:
+                if item[0] in indexed_properties and self._none_not_indexed(item) is False:
                     if item[1] == DataList.operator.EQUALS:
                         if item[0] == 'guid':
                             indexed_keys = {object_key.format(item[2])}
@@ -317,7 +317,7 @@ class DataList(object):
     def _can_use_indexes(self, indexed_properties, query_items, where_operator):
         """
         Validates the given query to decide whether it's possible to use indexes.
-        Indexes are possible UNLESS there is a query to a non-indexed property inside an OR block
+        Indexes are possible UNLESS there is a query to a non-indexed property (or to a None value which is not indexed) inside an OR block
         :param indexed_properties: The names of all indexed properties
         :param query_items: The query items
         :param where_operator: The WHERE operator
@@ -331,10 +331,24 @@ class DataList(object):
                 possible = self._can_use_indexes(indexed_properties, item['items'], item['type'])
                 if possible is False:
                     return False
-            elif item[0] not in indexed_properties and where_operator == DataList.where_operator.OR:
+            elif (item[0] not in indexed_properties or self._none_not_indexed(item) is True) and where_operator == DataList.where_operator.OR:
                 return False
         return True
 
+    def _none_not_indexed(self, item):
+        """
+        Verifies whether a query item looks up None for a property of which None values are not indexed
+        :param item: The query item
+        :return: Whether or not the item can not be looked up in the indexes
+        """
+        if item[1] == DataList.operator.EQUALS:
+            looks_up_none = item[2] is None
+        elif item[1] == DataList.operator.IN and isinstance(item[2], list):
+            looks_up_none = None in item[2]
+        else:
+            return False
+        return looks_up_none is True and any(prop.name == item[0] and prop.index_none is False for prop in self._object_type._properties)
+
     def _data_generator(self, prefix, query_items, query_type):
         """
         Generator that yields key-value pairs for the given prefix. If indexes are available an can be
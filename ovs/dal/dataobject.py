@@ -608,7 +608,7 @@ class DataObject(object):
                         raise RuntimeError('An index can only be set on field of type str, int, float, long, or bool')
                     classname = self.__class__.__name__.lower()
                     key = prop.name
-                    if self._new is False and key in changed_fields:
+                    if self._new is False and key in changed_fields and (self._original[key] is not None or prop.index_none is True):
                         original_value = self._original[key]
                         index_key = base_index_key.format(classname, key, hashlib.sha1(str(original_value)).hexdigest())
                         indexed_keys = list(self._persistent.get_multi([index_key], must_exist=False))[0]
@@ -621,7 +621,7 @@ class DataObject(object):
                                 self._persistent.delete(index_key, transaction=transaction)
                             else:
                                 self._persistent.set(index_key, indexed_keys, transaction=transaction)
-                    if self._new is True or key in changed_fields:
+                    if (self._new is True or key in changed_fields) and (self._data[key] is not None or prop.index_none is True):
                         new_value = self._data[key]
                         index_key = base_index_key.format(classname, key, hashlib.sha1(str(new_value)).hexdigest())
                         indexed_keys = list(self._persistent.get_multi([index_key], must_exist=False))[0]
@@ -789,6 +789,8 @@ class DataObject(object):
                     classname = self.__class__.__name__.lower()
                     key = prop.name
                     current_value = self._original[key]
+                    if current_value is None and prop.index_none is False:
+                        continue
                     index_key = base_index_key.format(classname, key, hashlib.sha1(str(current_value)).hexdigest())
                     indexed_keys = list(self._persistent.get_multi([index_key], must_exist=False))[0]
                     if indexed_keys is not None and self._key in indexed_keys:
@@ -19,8 +19,6 @@ VDisk module
 """
 
 import time
-import pickle
-from datetime import datetime
 from ovs.dal.datalist import DataList
 from ovs.dal.dataobject import DataObject
 from ovs.dal.hybrids.storagerouter import StorageRouter
@@ -30,7 +28,7 @@ from ovs.dal.structures import Dynamic, Property, Relation
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.storage.volatilefactory import VolatileFactory
 from ovs.extensions.storageserver.storagedriver import FSMetaDataClient, MaxRedirectsExceededException, ObjectRegistryClient, \
-    SnapshotNotFoundException, StorageDriverClient, VolumeRestartInProgressException, is_connection_failure
+    StorageDriverClient, VolumeRestartInProgressException, is_connection_failure
 
 
 class VDisk(DataObject):
@@ -47,7 +45,7 @@ class VDisk(DataObject):
                     Property('size', int, doc='Size of the vDisk in Bytes.'),
                     Property('devicename', str, doc='The name of the container file (e.g. the VMDK-file) describing the vDisk.'),
                     Property('volume_id', str, mandatory=False, indexed=True, doc='ID of the vDisk in the Open vStorage Volume Driver.'),
-                    Property('parentsnapshot', str, mandatory=False, doc='Points to a parent storage driver parent ID. None if there is no parent Snapshot'),
+                    Property('parentsnapshot', str, mandatory=False, indexed=True, index_none=False, doc='Points to a parent storage driver parent ID. None if there is no parent Snapshot'),
                     Property('cinder_id', str, mandatory=False, doc='Cinder Volume ID, for volumes managed through Cinder'),
                     Property('has_manual_dtl', bool, default=False, doc='Indicates whether the default DTL location has been overruled by customer'),
                     Property('pagecache_ratio', float, default=1.0, doc='Ratio of the volume\'s size that needs to be cached in metadata pages'),
@@ -179,12 +177,9 @@ class VDisk(DataObject):
         """
         Fetches the snapshot IDs for this vDisk
         """
-        if not self.volume_id or not self.vpool:
-            return []
-
-        from ovs.lib.vdisk import VDiskController
+        from ovs.lib.helpers.vdisk.snapshots import SnapshotCatalog
         try:
-            return VDiskController.list_snapshot_ids(vdisk=self)
+            return SnapshotCatalog.get_ids(vdisk=self)
         except:
             return []
 
@@ -192,34 +187,8 @@ class VDisk(DataObject):
         """
         Fetches the information of all snapshots for this vDisk
         """
-        snapshots = []
-        self.invalidate_dynamics('snapshot_ids')
-        for snap_id in self.snapshot_ids:
-            try:
-                snapshot = self.storagedriver_client.info_snapshot(str(self.volume_id), snap_id, req_timeout_secs=2)
-            except SnapshotNotFoundException:
-                continue
-            if snapshot.metadata:
-                metadata = pickle.loads(snapshot.metadata)
-                if isinstance(metadata, dict):
-                    snapshots.append({'guid': snap_id,
-                                      'timestamp': metadata['timestamp'],
-                                      'label': metadata['label'],
-                                      'is_consistent': metadata['is_consistent'],
-                                      'is_automatic': metadata.get('is_automatic', True),
-                                      'is_sticky': metadata.get('is_sticky', False),
-                                      'in_backend': snapshot.in_backend,
-                                      'stored': int(snapshot.stored)})
-            else:
-                snapshots.append({'guid': snap_id,
-                                  'timestamp': time.mktime(datetime.strptime(snapshot.timestamp.strip(), '%c').timetuple()),
-                                  'label': snap_id,
-                                  'is_consistent': False,
-                                  'is_automatic': False,
-                                  'is_sticky': False,
-                                  'in_backend': snapshot.in_backend,
-                                  'stored': int(snapshot.stored)})
-        return snapshots
+        from ovs.lib.helpers.vdisk.snapshots import SnapshotCatalog
+        return SnapshotCatalog.get(vdisk=self)
 
     def _info(self):
         """
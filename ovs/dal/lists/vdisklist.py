@@ -75,6 +75,14 @@ class VDiskList(object):
         return DataList(VDisk, {'type': DataList.where_operator.AND,
                                 'items': [('parentsnapshot', DataList.operator.EQUALS, snapshotid)]})
 
+    @staticmethod
+    def get_by_parentsnapshots(snapshotids):
+        """
+        Gets all vDisks whose parentsnapshot is one of the given snapshotids
+        """
+        return DataList(VDisk, {'type': DataList.where_operator.AND,
+                                'items': [('parentsnapshot', DataList.operator.IN, snapshotids)]})
+
     @staticmethod
     def get_with_parent_snaphots():
         """
@@ -29,7 +29,7 @@ class DALMigrator(object):
     """
 
     identifier = PackageFactory.COMP_MIGRATION_FWK
-    THIS_VERSION = 16
+    THIS_VERSION = 17
 
     def __init__(self):
         """ Init method """
@@ -166,7 +166,7 @@ class DALMigrator(object):
                 # The list caching keys were changed to class|field|list_id instead of class|list_id|field
                 persistent_client.delete_prefix(DataList.generate_persistent_cache_key())
 
-            # Migrate unique constraints & indexes
+            # Migrate unique constraints & indexes (e.g. the VDisk parentsnapshot index, introduced in version 17)
             hybrid_structure = HybridRunner.get_hybrids()
             for class_descriptor in hybrid_structure.values():
                 cls = Descriptor().load(class_descriptor).get_object()
@@ -176,14 +176,20 @@ class DALMigrator(object):
                 index_key = 'ovs_index_{0}|{{0}}|{{1}}'.format(classname)
                 uniques = []
                 indexes = []
+                skip_none = []
                 # noinspection PyProtectedMember
                 for prop in cls._properties:
+                    if prop.indexed is True and prop.index_none is False:
+                        # Objects of which this property is None are not indexed (e.g. the VDisk parentsnapshot)
+                        skip_none.append(prop.name)
+                        persistent_client.delete(index_key.format(prop.name, hashlib.sha1(str(None)).hexdigest()), must_exist=False)
                     if prop.unique is True and len([k for k in persistent_client.prefix(unique_key.format(prop.name))]) == 0:
                         uniques.append(prop.name)
                     if prop.indexed is True and len([k for k in persistent_client.prefix(index_prefix.format(prop.name))]) == 0:
                         indexes.append(prop.name)
                 if len(uniques) > 0 or len(indexes) > 0:
                     prefix = 'ovs_data_{0}_'.format(classname)
+                    new_indexes = {}
                     for key, data in persistent_client.prefix_entries(prefix):
                         for property_name in uniques:
                             ukey = '{0}{1}'.format(unique_key.format(property_name), hashlib.sha1(str(data[property_name])).hexdigest())
@@ -191,16 +197,25 @@ class DALMigrator(object):
                         for property_name in indexes:
                             if property_name not in data:
                                 continue  # This is the case when there's a new indexed property added.
+                            if data[property_name] is None and property_name in skip_none:
+                                continue
                             ikey = index_key.format(property_name, hashlib.sha1(str(data[property_name])).hexdigest())
-                            index = list(persistent_client.get_multi([ikey], must_exist=False))[0]
-                            transaction = persistent_client.begin_transaction()
-                            if index is None:
-                                persistent_client.assert_value(ikey, None, transaction=transaction)
-                                persistent_client.set(ikey, [key], transaction=transaction)
-                            elif key not in index:
-                                persistent_client.assert_value(ikey, index[:], transaction=transaction)
-                                persistent_client.set(ikey, index + [key], transaction=transaction)
-                            persistent_client.apply_transaction(transaction)
+                            new_indexes.setdefault(ikey, []).append(key)
+                    # Every index is written once, instead of rewriting it for every object it contains
+                    for ikey, keys in new_indexes.iteritems():
+                        index = list(persistent_client.get_multi([ikey], must_exist=False))[0]
+                        transaction = persistent_client.begin_transaction()
+                        if index is None:
+                            persistent_client.assert_value(ikey, None, transaction=transaction)
+                            persistent_client.set(ikey, keys, transaction=transaction)
+                        else:
+                            existing = set(index)
+                            missing = [key for key in keys if key not in existing]
+                            if len(missing) == 0:
+                                continue
+                            persistent_client.assert_value(ikey, index[:], transaction=transaction)
+                            persistent_client.set(ikey, index + missing, transaction=transaction)
+                        persistent_client.apply_transaction(transaction)
 
             # Clean up - removal of obsolete 'cfgdir'
             paths = Configuration.get(key='/ovs/framework/paths')
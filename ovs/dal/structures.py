@@ -24,9 +24,11 @@ class Property(object):
     Property
     """
 
-    def __init__(self, name, property_type, mandatory=True, default=None, unique=False, indexed=False, doc=None):
+    def __init__(self, name, property_type, mandatory=True, default=None, unique=False, indexed=False, index_none=True, doc=None):
         """
         Initializes a property
+        When index_none is False, objects of which the property is None are not indexed. Use this for indexed properties
+        which are None for most objects, to avoid a single huge index entry. Lookups of None then scan all objects
         """
         self.name = name
         self.property_type = property_type
@@ -35,6 +37,7 @@ class Property(object):
         self.mandatory = mandatory
         self.unique = unique
         self.indexed = indexed
+        self.index_none = index_none
 
 
 class Relation(object):
@@ -20,6 +20,7 @@ Arakoon ResultBackend Module
 import time
 import yaml
 from celery.backends.base import KeyValueStoreBackend
+from ovs.extensions.celery.resultcodec import ResultCodec
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.storage.persistentfactory import PersistentFactory
 from ovs_extensions.storage.exceptions import KeyNotFoundException
@@ -31,6 +32,12 @@ class ArakoonResultBackend(KeyValueStoreBackend):
     Requires PyYAML
     """
     _NAMESPACE_PREFIX = 'ovs_tasks_'
+    _EXPIRY_PREFIX = 'ovs_task_expiry_'  # Expiry index: <prefix><time bucket>_<key>[_<chunk version>]
+    _CURSOR_KEY = 'ovs_task_expiry_cursor'  # Last bucket of the expiry index which has been cleaned up
+    _BUCKET_SIZE = 3600
+    _BATCH_SIZE = 250
+    _UNFINISHED_STATES = ['STARTED', 'RETRY', 'PENDING']
+    _CHUNK_SIZE = 512 * 1024  # Larger payloads are split over multiple keys, each written in its own transaction
     # Arakoon does not expire of itself. This will enable enable celery beat to add a clean up job every CELERY_TASK_RESULT_EXPIRES seconds (default 1 day)
     supports_autoexpire = False
     supports_native_join = True
@@ -62,8 +69,41 @@ class ArakoonResultBackend(KeyValueStoreBackend):
         return self._set_data(key, value)
 
     def delete(self, key):
+        data = list(self._client.get_multi([key], must_exist=False))[0]
+        if isinstance(data, dict) and data.get('chunks', 0) > 0:
+            for index in xrange(data['chunks']):
+                self._client.delete(self._get_chunk_key(key, data['chunk_version'], index), must_exist=False)
         return self._client.delete(key)
 
+    def encode(self, data):
+        """
+        Encodes a result with the configured celery serializer (ovsyaml), compressed by the ResultCodec when large enough
+        A more compact codec (e.g. 'json' or 'msgpack') can be configured with the option 'result_codec'. Such codecs don't
+        keep all types (e.g. tuples become lists and non-string keys become strings), so they are opt-in. Results such a codec
+        cannot represent fall back to the celery serializer
+        """
+        compression_threshold = self.options.get('result_compression_threshold')
+        codec = self.options.get('result_codec')
+        if codec is not None:
+            try:
+                return ResultCodec.encode(data, codec=codec, compression_threshold=compression_threshold)
+            except (TypeError, ValueError, UnicodeDecodeError):
+                pass
+        return ResultCodec.pack(super(ArakoonResultBackend, self).encode(data),
+                                codec=ResultCodec.SERIALIZER,
+                                compression_threshold=compression_threshold)
+
+    def decode(self, payload):
+        """
+        Decodes a result. Results stored with the celery serializer (e.g. before a ResultCodec was used) remain readable
+        """
+        if ResultCodec.is_encoded(payload):
+            codec, serialized = ResultCodec.unpack(payload)
+            if codec != ResultCodec.SERIALIZER:
+                return ResultCodec.decode(payload)
+            payload = serialized
+        return super(ArakoonResultBackend, self).decode(payload)
+
     def _apply_chord_incr(self, header, partial_args, group_id, body, **opts):
         self._client.set(self.get_key_for_chord(group_id), 0)
         return super(ArakoonResultBackend, self)._apply_chord_incr(header, partial_args, group_id, body, **opts)
@@ -99,6 +139,17 @@ class ArakoonResultBackend(KeyValueStoreBackend):
         """
         return '{0}{1}'.format(self._NAMESPACE_PREFIX, key)
 
+    def _get_chunk_key(self, key, version, index):
+        """
+        Generates the key of a chunk of an oversized value
+        Every write uses its own chunk keys, so a value being overwritten never mixes chunks of different writes
+        :param key: Key of the value
+        :param version: Version of the chunks, unique for every write
+        :param index: Index of the chunk
+        :return: Key of the chunk
+        """
+        return '{0}_chunk_{1}_{2}'.format(key, version, index)
+
     def _extract_data(self, key=None, data=None):
         """
         The entries given in the backend are json by default with expiration information
@@ -113,22 +164,82 @@ class ArakoonResultBackend(KeyValueStoreBackend):
                 data = self._client.get(key)
             except KeyNotFoundException:
                 data = None
+        return self._unwrap(key, data)
+
+    def _extract_data_multi(self, keys):
+        return (self._unwrap(key, data) for key, data in zip(keys, self._client.get_multi(keys, must_exist=False)))
+
+    def _unwrap(self, key, data):
+        """
+        Extracts the value out of the wrapper, joining the chunks of oversized values
+        :param key: Key the data was stored under
+        :param data: Data as stored
+        :return: The value
+        """
         if isinstance(data, dict) and 'data' in data:
+            if data.get('chunks', 0) > 0:
+                chunks = list(self._client.get_multi([self._get_chunk_key(key, data['chunk_version'], index) for index in xrange(data['chunks'])], must_exist=False))
+                if None in chunks:  # Being overwritten or removed
+                    return None
+                return ''.join(chunks)
             return data['data']
         return data
 
-    def _extract_data_multi(self, keys):
-        return (self._extract_data(data=data) for data in self._client.get_multi(keys, must_exist=False))
-
-    def _set_data(self, key, value):
+    def _set_data(self, key, value, status=None):
         """
         Wraps the data to save to support expiration
+        An entry in the expiry index is written in the same transaction, so the clean up does not have to go over all results
+        Oversized values are split in chunks which are written in their own transaction, to keep the transactions small.
+        The expiry index entry is then written first, so the chunks are cleaned up even when the value itself never gets written
         :param key: Key to store under
         :param value: Value to store
+        :param status: Status of the task (if the value is a task result)
         :return: True if successful, false if not
         """
         # @Todo allow DataObjects to be stored and retrieved
-        return self._client.set(key, {'data': value, 'time_set': time.time()})
+        now = time.time()
+        chunks = []
+        version = None
+        if isinstance(value, basestring) and len(value) > self._CHUNK_SIZE:
+            chunks = [value[index:index + self._CHUNK_SIZE] for index in xrange(0, len(value), self._CHUNK_SIZE)]
+            value = None
+            version = int(now * 1000000)
+        expiry_entry = {'key': key, 'time_set': now, 'status': status, 'chunks': len(chunks), 'chunk_version': version}
+        if len(chunks) > 0:
+            self._client.set(self._get_expiry_key(now, key, version), expiry_entry)
+            for index, chunk in enumerate(chunks):
+                self._client.set(self._get_chunk_key(key, version, index), chunk)
+        transaction = self._client.begin_transaction()
+        self._client.set(key, {'data': value, 'time_set': now, 'status': status, 'chunks': len(chunks), 'chunk_version': version}, transaction=transaction)
+        if len(chunks) == 0:
+            self._client.set(self._get_expiry_key(now, key, version), expiry_entry, transaction=transaction)
+        return self._client.apply_transaction(transaction)
+
+    def _store_result(self, task_id, result, status, traceback=None, request=None, **kwargs):
+        """
+        Stores the result of a task. Identical to the KeyValueStoreBackend implementation, but passes on the status
+        so it can be recorded without parsing the payload
+        """
+        meta = {'status': status,
+                'result': result,
+                'traceback': traceback,
+                'children': self.current_task_children(request)}
+        self._set_data(self.get_key_for_task(task_id), self.encode(meta), status=status)
+        return result
+
+    def _get_expiry_key(self, time_set, key, version=None):
+        """
+        Generates the key of the expiry index entry for the given key
+        Entries of chunked values have their own key, so an overwrite within the same bucket does not lose track of the chunks
+        :param time_set: Time the value was set
+        :param key: Key of the value
+        :param version: Version of the chunks of the value (if chunked)
+        :return: Key of the entry in the expiry index
+        """
+        expiry_key = '{0}{1:010d}_{2}'.format(self._EXPIRY_PREFIX, int(time_set // self._BUCKET_SIZE), key)
+        if version is not None:
+            expiry_key = '{0}_{1}'.format(expiry_key, version)
+        return expiry_key
 
     def get_key_for_task(self, *args, **kwargs):
         """
@@ -153,31 +264,117 @@ class ArakoonResultBackend(KeyValueStoreBackend):
         Delete expired metadata. It will not remove results of tasks that are 'STARTED', 'PENDING' or 'RETRY' as the user
         would not be able to retrieve the information of the task if it would be removed
         The clean up task is scheduled by the celery beat. The default expires is 1 day (can be overruled in the settings)
+        Only the buckets of the expiry index of which all entries expired are processed, in transactions of at most _BATCH_SIZE entries
+        """
+        now = time.time()
+        last_bucket = int((now - self.expires) // self._BUCKET_SIZE) - 1  # Last bucket of which all entries have expired
+        cursor = list(self._client.get_multi([self._CURSOR_KEY], must_exist=False))[0]
+        if cursor is None:
+            # Results stored before the expiry index existed are not indexed yet. Results stored since then are, so the
+            # buckets are walked starting from the oldest existing one
+            self._cleanup_unindexed(now)
+            first_bucket = self._get_first_bucket()
+            cursor = last_bucket if first_bucket is None else min(first_bucket - 1, last_bucket)
+            self._client.set(self._CURSOR_KEY, cursor)
+        for bucket in xrange(cursor + 1, last_bucket + 1):
+            entries = list(self._client.prefix_entries('{0}{1:010d}_'.format(self._EXPIRY_PREFIX, bucket)))
+            for index in xrange(0, len(entries), self._BATCH_SIZE):
+                self._cleanup_batch(entries[index:index + self._BATCH_SIZE], now)
+            self._client.set(self._CURSOR_KEY, bucket)  # Keep track of the progress in case the clean up gets interrupted
+
+    def _get_first_bucket(self):
+        """
+        Retrieves the oldest bucket of the expiry index
+        :return: The oldest bucket or None if the expiry index is empty
+        :rtype: int
+        """
+        first_bucket = None
+        for key in self._client.prefix(self._EXPIRY_PREFIX):
+            bucket = key[len(self._EXPIRY_PREFIX):].split('_', 1)[0]
+            if bucket.isdigit():  # Skips the cursor
+                first_bucket = int(bucket) if first_bucket is None else min(first_bucket, int(bucket))
+        return first_bucket
+
+    def _cleanup_batch(self, entries, now):
         """
-        def build_cleanup():
-            transaction = self._client.begin_transaction()  # Faster to batch them all at once than it is to wait for results after every delete
-            for key, value in self._client.prefix_entries(self._NAMESPACE_PREFIX):
-                if isinstance(value, dict):  # PyrakoonStore wraps it up in a dict and json dumps/loads it
-                    if all(k in value for k in ['time_set', 'data']):  # Dealing with a wrapped instance
-                        # Will be either JSON or YAML format. JSON will be decoded as dict, YAML as string which needs conversion
-                        data = value.get('data')
-                        loaded_data = None
-                        if isinstance(data, basestring):
-                            try:
-                                loaded_data = yaml.load(data)
-                            except Exception:
-                                self._logger.exception('Invalid entry within the ResultBackend')
-                        elif isinstance(data, dict):
-                            loaded_data = data
-                        if isinstance(loaded_data, dict) and 'status' in loaded_data:  # Check for state
-                            status = loaded_data['status']
-                            # All possible states: PENDING, STARTED, RETRY, FAILURE, SUCCESS
-                            if status in ['STARTED', 'RETRY', 'PENDING']:
-                                self._logger.debug('Not removing {0} as it has not yet finished'.format(key))
-                                continue
-                        if time.time() - value['time_set'] > self.expires:
-                            self._logger.debug('Removing {0} as it has expired'.format(key))
-                            self._client.delete(key, must_exist=False, transaction=transaction)
-            self._logger.debug('Applying removal transactions')
-            return transaction
-        self._client.apply_callback_transaction(build_cleanup, max_retries=20)
+        Removes the expired results of a batch of expiry index entries
+        :param entries: Keys and values of the expiry index entries
+        :param now: Time the clean up started
+        :return: None
+        """
+        results = list(self._client.get_multi([entry['key'] for _, entry in entries], must_exist=False))
+        transaction = self._client.begin_transaction()
+        for (index_key, entry), result in zip(entries, results):
+            self._client.delete(index_key, must_exist=False, transaction=transaction)
+            if not isinstance(result, dict) or result.get('time_set') != entry['time_set'] or result.get('chunk_version') != entry.get('chunk_version'):
+                # Removed, overwritten or never written in the meantime. The latest write has its own entry in the expiry index
+                for chunk in xrange(entry.get('chunks', 0)):
+                    self._client.delete(self._get_chunk_key(entry['key'], entry['chunk_version'], chunk), must_exist=False, transaction=transaction)
+                continue
+            if entry['status'] in self._UNFINISHED_STATES:
+                self._logger.debug('Not removing {0} as it has not yet finished'.format(entry['key']))
+                self._client.set(self._get_expiry_key(now, entry['key'], entry.get('chunk_version')), entry, transaction=transaction)  # Check again later
+                continue
+            self._logger.debug('Removing {0} as it has expired'.format(entry['key']))
+            self._client.delete(entry['key'], must_exist=False, transaction=transaction)
+            for chunk in xrange(result.get('chunks', 0)):
+                self._client.delete(self._get_chunk_key(entry['key'], result['chunk_version'], chunk), must_exist=False, transaction=transaction)
+        self._logger.debug('Applying removal transaction for {0} expiry index entries'.format(len(entries)))
+        self._client.apply_transaction(transaction)
+
+    def _cleanup_unindexed(self, now):
+        """
+        Goes over all results once: removes the expired ones and adds the others to the expiry index
+        Results which already have an entry in the expiry index (recognized by their status field) are skipped
+        :param now: Time the clean up started
+        :return: None
+        """
+        operations = []
+        for key, value in self._client.prefix_entries(self._NAMESPACE_PREFIX):
+            if isinstance(value, dict):  # PyrakoonStore wraps it up in a dict and json dumps/loads it
+                if all(k in value for k in ['time_set', 'data']) and 'status' not in value:  # Dealing with an unindexed wrapped instance
+                    status = self._get_status(value['data'])
+                    chunks = value.get('chunks', 0)
+                    version = value.get('chunk_version')
+                    if status not in self._UNFINISHED_STATES and now - value['time_set'] > self.expires:
+                        self._logger.debug('Removing {0} as it has expired'.format(key))
+                        operations.append((key, None))
+                        operations.extend((self._get_chunk_key(key, version, chunk), None) for chunk in xrange(chunks))
+                    else:
+                        # Buckets up to the cursor are never visited again, so old unfinished results are indexed under the
+                        # first bucket which has not fully expired yet
+                        index_time = max(value['time_set'], now - self.expires)
+                        operations.append((self._get_expiry_key(index_time, key), {'key': key, 'time_set': value['time_set'], 'status': status, 'chunks': chunks, 'chunk_version': version}))
+        for index in xrange(0, len(operations), self._BATCH_SIZE):
+            transaction = self._client.begin_transaction()
+            for key, value in operations[index:index + self._BATCH_SIZE]:
+                if value is None:
+                    self._client.delete(key, must_exist=False, transaction=transaction)
+                else:
+                    self._client.set(key, value, transaction=transaction)
+            self._logger.debug('Applying transaction for {0} unindexed results'.format(len(operations[index:index + self._BATCH_SIZE])))
+            self._client.apply_transaction(transaction)
+
+    def _get_status(self, data):
+        """
+        Parses the status out of a stored result
+        :param data: Stored result
+        :return: Status of the task or None if the data does not represent a task result
+        """
+        # Will be either JSON, YAML or ResultCodec format. JSON will be decoded as dict, YAML and ResultCodec as string which needs conversion
+        loaded_data = None
+        if ResultCodec.is_encoded(data):
+            try:
+                loaded_data = self.decode(data)
+            except Exception:
+                self._logger.exception('Invalid entry within the ResultBackend')
+        elif isinstance(data, basestring):
+            try:
+                loaded_data = yaml.load(data)
+            except Exception:
+                self._logger.exception('Invalid entry within the ResultBackend')
+        elif isinstance(data, dict):
+            loaded_data = data
+        if isinstance(loaded_data, dict):  # All possible states: PENDING, STARTED, RETRY, FAILURE, SUCCESS
+            return loaded_data.get('status')
+        return None
@@ -0,0 +1,157 @@
+# Copyright (C) 2017 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Module which contains the codecs used to store celery results
+"""
+
+import json
+import zlib
+import base64
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class ResultCodec(object):
+    """
+    Encodes celery results, compressed with zlib when exceeding a threshold
+    Encoded payloads are strings formatted as '<MARKER><codec>:<compression>:<payload>', so they can be distinguished from
+    results which were stored uncompressed using the celery serializer (ovsyaml) before. Binary payloads (compressed or msgpack)
+    are base64 encoded as the persistent store only handles JSON serializable values.
+    The SERIALIZER codec marks payloads which were serialized by the celery serializer, of which the ResultCodec only handles
+    the compression (see pack and unpack). The other codecs are more compact, but JSON and msgpack don't keep all python types
+    (e.g. tuples become lists, non-string keys become strings). Additional codecs can be registered with ResultCodec.register
+    """
+    MARKER = 'ovsrc1:'
+    SERIALIZER = 'serializer'
+    COMPRESSION_THRESHOLD = 4096
+
+    _codecs = {'json': (lambda data: json.dumps(data, separators=(',', ':')), json.loads, False)}
+    if msgpack is not None:
+        _codecs['msgpack'] = (msgpack.packb, msgpack.unpackb, True)
+
+    @classmethod
+    def register(cls, name, dumps, loads, binary):
+        """
+        Registers a codec
+        :param name: Name of the codec
+        :type name: str
+        :param dumps: Function converting data into a string
+        :type dumps: callable
+        :param loads: Function converting a string back into data
+        :type loads: callable
+        :param binary: Whether the output of dumps is binary
+        :type binary: bool
+        :return: None
+        """
+        if ':' in name or name == cls.SERIALIZER:
+            raise ValueError('Invalid codec name {0}'.format(name))
+        cls._codecs[name] = (dumps, loads, binary)
+
+    @classmethod
+    def is_encoded(cls, payload):
+        """
+        Verifies whether the payload was encoded by a ResultCodec
+        :param payload: Payload to verify
+        :return: True if encoded by a ResultCodec
+        :rtype: bool
+        """
+        return isinstance(payload, basestring) and payload.startswith(cls.MARKER)
+
+    @classmethod
+    def encode(cls, data, codec, compression_threshold=None):
+        """
+        Encodes the given data
+        :param data: Data to encode
+        :param codec: Name of the codec to use
+        :type codec: str
+        :param compression_threshold: Minimal size of the encoded data to compress it. Defaults to COMPRESSION_THRESHOLD
+        :type compression_threshold: int
+        :return: The encoded data
+        :rtype: str
+        :raises TypeError: When the data cannot be represented by the codec
+        """
+        if codec not in cls._codecs:
+            raise ValueError('Unknown result codec {0}'.format(codec))
+        dumps, _, binary = cls._codecs[codec]
+        return cls._pack(dumps(data), codec=codec, binary=binary, compression_threshold=compression_threshold)
+
+    @classmethod
+    def pack(cls, payload, codec, compression_threshold=None):
+        """
+        Wraps an already serialized payload, compressing it when large enough
+        :param payload: The serialized data
+        :type payload: str
+        :param codec: Name of the codec which serialized the payload (e.g. SERIALIZER)
+        :type codec: str
+        :param compression_threshold: Minimal size of the payload to compress it. Defaults to COMPRESSION_THRESHOLD
+        :type compression_threshold: int
+        :return: The encoded data
+        :rtype: str
+        """
+        return cls._pack(payload, codec=codec, binary=False, compression_threshold=compression_threshold)
+
+    @classmethod
+    def unpack(cls, payload):
+        """
+        Unwraps and decompresses an encoded payload, without deserializing it
+        :param payload: Encoded data
+        :type payload: str
+        :return: The name of the codec and the serialized data
+        :rtype: tuple(str, str)
+        """
+        codec, compression, payload = payload[len(cls.MARKER):].split(':', 2)
+        binary = cls._codecs[codec][2] if codec in cls._codecs else False
+        if binary is True or compression != '':
+            payload = base64.b64decode(payload)
+        if compression == 'zlib':
+            payload = zlib.decompress(payload)
+        elif compression != '':
+            raise ValueError('Unknown result compression {0}'.format(compression))
+        return codec, payload
+
+    @classmethod
+    def _pack(cls, payload, codec, binary, compression_threshold):
+        """
+        Compresses and wraps a serialized payload
+        """
+        compression_threshold = cls.COMPRESSION_THRESHOLD if compression_threshold is None else compression_threshold
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        compression = ''
+        if len(payload) >= compression_threshold:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                compression = 'zlib'
+        if binary is True or compression != '':
+            payload = base64.b64encode(payload)
+        return '{0}{1}:{2}:{3}'.format(cls.MARKER, codec, compression, payload)
+
+    @classmethod
+    def decode(cls, payload):
+        """
+        Decodes data encoded by ResultCodec.encode
+        :param payload: Encoded data
+        :type payload: str
+        :return: The decoded data
+        """
+        codec, payload = cls.unpack(payload)
+        if codec not in cls._codecs:
+            raise ValueError('Unknown result codec {0}'.format(codec))
+        return cls._codecs[codec][1](payload)
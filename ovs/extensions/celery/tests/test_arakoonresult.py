@@ -0,0 +1,150 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Arakoon result backend test module
+"""
+import unittest
+from celery import Celery
+from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.celery import arakoonresult
+from ovs.extensions.celery.arakoonresult import ArakoonResultBackend
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+
+
+class _Clock(object):
+    now = 1000000.0
+
+    @staticmethod
+    def time():
+        return _Clock.now
+
+
+class ArakoonResultBackendTest(unittest.TestCase):
+    """
+    This test class will validate the expiry index and the clean up of the Arakoon result backend
+    """
+    EXPIRES = 24 * 3600
+
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        self._original_time = arakoonresult.time
+        arakoonresult.time = _Clock
+        _Clock.now = 1000000.0
+        app = Celery(set_as_current=False)
+        app.conf.CELERY_RESULT_SERIALIZER = 'json'
+        self.backend = ArakoonResultBackend(app=app, expires=ArakoonResultBackendTest.EXPIRES)
+        self.client = PersistentFactory.get_client()
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        arakoonresult.time = self._original_time
+        DalHelper.teardown()
+
+    def _get_expiry_keys(self):
+        return sorted(key for key in self.client.prefix(ArakoonResultBackend._EXPIRY_PREFIX) if key != ArakoonResultBackend._CURSOR_KEY)
+
+    def _get_bucket(self, timestamp):
+        return int(timestamp // ArakoonResultBackend._BUCKET_SIZE)
+
+    def test_expiry_index(self):
+        """
+        Validates whether every write adds an entry to the expiry index, in the bucket of the time it was written
+        """
+        start = _Clock.now
+        self.backend.set('ovs_tasks_1', 'value_1')
+        self.backend._set_data('ovs_tasks_2', 'value_2', status='SUCCESS')
+        self.assertEqual(self._get_expiry_keys(), ['ovs_task_expiry_{0:010d}_ovs_tasks_{1}'.format(self._get_bucket(start), index) for index in [1, 2]])
+        self.assertEqual(self.client.get('ovs_task_expiry_{0:010d}_ovs_tasks_2'.format(self._get_bucket(start)))['status'], 'SUCCESS')
+        self.assertEqual(self.backend.get('ovs_tasks_2'), 'value_2')
+
+        # An overwrite gets its own entry, the entry of the previous write is skipped by the clean up
+        _Clock.now += ArakoonResultBackend._BUCKET_SIZE
+        self.backend.set('ovs_tasks_1', 'value_1_new')
+        self.assertIn('ovs_task_expiry_{0:010d}_ovs_tasks_1'.format(self._get_bucket(_Clock.now)), self._get_expiry_keys())
+        self.assertEqual(self.backend.get('ovs_tasks_1'), 'value_1_new')
+        _Clock.now = start + ArakoonResultBackendTest.EXPIRES + ArakoonResultBackend._BUCKET_SIZE
+        self.backend.cleanup()
+        self.assertFalse(self.client.exists('ovs_tasks_2'))
+        self.assertEqual(self.backend.get('ovs_tasks_1'), 'value_1_new')
+        self.assertEqual(self._get_expiry_keys(), ['ovs_task_expiry_{0:010d}_ovs_tasks_1'.format(self._get_bucket(start + ArakoonResultBackend._BUCKET_SIZE))])
+
+    def test_chunks(self):
+        """
+        Validates whether oversized values are split in chunks, which are removed together with the value
+        """
+        self.backend._CHUNK_SIZE = 10
+        value = 'x' * 10 + 'y' * 10 + 'z' * 5
+        self.backend._set_data('ovs_tasks_1', value, status='SUCCESS')
+        self.assertEqual(len(list(self.client.prefix('ovs_tasks_1_chunk_'))), 3)
+        self.assertEqual(self.backend.get('ovs_tasks_1'), value)
+        self.assertEqual(list(self.backend.mget(['ovs_tasks_1'])), [value])
+
+        # An overwrite, even within the same bucket, does not lose track of the previous chunks
+        self.backend._set_data('ovs_tasks_1', 'short', status='SUCCESS')
+        self.assertEqual(self.backend.get('ovs_tasks_1'), 'short')
+        _Clock.now += ArakoonResultBackendTest.EXPIRES + 2 * ArakoonResultBackend._BUCKET_SIZE
+        self.backend.cleanup()
+        self.assertEqual(list(self.client.prefix('ovs_tasks_1')), [])
+
+        self.backend._set_data('ovs_tasks_2', value, status='SUCCESS')
+        self.backend.delete('ovs_tasks_2')
+        self.assertEqual(list(self.client.prefix('ovs_tasks_2')), [])
+
+    def test_cleanup(self):
+        """
+        Validates whether the clean up removes the expired finished results and keeps the unfinished ones
+        - Entries of the expiry index written before the first clean up are visited, even when in buckets older than the ones which fully expired
+        - Results stored before the expiry index existed are removed when expired and indexed otherwise
+        """
+        start = _Clock.now
+        self.backend._set_data('ovs_tasks_1', 'value_1', status='SUCCESS')
+        self.backend._set_data('ovs_tasks_2', 'value_2', status='STARTED')
+        self.client.set('ovs_tasks_3', {'data': 'status: SUCCESS\nresult: 3\n', 'time_set': start})  # Unindexed
+        self.client.set('ovs_tasks_4', {'data': 'status: STARTED\nresult: null\n', 'time_set': start})  # Unindexed
+
+        _Clock.now = start + ArakoonResultBackendTest.EXPIRES + 2 * ArakoonResultBackend._BUCKET_SIZE
+        first_cleanup = _Clock.now
+        last_bucket = self._get_bucket(_Clock.now - ArakoonResultBackendTest.EXPIRES) - 1
+        self.backend.cleanup()
+        self.assertFalse(self.client.exists('ovs_tasks_1'))
+        self.assertFalse(self.client.exists('ovs_tasks_3'))
+        self.assertTrue(self.client.exists('ovs_tasks_2'))
+        self.assertTrue(self.client.exists('ovs_tasks_4'))
+        self.assertEqual(self.client.get(ArakoonResultBackend._CURSOR_KEY), last_bucket)
+        # Unfinished results are checked again later, in a bucket which has not been visited yet
+        self.assertEqual(self._get_expiry_keys(), ['ovs_task_expiry_{0:010d}_ovs_tasks_4'.format(last_bucket + 1),
+                                                   'ovs_task_expiry_{0:010d}_ovs_tasks_2'.format(self._get_bucket(_Clock.now))])
+        self.assertEqual(self.client.get('ovs_task_expiry_{0:010d}_ovs_tasks_4'.format(last_bucket + 1))['status'], 'STARTED')
+
+        # The results which finished in the meantime are removed on a next clean up
+        _Clock.now += 100
+        self.backend._set_data('ovs_tasks_2', 'value_2', status='SUCCESS')
+        _Clock.now = first_cleanup + ArakoonResultBackendTest.EXPIRES + 2 * ArakoonResultBackend._BUCKET_SIZE
+        self.backend.cleanup()
+        self.assertFalse(self.client.exists('ovs_tasks_2'))
+        self.assertTrue(self.client.exists('ovs_tasks_4'))
+        self.assertEqual(self._get_expiry_keys(), ['ovs_task_expiry_{0:010d}_ovs_tasks_4'.format(self._get_bucket(_Clock.now))])
+
+        # Without anything to clean up, the cursor still moves on
+        _Clock.now += ArakoonResultBackend._BUCKET_SIZE
+        self.backend.cleanup()
+        self.assertEqual(self.client.get(ArakoonResultBackend._CURSOR_KEY), self._get_bucket(_Clock.now - ArakoonResultBackendTest.EXPIRES) - 1)
@@ -0,0 +1,174 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Distributed celery beat scheduler test module
+"""
+import unittest
+from datetime import datetime, timedelta
+from celery import Celery
+from celery.utils.timeutils import timezone
+from ovs import celery_beat
+from ovs.celery_beat import DistributedScheduler
+from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+
+
+class _Clock(object):
+    now = 1000000.0
+
+    @staticmethod
+    def time():
+        return _Clock.now
+
+
+class _System(object):
+    machine_id = None
+
+    @staticmethod
+    def get_my_machine_id():
+        return _System.machine_id
+
+
+class DistributedSchedulerTest(unittest.TestCase):
+    """
+    This test class will validate the leadership lease and the persistence of the schedule entries of the beat scheduler
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        self._original_time = celery_beat.time
+        self._original_system = celery_beat.System
+        celery_beat.time = _Clock
+        celery_beat.System = _System
+        _Clock.now = 1000000.0
+        self.app = Celery(set_as_current=False)
+        self.persistent = PersistentFactory.get_client()
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        celery_beat.time = self._original_time
+        celery_beat.System = self._original_system
+        DalHelper.teardown()
+
+    def _get_scheduler(self):
+        scheduler = DistributedScheduler(app=self.app, lazy=True)
+        scheduler.merge_inplace({'task_1': {'task': 'task_1', 'schedule': timedelta(hours=1), 'args': []},
+                                 'task_2': {'task': 'task_2', 'schedule': timedelta(hours=1), 'args': []}})
+        scheduler._load_schedule()
+        return scheduler
+
+    @staticmethod
+    def _tick(scheduler, node):
+        """
+        Executes the lease handling of a tick of the scheduler running on the given node
+        """
+        _System.machine_id = node
+        scheduler._has_lock = scheduler._acquire_lock()
+        return scheduler._has_lock
+
+    @staticmethod
+    def _run(scheduler, name, when):
+        entry = scheduler.schedule[name]
+        entry.last_run_at = when
+        entry.total_run_count = (entry.total_run_count or 0) + 1
+
+    def test_leader_takeover(self):
+        """
+        Validates whether only a single node holds the lease, the lease is renewed with the same fencing token and is
+        taken over with a new token when it timed out
+        """
+        scheduler_1 = self._get_scheduler()
+        scheduler_2 = self._get_scheduler()
+        self.assertTrue(self._tick(scheduler_1, 'node_1'))
+        self.assertFalse(self._tick(scheduler_2, 'node_2'))
+        self.assertEqual(self.persistent.get(scheduler_1._lock_name), {'name': 'node_1', 'timestamp': _Clock.now, 'token': 1})
+
+        # Renewing keeps the token
+        _Clock.now += DistributedScheduler.RENEW_INTERVAL
+        self.assertTrue(self._tick(scheduler_1, 'node_1'))
+        self.assertFalse(self._tick(scheduler_2, 'node_2'))
+        self.assertEqual(self.persistent.get(scheduler_1._lock_name), {'name': 'node_1', 'timestamp': _Clock.now, 'token': 1})
+
+        run_at = datetime(2018, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        self._run(scheduler_1, 'task_1', run_at)
+        scheduler_1.sync()
+        self.assertEqual(self.persistent.get('{0}task_1'.format(scheduler_1._entry_prefix))['total_run_count'], 1)
+
+        # Node 1 stops renewing, node 2 takes over once the lease timed out and continues from the persisted schedule
+        _Clock.now += DistributedScheduler.TIMEOUT / 2
+        self.assertFalse(self._tick(scheduler_2, 'node_2'))
+        _Clock.now += DistributedScheduler.TIMEOUT / 2 + 1
+        self.assertTrue(self._tick(scheduler_2, 'node_2'))
+        self.assertEqual(self.persistent.get(scheduler_2._lock_name), {'name': 'node_2', 'timestamp': _Clock.now, 'token': 2})
+        self.assertEqual(scheduler_2.schedule['task_1'].last_run_at, run_at)
+        self.assertEqual(scheduler_2.schedule['task_1'].total_run_count, 1)
+        self.assertFalse(self._tick(scheduler_1, 'node_1'))
+        self.assertIsNone(scheduler_1._lock)
+
+        # A restarted scheduler on the leading node takes over the lease of its previous run, with a new token
+        scheduler_3 = self._get_scheduler()
+        self.assertTrue(self._tick(scheduler_3, 'node_2'))
+        self.assertEqual(self.persistent.get(scheduler_3._lock_name)['token'], 3)
+        self.assertFalse(self._tick(scheduler_2, 'node_2'))
+
+    def test_stale_leader(self):
+        """
+        Validates whether a node which lost its lease can no longer write the schedule entries and whether only the
+        changed entries are written
+        """
+        scheduler_1 = self._get_scheduler()
+        scheduler_2 = self._get_scheduler()
+        entry_key = '{0}{{0}}'.format(scheduler_1._entry_prefix)
+        self.assertTrue(self._tick(scheduler_1, 'node_1'))
+        run_at = datetime(2018, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        self._run(scheduler_1, 'task_1', run_at)
+        self._run(scheduler_1, 'task_2', run_at)
+        scheduler_1.sync()
+        self.assertEqual(self.persistent.get(entry_key.format('task_1'))['total_run_count'], 1)
+        self.assertEqual(self.persistent.get(entry_key.format('task_2'))['total_run_count'], 1)
+
+        # Unchanged entries are not written again
+        marker = {'last_run_at': None, 'total_run_count': 100}
+        self.persistent.set(entry_key.format('task_2'), marker)
+        self._run(scheduler_1, 'task_1', run_at + timedelta(hours=1))
+        scheduler_1.sync()
+        self.assertEqual(self.persistent.get(entry_key.format('task_1'))['total_run_count'], 2)
+        self.assertEqual(self.persistent.get(entry_key.format('task_2')), marker)
+        self.persistent.set(entry_key.format('task_2'), DistributedScheduler._serialize_entry(scheduler_1.schedule['task_2']))
+
+        # Node 2 takes over while node 1 is stalled. Node 1 still believes it holds the lease, but its write is rejected
+        _Clock.now += DistributedScheduler.TIMEOUT + 1
+        self.assertTrue(self._tick(scheduler_2, 'node_2'))
+        self.assertTrue(scheduler_1._has_lock)
+        self._run(scheduler_1, 'task_1', run_at + timedelta(hours=2))
+        self._run(scheduler_1, 'task_2', run_at + timedelta(hours=2))
+        scheduler_1.sync()
+        self.assertFalse(scheduler_1._has_lock)
+        self.assertIsNone(scheduler_1._lock)
+        self.assertEqual(self.persistent.get(entry_key.format('task_1'))['total_run_count'], 2)
+        self.assertEqual(self.persistent.get(entry_key.format('task_2'))['total_run_count'], 1)
+        self.assertEqual(self.persistent.get(scheduler_2._lock_name)['name'], 'node_2')
+
+        # The new leader writes its own runs
+        self._run(scheduler_2, 'task_2', run_at + timedelta(hours=3))
+        scheduler_2.sync()
+        self.assertEqual(self.persistent.get(entry_key.format('task_2'))['total_run_count'], 2)
+        self.assertEqual(self.persistent.get(entry_key.format('task_1'))['total_run_count'], 2)
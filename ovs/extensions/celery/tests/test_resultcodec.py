@@ -0,0 +1,138 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Result codec test module
+"""
+import json
+import unittest
+from celery import Celery
+from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.celery.arakoonresult import ArakoonResultBackend
+from ovs.extensions.celery.resultcodec import ResultCodec
+
+
+class ResultCodecTest(unittest.TestCase):
+    """
+    This test class will validate the round trips of the result codec and of the results stored by the Arakoon result backend
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        self._original_codecs = ResultCodec._codecs.copy()
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        ResultCodec._codecs = self._original_codecs
+        DalHelper.teardown()
+
+    @staticmethod
+    def _get_backend(**options):
+        app = Celery(set_as_current=False)
+        app.conf.CELERY_RESULT_SERIALIZER = 'json'
+        return ArakoonResultBackend(app=app, expires=3600, options=options)
+
+    def test_codec(self):
+        """
+        Validates whether data survives an encode and decode, compressed only once the threshold is reached
+        """
+        small = {'status': 'SUCCESS', 'result': [1, 2, 3], 'traceback': None}
+        encoded = ResultCodec.encode(small, codec='json')
+        self.assertTrue(ResultCodec.is_encoded(encoded))
+        self.assertTrue(encoded.startswith('{0}json::'.format(ResultCodec.MARKER)))
+        self.assertEqual(ResultCodec.decode(encoded), small)
+
+        large = {'status': 'SUCCESS', 'result': ['vdisk_{0}'.format(index) for index in xrange(1000)]}
+        encoded = ResultCodec.encode(large, codec='json')
+        self.assertTrue(encoded.startswith('{0}json:zlib:'.format(ResultCodec.MARKER)))
+        self.assertLess(len(encoded), len(json.dumps(large)))
+        self.assertEqual(ResultCodec.decode(encoded), large)
+        self.assertTrue(ResultCodec.encode(large, codec='json', compression_threshold=10 ** 9).startswith('{0}json::'.format(ResultCodec.MARKER)))
+
+        # Data which does not compress stays uncompressed
+        self.assertTrue(ResultCodec.encode('x', codec='json', compression_threshold=0).startswith('{0}json::'.format(ResultCodec.MARKER)))
+
+        # Payloads serialized elsewhere are only wrapped
+        serialized = 'status: SUCCESS\nresult: {0}\n'.format('a' * 10000)
+        packed = ResultCodec.pack(serialized, codec=ResultCodec.SERIALIZER)
+        self.assertTrue(ResultCodec.is_encoded(packed))
+        self.assertLess(len(packed), len(serialized))
+        self.assertEqual(ResultCodec.unpack(packed), (ResultCodec.SERIALIZER, serialized))
+
+        self.assertFalse(ResultCodec.is_encoded(serialized))
+        self.assertFalse(ResultCodec.is_encoded({'status': 'SUCCESS'}))
+        with self.assertRaises(ValueError):
+            ResultCodec.encode(small, codec='unknown')
+        with self.assertRaises(ValueError):
+            ResultCodec.decode('{0}unknown::{{}}'.format(ResultCodec.MARKER))
+        with self.assertRaises(ValueError):
+            ResultCodec.register(ResultCodec.SERIALIZER, json.dumps, json.loads, False)
+
+    def test_binary_codec(self):
+        """
+        Validates whether the output of binary codecs is kept intact
+        """
+        ResultCodec.register('reversed', lambda data: json.dumps(data)[::-1], lambda payload: json.loads(payload[::-1]), True)
+        data = {'status': 'SUCCESS', 'result': u'\xe9\xe8'}
+        encoded = ResultCodec.encode(data, codec='reversed')
+        self.assertTrue(encoded.startswith('{0}reversed::'.format(ResultCodec.MARKER)))
+        self.assertEqual(ResultCodec.decode(encoded), data)
+
+    def test_backend(self):
+        """
+        Validates whether results stored by the backend can be read back
+        - Compressed or not, with the celery serializer or with a configured codec
+        - Split in chunks when oversized
+        - Stored with the celery serializer before the ResultCodec was used
+        """
+        small = {'status': 'SUCCESS', 'result': [1, 2, 3], 'traceback': None, 'children': []}
+        large = {'status': 'SUCCESS', 'result': ['vdisk_{0}'.format(index) for index in xrange(1000)], 'traceback': None, 'children': []}
+        for options in [{}, {'result_codec': 'json'}, {'result_compression_threshold': 0}]:
+            backend = ResultCodecTest._get_backend(**options)
+            for data in [small, large]:
+                encoded = backend.encode(data)
+                self.assertTrue(ResultCodec.is_encoded(encoded))
+                self.assertEqual(backend.decode(encoded), data)
+        self.assertTrue(ResultCodecTest._get_backend().encode(large).startswith('{0}{1}:zlib:'.format(ResultCodec.MARKER, ResultCodec.SERIALIZER)))
+        self.assertTrue(ResultCodecTest._get_backend(result_codec='json').encode(large).startswith('{0}json:zlib:'.format(ResultCodec.MARKER)))
+
+        # Results the configured codec cannot represent fall back to the celery serializer
+        def _dumps(data):
+            if not isinstance(data.get('result'), list):
+                raise TypeError('Only lists are supported')
+            return json.dumps(data)
+        ResultCodec.register('lists', _dumps, json.loads, False)
+        backend = ResultCodecTest._get_backend(result_codec='lists')
+        self.assertTrue(backend.encode(small).startswith('{0}lists:'.format(ResultCodec.MARKER)))
+        data = {'status': 'SUCCESS', 'result': 'not a list', 'traceback': None, 'children': []}
+        encoded = backend.encode(data)
+        self.assertTrue(encoded.startswith('{0}{1}:'.format(ResultCodec.MARKER, ResultCodec.SERIALIZER)))
+        self.assertEqual(backend.decode(encoded), data)
+
+        # Results stored before the ResultCodec was used
+        self.assertEqual(backend.decode(json.dumps(small)), small)
+
+        # Oversized results are stored in chunks
+        backend = ResultCodecTest._get_backend(result_compression_threshold=10 ** 9)
+        backend._CHUNK_SIZE = 1024
+        backend._store_result('task_1', large['result'], 'SUCCESS')
+        key = backend.get_key_for_task('task_1')
+        self.assertGreater(list(backend._client.get_multi([key]))[0]['chunks'], 1)
+        self.assertEqual(backend.decode(backend.get(key))['result'], large['result'])
@@ -0,0 +1,320 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Celery worker state module
+"""
+
+import os
+import copy
+import time
+from threading import Event, Lock, Thread
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.system import System
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class WorkerState(object):
+    """
+    Provides the active, reserved, scheduled and revoked tasks of all celery workers
+    The state is served from the view maintained by the WorkerStateAggregator. Live inspection (a broadcast towards
+    all workers, waiting for their replies) is only used when explicitly requested or when no view is available.
+    """
+    STATE_KEY = 'ovs_celery_worker_state'
+    STATES = ['active', 'scheduled', 'reserved', 'revoked']
+
+    _logger = Logger('celery')
+
+    @classmethod
+    def get_tasks(cls, live=False):
+        """
+        Retrieves the tasks per state and worker
+        :param live: Inspect the workers instead of using the aggregated view
+        :type live: bool
+        :return: Dict with per state a dict with per worker hostname the list of tasks
+        :rtype: dict
+        """
+        if live is False:
+            view = VolatileFactory.get_client().get(WorkerState.STATE_KEY)
+            if view is not None:
+                tasks = dict((state, {}) for state in WorkerState.STATES)
+                for hostname, worker in view['workers'].iteritems():
+                    for state in WorkerState.STATES:
+                        tasks[state][hostname] = worker[state]
+                return tasks
+            cls._logger.warning('No aggregated worker state available, inspecting the workers')
+        return cls.inspect()
+
+    @staticmethod
+    def inspect():
+        """
+        Inspects the workers
+        :return: Dict with per state a dict with per worker hostname the list of tasks
+        :rtype: dict
+        """
+        from ovs.celery_run import inspect
+        inspector = inspect()
+        return dict((state, getattr(inspector, state)()) for state in WorkerState.STATES)
+
+
+class WorkerStateAggregator(object):
+    """
+    Maintains the state of all celery workers by consuming the celery events
+    A single aggregator in the cluster (holding a lease in the volatile store) consumes the events. The other
+    aggregators stand by and take over when the lease expires. On take over, the state is seeded once by inspecting
+    the workers. The state is published in the volatile store under WorkerState.STATE_KEY.
+    The lease ({'id': <aggregator>, 'until': <timestamp>}) is only taken with an atomic add. The holder only overwrites
+    it while at least RENEW_MARGIN seconds remain, so it can not overwrite a lease which expired and was taken by another
+    aggregator in the meantime. A holder which could not renew in time stops and competes for the lease again.
+    """
+    LEASE_KEY = 'ovs_celery_worker_state_lease'
+    LEASE_TIME = 30
+    RENEW_MARGIN = 10
+    FLUSH_INTERVAL = 1
+    REFRESH_INTERVAL = 30
+    RETRY_INTERVAL = 10
+    WORKER_TIMEOUT = 60
+    STATE_TTL = 120
+    MAX_REVOKED = 1000
+
+    _logger = Logger('celery')
+
+    def __init__(self, app):
+        """
+        :param app: The celery application
+        :type app: celery.Celery
+        """
+        self._app = app
+        self._id = '{0}_{1}'.format(System.get_my_machine_id(), os.getpid())
+        self._lock = Lock()
+        self._workers = {}
+        self._dirty = False
+        self._last_flush = 0
+        self._receiver = None
+
+    @classmethod
+    def start(cls, app):
+        """
+        Starts an aggregator in a background thread
+        :param app: The celery application
+        :type app: celery.Celery
+        :return: The started aggregator
+        :rtype: WorkerStateAggregator
+        """
+        aggregator = cls(app)
+        thread = Thread(target=aggregator.run, name='worker_state_aggregator')
+        thread.daemon = True
+        thread.start()
+        return aggregator
+
+    def run(self):
+        """
+        Consumes the celery events whenever this aggregator holds the lease
+        :return: None
+        :rtype: NoneType
+        """
+        while True:
+            try:
+                if self._acquire_lease() is True:
+                    self._logger.info('Aggregating the celery worker state')
+                    self._consume()
+            except Exception:
+                self._logger.exception('Error while aggregating the celery worker state')
+            time.sleep(WorkerStateAggregator.RETRY_INTERVAL)
+
+    def _consume(self):
+        """
+        Seeds the state and consumes the events until the lease is lost
+        """
+        stop = Event()
+        with self._app.connection() as connection:
+            self._receiver = self._app.events.Receiver(connection, handlers={'*': self._on_event})
+            self._seed()
+            flusher = Thread(target=self._flush_loop, args=(stop,), name='worker_state_flusher')
+            flusher.daemon = True
+            flusher.start()
+            try:
+                self._receiver.capture(limit=None, timeout=None, wakeup=True)
+            finally:
+                stop.set()
+                self._receiver = None
+
+    def _seed(self):
+        """
+        Builds the initial state by inspecting the workers
+        """
+        tasks = WorkerState.inspect()
+        now = time.time()
+        with self._lock:
+            self._workers = {}
+            for state in WorkerState.STATES:
+                for hostname, entries in (tasks[state] or {}).iteritems():
+                    worker = self._get_worker(hostname, now)
+                    if state == 'revoked':
+                        worker['revoked'] = list(entries)[-WorkerStateAggregator.MAX_REVOKED:]
+                        continue
+                    for entry in entries:
+                        task_id = entry['request']['id'] if 'request' in entry else entry['id']
+                        worker[state][task_id] = entry
+            self._dirty = True
+
+    def _get_worker(self, hostname, now):
+        """
+        Retrieves the state of a worker, registering the worker when unknown
+        """
+        if hostname not in self._workers:
+            self._workers[hostname] = {'heartbeat': now,
+                                       'active': {},
+                                       'scheduled': {},
+                                       'reserved': {},
+                                       'revoked': []}
+        return self._workers[hostname]
+
+    def _pop_task(self, task_id):
+        """
+        Removes a task from all workers
+        :return: The request information of the task, if known
+        """
+        info = None
+        for worker in self._workers.itervalues():
+            for state in ['active', 'scheduled', 'reserved']:
+                entry = worker[state].pop(task_id, None)
+                if entry is not None:
+                    info = entry['request'] if state == 'scheduled' else entry
+        return info
+
+    def _on_event(self, event):
+        """
+        Processes a single celery event
+        :param event: The celery event
+        :type event: dict
+        """
+        event_type = event.get('type', '')
+        hostname = event.get('hostname')
+        if hostname is None:
+            return
+        now = time.time()  # The local clock is used, to be independent of the clock skew between the nodes
+        with self._lock:
+            if event_type == 'worker-offline':
+                self._workers.pop(hostname, None)
+                self._dirty = True
+                return
+            worker = self._get_worker(hostname, now)
+            worker['heartbeat'] = now
+            if not event_type.startswith('task-'):
+                return
+            task_id = event.get('uuid')
+            self._dirty = True
+            if event_type == 'task-received':
+                self._pop_task(task_id)  # Retried tasks are received again
+                info = {'id': task_id,
+                        'name': event.get('name'),
+                        'args': event.get('args'),
+                        'kwargs': event.get('kwargs'),
+                        'hostname': hostname,
+                        'retries': event.get('retries'),
+                        'time_received': event.get('timestamp')}
+                if event.get('eta') is not None:
+                    worker['scheduled'][task_id] = {'eta': event['eta'],
+                                                    'request': info}
+                else:
+                    worker['reserved'][task_id] = info
+            elif event_type == 'task-started':
+                info = self._pop_task(task_id) or {'id': task_id, 'hostname': hostname}
+                info.update({'time_start': event.get('timestamp'),
+                             'worker_pid': event.get('pid')})
+                worker['active'][task_id] = info
+            elif event_type == 'task-revoked':
+                self._pop_task(task_id)
+                worker['revoked'].append(task_id)
+                del worker['revoked'][:-WorkerStateAggregator.MAX_REVOKED]
+            elif event_type in ['task-succeeded', 'task-failed', 'task-retried', 'task-rejected']:
+                self._pop_task(task_id)
+
+    def _flush_loop(self, stop):
+        """
+        Publishes the state and renews the lease until stopped
+        """
+        while not stop.wait(WorkerStateAggregator.FLUSH_INTERVAL):
+            try:
+                if self._renew_lease() is False:
+                    self._logger.info('Lost the celery worker state lease')
+                    receiver = self._receiver
+                    if receiver is not None:
+                        receiver.should_stop = True
+                    return
+                self._flush()
+            except Exception:
+                self._logger.exception('Could not publish the celery worker state')
+
+    def _flush(self):
+        """
+        Publishes the state in the volatile store when it changed
+        """
+        now = time.time()
+        with self._lock:
+            for hostname in self._workers.keys():
+                if now - self._workers[hostname]['heartbeat'] > WorkerStateAggregator.WORKER_TIMEOUT:
+                    self._logger.warning('Celery worker {0} did not send a heartbeat, removing it'.format(hostname))
+                    del self._workers[hostname]
+                    self._dirty = True
+            if self._dirty is False and now - self._last_flush < WorkerStateAggregator.REFRESH_INTERVAL:
+                return
+            view = {'updated': now,
+                    'aggregator': self._id,
+                    'workers': dict((hostname, {'heartbeat': worker['heartbeat'],
+                                                'active': worker['active'].values(),
+                                                'scheduled': worker['scheduled'].values(),
+                                                'reserved': worker['reserved'].values(),
+                                                'revoked': list(worker['revoked'])})
+                                    for hostname, worker in self._workers.iteritems())}
+            view = copy.deepcopy(view)
+            self._dirty = False
+            self._last_flush = now
+        VolatileFactory.get_client().set(WorkerState.STATE_KEY, view, WorkerStateAggregator.STATE_TTL)
+
+    def _acquire_lease(self):
+        """
+        Tries to acquire the aggregator lease
+        """
+        volatile = VolatileFactory.get_client()
+        lease = {'id': self._id,
+                 'until': time.time() + WorkerStateAggregator.LEASE_TIME}
+        if volatile.add(key=WorkerStateAggregator.LEASE_KEY, value=lease, time=WorkerStateAggregator.LEASE_TIME) is not False:
+            return True
+        return self._renew_lease()
+
+    def _renew_lease(self):
+        """
+        Renews the aggregator lease
+        :return: True if this aggregator still holds the lease
+        :rtype: bool
+        """
+        volatile = VolatileFactory.get_client()
+        now = time.time()
+        current = volatile.get(WorkerStateAggregator.LEASE_KEY)
+        if current is None:
+            lease = {'id': self._id,
+                     'until': now + WorkerStateAggregator.LEASE_TIME}
+            return volatile.add(key=WorkerStateAggregator.LEASE_KEY, value=lease, time=WorkerStateAggregator.LEASE_TIME) is not False
+        if not isinstance(current, dict) or current.get('id') != self._id:
+            return False
+        if current['until'] - now < WorkerStateAggregator.RENEW_MARGIN:
+            # The lease might expire (and be taken by another aggregator) before it would be overwritten
+            return False
+        current['until'] = now + WorkerStateAggregator.LEASE_TIME
+        volatile.set(WorkerStateAggregator.LEASE_KEY, current, WorkerStateAggregator.LEASE_TIME)
+        return True
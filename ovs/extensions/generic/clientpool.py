@@ -0,0 +1,237 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Process-wide pools of HTTP sessions and authenticated API clients
+"""
+
+import os
+import json
+import time
+import hashlib
+import requests
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+from requests.adapters import HTTPAdapter
+from ovs_extensions.api.client import OVSClient
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class SessionPool(object):
+    """
+    Keeps one keep-alive HTTP session per endpoint, credentials and process
+    The amount of concurrent connections towards a single endpoint is bounded by POOL_SIZE.
+    """
+    POOL_SIZE = 10
+
+    _lock = Lock()
+    _sessions = {}
+
+    @classmethod
+    def get_session(cls, base_url, credentials=None):
+        """
+        Retrieves the session for the given endpoint and credentials
+        Sessions keep cookies and authentication state, so callers using other credentials never share a session
+        :param base_url: Base url of the endpoint (e.g. https://10.100.1.1:8500)
+        :type base_url: str
+        :param credentials: Credentials used towards the endpoint (e.g. the username and password or the Authorization header)
+        :type credentials: any
+        :return: The session
+        :rtype: requests.Session
+        """
+        # The credentials are part of the key (hashed) to avoid keeping them in plain text. Sessions can't be shared with forked processes
+        key = (os.getpid(), base_url, hashlib.sha1(repr(credentials)).hexdigest())
+        session = cls._sessions.get(key)
+        if session is None:
+            with cls._lock:
+                session = cls._sessions.get(key)
+                if session is None:
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SessionPool.POOL_SIZE, pool_block=True)
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    cls._sessions[key] = session
+        return session
+
+
+class CachedResponse(object):
+    """
+    Response served from the response cache of the OVSClientPool
+    Mimics the attributes of a requests.Response used by raw response consumers
+    """
+    def __init__(self, text, status_code, headers):
+        """
+        :param text: Content of the response
+        :type text: str
+        :param status_code: HTTP status code of the response
+        :type status_code: int
+        :param headers: Headers of the response
+        :type headers: dict
+        """
+        self.text = text
+        self.content = text
+        self.status_code = status_code
+        self.headers = headers
+
+    def json(self):
+        """
+        Parses the content of the response
+        :return: The parsed content
+        :rtype: any
+        """
+        return json.loads(self.text)
+
+
+class PooledOVSClient(object):
+    """
+    OVSClient shared by all callers in the process using the same endpoint and credentials
+    The OVSClient keeps its token until it expires. Concurrent calls are bounded and GET calls can be served
+    from a short-lived response cache in the volatile store.
+    """
+    MAX_CACHE_TTL = 30
+    CACHE_KEY = 'ovs_clientpool_response_{0}'
+
+    def __init__(self, key, client, concurrency):
+        """
+        :param key: Key identifying the endpoint and credentials
+        :type key: str
+        :param client: The wrapped client
+        :type client: ovs_extensions.api.client.OVSClient
+        :param concurrency: Maximum amount of concurrent calls
+        :type concurrency: int
+        """
+        self.key = key
+        self.client = client
+        self.last_used = time.time()
+        self._semaphore = BoundedSemaphore(concurrency)
+
+    def call(self, method, path, cache_ttl=None, **kwargs):
+        """
+        Executes a call
+        :param method: HTTP method to execute (get, post, put, patch or delete)
+        :type method: str
+        :param path: Path to call
+        :type path: str
+        :param cache_ttl: Amount of seconds a successful GET response may be served from cache (capped at MAX_CACHE_TTL)
+        :type cache_ttl: int
+        :param kwargs: Additional arguments for the client (params, data)
+        :return: The response of the call
+        :rtype: any
+        """
+        self.last_used = time.time()
+        cache_key = None
+        volatile = None
+        if method == 'get' and cache_ttl:
+            volatile = VolatileFactory.get_client()
+            params = kwargs.get('params') or {}
+            fingerprint = json.dumps([self.key, path, sorted((str(k), str(v)) for k, v in params.iteritems())])
+            cache_key = PooledOVSClient.CACHE_KEY.format(hashlib.sha1(fingerprint).hexdigest())
+            cached = volatile.get(cache_key)
+            if cached is not None:
+                if cached['raw'] is True:
+                    return CachedResponse(text=cached['text'], status_code=cached['status_code'], headers=cached['headers'])
+                return cached['data']
+
+        with self._semaphore:
+            response = getattr(self.client, method)(path, **kwargs)
+
+        if cache_key is not None:
+            ttl = min(int(cache_ttl), PooledOVSClient.MAX_CACHE_TTL)
+            if hasattr(response, 'status_code'):
+                if response.status_code == 200:
+                    volatile.set(cache_key, {'raw': True,
+                                             'text': response.text,
+                                             'status_code': response.status_code,
+                                             'headers': dict(response.headers)}, ttl)
+            else:
+                volatile.set(cache_key, {'raw': False, 'data': response}, ttl)
+        return response
+
+
+class OVSClientPool(object):
+    """
+    Process-wide pool of authenticated OVSClients keyed by endpoint and credentials
+    Reusing the clients avoids a new OAuth 2 handshake for every call towards the same endpoint.
+    """
+    MAX_CLIENTS = 64
+    IDLE_TIMEOUT = 600
+    CONCURRENCY = 10
+
+    _logger = Logger('extensions-generic')
+    _lock = Lock()
+    _clients = OrderedDict()
+
+    @classmethod
+    def get_client(cls, ip, port, credentials, version='*', raw_response=False):
+        """
+        Retrieves a pooled client
+        :param ip: IP of the endpoint
+        :type ip: str
+        :param port: Port of the endpoint
+        :type port: int
+        :param credentials: Tuple with client id, client secret
+        :type credentials: tuple
+        :param version: API version to request
+        :type version: str or int
+        :param raw_response: Return the raw responses instead of the parsed data
+        :type raw_response: bool
+        :return: The pooled client
+        :rtype: PooledOVSClient
+        """
+        client_id, client_secret = credentials
+        key = cls._build_key(ip, port, client_id, client_secret, version, raw_response)
+        return cls._get(key, lambda: OVSClient(ip, port,
+                                               credentials=credentials,
+                                               version=version,
+                                               raw_response=raw_response,
+                                               cache_store=VolatileFactory.get_client()))
+
+    @classmethod
+    def get_instance(cls, connection_info):
+        """
+        Retrieves a pooled client based on connection information as stored in the model
+        :param connection_info: Connection information (host, port, client_id, client_secret, ...)
+        :type connection_info: dict
+        :return: The pooled client
+        :rtype: PooledOVSClient
+        """
+        key = cls._build_key(connection_info['host'], connection_info['port'], connection_info['client_id'],
+                             connection_info['client_secret'], None, False)
+        return cls._get(key, lambda: OVSClient.get_instance(connection_info=connection_info, cache_store=VolatileFactory.get_client()))
+
+    @staticmethod
+    def _build_key(ip, port, client_id, client_secret, version, raw_response):
+        # The secret is part of the key (hashed) to prevent serving a client authenticated with other credentials
+        return '{0}:{1}_{2}_{3}_{4}_{5}_{6}'.format(ip, port, client_id, hashlib.sha1(str(client_secret)).hexdigest(),
+                                                    version, raw_response, os.getpid())
+
+    @classmethod
+    def _get(cls, key, create):
+        """
+        Retrieves a client from the pool or creates one, evicting idle or least recently used clients
+        """
+        with cls._lock:
+            pooled = cls._clients.pop(key, None)
+            if pooled is None:
+                pooled = PooledOVSClient(key=key, client=create(), concurrency=OVSClientPool.CONCURRENCY)
+            cls._clients[key] = pooled  # Most recently used entries are kept at the end
+            now = time.time()
+            for other_key, other in cls._clients.items():
+                if len(cls._clients) > OVSClientPool.MAX_CLIENTS or now - other.last_used > OVSClientPool.IDLE_TIMEOUT:
+                    if other_key != key:
+                        del cls._clients[other_key]
+            return pooled
@@ -0,0 +1,262 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Latency histogram module
+"""
+
+import os
+import time
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.system import System
+from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class LatencyHistogram(object):
+    """
+    HDR-style latency histogram
+    Values are stored in microseconds in logarithmic buckets, each power of 2 being split in SUB_BUCKETS linear
+    sub-buckets. This keeps the relative error below 1 / SUB_BUCKETS with a bounded amount of buckets.
+    """
+    SUB_BUCKETS = 16
+    _SUB_BUCKET_BITS = 4
+
+    def __init__(self):
+        """
+        Initializes an empty histogram
+        """
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = {}
+
+    @staticmethod
+    def _index(value):
+        """
+        Calculates the bucket index of a value in microseconds
+        """
+        if value < LatencyHistogram.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 1 - LatencyHistogram._SUB_BUCKET_BITS
+        return shift * LatencyHistogram.SUB_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def _value(index):
+        """
+        Calculates the value (in microseconds) in the middle of the bucket with the given index
+        """
+        if index < LatencyHistogram.SUB_BUCKETS:
+            return index
+        shift = index / LatencyHistogram.SUB_BUCKETS - 1
+        sub_bucket = index - shift * LatencyHistogram.SUB_BUCKETS
+        return (sub_bucket << shift) + ((1 << shift) - 1) / 2.0
+
+    def record(self, value):
+        """
+        Records a value
+        :param value: Duration in seconds
+        :type value: float
+        :return: None
+        :rtype: NoneType
+        """
+        index = LatencyHistogram._index(max(0, int(value * 1000000)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other):
+        """
+        Merges another histogram into this one
+        :param other: Histogram to merge
+        :type other: LatencyHistogram
+        :return: None
+        :rtype: NoneType
+        """
+        for index, amount in other.buckets.iteritems():
+            self.buckets[index] = self.buckets.get(index, 0) + amount
+        self.count += other.count
+        self.total += other.total
+        for attribute, function in [('minimum', min), ('maximum', max)]:
+            values = [value for value in [getattr(self, attribute), getattr(other, attribute)] if value is not None]
+            setattr(self, attribute, function(values) if values else None)
+
+    def percentile(self, percentile):
+        """
+        Estimates the given percentile
+        :param percentile: Percentile to calculate (0 - 100)
+        :type percentile: float
+        :return: The estimated value in seconds
+        :rtype: float
+        """
+        if self.count == 0:
+            return None
+        threshold = self.count * percentile / 100.0
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= threshold:
+                return min(self.maximum, max(self.minimum, LatencyHistogram._value(index) / 1000000.0))
+        return self.maximum
+
+    def summary(self):
+        """
+        Summarizes the histogram
+        :return: Count, sum, min, max, mean and the most relevant percentiles
+        :rtype: dict
+        """
+        return {'count': self.count,
+                'sum': self.total,
+                'min': self.minimum,
+                'max': self.maximum,
+                'mean': self.total / self.count if self.count > 0 else None,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+    def serialize(self):
+        """
+        Serializes the histogram so it can be stored in the volatile store
+        :return: Serialized histogram
+        :rtype: dict
+        """
+        return {'count': self.count,
+                'sum': self.total,
+                'min': self.minimum,
+                'max': self.maximum,
+                'buckets': self.buckets}
+
+    @classmethod
+    def deserialize(cls, data):
+        """
+        Restores a serialized histogram
+        :param data: Serialized histogram
+        :type data: dict
+        :return: The histogram
+        :rtype: LatencyHistogram
+        """
+        histogram = cls()
+        histogram.count = data['count']
+        histogram.total = data['sum']
+        histogram.minimum = data['min']
+        histogram.maximum = data['max']
+        histogram.buckets = dict((int(index), amount) for index, amount in data['buckets'].iteritems())
+        return histogram
+
+
+class HistogramAggregator(object):
+    """
+    Aggregates durations per name and phase in LatencyHistograms
+    Every process keeps its own histograms and periodically publishes them in the volatile store.
+    The histograms of all processes are merged when they are requested.
+    Subclasses define the volatile keys and their own process state (_lock, _histograms, _last_push, _worker_id)
+    """
+    PUSH_INTERVAL = 30
+    WORKER_TIMEOUT = 300
+    WORKERS_KEY = None
+    WORKER_KEY = None
+
+    _logger = Logger('extensions-generic')
+    _lock = None
+    _histograms = None
+    _last_push = None
+    _worker_id = None
+
+    @classmethod
+    def record_values(cls, name, values):
+        """
+        Records a set of durations
+        :param name: Identifier of the measured item (e.g. an endpoint or a task name)
+        :type name: str
+        :param values: Durations in seconds per phase
+        :type values: dict
+        :return: None
+        :rtype: NoneType
+        """
+        cls._get_worker_id()
+        with cls._lock:
+            phases = cls._histograms.setdefault(name, {})
+            for phase, value in values.iteritems():
+                if phase not in phases:
+                    phases[phase] = LatencyHistogram()
+                phases[phase].record(value)
+        if cls._last_push is None or time.time() - cls._last_push > cls.PUSH_INTERVAL:
+            cls.publish()
+
+    @classmethod
+    def publish(cls):
+        """
+        Publishes the histograms of this process in the volatile store
+        :return: None
+        :rtype: NoneType
+        """
+        now = time.time()
+        cls._last_push = now
+        worker_id = cls._get_worker_id()
+        with cls._lock:
+            snapshot = dict((name, dict((phase, histogram.serialize()) for phase, histogram in phases.iteritems()))
+                            for name, phases in cls._histograms.iteritems())
+        try:
+            client = VolatileFactory.get_client()
+            client.set(cls.WORKER_KEY.format(worker_id), snapshot, cls.WORKER_TIMEOUT)
+            workers = client.get(cls.WORKERS_KEY, {})
+            if worker_id not in workers or now - workers[worker_id] > cls.WORKER_TIMEOUT / 2:
+                with volatile_mutex(cls.WORKERS_KEY):
+                    workers = client.get(cls.WORKERS_KEY, {})
+                    workers = dict((key, last_seen) for key, last_seen in workers.iteritems() if now - last_seen < cls.WORKER_TIMEOUT)
+                    workers[worker_id] = now
+                    client.set(cls.WORKERS_KEY, workers)
+        except Exception:
+            cls._logger.exception('Could not publish the metrics')
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        Merges the metrics of all processes
+        :return: Summary per name and phase
+        :rtype: dict
+        """
+        cls.publish()
+        client = VolatileFactory.get_client()
+        merged = {}
+        for worker_id in client.get(cls.WORKERS_KEY, {}):
+            snapshot = client.get(cls.WORKER_KEY.format(worker_id))
+            if snapshot is None:
+                continue
+            for name, phases in snapshot.iteritems():
+                merged_phases = merged.setdefault(name, {})
+                for phase, data in phases.iteritems():
+                    if phase not in merged_phases:
+                        merged_phases[phase] = LatencyHistogram()
+                    merged_phases[phase].merge(LatencyHistogram.deserialize(data))
+        return dict((name, dict((phase, histogram.summary()) for phase, histogram in phases.iteritems()))
+                    for name, phases in merged.iteritems())
+
+    @classmethod
+    def _get_worker_id(cls):
+        """
+        Identifies this process. Reset after a fork, as the histograms are only valid for the parent process
+        """
+        worker_id = '{0}_{1}'.format(System.get_my_machine_id(), os.getpid())
+        if cls._worker_id != worker_id:
+            with cls._lock:
+                if cls._worker_id is not None:
+                    cls._histograms = {}
+                cls._worker_id = worker_id
+        return worker_id
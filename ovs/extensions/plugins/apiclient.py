@@ -24,6 +24,7 @@ import inspect
 import logging
 import requests
 from ovs_extensions.generic.exceptions import InvalidCredentialsError, NotFoundError
+from ovs.extensions.generic.clientpool import SessionPool
 from ovs.extensions.generic.logger import Logger
 try:
     from requests.packages.urllib3 import disable_warnings
@@ -45,6 +46,7 @@ class APIClient(object):
     Basic API client: passes username and password in the Authorization header
     """
     _logger = Logger('extensions-plugins')
+    _SESSION_METHODS = ['get', 'post', 'put', 'patch', 'delete']
 
     disable_warnings(InsecurePlatformWarning)
     disable_warnings(InsecureRequestWarning)
@@ -111,6 +113,9 @@ class APIClient(object):
         for key, val in [('json', json), ('data', data)]:
             if val is not None:
                 kwargs[key] = val
+        # Execute the call over the pooled keep-alive session of the endpoint
+        if getattr(method, '__name__', None) in APIClient._SESSION_METHODS:
+            method = getattr(SessionPool.get_session(self._base_url, credentials=self._base_headers.get('Authorization')), method.__name__)
         response = method(**kwargs)
         if response.status_code == 404:
             msg = 'URL not found: {0}'.format(kwargs['url'])
@@ -28,25 +28,72 @@ import logging
 from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.system import System
-from ovs.extensions.rabbitmq.processor import process
+from ovs.extensions.rabbitmq.processor import EventBatcher, get_ordering_key, process
+from ovs.extensions.rabbitmq.workerpool import AckTracker, ConsumerStats, OrderedWorkerPool
 
+ACK_INTERVAL = 0.25
+DEFAULT_PREFETCH = 250
+DEFAULT_WORKERS = 4
 mapping = {}
 
 
 if __name__ == '__main__':
     def callback(ch, method, properties, body):
         """
-        Handles the message, making sure it gets acknowledged once processed
+        Hands the message to the worker pool. It gets acknowledged once processed and its events are dispatched
         """
         _ = properties
+        ack_tracker.delivered(method.delivery_tag)
         try:
             if type(body) == unicode:
                 data = bytearray(body, 'utf-8')
                 body = bytes(data)
-            process(queue, body, mapping)
+            ordering_key = get_ordering_key(queue, body)
         except Exception as e:
-            logger.exception('Error processing message: {0}'.format(e))
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+            logger.exception('Error determining the ordering key of message: {0}'.format(e))
+            ordering_key = None
+        pool.submit(ordering_key, method.delivery_tag, body)
+        if batcher.due() or ack_tracker.in_flight >= ack_threshold:
+            acknowledge(ch)
+
+    def handle(body):
+        """
+        Processes a single message
+        """
+        process(queue, body, mapping, batcher)
+
+    def acknowledge(ch):
+        """
+        Dispatches the batched events when due and acknowledges the messages of which the events are dispatched
+        """
+        processed_tags.extend(pool.completed())  # Their events were added to the batcher before they were reported
+        if batcher.due():
+            try:
+                batcher.flush()
+            except Exception as e:
+                logger.exception('Error dispatching batched events: {0}'.format(e))
+                return
+        elif not batcher.empty():
+            return
+        ack_tracker.completed(processed_tags)
+        del processed_tags[:]
+        tag = ack_tracker.ackable()
+        if tag is not None:
+            ch.basic_ack(delivery_tag=tag, multiple=True)
+
+    def ack_timer():
+        """
+        Acknowledges the processed messages and reports the statistics when no new messages arrive
+        """
+        try:
+            if ack_tracker.in_flight > 0:
+                acknowledge(channel)
+            if stats.due():
+                backlog = channel.queue_declare(queue=queue, durable=durable, passive=True).method.message_count
+                stats.report(backlog=backlog, in_flight=ack_tracker.in_flight)
+        except Exception as e:
+            logger.exception('Error acknowledging messages: {0}'.format(e))
+        connection.add_timeout(ACK_INTERVAL, ack_timer)
 
     import argparse
     parser = argparse.ArgumentParser(description='Rabbitmq Event Processor for OVS',
@@ -113,11 +160,27 @@ if __name__ == '__main__':
             queue = args.rabbitmq_queue
             durable = args.queue_durable
             channel.queue_declare(queue=queue, durable=durable)
+
+            # Consumer settings, optionally configured in /ovs/framework/messagequeue|consumer:
+            # - prefetch: Amount of unacknowledged messages delivered to the consumer
+            # - workers: Amount of threads processing messages. Messages of the same volume are processed by the same thread, in order.
+            #            When set to 0, the messages are processed by the consuming thread
+            consumer_config = Configuration.get('/ovs/framework/messagequeue|consumer', default={})
+            prefetch = consumer_config.get('prefetch', DEFAULT_PREFETCH)
+            # Acknowledge without waiting for the ack timer once half of the prefetch window is in flight. A prefetch of 0 means
+            # unlimited, so the default window is used then. A window of a single message is acknowledged as soon as possible
+            ack_threshold = max(1, (prefetch or DEFAULT_PREFETCH) / 2)
+            batcher = EventBatcher()
+            stats = ConsumerStats(queue)
+            ack_tracker = AckTracker()
+            processed_tags = []
+            pool = OrderedWorkerPool(amount=consumer_config.get('workers', DEFAULT_WORKERS), handler=handle, stats=stats)
             logger.info('Waiting for messages on {0}...'.format(queue))
             logger.info('To exit press CTRL+C', extra={'print_msg': True})
 
-            channel.basic_qos(prefetch_count=1)
+            channel.basic_qos(prefetch_count=prefetch)  # Messages are acknowledged once processed and their events are dispatched
             channel.basic_consume(callback, queue=queue)
+            connection.add_timeout(ACK_INTERVAL, ack_timer)
             channel.start_consuming()
         else:
             logger.info('Nothing to do here, kthxbai',)
@@ -0,0 +1,106 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Volume event waiter module
+"""
+
+import time
+from threading import Lock
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class VolumeEventWaiter(object):
+    """
+    Allows waiting for volumedriver events of a volume
+    For every processed volumedriver event, the event processor increments the sequence of the volume and a global
+    sequence in the volatile store. All waiters in a process share a single read of the global sequence every
+    POLL_INTERVAL seconds. A waiter only reads the sequence of its volume when the global sequence changed.
+    """
+    SEQUENCE_KEY = 'ovs_volume_events_sequence'
+    VOLUME_KEY = 'ovs_volume_events_{0}'
+    VOLUME_TTL = 24 * 60 * 60
+    POLL_INTERVAL = 0.05
+
+    _lock = Lock()
+    _sequence = None
+    _last_read = 0
+
+    @staticmethod
+    def notify(volume_id):
+        """
+        Registers an event for a volume, waking up its waiters
+        :param volume_id: ID of the volume
+        :type volume_id: str
+        :return: None
+        :rtype: NoneType
+        """
+        volatile = VolatileFactory.get_client()
+        volatile.add(key=VolumeEventWaiter.VOLUME_KEY.format(volume_id), value=0, time=VolumeEventWaiter.VOLUME_TTL)
+        volatile.incr(VolumeEventWaiter.VOLUME_KEY.format(volume_id))
+        volatile.add(VolumeEventWaiter.SEQUENCE_KEY, 0)
+        volatile.incr(VolumeEventWaiter.SEQUENCE_KEY)
+
+    @staticmethod
+    def get_sequence(volume_id):
+        """
+        Retrieves the event sequence of a volume. To be passed to 'wait' as the point to wait from
+        :param volume_id: ID of the volume
+        :type volume_id: str
+        :return: The event sequence
+        :rtype: int
+        """
+        return VolatileFactory.get_client().get(VolumeEventWaiter.VOLUME_KEY.format(volume_id), 0)
+
+    @classmethod
+    def wait(cls, volume_id, since, timeout):
+        """
+        Waits until an event for a volume occurred after the given sequence
+        :param volume_id: ID of the volume
+        :type volume_id: str
+        :param since: Sequence of the volume as retrieved by 'get_sequence' before the waited for condition was checked
+        :type since: int
+        :param timeout: Maximum amount of seconds to wait
+        :type timeout: float
+        :return: True when an event occurred, False when the timeout expired
+        :rtype: bool
+        """
+        deadline = time.time() + timeout
+        global_sequence = cls._get_global_sequence()
+        while True:
+            if cls.get_sequence(volume_id) != since:
+                return True
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(VolumeEventWaiter.POLL_INTERVAL, remaining))
+                current = cls._get_global_sequence()
+                if current != global_sequence:
+                    global_sequence = current
+                    break
+
+    @classmethod
+    def _get_global_sequence(cls):
+        """
+        Retrieves the global event sequence, reading it from the volatile store at most once every POLL_INTERVAL seconds
+        """
+        with cls._lock:
+            now = time.time()
+            if not 0 <= now - cls._last_read < VolumeEventWaiter.POLL_INTERVAL:
+                cls._sequence = VolatileFactory.get_client().get(VolumeEventWaiter.SEQUENCE_KEY, 0)
+                cls._last_read = now
+            return cls._sequence
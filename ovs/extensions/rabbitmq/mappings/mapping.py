@@ -34,7 +34,8 @@ class Mapping(object):
                                                                '[NODE_ID]': 'storagedriver_id'},
                                                  'options': {'delay': 1,
                                                              'dedupe': True,
-                                                             'dedupe_key': 'create_resize_[volume_id]_[storagedriver_id]'}}],
+                                                             'dedupe_key': 'create_resize_[volume_id]_[storagedriver_id]',
+                                                             'batch_task': VDiskController.resize_multiple_from_voldrv}}],
                FileSystemEvents.volume_create: [{'task': VDiskController.resize_from_voldrv,
                                                  'arguments': {'name': 'volume_id',
                                                                'size': 'volume_size',
@@ -42,12 +43,16 @@ class Mapping(object):
                                                                '[NODE_ID]': 'storagedriver_id'},
                                                  'options': {'delay': 1,
                                                              'dedupe': True,
-                                                             'dedupe_key': 'create_resize_[volume_id]_[storagedriver_id]'}}],
+                                                             'dedupe_key': 'create_resize_[volume_id]_[storagedriver_id]',
+                                                             'batch_task': VDiskController.resize_multiple_from_voldrv}}],
                FileSystemEvents.up_and_running: [{'task': VPoolController.up_and_running,
                                                   'arguments': {'[NODE_ID]': 'storagedriver_id'}}],
                FileSystemEvents.owner_changed: [{'task': VDiskController.migrate_from_voldrv,
                                                  'arguments': {'name': 'volume_id',
-                                                               'new_owner_id': 'new_owner_id'}}],
+                                                               'new_owner_id': 'new_owner_id'},
+                                                 'options': {'dedupe': True,
+                                                             'dedupe_key': 'owner_changed_[volume_id]',
+                                                             'batch_task': VDiskController.migrate_multiple_from_voldrv}}],
                FileSystemEvents.file_rename: [{'task': VDiskController.rename_from_voldrv,
                                                'arguments': {'new_path': 'new_path',
                                                              'old_path': 'old_path',
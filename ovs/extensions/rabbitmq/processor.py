@@ -19,7 +19,10 @@ Contains the process method for processing rabbitmq messages
 """
 
 import json
+import time
 import inspect
+from collections import OrderedDict
+from threading import Lock
 import volumedriver.storagerouter.FileSystemEvents_pb2 as FileSystemEvents
 import volumedriver.storagerouter.VolumeDriverEvents_pb2 as VolumeDriverEvents
 from celery.task.control import revoke
@@ -27,17 +30,189 @@ from google.protobuf.descriptor import FieldDescriptor
 from ovs.dal.lists.storagedriverlist import StorageDriverList
 from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
+from ovs.extensions.rabbitmq.eventwaiter import VolumeEventWaiter
 from ovs.extensions.storage.volatilefactory import VolatileFactory
 
 CINDER_VOLUME_UPDATE_CACHE = {}
 
 
-def process(queue, body, mapping):
+class StorageDriverMap(object):
+    """
+    Cached map of StorageDriver IDs (as reported by the volumedriver events) towards their StorageDriver and StorageRouter
+    The map is reloaded when it expires or when an unknown ID is requested, at most once every MIN_RELOAD_INTERVAL seconds
+    """
+    TTL = 60
+    MIN_RELOAD_INTERVAL = 5
+
+    _map = {}
+    _loaded = 0
+
+    @classmethod
+    def get(cls, storagedriver_id):
+        """
+        Retrieves the information of a StorageDriver
+        :param storagedriver_id: ID of the StorageDriver
+        :type storagedriver_id: str
+        :return: Dict with the guid of the StorageDriver and the machine ID of its StorageRouter or None if unknown
+        :rtype: dict
+        """
+        now = time.time()
+        age = now - cls._loaded
+        if age > StorageDriverMap.TTL or (storagedriver_id not in cls._map and age > StorageDriverMap.MIN_RELOAD_INTERVAL):
+            cls._map = dict((storagedriver.storagedriver_id, {'guid': storagedriver.guid,
+                                                              'machine_id': storagedriver.storagerouter.machine_id})
+                            for storagedriver in StorageDriverList.get_storagedrivers())
+            cls._loaded = now
+        return cls._map.get(storagedriver_id)
+
+
+class EventBatcher(object):
+    """
+    Collects the events of which the mapping specifies a batch task
+    Events are grouped per batch task, routing key and delay. Events with the same dedupe key are coalesced, keeping the
+    last one. A group is dispatched as a single batch task when the batcher is flushed, which should happen when the
+    batcher is due: WINDOW seconds after the first collected event or when MAX_SIZE events are collected.
+    Events can be added by multiple threads.
+    """
+    WINDOW = 1
+    MAX_SIZE = 250
+
+    _logger = Logger('extensions-rabbitmq')
+
+    def __init__(self):
+        self._lock = Lock()
+        self._batches = OrderedDict()
+        self._started = None
+        self._size = 0
+        self._counter = 0
+
+    def add(self, task, kwargs, routing_key, delay, dedupe_key=None):
+        """
+        Adds an event
+        :param task: Batch task to dispatch the event with
+        :type task: celery.Task
+        :param kwargs: Arguments of the event
+        :type kwargs: dict
+        :param routing_key: Routing key for the batch task
+        :type routing_key: str
+        :param delay: Countdown for the batch task
+        :type delay: int
+        :param dedupe_key: Key on which events are coalesced
+        :type dedupe_key: str
+        :return: None
+        :rtype: NoneType
+        """
+        batch_key = (task.__name__, routing_key, delay)
+        with self._lock:
+            if batch_key not in self._batches:
+                self._batches[batch_key] = {'task': task,
+                                            'events': OrderedDict()}
+            events = self._batches[batch_key]['events']
+            if dedupe_key is None:
+                self._counter += 1
+                dedupe_key = self._counter
+            elif dedupe_key in events:
+                self._size -= 1
+                del events[dedupe_key]  # The coalesced event is moved to the end
+            events[dedupe_key] = kwargs
+            self._size += 1
+            if self._started is None:
+                self._started = time.time()
+
+    def empty(self):
+        """
+        Verifies whether there are events to dispatch
+        :return: True if no events are collected
+        :rtype: bool
+        """
+        return self._size == 0
+
+    def due(self):
+        """
+        Verifies whether the collected events should be dispatched
+        :return: True if the batcher should be flushed
+        :rtype: bool
+        """
+        return self._size >= EventBatcher.MAX_SIZE or (self._started is not None and time.time() - self._started >= EventBatcher.WINDOW)
+
+    def flush(self):
+        """
+        Dispatches the collected events
+        When dispatching fails, the batches which were not dispatched are kept for the next flush
+        :return: Amount of dispatched batch tasks
+        :rtype: int
+        """
+        with self._lock:
+            batches = self._batches
+            self._batches = OrderedDict()
+            self._started = None
+            self._size = 0
+        dispatched = 0
+        for batch_key, batch in batches.items():
+            _, routing_key, delay = batch_key
+            events = batch['events'].values()
+            try:
+                async_result = batch['task'].s(events=events).apply_async(countdown=delay, routing_key=routing_key)
+            except Exception:
+                with self._lock:
+                    for remaining_key, remaining in batches.items()[dispatched:]:
+                        for dedupe_key, kwargs in remaining['events'].iteritems():
+                            self._requeue(remaining_key, remaining['task'], dedupe_key, kwargs)
+                raise
+            dispatched += 1
+            EventBatcher._logger.info('{0}({1} events) started on {2} with taskid {3}. Delay: {4}s'.format(
+                batch['task'].__name__,
+                len(events),
+                routing_key,
+                async_result.id,
+                delay
+            ))
+        return dispatched
+
+    def _requeue(self, batch_key, task, dedupe_key, kwargs):
+        """
+        Puts back an event which could not be dispatched. Events collected in the meantime take precedence
+        """
+        if batch_key not in self._batches:
+            self._batches[batch_key] = {'task': task,
+                                        'events': OrderedDict()}
+        events = self._batches[batch_key]['events']
+        if dedupe_key not in events:
+            events[dedupe_key] = kwargs
+            self._size += 1
+        if self._started is None:
+            self._started = time.time()
+
+
+def get_ordering_key(queue, body):
+    """
+    Determines the key on which the processing order of the messages has to be preserved
+    For volumedriver events this is the volume id or, for events without volume, the StorageDriver ID
+    :param queue: Type of queue the message was received on
+    :type queue: str
+    :param body: Body of the message
+    :type body: str
+    :return: The ordering key
+    :rtype: str
+    """
+    if queue != Configuration.get('/ovs/framework/messagequeue|queues.storagedriver'):
+        return queue
+    message = FileSystemEvents.EventMessage()
+    message.ParseFromString(body)
+    volume_id = _get_volume_id(message)
+    if volume_id is not None:
+        return volume_id
+    return message.node_id
+
+
+def process(queue, body, mapping, batcher=None):
     """
     Processes the actual received body
     :param queue:   Type of queue to be used
     :param body:    Body of the message
     :param mapping:
+    :param batcher: Batcher collecting the events of which the mapping specifies a batch task. Without batcher, these events are dispatched individually
+    :type batcher: EventBatcher
     """
     logger = Logger('extensions-rabbitmq')
     if queue == Configuration.get('/ovs/framework/messagequeue|queues.storagedriver'):
@@ -56,6 +231,12 @@ def process(queue, body, mapping):
         # - [<argument value>]: Any value of the `arguments` dictionary.
 
         logger.info('Got event, processing...')
+        volume_id = _get_volume_id(message)
+        if volume_id is not None:
+            try:
+                VolumeEventWaiter.notify(volume_id)
+            except Exception:
+                logger.exception('Could not notify the waiters of volume {0}'.format(volume_id))
         event = None
         for extension in mapping.keys():
             if not message.event.HasExtension(extension):
@@ -78,12 +259,13 @@ def process(queue, body, mapping):
                 if 'options' in current_map:
                     options = current_map['options']
                     if options.get('execonstoragerouter', False):
-                        storagedriver = StorageDriverList.get_by_storagedriver_id(node_id)
-                        if storagedriver is not None:
-                            routing_key = 'sr.{0}'.format(storagedriver.storagerouter.machine_id)
+                        storagedriver_info = StorageDriverMap.get(node_id)
+                        if storagedriver_info is not None:
+                            routing_key = 'sr.{0}'.format(storagedriver_info['machine_id'])
                     delay = options.get('delay', 0)
                     dedupe = options.get('dedupe', False)
                     dedupe_key = options.get('dedupe_key', None)
+                    key = None
                     if dedupe is True and dedupe_key is not None:  # We can't dedupe without a key
                         key = 'ovs_dedupe_volumedriver_events_{0}'.format(dedupe_key)
                         key = key.replace('[EVENT_NAME]', extension.full_name)
@@ -91,6 +273,13 @@ def process(queue, body, mapping):
                         for kwarg_key in kwargs:
                             key = key.replace('[{0}]'.format(kwarg_key), str(kwargs[kwarg_key]))
                         key = key.replace(' ', '_')
+                    batch_task = options.get('batch_task')
+                    if batch_task is not None and batcher is not None:
+                        _log(task, kwargs, node_id)
+                        batcher.add(task=batch_task, kwargs=kwargs, routing_key=routing_key, delay=delay, dedupe_key=key)
+                        logger.info('[{0}] {1}({2}) batched for {3}'.format(queue, task.__name__, json.dumps(kwargs), routing_key))
+                        continue
+                    if key is not None:
                         task_id = cache.get(key)
                         if task_id:
                             # Key exists, task was already scheduled
@@ -171,7 +360,8 @@ def _log(task, kwargs, storagedriver_id):
     """
     Log an event
     """
-    metadata = {'storagedriver': StorageDriverList.get_by_storagedriver_id(storagedriver_id).guid}
+    storagedriver_info = StorageDriverMap.get(storagedriver_id)
+    metadata = {'storagedriver': None if storagedriver_info is None else storagedriver_info['guid']}
     _logger = Logger('volumedriver_event')
     _logger.info('[{0}.{1}] - {2} - {3}'.format(
         task.__class__.__module__,
@@ -179,3 +369,15 @@ def _log(task, kwargs, storagedriver_id):
         json.dumps(kwargs),
         json.dumps(metadata)
     ))
+
+
+def _get_volume_id(message):
+    """
+    Retrieves the volume id a volumedriver event message relates to, or None for events without volume
+    """
+    for _, event in message.event.ListFields():
+        for field in ['name', 'volume_name']:
+            volume_id = getattr(event, field, None)
+            if volume_id:
+                return volume_id
+    return None
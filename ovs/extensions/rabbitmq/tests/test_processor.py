@@ -0,0 +1,171 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Rabbitmq event processor test module
+"""
+import unittest
+from ovs.extensions.rabbitmq import processor
+from ovs.extensions.rabbitmq.processor import EventBatcher
+
+
+class _Clock(object):
+    now = 1000000.0
+
+    @staticmethod
+    def time():
+        return _Clock.now
+
+
+class _AsyncResult(object):
+    def __init__(self, task_id):
+        self.id = task_id
+
+
+class _BatchTask(object):
+    """
+    Batch task recording its dispatches instead of sending them to celery
+    """
+    def __init__(self, name):
+        self.__name__ = name
+        self.dispatched = []
+        self.fail = False
+        self.on_dispatch = None
+
+    def s(self, events):
+        task = self
+
+        class _Signature(object):
+            @staticmethod
+            def apply_async(countdown, routing_key):
+                if task.on_dispatch is not None:
+                    task.on_dispatch()
+                if task.fail is True:
+                    raise RuntimeError('Could not dispatch {0}'.format(task.__name__))
+                task.dispatched.append({'events': events,
+                                        'countdown': countdown,
+                                        'routing_key': routing_key})
+                return _AsyncResult('{0}_{1}'.format(task.__name__, len(task.dispatched)))
+        return _Signature()
+
+
+class EventBatcherTest(unittest.TestCase):
+    """
+    This test class will validate the batching of the events which are dispatched to batch tasks
+    """
+    def setUp(self):
+        """
+        Replaces the clock of the processor on every test
+        """
+        self._original_time = processor.time
+        processor.time = _Clock
+        _Clock.now = 1000000.0
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        processor.time = self._original_time
+
+    def test_coalescing(self):
+        """
+        Validates whether events are grouped per task, routing key and delay and coalesced on their dedupe key
+        """
+        task_1 = _BatchTask('task_1')
+        task_2 = _BatchTask('task_2')
+        batcher = EventBatcher()
+        self.assertTrue(batcher.empty())
+        batcher.add(task_1, {'volume': 'volume_1', 'seq': 1}, 'sr_1', 0, dedupe_key='volume_1')
+        batcher.add(task_1, {'volume': 'volume_2', 'seq': 1}, 'sr_1', 0, dedupe_key='volume_2')
+        batcher.add(task_1, {'volume': 'volume_1', 'seq': 2}, 'sr_1', 0, dedupe_key='volume_1')
+        batcher.add(task_1, {'volume': 'volume_3', 'seq': 1}, 'sr_2', 0)
+        batcher.add(task_1, {'volume': 'volume_3', 'seq': 2}, 'sr_2', 0)
+        batcher.add(task_2, {'volume': 'volume_1', 'seq': 1}, 'sr_1', 5, dedupe_key='volume_1')
+        self.assertFalse(batcher.empty())
+        self.assertEqual(batcher._size, 5)
+
+        self.assertEqual(batcher.flush(), 3)
+        self.assertTrue(batcher.empty())
+        # The coalesced event keeps its last arguments and moves to the end
+        self.assertEqual(task_1.dispatched, [{'events': [{'volume': 'volume_2', 'seq': 1}, {'volume': 'volume_1', 'seq': 2}],
+                                              'countdown': 0,
+                                              'routing_key': 'sr_1'},
+                                             {'events': [{'volume': 'volume_3', 'seq': 1}, {'volume': 'volume_3', 'seq': 2}],
+                                              'countdown': 0,
+                                              'routing_key': 'sr_2'}])
+        self.assertEqual(task_2.dispatched, [{'events': [{'volume': 'volume_1', 'seq': 1}],
+                                              'countdown': 5,
+                                              'routing_key': 'sr_1'}])
+        self.assertEqual(batcher.flush(), 0)
+
+    def test_due(self):
+        """
+        Validates whether the batcher is due once the window passed since the first event or the maximum size is reached
+        """
+        task = _BatchTask('task')
+        batcher = EventBatcher()
+        self.assertFalse(batcher.due())
+        batcher.add(task, {'seq': 0}, 'sr_1', 0)
+        _Clock.now += EventBatcher.WINDOW / 2.0
+        batcher.add(task, {'seq': 1}, 'sr_1', 0)
+        self.assertFalse(batcher.due())
+        _Clock.now += EventBatcher.WINDOW / 2.0
+        self.assertTrue(batcher.due())
+        batcher.flush()
+        self.assertFalse(batcher.due())
+
+        for seq in xrange(EventBatcher.MAX_SIZE - 1):
+            batcher.add(task, {'seq': seq}, 'sr_1', 0)
+        self.assertFalse(batcher.due())
+        batcher.add(task, {'seq': 0}, 'sr_1', 0, dedupe_key='key')
+        self.assertTrue(batcher.due())
+        batcher.add(task, {'seq': 1}, 'sr_1', 0, dedupe_key='key')  # Coalesced events do not count
+        self.assertEqual(batcher._size, EventBatcher.MAX_SIZE)
+        batcher.flush()
+        self.assertFalse(batcher.due())
+
+    def test_requeue(self):
+        """
+        Validates whether the batches which could not be dispatched are kept for the next flush, without overwriting
+        events collected during the flush
+        """
+        task_1 = _BatchTask('task_1')
+        task_2 = _BatchTask('task_2')
+        batcher = EventBatcher()
+        batcher.add(task_1, {'seq': 1}, 'sr_1', 0, dedupe_key='volume_1')
+        batcher.add(task_2, {'seq': 1}, 'sr_1', 0, dedupe_key='volume_1')
+        batcher.add(task_2, {'seq': 1}, 'sr_1', 0, dedupe_key='volume_2')
+        task_2.fail = True
+        task_2.on_dispatch = lambda: batcher.add(task_2, {'seq': 2}, 'sr_1', 0, dedupe_key='volume_2')
+        _Clock.now += EventBatcher.WINDOW
+        self.assertTrue(batcher.due())
+        with self.assertRaises(RuntimeError):
+            batcher.flush()
+        self.assertEqual(len(task_1.dispatched), 1)
+        self.assertFalse(batcher.empty())
+        self.assertEqual(batcher._size, 2)
+        self.assertFalse(batcher.due())  # The window restarts with the event collected during the flush
+
+        task_2.fail = False
+        task_2.on_dispatch = None
+        _Clock.now += EventBatcher.WINDOW
+        self.assertTrue(batcher.due())
+        self.assertEqual(batcher.flush(), 1)
+        self.assertEqual(task_2.dispatched, [{'events': [{'seq': 2}, {'seq': 1}],
+                                              'countdown': 0,
+                                              'routing_key': 'sr_1'}])
+        self.assertEqual(len(task_1.dispatched), 1)
+        self.assertTrue(batcher.empty())
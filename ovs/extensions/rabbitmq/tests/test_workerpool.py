@@ -0,0 +1,128 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Rabbitmq worker pool test module
+"""
+import time
+import zlib
+import unittest
+from threading import Event, Lock
+from ovs.extensions.rabbitmq.workerpool import AckTracker, OrderedWorkerPool
+
+
+class WorkerPoolTest(unittest.TestCase):
+    """
+    This test class will validate the ordered worker pool and the batched acknowledgement of messages
+    """
+    @staticmethod
+    def _wait_completed(pool, amount, timeout=10):
+        tags = []
+        start = time.time()
+        while len(tags) < amount and time.time() - start < timeout:
+            tags.extend(pool.completed())
+            time.sleep(0.01)
+        return tags
+
+    @staticmethod
+    def _get_queue(pool, ordering_key):
+        return pool._queues[zlib.crc32(str(ordering_key)) % len(pool._queues)]
+
+    def test_ack_tracker(self):
+        """
+        Validates whether only the messages of which all preceding messages are completed can be acknowledged
+        """
+        tracker = AckTracker()
+        self.assertEqual(tracker.in_flight, 0)
+        self.assertIsNone(tracker.ackable())
+        for tag in xrange(1, 6):
+            tracker.delivered(tag)
+        self.assertEqual(tracker.in_flight, 5)
+
+        # Completed out of order: message 1 is still being processed
+        tracker.completed([2, 3])
+        self.assertIsNone(tracker.ackable())
+        self.assertEqual(tracker.in_flight, 5)
+
+        tracker.completed([1, 5])
+        self.assertEqual(tracker.ackable(), 3)
+        self.assertEqual(tracker.in_flight, 2)
+        self.assertIsNone(tracker.ackable())  # Message 4 blocks message 5
+
+        tracker.completed([4])
+        self.assertEqual(tracker.ackable(), 5)
+        self.assertEqual(tracker.in_flight, 0)
+        self.assertIsNone(tracker.ackable())
+
+    def test_ordering(self):
+        """
+        Validates whether messages with the same ordering key are processed in order while other keys are processed concurrently
+        """
+        processed = {}
+        processed_lock = Lock()
+        release = Event()
+
+        def _handler(key, value):
+            if key == 'blocked':
+                release.wait(10)
+            with processed_lock:
+                processed.setdefault(key, []).append(value)
+
+        pool = OrderedWorkerPool(amount=4, handler=_handler)
+        # Pick a key which is handled by another worker than the blocked one
+        other_key = [key for key in ('volume_{0}'.format(i) for i in xrange(100))
+                     if self._get_queue(pool, key) is not self._get_queue(pool, 'blocked')][0]
+        tag = 0
+        for value in xrange(10):
+            for key in ['blocked', other_key]:
+                tag += 1
+                pool.submit(key, tag, key, value)
+
+        # The messages of the other key are processed while the blocked worker is waiting
+        tags = self._wait_completed(pool, 10)
+        self.assertEqual(sorted(tags), range(2, 21, 2))
+        self.assertEqual(processed, {other_key: range(10)})
+
+        release.set()
+        tags = self._wait_completed(pool, 10)
+        self.assertEqual(sorted(tags), range(1, 20, 2))
+        self.assertEqual(processed, {other_key: range(10),
+                                     'blocked': range(10)})
+
+    def test_inline(self):
+        """
+        Validates whether messages are processed when submitted without workers and failing messages are still reported
+        """
+        processed = []
+
+        def _handler(value):
+            if value == 2:
+                raise RuntimeError('Processing failed')
+            processed.append(value)
+
+        pool = OrderedWorkerPool(amount=0, handler=_handler)
+        for value in xrange(1, 4):
+            pool.submit('volume_1', value, value)
+            self.assertIn(value, pool.completed())
+        self.assertEqual(processed, [1, 3])
+        self.assertEqual(pool.completed(), [])
+
+        pool = OrderedWorkerPool(amount=2, handler=_handler)
+        for value in xrange(1, 4):
+            pool.submit('volume_1', value, value)
+        self.assertEqual(sorted(self._wait_completed(pool, 3)), [1, 2, 3])
+        self.assertEqual(processed, [1, 3, 1, 3])
+
@@ -0,0 +1,230 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Concurrent processing of rabbitmq messages
+"""
+
+import time
+import zlib
+from collections import deque
+from Queue import Empty, Queue
+from threading import Lock, Thread
+from ovs.extensions.generic.histogram import LatencyHistogram
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.system import System
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class OrderedWorkerPool(object):
+    """
+    Pool of worker threads processing messages
+    Messages with the same ordering key (e.g. a volume id) are always processed by the same worker, in the order they
+    were submitted. Without workers, the messages are processed inline when submitted.
+    """
+    _logger = Logger('extensions-rabbitmq')
+
+    def __init__(self, amount, handler, stats=None):
+        """
+        :param amount: Amount of worker threads
+        :type amount: int
+        :param handler: Function processing a single message, receiving the submitted arguments
+        :type handler: callable
+        :param stats: Statistics to record the processing times in
+        :type stats: ConsumerStats
+        """
+        self._handler = handler
+        self._stats = stats
+        self._done = Queue()
+        self._queues = []
+        for index in xrange(amount):
+            queue = Queue()
+            thread = Thread(target=self._work, args=(queue,), name='event_worker_{0}'.format(index))
+            thread.daemon = True
+            thread.start()
+            self._queues.append(queue)
+
+    def submit(self, ordering_key, tag, *args):
+        """
+        Submits a message for processing
+        :param ordering_key: Key on which the processing order is preserved
+        :type ordering_key: str
+        :param tag: Identifier of the message (e.g. the delivery tag), reported once processed
+        :type tag: int
+        :param args: Arguments for the handler
+        :return: None
+        :rtype: NoneType
+        """
+        if len(self._queues) == 0:
+            self._execute(tag, args)
+        else:
+            self._queues[zlib.crc32(str(ordering_key)) % len(self._queues)].put((tag, args))
+
+    def completed(self):
+        """
+        Retrieves the identifiers of the messages processed since the last call
+        :return: List of message identifiers
+        :rtype: list
+        """
+        tags = []
+        while True:
+            try:
+                tags.append(self._done.get_nowait())
+            except Empty:
+                return tags
+
+    def _work(self, queue):
+        """
+        Processes the messages of a single worker
+        """
+        while True:
+            tag, args = queue.get()
+            self._execute(tag, args)
+
+    def _execute(self, tag, args):
+        """
+        Processes a single message. Failures are logged, the message is reported as processed regardless
+        """
+        start = time.time()
+        try:
+            self._handler(*args)
+        except Exception as ex:
+            OrderedWorkerPool._logger.exception('Error processing message: {0}'.format(ex))
+        finally:
+            if self._stats is not None:
+                self._stats.record(time.time() - start)
+            self._done.put(tag)
+
+
+class AckTracker(object):
+    """
+    Tracks the delivered messages of a channel to acknowledge them in batches
+    A message is only acknowledged when it and all messages delivered before it are completed, so a single
+    acknowledgement with multiple=True can be used without breaking the at-least-once semantics.
+    """
+    def __init__(self):
+        self._delivered = deque()
+        self._completed = set()
+
+    @property
+    def in_flight(self):
+        """
+        Amount of delivered messages which are not acknowledged yet
+        """
+        return len(self._delivered)
+
+    def delivered(self, tag):
+        """
+        Registers a delivered message
+        :param tag: Delivery tag of the message
+        :type tag: int
+        :return: None
+        :rtype: NoneType
+        """
+        self._delivered.append(tag)
+
+    def completed(self, tags):
+        """
+        Registers completed messages
+        :param tags: Delivery tags of the completed messages
+        :type tags: list
+        :return: None
+        :rtype: NoneType
+        """
+        self._completed.update(tags)
+
+    def ackable(self):
+        """
+        Retrieves the delivery tag to acknowledge (with multiple=True), forgetting all messages up to it
+        :return: The delivery tag or None if nothing can be acknowledged
+        :rtype: int
+        """
+        tag = None
+        while len(self._delivered) > 0 and self._delivered[0] in self._completed:
+            tag = self._delivered.popleft()
+            self._completed.remove(tag)
+        return tag
+
+
+class ConsumerStats(object):
+    """
+    Statistics of an event consumer: processing time, throughput and lag (messages waiting in the queue and in flight)
+    The statistics are logged and stored in the volatile store every REPORT_INTERVAL seconds
+    """
+    REPORT_INTERVAL = 60
+    STATS_KEY = 'ovs_rabbitmq_consumer_stats_{0}_{1}'
+    STATS_TTL = 600
+
+    _logger = Logger('extensions-rabbitmq')
+
+    def __init__(self, queue):
+        """
+        :param queue: Name of the consumed queue
+        :type queue: str
+        """
+        self._queue = queue
+        self._lock = Lock()
+        self._histogram = LatencyHistogram()
+        self._start = time.time()
+
+    def record(self, duration):
+        """
+        Records the processing time of a message
+        :param duration: Processing time in seconds
+        :type duration: float
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self._histogram.record(duration)
+
+    def due(self):
+        """
+        Verifies whether the statistics should be reported
+        :return: True if the report interval passed
+        :rtype: bool
+        """
+        return time.time() - self._start >= ConsumerStats.REPORT_INTERVAL
+
+    def report(self, backlog, in_flight):
+        """
+        Reports the statistics gathered since the previous report
+        :param backlog: Amount of messages waiting in the queue
+        :type backlog: int
+        :param in_flight: Amount of delivered messages which are not acknowledged yet
+        :type in_flight: int
+        :return: The reported statistics
+        :rtype: dict
+        """
+        now = time.time()
+        with self._lock:
+            histogram = self._histogram
+            self._histogram = LatencyHistogram()
+            elapsed = now - self._start
+            self._start = now
+        stats = {'timestamp': now,
+                 'backlog': backlog,
+                 'in_flight': in_flight,
+                 'throughput': histogram.count / elapsed if elapsed > 0 else 0.0,
+                 'processing_time': histogram.summary()}
+        ConsumerStats._logger.info('Queue {0} - Backlog: {1} - In flight: {2} - Throughput: {3:.1f} msg/s - Processing time p50/p99: {4}/{5}'.format(
+            self._queue, backlog, in_flight, stats['throughput'], stats['processing_time']['p50'], stats['processing_time']['p99']
+        ))
+        try:
+            VolatileFactory.get_client().set(ConsumerStats.STATS_KEY.format(self._queue, System.get_my_machine_id()), stats, ConsumerStats.STATS_TTL)
+        except Exception:
+            ConsumerStats._logger.exception('Could not store the consumer statistics')
+        return stats
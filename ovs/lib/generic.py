@@ -21,9 +21,7 @@ GenericTaskController module
 import os
 import copy
 import time
-from datetime import datetime, timedelta
 from threading import Thread
-from time import mktime
 from ovs_extensions.constants.config import ARAKOON_NAME, ARAKOON_NAME_UNITTEST
 from ovs.dal.hybrids.servicetype import ServiceType
 from ovs.dal.lists.servicelist import ServiceList
@@ -34,8 +32,11 @@ from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.sshclient import NotAuthenticatedException, SSHClient, UnableToConnectException
 from ovs_extensions.generic.toolbox import ExtensionsToolbox
 from ovs.extensions.packages.packagefactory import PackageFactory
-from ovs.lib.helpers.decorators import ovs_task
+from ovs.lib.helpers.decorators import ENSURE_SINGLE_KEY, ovs_task
+from ovs.lib.helpers.ensuresingle import EnsureSingleCoordinator
+from ovs.lib.helpers.generic.retention import SnapshotRetention
 from ovs.lib.helpers.generic.scrubber import Scrubber
+from ovs.lib.helpers.generic.scrubscheduler import ScrubScheduler
 from ovs.lib.helpers.toolbox import Toolbox, Schedule
 from ovs.lib.vdisk import VDiskController
 
@@ -54,29 +55,32 @@ class GenericController(object):
         Snapshots all vDisks
         """
         GenericController._logger.info('[SSA] started')
+        vdisk_guids = [vdisk.guid for vdisk in VDiskList.get_vdisks() if vdisk.is_vtemplate is not True]
+        metadata = {'label': '',
+                    'is_consistent': False,
+                    'timestamp': str(int(time.time())),
+                    'is_automatic': True,
+                    'is_sticky': False}
+        outcome = VDiskController.create_snapshots(vdisk_guids=vdisk_guids, metadata=metadata, timings=True)
         success = []
         fail = []
-        for vdisk in VDiskList.get_vdisks():
-            if vdisk.is_vtemplate is True:
-                continue
-            try:
-                metadata = {'label': '',
-                            'is_consistent': False,
-                            'timestamp': str(int(time.time())),
-                            'is_automatic': True,
-                            'is_sticky': False}
-                VDiskController.create_snapshot(vdisk_guid=vdisk.guid,
-                                                metadata=metadata)
-                success.append(vdisk.guid)
-            except Exception:
-                GenericController._logger.exception('Error taking snapshot for vDisk {0}'.format(vdisk.guid))
-                fail.append(vdisk.guid)
-        GenericController._logger.info('[SSA] Snapshot has been taken for {0} vDisks, {1} failed.'.format(len(success), len(fail)))
+        for vdisk_guid in vdisk_guids:
+            result = outcome['results'][vdisk_guid]
+            if result[0] is True:
+                success.append(vdisk_guid)
+            else:
+                GenericController._logger.error('Error taking snapshot for vDisk {0}: {1}'.format(vdisk_guid, result[1]))
+                fail.append(vdisk_guid)
+        timings = outcome['timings']
+        GenericController._logger.info('[SSA] Snapshot has been taken for {0} vDisks, {1} failed. Took {2:.2f}s (grouping {3:.2f}s, slowest StorageDriver {4:.2f}s)'.format(
+            len(success), len(fail), timings['total'], timings['grouping'],
+            max([item['duration'] for item in timings['storagedrivers'].itervalues()] or [0.0])
+        ))
         return success, fail
 
     @staticmethod
     @ovs_task(name='ovs.generic.delete_snapshots', schedule=Schedule(minute='1', hour='2'), ensure_single_info={'mode': 'DEFAULT'})
-    def delete_snapshots(timestamp=None):
+    def delete_snapshots(timestamp=None, dry_run=False):
         """
         Delete snapshots & scrubbing policy
 
@@ -88,112 +92,19 @@ class GenericController(object):
 
         :param timestamp: Timestamp to determine whether snapshots should be kept or not, if none provided, current time will be used
         :type timestamp: float
-
-        :return: None
+        :param dry_run: Only return the snapshots which would be deleted
+        :type dry_run: bool
+        :return: The plan (snapshots to delete per vDisk) when executing a dry run, None otherwise
+        :rtype: dict
         """
         GenericController._logger.info('Delete snapshots started')
-
-        day = timedelta(1)
-        week = day * 7
-
-        def make_timestamp(offset):
-            """
-            Create an integer based timestamp
-            :param offset: Offset in days
-            :return: Timestamp
-            """
-            return int(mktime((base - offset).timetuple()))
-
-        # Calculate bucket structure
-        if timestamp is None:
-            timestamp = time.time()
-        base = datetime.fromtimestamp(timestamp).date() - day
-        buckets = []
-        # Buckets first 7 days: [0-1[, [1-2[, [2-3[, [3-4[, [4-5[, [5-6[, [6-7[
-        for i in xrange(0, 7):
-            buckets.append({'start': make_timestamp(day * i),
-                            'end': make_timestamp(day * (i + 1)),
-                            'type': '1d',
-                            'snapshots': []})
-        # Week buckets next 3 weeks: [7-14[, [14-21[, [21-28[
-        for i in xrange(1, 4):
-            buckets.append({'start': make_timestamp(week * i),
-                            'end': make_timestamp(week * (i + 1)),
-                            'type': '1w',
-                            'snapshots': []})
-        buckets.append({'start': make_timestamp(week * 4),
-                        'end': 0,
-                        'type': 'rest',
-                        'snapshots': []})
-
-        # Get a list of all snapshots that are used as parents for clones
-        parent_snapshots = set([vd.parentsnapshot for vd in VDiskList.get_with_parent_snaphots()])
-
-        # Place all snapshots in bucket_chains
-        bucket_chains = []
-        for vdisk in VDiskList.get_vdisks():
-            vdisk.invalidate_dynamics('being_scrubbed')
-            if vdisk.being_scrubbed:
-                continue
-
-            if vdisk.info['object_type'] in ['BASE']:
-                bucket_chain = copy.deepcopy(buckets)
-                for snapshot in vdisk.snapshots:
-                    if snapshot.get('is_sticky') is True:
-                        continue
-                    if snapshot['guid'] in parent_snapshots:
-                        GenericController._logger.info('Not deleting snapshot {0} because it has clones'.format(snapshot['guid']))
-                        continue
-                    timestamp = int(snapshot['timestamp'])
-                    for bucket in bucket_chain:
-                        if bucket['start'] >= timestamp > bucket['end']:
-                            bucket['snapshots'].append({'timestamp': timestamp,
-                                                        'snapshot_id': snapshot['guid'],
-                                                        'vdisk_guid': vdisk.guid,
-                                                        'is_consistent': snapshot['is_consistent']})
-                bucket_chains.append(bucket_chain)
-
-        # Clean out the snapshot bucket_chains, we delete the snapshots we want to keep
-        # And we'll remove all snapshots that remain in the buckets
-        for bucket_chain in bucket_chains:
-            first = True
-            for bucket in bucket_chain:
-                if first is True:
-                    best = None
-                    for snapshot in bucket['snapshots']:
-                        if best is None:
-                            best = snapshot
-                        # Consistent is better than inconsistent
-                        elif snapshot['is_consistent'] and not best['is_consistent']:
-                            best = snapshot
-                        # Newer (larger timestamp) is better than older snapshots
-                        elif snapshot['is_consistent'] == best['is_consistent'] and \
-                                snapshot['timestamp'] > best['timestamp']:
-                            best = snapshot
-                    bucket['snapshots'] = [s for s in bucket['snapshots'] if
-                                           s['timestamp'] != best['timestamp']]
-                    first = False
-                elif bucket['end'] > 0:
-                    oldest = None
-                    for snapshot in bucket['snapshots']:
-                        if oldest is None:
-                            oldest = snapshot
-                        # Older (smaller timestamp) is the one we want to keep
-                        elif snapshot['timestamp'] < oldest['timestamp']:
-                            oldest = snapshot
-                    bucket['snapshots'] = [s for s in bucket['snapshots'] if
-                                           s['timestamp'] != oldest['timestamp']]
-
-        # Delete obsolete snapshots
-        for bucket_chain in bucket_chains:
-            for bucket in bucket_chain:
-                for snapshot in bucket['snapshots']:
-                    VDiskController.delete_snapshot(vdisk_guid=snapshot['vdisk_guid'],
-                                                    snapshot_id=snapshot['snapshot_id'])
+        plan = SnapshotRetention(timestamp=timestamp).execute(dry_run=dry_run)
         GenericController._logger.info('Delete snapshots finished')
+        if dry_run is True:
+            return plan
 
     @staticmethod
-    @ovs_task(name='ovs.generic.execute_scrub', schedule=Schedule(minute='0', hour='3'), ensure_single_info={'mode': 'DEDUPED'})
+    @ovs_task(name='ovs.generic.execute_scrub', ensure_single_info={'mode': 'DEDUPED'})
     def execute_scrub(vpool_guids=None, vdisk_guids=None, storagerouter_guid=None, manual=False):
         """
         Divide the scrub work among all StorageRouters with a SCRUB partition
@@ -207,7 +118,13 @@ class GenericController(object):
         :type manual: bool
         :return: None
         :rtype: NoneType
+        :raises RuntimeError: When a scheduled scrub is running
         """
+        # The scheduled scrub does not start while this task runs (see its extra_task_names), this guards the other direction
+        scheduled_key = '{0}_{1}'.format(ENSURE_SINGLE_KEY, 'ovs.generic.execute_scheduled_scrub')
+        if EnsureSingleCoordinator(key=scheduled_key, mode='DEFAULT').get() is not None:
+            raise RuntimeError('A scheduled scrub is running, not starting a scrub')
+
         # GenericController.execute_scrub.request.id gets the current celery task id (None if executed directly)
         # Fetching the task_id with the hasattr because Unit testing does not execute the wrapper (No celery task but a normal function being called)
         if os.environ.get('RUNNING_UNITTESTS') == 'True':
@@ -217,6 +134,26 @@ class GenericController(object):
         scrubber = Scrubber(vpool_guids, vdisk_guids, storagerouter_guid, manual=manual, task_id=task_id)
         return scrubber.execute_scrubbing()
 
+    @staticmethod
+    @ovs_task(name='ovs.generic.execute_scheduled_scrub', schedule=Schedule(minute='0', hour='*'), ensure_single_info={'mode': 'DEFAULT', 'extra_task_names': ['ovs.generic.execute_scrub']})
+    def execute_scheduled_scrub():
+        """
+        Continuously scrubs all vDisks during the off-peak windows (see ScrubScheduler)
+        Every run picks up the most beneficial vDisks first and stops picking up vDisks when the window closes or the work
+        unit budget is consumed. Idle vDisks are skipped
+        :return: None
+        :rtype: NoneType
+        """
+        if ScrubScheduler.get_window_end() is None:
+            GenericController._logger.info('Scheduled scrub - Not within an off-peak window, not scrubbing')
+            return
+        if os.environ.get('RUNNING_UNITTESTS') == 'True':
+            task_id = 'unittest'
+        else:
+            task_id = GenericController.execute_scheduled_scrub.request.id if hasattr(GenericController.execute_scheduled_scrub, 'request') else None
+        scrubber = Scrubber(task_id=task_id, continuous=True)
+        return scrubber.execute_scrubbing()
+
     @staticmethod
     @ovs_task(name='ovs.generic.collapse_arakoon', schedule=Schedule(minute='10', hour='0,2,4,6,8,10,12,14,16,18,20,22'), ensure_single_info={'mode': 'DEFAULT'})
     def collapse_arakoon():
@@ -28,9 +28,9 @@ import threading
 from functools import wraps
 from ovs.dal.lists.storagedriverlist import StorageDriverList
 from ovs.extensions.generic.logger import Logger
-from ovs.extensions.generic.volatilemutex import volatile_mutex
-from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.lib.helpers.ensuresingle import EnsureSingleCoordinator
 from ovs.lib.helpers.exceptions import EnsureSingleTimeoutReached
+from ovs.lib.helpers.taskmetrics import TaskMetrics
 
 ENSURE_SINGLE_KEY = 'ovs_ensure_single'
 
@@ -44,12 +44,15 @@ class Decorators(object):
     # Keep order in which threads enter certain states
     unittest_thread_info_by_state = {'WAITING': [],
                                      'FINISHED': []}
+    # Queued tasks are not parked in unittest mode, unless the unittest enables it
+    unittest_parking = False
 
     @staticmethod
     def _clean():
         Decorators.unittest_thread_info_by_name = {}
         Decorators.unittest_thread_info_by_state = {'WAITING': [],
                                                     'FINISHED': []}
+        Decorators.unittest_parking = False
 
 
 def log(event_type):
@@ -98,6 +101,7 @@ def ovs_task(**kwargs):
     """
     Decorator to execute celery tasks in OVS
     These tasks can be wrapped additionally in the ensure single decorator
+    Every task is instrumented by TaskMetrics
     """
     def wrapper(f):
         """
@@ -109,6 +113,7 @@ def ovs_task(**kwargs):
         if ensure_single_info != {}:
             f = _ensure_single(task_name=kwargs['name'], **ensure_single_info)(f)
             kwargs['bind'] = True
+        f = TaskMetrics.instrument(task_name=kwargs['name'], f=f)
         return celery.task(**kwargs)(f)
     return wrapper
 
@@ -122,6 +127,11 @@ def _ensure_single(task_name, mode, extra_task_names=None, global_timeout=300, c
     a worker currently processing a "duplicate" task, it will only get validated after the first
     one completes, which will result in the fact that the task will execute normally.
 
+    The queue of every task is stored in the persistent store and updated with compare-and-swap transactions (see EnsureSingleCoordinator).
+    Queued tasks only re-read the queue when woken up by a change of the queue. Asynchronous tasks are parked (retried with a
+    countdown) while waiting for their turn, so they don't occupy a worker process. The lease of a queued or executing task
+    is kept alive by a heartbeat, so entries of crashed workers no longer block the queue.
+
     Allowed modes:
      - DEFAULT: De-duplication based on the task's name. If any new task with the same name is scheduled it will be
                 discarded
@@ -177,33 +187,49 @@ def _ensure_single(task_name, mode, extra_task_names=None, global_timeout=300, c
                     complete_message = 'Ensure single {0} mode - ID {1} - {2} - {3}'.format(mode, now, threading.current_thread().getName(), message)
                 getattr(logger, level)(complete_message)
 
-            def update_value(key, append, value_to_update=None):
+            def discard(message):
+                """
+                Discards the current invocation, executing the callback if the task was executed inline
+                :param message: Reason of discarding
+                :return:        The output of the callback, if any
+                """
+                if async_task is True or callback is None:
+                    log_message('Execution of task {0} discarded{1}'.format(task_name, message))
+                    TaskMetrics.set_outcome('discarded')
+                    if unittest_mode is True:
+                        Decorators.unittest_thread_info_by_name[thread_name] = ('DISCARDED', None)
+                    return None
+                log_message('Execution of task {0} in progress, executing callback function'.format(task_name))
+                TaskMetrics.set_outcome('callback')
+                if unittest_mode is True:
+                    Decorators.unittest_thread_info_by_name[thread_name] = ('CALLBACK', None)
+                return callback(*args, **kwargs)
+
+            def execute():
+                """
+                Executes the wrapped function
+                :return: The output of the function
                 """
-                Store the specified value in the PersistentFactory
-                :param key:             Key to store the value for
-                :param append:          If True, the specified value will be appended else element at index 0 will be popped
-                :param value_to_update: Value to append to the list or remove from the list
-                :return:                Updated value
+                if unittest_mode is True:
+                    Decorators.unittest_thread_info_by_name[thread_name] = ('EXECUTING', None)
+                output = f(*args, **kwargs)
+                if unittest_mode is True:
+                    Decorators.unittest_thread_info_by_name[thread_name] = ('FINISHED', None)
+                    Decorators.unittest_thread_info_by_state['FINISHED'].append(thread_name)
+                log_message('Task {0} finished successfully'.format(task_name))
+                return output
+
+            def timeout_reached(reason):
                 """
-                with volatile_mutex(name=key, wait=5):
-                    vals = list(persistent_client.get_multi([key], must_exist=False))
-                    if vals[0] is not None:
-                        val = vals[0]
-                        if append is True and value_to_update is not None:
-                            val['values'].append(value_to_update)
-                        elif append is False and value_to_update is not None:
-                            for value_item in val['values']:
-                                if value_item == value_to_update:
-                                    val['values'].remove(value_item)
-                                    break
-                        elif append is False and len(val['values']) > 0:
-                            val['values'].pop(0)
-                    else:
-                        log_message('Setting initial value for key {0}'.format(key))
-                        val = {'mode': mode,
-                               'values': []}
-                    persistent_client.set(key, val)
-                return val
+                Raises the timeout exception
+                :param reason: Reason of the timeout
+                """
+                if unittest_mode is True:
+                    Decorators.unittest_thread_info_by_name[thread_name] = ('EXCEPTION', 'Could not start within timeout of {0}s {1}'.format(timeout, reason))
+                raise EnsureSingleTimeoutReached('Ensure single {0} mode - ID {1} - Task {2} could not be started within timeout of {3}s'.format(mode,
+                                                                                                                                                 now,
+                                                                                                                                                 task_name,
+                                                                                                                                                 timeout))
 
             if not hasattr(self, 'request'):
                 raise RuntimeError('The decorator ensure_single can only be applied to bound tasks (with bind=True argument)')
@@ -215,43 +241,37 @@ def _ensure_single(task_name, mode, extra_task_names=None, global_timeout=300, c
             thread_name = threading.current_thread().getName()
             unittest_mode = os.environ.get('RUNNING_UNITTESTS') == 'True'
             persistent_key = '{0}_{1}'.format(ENSURE_SINGLE_KEY, task_name)
-            persistent_client = PersistentFactory.get_client()
+            coordinator = EnsureSingleCoordinator(key=persistent_key, mode=mode)
 
             if mode == 'DEFAULT':
-                with volatile_mutex(persistent_key, wait=5):
-                    for task in task_names:
-                        key_to_check = '{0}_{1}'.format(ENSURE_SINGLE_KEY, task)
-                        if persistent_client.exists(key_to_check):
-                            if async_task is True or callback is None:
-                                log_message('Execution of task {0} discarded'.format(task_name))
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('DISCARDED', None)
-                                return None
-                            else:
-                                log_message('Execution of task {0} in progress, executing callback function'.format(task_name))
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('CALLBACK', None)
-                                return callback(*args, **kwargs)
-
-                    log_message('Setting key {0}'.format(persistent_key))
-                    persistent_client.set(persistent_key, {'mode': mode,
-                                                           'values': [{'task_id': task_id}]})
-
+                for task in task_names:
+                    key_to_check = '{0}_{1}'.format(ENSURE_SINGLE_KEY, task)
+                    if EnsureSingleCoordinator(key=key_to_check, mode=mode).get() is not None:
+                        return discard('')
+
+                entry = {'task_id': task_id,
+                         'timestamp': now,
+                         'lease_until': EnsureSingleCoordinator.lease()}
+
+                def _claim(value):
+                    if len(value['values']) == 0:
+                        value['values'].append(entry)
+                    return value
+
+                log_message('Setting key {0}'.format(persistent_key))
+                value = coordinator.update(_claim)
+                if value is None or value['values'][0]['timestamp'] != now:
+                    return discard('')  # Claimed by another task in the meantime
+
+                heartbeat = coordinator.heartbeat(timestamp=now)
                 try:
-                    if unittest_mode is True:
-                        Decorators.unittest_thread_info_by_name[thread_name] = ('EXECUTING', None)
-                    output = f(*args, **kwargs)
-                    if unittest_mode is True:
-                        Decorators.unittest_thread_info_by_name[thread_name] = ('FINISHED', None)
-                        Decorators.unittest_thread_info_by_state['FINISHED'].append(thread_name)
-                    log_message('Task {0} finished successfully'.format(task_name))
-                    return output
+                    return execute()
                 finally:
-                    with volatile_mutex(persistent_key, wait=5):
-                        log_message('Deleting key {0}'.format(persistent_key))
-                        persistent_client.delete(persistent_key, must_exist=False)
+                    heartbeat.cancel()
+                    log_message('Deleting key {0}'.format(persistent_key))
+                    coordinator.remove(timestamp=now)
 
-            elif mode == 'DEDUPED':
+            elif mode in ('DEDUPED', 'CHAINED'):
                 if extra_task_names is not None:
                     log_message('Extra tasks are not allowed in this mode',
                                 level='error')
@@ -266,230 +286,135 @@ def _ensure_single(task_name, mode, extra_task_names=None, global_timeout=300, c
                     kwargs_dict[function_info.args[index]] = arg
                 kwargs_dict.update(kwargs)
                 params_info = 'with params {0}'.format(kwargs_dict) if kwargs_dict else 'with default params'
-
-                # Set the key in arakoon if non-existent
-                value = update_value(key=persistent_key,
-                                     append=True)
-
-                # Validate whether another job with same params is being executed
-                job_counter = 0
-                for item in value['values']:
-                    if item['kwargs'] == kwargs_dict:
-                        job_counter += 1
-                        if job_counter == 2:  # 1st job with same params is being executed, 2nd is scheduled for execution ==> Discard current
-                            if async_task is True:  # Not waiting for other jobs to finish since asynchronously
-                                log_message('Execution of task {0} {1} discarded because of identical parameters'.format(task_name, params_info))
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('DISCARDED', None)
-                                return None
-
-                            # If executed inline (sync), execute callback if any provided
-                            if callback is not None:
-                                log_message('Execution of task {0} {1} in progress, executing callback function'.format(task_name, params_info))
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('CALLBACK', None)
-                                return callback(*args, **kwargs)
-
-                            # Let's wait for 2nd job in queue to have finished if no callback provided
-                            slept = 0
-                            while slept < timeout:
-                                log_message('Task {0} {1} is waiting for similar tasks to finish - ({2})'.format(task_name, params_info, slept + sleep))
-                                values = list(persistent_client.get_multi([persistent_key], must_exist=False))
-                                if values[0] is None:
-                                    if unittest_mode is True:
-                                        Decorators.unittest_thread_info_by_name[thread_name] = ('WAITED', None)
-                                    return None  # All pending jobs have been deleted in the meantime, no need to wait
-                                if item['timestamp'] not in [value['timestamp'] for value in values[0]['values']]:
-                                    if unittest_mode is True:
-                                        Decorators.unittest_thread_info_by_name[thread_name] = ('WAITED', None)
-                                    return None  # Similar tasks have been executed, so sync task currently waiting can return without having been executed
-                                slept += sleep
-                                time.sleep(sleep)
-                                if slept >= timeout:
-                                    log_message('Task {0} {1} waited {2}s for similar tasks to finish, but timeout was reached'.format(task_name, params_info, slept),
-                                                level='error')
-                                    if unittest_mode is True:
-                                        Decorators.unittest_thread_info_by_name[thread_name] = ('EXCEPTION', 'Could not start within timeout of {0}s while waiting for other tasks'.format(timeout))
-                                    raise EnsureSingleTimeoutReached('Ensure single {0} mode - ID {1} - Task {2} could not be started within timeout of {3}s'.format(mode,
-                                                                                                                                                                     now,
-                                                                                                                                                                     task_name,
-                                                                                                                                                                     timeout))
-                                if unittest_mode is True:
-                                    if thread_name not in Decorators.unittest_thread_info_by_state['WAITING']:
-                                        Decorators.unittest_thread_info_by_state['WAITING'].append(thread_name)
-
-                log_message('New task {0} {1} scheduled for execution'.format(task_name, params_info))
-                update_value(key=persistent_key,
-                             append=True,
-                             value_to_update={'kwargs': kwargs_dict,
-                                              'task_id': task_id,
-                                              'timestamp': now})
-
-                # Poll the arakoon to see whether this call is the only in list, if so --> execute, else wait
-                slept = 0
-                while slept < timeout:
-                    values = list(persistent_client.get_multi([persistent_key], must_exist=False))
-                    if values[0] is not None:
-                        queued_jobs = [v for v in values[0]['values'] if v['kwargs'] == kwargs_dict]
-                        if len(queued_jobs) != 1:
+                # Queued celery tasks are parked (retried with a countdown) instead of occupying a worker process while waiting
+                park = async_task is True and (unittest_mode is False or Decorators.unittest_parking is True) and hasattr(self, 'retry') and getattr(self.request, 'is_eager', False) is False
+
+                def _get_duplicate(values):
+                    """
+                    DEDUPED: Identical tasks are executed in serial, so the 2nd identical task is the queued one
+                    CHAINED: All tasks are executed in serial, so every identical task after the 1st (executing) one is queued
+                    """
+                    if mode == 'DEDUPED':
+                        identical = [v for v in values if v['kwargs'] == kwargs_dict]
+                        return identical[1] if len(identical) > 1 else None
+                    identical = [v for v in values[1:] if v['kwargs'] == kwargs_dict]
+                    return identical[0] if len(identical) > 0 else None
+
+                def _can_start(values, timestamp):
+                    """
+                    DEDUPED: Only the 1st task with identical params can be executed
+                    CHAINED: Only the 1st task can be executed
+                    """
+                    if mode == 'DEDUPED':
+                        values = [v for v in values if v['kwargs'] == kwargs_dict]
+                    return len(values) > 0 and values[0]['timestamp'] == timestamp
+
+                state = {}
+
+                def _enqueue(value):
+                    state.clear()
+                    if task_id is not None:
+                        for item in value['values']:
+                            if item['task_id'] == task_id:  # Parked earlier, continue waiting for its turn
+                                state['entry'] = item
+                                return value
+                    item = _get_duplicate(value['values'])
+                    if item is not None:
+                        state['duplicate'] = item
+                        return value
+                    state['entry'] = {'kwargs': kwargs_dict,
+                                      'task_id': task_id,
+                                      'timestamp': now,
+                                      'queued_at': time.time(),
+                                      'lease_until': EnsureSingleCoordinator.lease()}
+                    value['values'].append(state['entry'])
+                    return value
+
+                coordinator.update(_enqueue)
+
+                # Validate whether another job with same params is already queued
+                if 'duplicate' in state:
+                    item = state['duplicate']
+                    # Not waiting for other jobs to finish if executed asynchronously or if a callback is provided
+                    if async_task is True or callback is not None:
+                        return discard(' because of identical parameters')
+
+                    # Let's wait for the queued job to have finished if no callback provided
+                    log_message('Task {0} {1} is waiting for similar tasks to finish'.format(task_name, params_info))
+                    start = time.time()
+                    while True:
+                        generation = coordinator.generation()
+                        value = coordinator.get()
+                        if value is None or item['timestamp'] not in [v['timestamp'] for v in value['values']]:
+                            # All pending jobs have been deleted in the meantime or similar tasks have been executed, so sync task can return without having been executed
+                            TaskMetrics.add_wait(time.time() - start)
+                            TaskMetrics.set_outcome('waited')
                             if unittest_mode is True:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('WAITING', None)
-                                if thread_name not in Decorators.unittest_thread_info_by_state['WAITING']:
-                                    Decorators.unittest_thread_info_by_state['WAITING'].append(thread_name)
-                        else:
-                            try:
-                                if slept != 0:
-                                    log_message('Task {0} {1} had to wait {2} seconds before being able to start'.format(task_name,
-                                                                                                                         params_info,
-                                                                                                                         slept))
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('EXECUTING', None)
-                                output = f(*args, **kwargs)
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('FINISHED', None)
-                                    Decorators.unittest_thread_info_by_state['FINISHED'].append(thread_name)
-                                log_message('Task {0} finished successfully'.format(task_name))
-                                return output
-                            finally:
-                                update_value(key=persistent_key,
-                                             append=False,
-                                             value_to_update=queued_jobs[0])
-                    slept += sleep
-                    time.sleep(sleep)
-                    if slept >= timeout:
-                        update_value(key=persistent_key,
-                                     append=False,
-                                     value_to_update={'kwargs': kwargs_dict,
-                                                      'task_id': task_id,
-                                                      'timestamp': now})
-                        log_message('Could not start task {0} {1}, within expected time ({2}s). Removed it from queue'.format(task_name, params_info, timeout),
-                                    level='error')
-                        if unittest_mode is True:
-                            Decorators.unittest_thread_info_by_name[thread_name] = ('EXCEPTION', 'Could not start within timeout of {0}s while queued'.format(timeout))
-                        raise EnsureSingleTimeoutReached('Ensure single {0} mode - ID {1} - Task {2} could not be started within timeout of {3}s'.format(mode,
-                                                                                                                                                         now,
-                                                                                                                                                         task_name,
-                                                                                                                                                         timeout))
-
-            elif mode == 'CHAINED':
-                if extra_task_names is not None:
-                    log_message('Extra tasks are not allowed in this mode',
-                                level='error')
-                    raise ValueError('Ensure single {0} mode - ID {1} - Extra tasks are not allowed in this mode'.format(mode, now))
-
-                # Update kwargs with args
-                sleep = 1 if unittest_mode is False else 0.1
-                timeout = kwargs.pop('ensure_single_timeout', 10 if unittest_mode is True else global_timeout)
-                function_info = inspect.getargspec(f)
-                kwargs_dict = {}
-                for index, arg in enumerate(args):
-                    kwargs_dict[function_info.args[index]] = arg
-                kwargs_dict.update(kwargs)
-                params_info = 'with params {0}'.format(kwargs_dict) if kwargs_dict else 'with default params'
-
-                # Set the key in arakoon if non-existent
-                value = update_value(key=persistent_key,
-                                     append=True)
-
-                # Validate whether another job with same params is being executed, skip if so
-                for item in value['values'][1:]:  # 1st element is processing job, we check all other queued jobs for identical params
-                    if item['kwargs'] == kwargs_dict:
-                        if async_task is True:  # Not waiting for other jobs to finish since asynchronously
-                            log_message('Execution of task {0} {1} discarded because of identical parameters'.format(task_name, params_info))
-                            if unittest_mode is True:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('DISCARDED', None)
+                                Decorators.unittest_thread_info_by_name[thread_name] = ('WAITED', None)
                             return None
-
-                        # If executed inline (sync), execute callback if any provided
-                        if callback is not None:
-                            log_message('Execution of task {0} {1} in progress, executing callback function'.format(task_name, params_info))
-                            if unittest_mode is True:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('CALLBACK', None)
-                            return callback(*args, **kwargs)
-
-                        # Let's wait for 2nd job in queue to have finished if no callback provided
-                        slept = 0
-                        while slept < timeout:
-                            log_message('Task {0} {1} is waiting for similar tasks to finish - ({2})'.format(task_name, params_info, slept + sleep))
-                            values = list(persistent_client.get_multi([persistent_key], must_exist=False))
-                            if values[0] is None:
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('WAITED', None)
-                                return None  # All pending jobs have been deleted in the meantime, no need to wait
-                            if item['timestamp'] not in [value['timestamp'] for value in values[0]['values']]:
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('WAITED', None)
-                                return None  # Similar tasks have been executed, so sync task currently waiting can return without having been executed
-                            slept += sleep
-                            time.sleep(sleep)
-                            if slept >= timeout:
-                                log_message('Task {0} {1} waited {2}s for similar tasks to finish, but timeout was reached'.format(task_name, params_info, slept),
-                                            level='error')
-                                if unittest_mode is True:
-                                    Decorators.unittest_thread_info_by_name[thread_name] = ('EXCEPTION', 'Could not start within timeout of {0}s while waiting for other tasks'.format(timeout))
-                                raise EnsureSingleTimeoutReached('Ensure single {0} mode - ID {1} - Task {2} could not be started within timeout of {3}s'.format(mode,
-                                                                                                                                                                 now,
-                                                                                                                                                                 task_name,
-                                                                                                                                                                 timeout))
-                            if unittest_mode is True:
-                                if thread_name not in Decorators.unittest_thread_info_by_state['WAITING']:
-                                    Decorators.unittest_thread_info_by_state['WAITING'].append(thread_name)
-
-                log_message('New task {0} {1} scheduled for execution'.format(task_name, params_info))
-                update_value(key=persistent_key,
-                             append=True,
-                             value_to_update={'kwargs': kwargs_dict,
-                                              'task_id': task_id,
-                                              'timestamp': now})
-
-                # Poll the arakoon to see whether this call is the first in list, if so --> execute, else wait
-                first_element = None
-                slept = 0
-                while slept < timeout:
-                    values = list(persistent_client.get_multi([persistent_key], must_exist=False))
-                    if values[0] is not None:
-                        value = values[0]
-                        first_element = value['values'][0]['timestamp'] if len(value['values']) > 0 else None
-
-                    if first_element == now:
-                        try:
-                            if slept > 0:
-                                log_message('Task {0} {1} had to wait {2} seconds before being able to start'.format(task_name,
-                                                                                                                     params_info,
-                                                                                                                     slept))
-                            if unittest_mode is True:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('EXECUTING', None)
-                            output = f(*args, **kwargs)
-                            if unittest_mode is True:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('FINISHED', None)
-                                Decorators.unittest_thread_info_by_state['FINISHED'].append(thread_name)
-                            log_message('Task {0} finished successfully'.format(task_name))
-                            return output
-                        finally:
-                            update_value(key=persistent_key,
-                                         append=False)
-                    else:
-                        if unittest_mode is True:
+                        coordinator.wait(generation=generation, timeout=timeout - (time.time() - start))
+                        slept = time.time() - start
+                        if slept >= timeout:
+                            log_message('Task {0} {1} waited {2:.2f}s for similar tasks to finish, but timeout was reached'.format(task_name, params_info, slept),
+                                        level='error')
+                            timeout_reached('while waiting for other tasks')
+                        if unittest_mode is True and slept >= sleep:
                             if thread_name not in Decorators.unittest_thread_info_by_state['WAITING']:
-                                Decorators.unittest_thread_info_by_name[thread_name] = ('WAITING', None)
                                 Decorators.unittest_thread_info_by_state['WAITING'].append(thread_name)
 
-                    slept += sleep
-                    time.sleep(sleep)
-                    if slept >= timeout:
-                        update_value(key=persistent_key,
-                                     append=False,
-                                     value_to_update={'kwargs': kwargs_dict,
-                                                      'task_id': task_id,
-                                                      'timestamp': now})
-                        log_message('Could not start task {0} {1}, within expected time ({2}s). Removed it from queue'.format(task_name, params_info, timeout),
-                                    level='error')
+                entry = state['entry']
+                if entry['timestamp'] == now:
+                    log_message('New task {0} {1} scheduled for execution'.format(task_name, params_info))
+                invocation_start = time.time()
+                start = entry.get('queued_at', invocation_start)  # The timeout covers all invocations of a parked task
+                heartbeat = coordinator.heartbeat(timestamp=entry['timestamp'])
+                try:
+                    # Wait until this task is allowed to start. The queue is only re-read after a wake-up
+                    while True:
+                        generation = coordinator.generation()
+                        value = coordinator.get()
+                        values = [] if value is None else value['values']
+                        if entry['timestamp'] not in [v['timestamp'] for v in values]:
+                            log_message('Task {0} {1} was removed from the queue, queueing it again'.format(task_name, params_info), level='warning')
+                            entry['lease_until'] = EnsureSingleCoordinator.lease()
+                            value = coordinator.update(lambda current: dict(current, values=current['values'] + [entry]))
+                            values = value['values']
+                        if _can_start(values, entry['timestamp']):
+                            break
+                        slept = time.time() - start
+                        if slept >= timeout:
+                            coordinator.remove(timestamp=entry['timestamp'])
+                            log_message('Could not start task {0} {1}, within expected time ({2}s). Removed it from queue'.format(task_name, params_info, timeout),
+                                        level='error')
+                            timeout_reached('while queued')
                         if unittest_mode is True:
-                            Decorators.unittest_thread_info_by_name[thread_name] = ('EXCEPTION', 'Could not start within timeout of {0}s while queued'.format(timeout))
-                        raise EnsureSingleTimeoutReached('Ensure single {0} mode - ID {1} - Task {2} could not be started within timeout of {3}s'.format(mode,
-                                                                                                                                                         now,
-                                                                                                                                                         task_name,
-                                                                                                                                                         timeout))
+                            Decorators.unittest_thread_info_by_name[thread_name] = ('WAITING', None)
+                            if thread_name not in Decorators.unittest_thread_info_by_state['WAITING']:
+                                Decorators.unittest_thread_info_by_state['WAITING'].append(thread_name)
+                        if park is True:
+                            countdown = EnsureSingleCoordinator.PARK_INTERVAL
+                            # A parked task only renews its lease when redelivered, which can take a lot longer than the countdown
+                            # on saturated workers. Its entry is therefore leased until the task would have timed out anyway
+                            parked_lease = start + timeout + EnsureSingleCoordinator.LEASE_TIME
+                            if entry['lease_until'] < parked_lease:
+                                coordinator.renew(timestamp=entry['timestamp'], lease_until=parked_lease)
+                                entry['lease_until'] = parked_lease
+                            heartbeat.cancel()
+                            heartbeat = None
+                            TaskMetrics.add_wait(time.time() - invocation_start)
+                            log_message('Task {0} {1} is parked for {2}s while waiting for its turn'.format(task_name, params_info, countdown), level='debug')
+                            raise self.retry(countdown=countdown, max_retries=None)
+                        coordinator.wait(generation=generation, timeout=timeout - slept)
+
+                    slept = time.time() - start
+                    TaskMetrics.add_wait(time.time() - invocation_start, queued=slept)
+                    if slept >= sleep:
+                        log_message('Task {0} {1} had to wait {2:.2f} seconds before being able to start'.format(task_name, params_info, slept))
+                    return execute()
+                finally:
+                    if heartbeat is not None:  # Parked tasks keep their entry in the queue
+                        heartbeat.cancel()
+                        coordinator.remove(timestamp=entry['timestamp'])
             else:
                 raise ValueError('Unsupported mode "{0}" provided'.format(mode))
 
@@ -0,0 +1,230 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Coordination module for the ensure single decorator
+"""
+
+import copy
+import time
+import random
+from ovs_extensions.storage.exceptions import AssertException
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+from ovs.lib.helpers.repeatingtimer import RepeatingTimer
+
+
+class EnsureSingleCoordinator(object):
+    """
+    Coordinates the queue of a single ensure single key
+    The queue ({'mode': <mode>, 'values': [<entry>, ...]}) is updated with compare-and-swap transactions, so no
+    additional lock is required. Every entry holds a lease which is extended by heartbeats of the task owning it.
+    Entries of which the lease expired (e.g. the worker died) are purged on the next update.
+    Every change of the queue, except for lease renewals, increments a wake-up counter in the volatile store.
+    Waiting tasks only watch that counter and re-read the persistent queue when it changed (or after FALLBACK_INTERVAL).
+    """
+    LEASE_TIME = 60
+    HEARTBEAT_INTERVAL = 15
+    POLL_INTERVAL = 0.1
+    FALLBACK_INTERVAL = 5
+    PARK_INTERVAL = 2
+    MAX_ATTEMPTS = 20
+    WAKEUP_KEY = '{0}_wakeup'
+
+    _logger = Logger('lib')
+
+    def __init__(self, key, mode):
+        """
+        :param key: Persistent key holding the queue
+        :type key: str
+        :param mode: Ensure single mode, stored with the queue
+        :type mode: str
+        """
+        self.key = key
+        self.mode = mode
+        self._persistent = PersistentFactory.get_client()
+        self._volatile = VolatileFactory.get_client()
+
+    @staticmethod
+    def lease():
+        """
+        Calculates the end of a lease which starts now
+        :return: Timestamp at which the lease expires
+        :rtype: float
+        """
+        return time.time() + EnsureSingleCoordinator.LEASE_TIME
+
+    @staticmethod
+    def _expired(entry, now):
+        # Entries without lease were written by older versions and are cleaned up by the celery startup script
+        return entry.get('lease_until') is not None and entry['lease_until'] < now
+
+    def get(self):
+        """
+        Retrieves the current queue. Entries of which the lease expired are purged
+        :return: The queue or None if there is no queue
+        :rtype: dict
+        """
+        value = list(self._persistent.get_multi([self.key], must_exist=False))[0]
+        if value is not None:
+            now = time.time()
+            if any(EnsureSingleCoordinator._expired(entry, now) for entry in value['values']):
+                value = self.update(lambda current: current)
+        return value
+
+    def update(self, modifier, notify=True):
+        """
+        Updates the queue using a compare-and-swap transaction
+        :param modifier: Function receiving a copy of the current queue (with expired entries purged) and returning the new queue.
+                         Returning None or a queue without values removes the key. The function can be called multiple times.
+        :type modifier: callable
+        :param notify: Wake up the waiting tasks. Waiters are always woken up when expired entries were purged
+        :type notify: bool
+        :return: The queue as stored
+        :rtype: dict
+        """
+        for attempt in xrange(EnsureSingleCoordinator.MAX_ATTEMPTS):
+            current = list(self._persistent.get_multi([self.key], must_exist=False))[0]
+            expired = []
+            if current is None:
+                value = {'mode': self.mode,
+                         'values': []}
+            else:
+                value = copy.deepcopy(current)
+                now = time.time()
+                expired = [entry for entry in value['values'] if EnsureSingleCoordinator._expired(entry, now)]
+                for entry in expired:
+                    EnsureSingleCoordinator._logger.warning('Ensure single {0} - Lease of task {1} expired, removing it from the queue'.format(self.key, entry.get('task_id')))
+                    value['values'].remove(entry)
+            value = modifier(value)
+            if value is not None and len(value['values']) == 0:
+                value = None
+            if value == current:
+                return current
+            transaction = self._persistent.begin_transaction()
+            self._persistent.assert_value(self.key, current, transaction=transaction)
+            if value is None:
+                self._persistent.delete(self.key, must_exist=False, transaction=transaction)
+            else:
+                self._persistent.set(self.key, value, transaction=transaction)
+            try:
+                self._persistent.apply_transaction(transaction)
+            except AssertException:
+                time.sleep(random.randint(0, 5 * (attempt + 1)) / 100.0)
+                continue
+            if notify is True or len(expired) > 0:
+                self.notify()
+            return value
+        raise RuntimeError('Ensure single {0} - Could not update the queue after {1} attempts'.format(self.key, EnsureSingleCoordinator.MAX_ATTEMPTS))
+
+    def generation(self):
+        """
+        Retrieves the wake-up counter of the queue
+        :return: The wake-up counter
+        :rtype: int
+        """
+        return self._volatile.get(EnsureSingleCoordinator.WAKEUP_KEY.format(self.key), 0)
+
+    def notify(self):
+        """
+        Wakes up all tasks waiting for a change of the queue
+        :return: None
+        :rtype: NoneType
+        """
+        key = EnsureSingleCoordinator.WAKEUP_KEY.format(self.key)
+        try:
+            self._volatile.add(key, 0)
+            self._volatile.incr(key)
+        except Exception:
+            # Waiters fall back to re-reading the queue every FALLBACK_INTERVAL seconds
+            EnsureSingleCoordinator._logger.exception('Ensure single {0} - Could not send wake-up'.format(self.key))
+
+    def wait(self, generation, timeout):
+        """
+        Blocks until the queue changed after the given wake-up counter was read
+        :param generation: Wake-up counter as read before the queue was inspected
+        :type generation: int
+        :param timeout: Maximum amount of seconds to wait (capped at FALLBACK_INTERVAL)
+        :type timeout: float
+        :return: True if woken up, False if the timeout passed
+        :rtype: bool
+        """
+        end = time.time() + min(timeout, EnsureSingleCoordinator.FALLBACK_INTERVAL)
+        while True:
+            if self.generation() != generation:
+                return True
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(EnsureSingleCoordinator.POLL_INTERVAL, remaining))
+
+    def renew(self, timestamp, lease_until=None):
+        """
+        Extends the lease of an entry. A lease is never shortened. Renewing does not wake up the waiting tasks
+        :param timestamp: Identifier of the entry
+        :type timestamp: str
+        :param lease_until: End of the new lease. Defaults to LEASE_TIME seconds from now
+        :type lease_until: float
+        :return: True if the entry is still queued
+        :rtype: bool
+        """
+        found = []
+
+        def _renew(value):
+            for entry in value['values']:
+                if entry['timestamp'] == timestamp:
+                    entry['lease_until'] = max(entry.get('lease_until') or 0, EnsureSingleCoordinator.lease() if lease_until is None else lease_until)
+                    found.append(entry)
+            return value
+
+        self.update(_renew, notify=False)
+        return len(found) > 0
+
+    def remove(self, timestamp):
+        """
+        Removes an entry from the queue
+        :param timestamp: Identifier of the entry
+        :type timestamp: str
+        :return: The queue as stored
+        :rtype: dict
+        """
+        def _remove(value):
+            value['values'] = [entry for entry in value['values'] if entry['timestamp'] != timestamp]
+            return value
+
+        return self.update(_remove)
+
+    def heartbeat(self, timestamp):
+        """
+        Starts a heartbeat which keeps the lease of an entry alive. Stop it by calling cancel() on the returned timer
+        :param timestamp: Identifier of the entry
+        :type timestamp: str
+        :return: The running heartbeat
+        :rtype: ovs.lib.helpers.repeatingtimer.RepeatingTimer
+        """
+        def _beat():
+            if timer.finished.is_set():
+                return
+            try:
+                self.renew(timestamp)
+            except Exception:
+                EnsureSingleCoordinator._logger.exception('Ensure single {0} - Could not renew the lease of {1}'.format(self.key, timestamp))
+
+        timer = RepeatingTimer(EnsureSingleCoordinator.HEARTBEAT_INTERVAL, _beat)
+        timer.daemon = True
+        timer.start()
+        return timer
@@ -0,0 +1,250 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Snapshot retention module
+"""
+
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from threading import Lock
+from time import mktime
+from ovs.dal.lists.vdisklist import VDiskList
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+from ovs.lib.helpers.toolbox import Toolbox
+
+
+class SnapshotRetention(object):
+    """
+    Applies the snapshot retention policy on all vDisks
+    Implemented policy:
+    < 1d | 1d bucket | 1 | best of bucket   | 1d
+    < 1w | 1d bucket | 6 | oldest of bucket | 7d = 1w
+    < 1m | 1w bucket | 3 | oldest of bucket | 4w = 1m
+    > 1m | delete
+
+    The snapshot information of the vDisks is gathered concurrently. The snapshots to delete are grouped per vDisk and
+    the deletions are executed concurrently for different StorageDrivers, but sequentially for a single StorageDriver.
+    Progress is published in the volatile store under PROGRESS_KEY.
+    """
+    MAX_PARALLEL_GATHER = 8
+    MAX_PARALLEL_DELETE = 4
+    PROGRESS_KEY = 'ovs_snapshot_retention_progress'
+    PROGRESS_TTL = 24 * 60 * 60
+
+    _logger = Logger('lib')
+
+    def __init__(self, timestamp=None):
+        """
+        :param timestamp: Timestamp to determine whether snapshots should be kept or not, if none provided, current time will be used
+        :type timestamp: float
+        """
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.buckets = SnapshotRetention.build_buckets(self.timestamp)
+        self._lock = Lock()
+        self._progress = {'phase': 'initializing',
+                          'started': time.time(),
+                          'timestamp': self.timestamp,
+                          'vdisks_total': 0,
+                          'vdisks_gathered': 0,
+                          'vdisks_processed': 0,
+                          'snapshots_planned': 0,
+                          'snapshots_deleted': 0,
+                          'snapshots_failed': 0}
+
+    @staticmethod
+    def build_buckets(timestamp):
+        """
+        Calculates the bucket structure. A snapshot belongs to a bucket when start >= snapshot timestamp > end
+        :param timestamp: Timestamp to calculate the buckets for
+        :type timestamp: float
+        :return: List of buckets (dicts with start, end and type), the most recent bucket first
+        :rtype: list
+        """
+        day = timedelta(1)
+        week = day * 7
+        base = datetime.fromtimestamp(timestamp).date() - day
+
+        def make_timestamp(offset):
+            return int(mktime((base - offset).timetuple()))
+
+        # Buckets first 7 days: [0-1[, [1-2[, [2-3[, [3-4[, [4-5[, [5-6[, [6-7[
+        buckets = [{'start': make_timestamp(day * i), 'end': make_timestamp(day * (i + 1)), 'type': '1d'} for i in xrange(0, 7)]
+        # Week buckets next 3 weeks: [7-14[, [14-21[, [21-28[
+        buckets += [{'start': make_timestamp(week * i), 'end': make_timestamp(week * (i + 1)), 'type': '1w'} for i in xrange(1, 4)]
+        buckets.append({'start': make_timestamp(week * 4), 'end': 0, 'type': 'rest'})
+        return buckets
+
+    def plan(self):
+        """
+        Calculates which snapshots have to be deleted, without deleting them
+        :return: The plan: per vDisk guid the snapshots to delete, the skipped vDisks and the progress
+        :rtype: dict
+        """
+        self._set_progress(phase='gathering')
+        vdisks = self._gather()
+        self._set_progress(phase='planning')
+        # Snapshots that are used as parents for clones can't be deleted
+        parent_snapshots = set(vdisk.parentsnapshot for vdisk in VDiskList.get_with_parent_snaphots())
+        starts = sorted(bucket['start'] for bucket in self.buckets)
+        bucket_indexes = dict((bucket['start'], index) for index, bucket in enumerate(self.buckets))
+        plan = {'timestamp': self.timestamp,
+                'vdisks': {},
+                'skipped': {}}
+        for vdisk_guid, info in vdisks.iteritems():
+            if info['skipped'] is not None:
+                plan['skipped'][vdisk_guid] = info['skipped']
+                continue
+            bucket_chain = [[] for _ in self.buckets]
+            for snapshot in info['snapshots']:
+                if snapshot.get('is_sticky') is True:
+                    continue
+                if snapshot['guid'] in parent_snapshots:
+                    SnapshotRetention._logger.info('Not deleting snapshot {0} because it has clones'.format(snapshot['guid']))
+                    continue
+                timestamp = int(snapshot['timestamp'])
+                position = bisect_left(starts, timestamp)  # Bucket with the smallest start >= timestamp
+                if position == len(starts) or timestamp <= 0:
+                    continue
+                bucket_chain[bucket_indexes[starts[position]]].append({'timestamp': timestamp,
+                                                                       'snapshot_id': snapshot['guid'],
+                                                                       'is_consistent': snapshot['is_consistent']})
+            to_delete = []
+            for index, bucket in enumerate(self.buckets):
+                snapshots = bucket_chain[index]
+                if len(snapshots) == 0:
+                    continue
+                if index == 0:
+                    # Consistent is better than inconsistent, newer (larger timestamp) is better than older snapshots
+                    keep = max(snapshots, key=lambda s: (s['is_consistent'], s['timestamp']))
+                elif bucket['end'] > 0:
+                    # Older (smaller timestamp) is the one we want to keep
+                    keep = min(snapshots, key=lambda s: s['timestamp'])
+                else:
+                    keep = None
+                to_delete += [s['snapshot_id'] for s in snapshots if keep is None or s['timestamp'] != keep['timestamp']]
+            if len(to_delete) > 0:
+                plan['vdisks'][vdisk_guid] = {'name': info['name'],
+                                              'storagedriver_id': info['storagedriver_id'],
+                                              'snapshots': to_delete}
+        self._set_progress(snapshots_planned=sum(len(item['snapshots']) for item in plan['vdisks'].itervalues()))
+        plan['progress'] = self._get_progress()
+        return plan
+
+    def execute(self, dry_run=False):
+        """
+        Applies the retention policy
+        :param dry_run: Only calculate the plan, without deleting any snapshot
+        :type dry_run: bool
+        :return: The plan, including the result per vDisk when executed
+        :rtype: dict
+        """
+        plan = self.plan()
+        if dry_run is True:
+            self._set_progress(phase='finished')
+            plan['progress'] = self._get_progress()
+            return plan
+
+        self._set_progress(phase='deleting')
+        from ovs.lib.vdisk import VDiskController
+
+        per_storagedriver = {}
+        for vdisk_guid, item in plan['vdisks'].iteritems():
+            per_storagedriver.setdefault(item['storagedriver_id'], []).append(vdisk_guid)
+        results = {}
+
+        def _delete(vdisk_guids):
+            for vdisk_guid in vdisk_guids:
+                snapshot_ids = plan['vdisks'][vdisk_guid]['snapshots']
+                try:
+                    result = VDiskController.delete_snapshots({vdisk_guid: snapshot_ids})[vdisk_guid]
+                except Exception as ex:
+                    SnapshotRetention._logger.exception('Deleting snapshots of vDisk {0} failed'.format(vdisk_guid))
+                    result = {'success': False, 'error': str(ex), 'results': {}}
+                deleted = len([1 for outcome in result['results'].itervalues() if outcome[0] is True])
+                with self._lock:
+                    results[vdisk_guid] = result
+                    self._progress['vdisks_processed'] += 1
+                    self._progress['snapshots_deleted'] += deleted
+                    self._progress['snapshots_failed'] += len(snapshot_ids) - deleted
+                self._publish_progress()
+
+        Toolbox.run_parallel(_delete, per_storagedriver.values(), SnapshotRetention.MAX_PARALLEL_DELETE, name='snapshot_retention', logger=SnapshotRetention._logger)
+        for vdisk_guid, result in results.iteritems():
+            plan['vdisks'][vdisk_guid]['result'] = result
+        self._set_progress(phase='finished')
+        plan['progress'] = self._get_progress()
+        SnapshotRetention._logger.info('Snapshot retention - Deleted {0} snapshots, {1} failures'.format(plan['progress']['snapshots_deleted'],
+                                                                                                         plan['progress']['snapshots_failed']))
+        return plan
+
+    def _gather(self):
+        """
+        Gathers the snapshot information of all vDisks concurrently
+        """
+        vdisks = list(VDiskList.get_vdisks())
+        self._set_progress(vdisks_total=len(vdisks))
+        information = {}
+
+        def _gather_vdisk(vdisk):
+            info = {'name': vdisk.name,
+                    'storagedriver_id': None,
+                    'snapshots': [],
+                    'skipped': None}
+            try:
+                vdisk.invalidate_dynamics('being_scrubbed')
+                if vdisk.being_scrubbed:
+                    info['skipped'] = 'being scrubbed'
+                elif vdisk.info['object_type'] not in ['BASE']:
+                    info['skipped'] = 'object type {0}'.format(vdisk.info['object_type'])
+                else:
+                    info['storagedriver_id'] = vdisk.storagedriver_id
+                    info['snapshots'] = vdisk.snapshots
+            except Exception as ex:
+                SnapshotRetention._logger.exception('Gathering the snapshots of vDisk {0} failed'.format(vdisk.guid))
+                info['skipped'] = 'gathering failed: {0}'.format(ex)
+            with self._lock:
+                information[vdisk.guid] = info
+                self._progress['vdisks_gathered'] += 1
+
+        Toolbox.run_parallel(_gather_vdisk, vdisks, SnapshotRetention.MAX_PARALLEL_GATHER, name='snapshot_retention', logger=SnapshotRetention._logger)
+        return information
+
+    def _set_progress(self, **kwargs):
+        """
+        Updates and publishes the progress
+        """
+        with self._lock:
+            self._progress.update(kwargs)
+        self._publish_progress()
+
+    def _get_progress(self):
+        """
+        Retrieves a copy of the progress
+        """
+        with self._lock:
+            return dict(self._progress)
+
+    def _publish_progress(self):
+        """
+        Publishes the progress in the volatile store
+        """
+        try:
+            VolatileFactory.get_client().set(SnapshotRetention.PROGRESS_KEY, self._get_progress(), SnapshotRetention.PROGRESS_TTL)
+        except Exception:
+            SnapshotRetention._logger.exception('Could not publish the snapshot retention progress')
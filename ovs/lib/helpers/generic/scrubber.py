@@ -53,6 +53,7 @@ from ovs.extensions.storage.persistentfactory import PersistentFactory
 from ovs_extensions.generic.repeatingtimer import RepeatingTimer
 from ovs.lib.mdsservice import MDSServiceController
 from ovs.lib.graphite import GraphiteController
+from ovs.lib.helpers.generic.scrubscheduler import ScrubScheduler
 
 
 class ScrubShared(object):
@@ -214,7 +215,7 @@ class StackWorkHandler(ScrubShared):
     Handles generation, unregistering and saving of vpool stack work
     """
 
-    def __init__(self, job_id, vpool, vdisks, worker_contexts):
+    def __init__(self, job_id, vpool, vdisks, worker_contexts, scheduler=None):
         """
         Initialize
         :param vpool: vPool to generate work for
@@ -223,12 +224,15 @@ class StackWorkHandler(ScrubShared):
         :type vdisks: list
         :param worker_contexts: Contexts about the workers
         :type worker_contexts: dict
+        :param scheduler: Scheduler deciding the order of the work (defaults to a non-continuous one)
+        :type scheduler: ovs.lib.helpers.generic.scrubscheduler.ScrubScheduler
         """
         super(StackWorkHandler, self).__init__(job_id)
 
         self.vpool = vpool
         self.vdisks = vdisks
         self.worker_contexts = worker_contexts
+        self.scheduler = scheduler or ScrubScheduler()
 
         self._key = self._SCRUB_VDISK_KEY.format(self.vpool.name)  # Key to register items under
         self._key_active_scrub = self._SCRUB_VDISK_ACTIVE_KEY.format(self.vpool.name)  # Key to register items that are actively scrubbed under
@@ -252,7 +256,7 @@ class StackWorkHandler(ScrubShared):
         # Fetch data
         relevant_work_items, fetched_work_items = self._get_pending_scrub_work()
         registered_vdisks = [item['vdisk_guid'] for item in relevant_work_items]
-        work_queue = Queue()
+        vdisks_to_scrub = []
         for vd in self.vdisks:
             logging_start_vd = '{0} - vDisk {1} with guid {2}'.format(self._log, vd.name, vd.guid)
             if vd.guid in registered_vdisks:
@@ -265,6 +269,9 @@ class StackWorkHandler(ScrubShared):
             if not vd.storagedriver_id:
                 self._logger.warning('{0} no StorageDriver ID found'.format(logging_start_vd))
                 continue
+            vdisks_to_scrub.append(vd)
+        work_queue = Queue()
+        for vd in self.scheduler.prioritize(vdisks_to_scrub):
             work_queue.put(vd.guid)
         total_items = relevant_work_items + list(self._wrap_data(item) for item in work_queue.queue)
         return work_queue, total_items, fetched_work_items
@@ -404,7 +411,7 @@ class StackWorkHandler(ScrubShared):
         rt.start()
         return rt
 
-    def unregister_vdisk_for_scrub(self, vdisk_guid, registering_thread, possible_exception=None):
+    def unregister_vdisk_for_scrub(self, vdisk_guid, registering_thread, possible_exception=None, scrub_result=None):
         """
         Register that a vDisk is being actively scrubbed
         :param vdisk_guid: Guid of the vDisk to register
@@ -413,6 +420,8 @@ class StackWorkHandler(ScrubShared):
         :type registering_thread: RepeatingTimer
         :param possible_exception: Possible exception that occurred while scrubbing
         :type possible_exception: Excepion
+        :param scrub_result: Outcome of the scrub run (work units, duration and statistics), used for scheduling next runs
+        :type scrub_result: dict
         :return: The loop instance keeping the information up to date
         :rtype: RepeatedTimer
         """
@@ -430,9 +439,12 @@ class StackWorkHandler(ScrubShared):
                            'end_time_readable': datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S.%f%z"),
                            'exception': str(possible_exception) if possible_exception else possible_exception,
                            'ongoing': False})
+        if scrub_result is not None:
+            scrub_info.update(scrub_result)
         scrub_info_copy = scrub_info.copy()
         # Reset copy
-        scrub_info_copy.update(dict.fromkeys(['job_id', 'expires', 'exception', 'end_time', 'end_time_readable', 'start_time', 'start_time_readable', 'location']))
+        scrub_info_copy.update(dict.fromkeys(['job_id', 'expires', 'exception', 'end_time', 'end_time_readable', 'start_time', 'start_time_readable', 'location',
+                                              'work_units', 'duration', 'data_written', 'stored']))
         if possible_exception:
             previous_run_key = 'previous_failed_runs'
             previous_runs = scrub_info_copy.get('previous_failed_runs', [])
@@ -450,8 +462,11 @@ class StackWorker(ScrubShared):
     """
     This class represents a worker of the scrubbing stack
     """
+    _WORK_UNITS_PER_PROXY = 2  # Amount of work units of a vDisk which can be scrubbed concurrently per proxy
+    _WORK_UNIT_SCRATCH_SIZE = 10 * 1024 ** 3  # Default scratch space reserved for scrubbing a single work unit
+    _MAX_WORK_UNIT_THREADS = 8  # Maximum amount of work units of a vDisk which are scrubbed concurrently
 
-    def __init__(self, job_id, queue, vpool, scrub_info, error_messages, stack_work_handler, worker_contexts, stacks_to_spawn, stack_number, graphite_controller):
+    def __init__(self, job_id, queue, vpool, scrub_info, error_messages, stack_work_handler, worker_contexts, stacks_to_spawn, stack_number, graphite_controller, scheduler=None):
         """
         :param queue: a Queue with vDisk guids that need to be scrubbed (they should only be member of a single vPool)
         :type queue: Queue
@@ -471,6 +486,8 @@ class StackWorker(ScrubShared):
         :type stacks_to_spawn: int
         :param stack_number: Number given by the stack spawner
         :type stack_number: int
+        :param scheduler: Scheduler deciding whether more vDisks can be picked up (defaults to the one of the stack work handler)
+        :type scheduler: ovs.lib.helpers.generic.scrubscheduler.ScrubScheduler
         """
         super(StackWorker, self).__init__(job_id)
         self.queue = queue
@@ -480,6 +497,7 @@ class StackWorker(ScrubShared):
         self.stack_number = stack_number
         self.stacks_to_spawn = stacks_to_spawn
         self.stack_work_handler = stack_work_handler
+        self.scheduler = scheduler or stack_work_handler.scheduler
         self.scrub_info = scrub_info  # Stored for testing purposes
 
         self.queue_size = self.queue.qsize()
@@ -524,6 +542,15 @@ class StackWorker(ScrubShared):
             raise RuntimeError('Amount of threads to spawn must be an integer for StorageRouter with ID {0}'.format(self.storagerouter.machine_id))
         self.graphite_controller = graphite_controller
 
+        # The scratch partition is shared by all scrubbing threads of this stack
+        tweaks_key = 'ovs/vpools/{0}/scrub/tweaks'.format(self.vpool.guid)
+        work_unit_scratch_size = Configuration.get('{0}|work_unit_scratch_size'.format(tweaks_key), default=self._WORK_UNIT_SCRATCH_SIZE)
+        max_work_unit_threads = Configuration.get('{0}|max_work_unit_threads'.format(tweaks_key), default=self._MAX_WORK_UNIT_THREADS)
+        scratch_per_thread = DiskPartition(self.partition_guid).size / max(self.amount_threads, 1)
+        self.work_unit_threads = max(1, min(len(self.alba_proxy_services) * self._WORK_UNITS_PER_PROXY,
+                                            scratch_per_thread / max(work_unit_scratch_size, 1),
+                                            max_work_unit_threads))
+
     def deploy_stack_and_scrub(self):
         """
         Executes scrub work for a given vDisk queue and vPool, based on scrub_info
@@ -545,7 +572,7 @@ class StackWorker(ScrubShared):
 
         amount_threads = max(self.amount_threads, 1)  # Make sure amount_threads is at least 1
         amount_threads = min(min(self.queue.qsize(), amount_threads), 20)  # Make sure amount threads is max 20
-        self._logger.info('{0} - Spawning {1} threads for proxy services {2}'.format(self._log, amount_threads, ', '.join(self.alba_proxy_services)))
+        self._logger.info('{0} - Spawning {1} threads for proxy services {2}, scrubbing up to {3} work units per vDisk concurrently'.format(self._log, amount_threads, ', '.join(self.alba_proxy_services), self.work_unit_threads))
         for index in range(amount_threads):
             # Name the threads for unit testing purposes
             thread = Thread(name='execute_scrub_{0}_{1}_{2}'.format(self.vpool.guid, self.partition_guid, index),
@@ -581,6 +608,9 @@ class StackWorker(ScrubShared):
             # Empty the queue with vDisks to scrub
             with remote(self.storagerouter.ip, [VDisk]) as rem:
                 while True:
+                    if self.scheduler.may_continue() is False:
+                        self._logger.info('{0} - Scrub window closed or work unit budget consumed, leaving the remaining vDisks for the next run'.format(log))
+                        break
                     vdisk_guid = self.queue.get(False)  # Raises Empty Exception when queue is empty, so breaking the while True loop
                     volatile_key = 'ovs_scrubbing_vdisk_{0}'.format(vdisk_guid)
                     try:
@@ -615,6 +645,7 @@ class StackWorker(ScrubShared):
                                          'log_path': log_path}
                         registrator = self.stack_work_handler.register_vdisk_for_scrub(vdisk_guid, location_data)
                         scrub_exception = None
+                        scrub_result = None
                         try:
                             if 'post_vdisk_scrub_registration' in self._test_hooks:
                                 self._test_hooks['post_vdisk_scrub_registration'](self, vdisk_guid)
@@ -623,13 +654,10 @@ class StackWorker(ScrubShared):
                                 self._logger.info('{0} - Retrieve and apply scrub work'.format(vdisk_log, vdisk.name))
                                 starttime = time.time()
                                 work_units = locked_client.get_scrubbing_workunits()
-                                for work_unit in work_units:
-                                    res = locked_client.scrub(work_unit=work_unit,
-                                                              scratch_dir=self.scrub_directory,
-                                                              log_sinks=[log_path],
-                                                              backend_config=Configuration.get_configuration_path(self.backend_config_key))
-                                    locked_client.apply_scrubbing_result(scrubbing_work_result=res)
+                                self._scrub_work_units(locked_client=locked_client, work_units=work_units, log_path=log_path, thread_number=thread_number)
+                                self.scheduler.consume(len(work_units))
                                 scrubbing_succeeded = True
+                                scrub_result = self._get_scrub_result(vdisk=vdisk, work_units=work_units, start=starttime)
                                 self.graphite_controller.send_scrubjob_duration(vdisk.guid, start=starttime)
                                 self.graphite_controller.send_scrubjob_worker_units(vdisk.guid, len(work_units))
                                 if work_units:
@@ -640,7 +668,7 @@ class StackWorker(ScrubShared):
                             scrub_exception = ex
                             raise
                         finally:
-                            self.stack_work_handler.unregister_vdisk_for_scrub(vdisk_guid, registrator, scrub_exception)
+                            self.stack_work_handler.unregister_vdisk_for_scrub(vdisk_guid, registrator, scrub_exception, scrub_result)
                             self.graphite_controller.send_scrubjob_success(vdisk_guid, scrubbing_succeeded)
                             if 'post_vdisk_scrub_unregistration' in self._test_hooks:
                                 self._test_hooks['post_vdisk_scrub_unregistration'](self, vdisk_guid)
@@ -666,6 +694,89 @@ class StackWorker(ScrubShared):
             self.error_messages.append(message)
             self._logger.exception(message)
 
+    def _get_scrub_result(self, vdisk, work_units, start):
+        """
+        Gathers the outcome of scrubbing a vDisk, which the scheduler uses to estimate the benefit and cost of the next run
+        :param vdisk: The scrubbed vDisk
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :param work_units: The applied work units
+        :type work_units: list
+        :param start: Timestamp at which the scrubbing started
+        :type start: float
+        :return: The scrub result
+        :rtype: dict
+        """
+        scrub_result = {'work_units': len(work_units),
+                        'duration': time.time() - start,
+                        'data_written': None,
+                        'stored': None}
+        try:
+            vdisk.invalidate_dynamics('statistics')
+            statistics = vdisk.statistics
+            scrub_result.update({'data_written': statistics.get('data_written'),
+                                 'stored': statistics.get('stored')})
+        except Exception:
+            self._logger.warning('{0} - vDisk {1} - Could not retrieve the statistics after scrubbing'.format(self._log, vdisk.name))
+        return scrub_result
+
+    def _scrub_work_units(self, locked_client, work_units, log_path, thread_number):
+        """
+        Scrubs the work units of a vDisk and applies the results
+        Up to 'work_unit_threads' work units are scrubbed concurrently. The results are applied by the calling thread, in
+        the order of the work units. When scrubbing a work unit fails, the work units being scrubbed are awaited and the
+        results which were not applied yet are discarded
+        :param locked_client: Locked client of the vDisk
+        :param work_units: Work units to scrub
+        :type work_units: list
+        :param log_path: Path of the log sink for the scrubbing
+        :type log_path: str
+        :param thread_number: Number of the Thread that is executing the scrubbing
+        :type thread_number: int
+        :return: None
+        :rtype: NoneType
+        """
+        backend_config = Configuration.get_configuration_path(self.backend_config_key)
+
+        def _scrub(_work_unit, _outcome):
+            try:
+                _outcome['result'] = locked_client.scrub(work_unit=_work_unit,
+                                                         scratch_dir=self.scrub_directory,
+                                                         log_sinks=[log_path],
+                                                         backend_config=backend_config)
+            except Exception as ex:
+                _outcome['exception'] = ex
+
+        if self.work_unit_threads == 1 or len(work_units) <= 1:
+            for work_unit in work_units:
+                outcome = {}
+                _scrub(work_unit, outcome)
+                if 'exception' in outcome:
+                    raise outcome['exception']
+                locked_client.apply_scrubbing_result(scrubbing_work_result=outcome['result'])
+            return
+
+        running = []
+        remaining = list(enumerate(work_units))
+        remaining.reverse()
+        try:
+            while len(remaining) > 0 or len(running) > 0:
+                while len(remaining) > 0 and len(running) < self.work_unit_threads:
+                    index, work_unit = remaining.pop()
+                    outcome = {}
+                    thread = Thread(name='execute_scrub_{0}_{1}_{2}_work_unit_{3}'.format(self.vpool.guid, self.partition_guid, thread_number, index),
+                                    target=_scrub,
+                                    args=(work_unit, outcome))
+                    thread.start()
+                    running.append((thread, outcome))
+                thread, outcome = running.pop(0)
+                thread.join()
+                if 'exception' in outcome:
+                    raise outcome['exception']
+                locked_client.apply_scrubbing_result(scrubbing_work_result=outcome['result'])
+        finally:
+            for thread, _ in running:
+                thread.join()
+
     def _get_registered_proxy_users(self):
         """
         Retrieves all stacks using a certain proxy
@@ -937,7 +1048,7 @@ class Scrubber(ScrubShared):
 
     _KEY_LIFETIME = 7 * 24 * 60 * 60  # All job keys are kept for 7 days and after that the next scrubbing job will remove the outdated ones
 
-    def __init__(self, vpool_guids=None, vdisk_guids=None, storagerouter_guid=None, manual=False, task_id=None):
+    def __init__(self, vpool_guids=None, vdisk_guids=None, storagerouter_guid=None, manual=False, task_id=None, continuous=False):
         """
         :param vpool_guids: Guids of the vPools that need to be scrubbed completely
         :type vpool_guids: list
@@ -948,6 +1059,8 @@ class Scrubber(ScrubShared):
         :param manual: Indicator whether the execute_scrub is called manually or as scheduled task (automatically)
         :type manual: bool
         :param task_id: An ID for the current scrub task (this can be the current celery job id or None for a generated one)
+        :param continuous: Indicator whether this is a continuous scrub job, limited to the off-peak window and work unit budget
+        :type continuous: bool
         """
         # Validation
         if vdisk_guids is None:
@@ -974,6 +1087,7 @@ class Scrubber(ScrubShared):
         self.vpool_guids = vpool_guids
         self.storagerouter_guid = storagerouter_guid
         self.manual = manual
+        self.scheduler = ScrubScheduler(continuous=continuous)
 
         self._log = 'Scrubber {0}'.format(self.job_id)
 
@@ -1095,7 +1209,7 @@ class Scrubber(ScrubShared):
             # Verify amount of vDisks on vPool
             self._logger.info('{0} - Checking scrub work'.format(logging_start))
             try:
-                stack_work_handler = StackWorkHandler(vpool=vp, vdisks=vdisks, worker_contexts=self.worker_contexts, job_id=self.job_id)
+                stack_work_handler = StackWorkHandler(vpool=vp, vdisks=vdisks, worker_contexts=self.worker_contexts, job_id=self.job_id, scheduler=self.scheduler)
                 vpool_queue = stack_work_handler.generate_save_scrub_work()
                 vp_work_map[vp] = (vpool_queue, stack_work_handler)
                 if vpool_queue.qsize() == 0:
@@ -1115,7 +1229,8 @@ class Scrubber(ScrubShared):
                                                    job_id=self.job_id,
                                                    stacks_to_spawn=stacks_to_spawn,
                                                    stack_number=stack_number,
-                                                   graphite_controller=self.graphite_controller)
+                                                   graphite_controller=self.graphite_controller,
+                                                   scheduler=self.scheduler)
                     except Exception as ex:
                         self.error_messages.append(str(ex))
                         self._logger.exception(str(ex))
@@ -1149,16 +1264,17 @@ class Scrubber(ScrubShared):
 
         self._cleanup_job_entries()
 
+        # Items can be left over when scrubbing failed or when the scheduler stopped the stacks (window closed or budget consumed)
+        try:
+            self._clean_up_leftover_items(vp_work_map)
+        except Exception as ex:
+            self.error_messages.append(self._format_message('Exception while clearing remaining entries: {0}'.format(str(ex))))
         if len(self.error_messages) > 0:
-            try:
-                self._clean_up_leftover_items(vp_work_map)
-            except Exception as ex:
-                self.error_messages.append(self._format_message('Exception while clearing remaining entries: {0}'.format(str(ex))))
             raise Exception(self._format_message('Errors occurred while scrubbing:\n  - {0}'.format('\n  - '.join(self.error_messages))))
 
     def _clean_up_leftover_items(self, vpool_work_map):
         """
-        Cleans up leftover work items when scrubbing would have failed
+        Cleans up leftover work items when scrubbing would have failed or was stopped by the scheduler
         Doing this in the scrubber as the workers do not know if other workers have failed or not
         :param vpool_work_map: A mapping with which vpool did what work and the stackwork handler
         :type vpool_work_map: dict((ovs.dal.hybrids.vpool.VPool, tuple(queue.Queue, StackWorkHandler)
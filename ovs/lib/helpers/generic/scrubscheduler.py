@@ -0,0 +1,197 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Scrub scheduling module
+"""
+
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+from ovs_extensions.constants.framework import SCRUB_KEY
+from ovs.extensions.generic.configuration import Configuration
+from ovs.extensions.generic.logger import Logger
+from ovs.lib.helpers.toolbox import Toolbox
+
+
+class ScrubScheduler(object):
+    """
+    Decides which vDisks get scrubbed and in which order
+    The vDisks are ordered by the expected benefit of scrubbing them (the data written since their last successful scrub)
+    relative to the expected cost (the duration of their last successful scrub). vDisks without scrub history go first.
+    Continuous scrub jobs, started periodically by the scheduled scrub task, additionally:
+    - Only run within the configured off-peak windows and stop picking up vDisks when the window closes
+    - Stop picking up vDisks when their budget of work units is consumed
+    - Skip idle vDisks: vDisks which had less than 'min_data_written' bytes written since their last successful scrub,
+      unless that scrub is older than 'max_interval' seconds
+    The scrub history is kept in the scrubbing_information of the vDisks (see StackWorkHandler.unregister_vdisk_for_scrub)
+    """
+    SETTINGS_KEY = '{0}/generic|scheduling'.format(SCRUB_KEY)
+    DEFAULT_SETTINGS = {'windows': [[3, 7]],  # Off-peak windows as [start hour, end hour[, in local time
+                        'work_unit_budget': None,  # Maximum amount of work units a continuous scrub job applies
+                        'min_data_written': 64 * 1024 ** 2,
+                        'max_interval': 7 * 24 * 60 * 60}
+    DEFAULT_COST = 60  # Expected duration (in seconds) of scrubbing a vDisk without scrub history
+    MAX_PARALLEL_STATISTICS = 16  # Maximum amount of vDisks of which the statistics are fetched concurrently
+
+    _logger = Logger('lib')
+
+    def __init__(self, continuous=False):
+        """
+        :param continuous: Indicates whether this is a continuous scrub job, limited by the windows, budget and idle vDisks
+        :type continuous: bool
+        """
+        self.continuous = continuous
+        self.settings = ScrubScheduler.get_settings()
+        self.deadline = None
+        self.work_units_left = None
+        if continuous is True:
+            self.deadline = ScrubScheduler.get_window_end(settings=self.settings)
+            self.work_units_left = self.settings['work_unit_budget']
+        self._lock = Lock()
+
+    @staticmethod
+    def get_settings():
+        """
+        Retrieves the scrub scheduling settings, completed with the defaults
+        :return: The scheduling settings
+        :rtype: dict
+        """
+        settings = ScrubScheduler.DEFAULT_SETTINGS.copy()
+        settings.update(Configuration.get(ScrubScheduler.SETTINGS_KEY, default={}))
+        return settings
+
+    @staticmethod
+    def get_window_end(settings=None, now=None):
+        """
+        Retrieves the end of the off-peak window the given moment is in
+        :param settings: Scheduling settings (defaults to the configured ones)
+        :type settings: dict
+        :param now: Moment to check (defaults to the current time)
+        :type now: datetime.datetime
+        :return: Timestamp of the end of the window or None when not in an off-peak window
+        :rtype: float
+        """
+        if settings is None:
+            settings = ScrubScheduler.get_settings()
+        if now is None:
+            now = datetime.now()
+        ends = []
+        for start_hour, end_hour in settings['windows']:
+            start = now.replace(hour=start_hour, minute=0, second=0, microsecond=0)
+            if start > now:
+                start -= timedelta(days=1)
+            end = start + timedelta(hours=end_hour - start_hour)
+            if end <= start:  # Window passing midnight
+                end += timedelta(days=1)
+            if start <= now < end:
+                ends.append(end)
+        if len(ends) == 0:
+            return None
+        return time.mktime(max(ends).timetuple())
+
+    def prioritize(self, vdisks):
+        """
+        Orders the vDisks to scrub, most beneficial first. Continuous scrub jobs leave out idle vDisks
+        :param vdisks: vDisks to order
+        :type vdisks: list[ovs.dal.hybrids.vdisk.VDisk]
+        :return: The ordered vDisks
+        :rtype: list[ovs.dal.hybrids.vdisk.VDisk]
+        """
+        statistics = {}
+
+        def _fetch_statistics(_vdisk):
+            statistics[_vdisk.guid] = _vdisk.statistics
+
+        # Every vDisk requires a call to the volumedriver, so the statistics are fetched concurrently
+        Toolbox.run_parallel(_fetch_statistics, list(vdisks), ScrubScheduler.MAX_PARALLEL_STATISTICS, name='scrub_statistics', logger=self._logger)
+        priorities = []
+        for vdisk in vdisks:
+            benefit, cost, idle = self.estimate(vdisk, statistics=statistics.get(vdisk.guid, {}))
+            if idle is True and self.continuous is True:
+                self._logger.info('vDisk {0} with guid {1} has been idle since its last scrub, not scrubbing'.format(vdisk.name, vdisk.guid))
+                continue
+            never_scrubbed = ScrubScheduler.get_last_successful_run(vdisk) is None
+            priorities.append(((never_scrubbed, benefit / cost), vdisk))
+        priorities.sort(key=lambda item: item[0], reverse=True)
+        return [vdisk for _, vdisk in priorities]
+
+    def estimate(self, vdisk, statistics=None):
+        """
+        Estimates the benefit and the cost of scrubbing a vDisk, based on its scrub history and statistics
+        :param vdisk: vDisk to estimate
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :param statistics: Statistics of the vDisk (fetched when not given)
+        :type statistics: dict
+        :return: The expected benefit (bytes), the expected cost (seconds) and whether the vDisk is idle
+        :rtype: tuple(float, float, bool)
+        """
+        last_run = ScrubScheduler.get_last_successful_run(vdisk)
+        if statistics is None:
+            try:
+                statistics = vdisk.statistics
+            except Exception:
+                statistics = {}
+        data_written = statistics.get('data_written')
+        if last_run is None:  # The garbage is unknown, the stored data is the upper limit
+            return float(max(statistics.get('stored', 0), 1)), float(ScrubScheduler.DEFAULT_COST), False
+
+        cost = float(max(last_run.get('duration') or ScrubScheduler.DEFAULT_COST, 1))
+        if data_written is None or last_run.get('data_written') is None:
+            return float(max(statistics.get('stored', 0), 1)), cost, False
+        written = data_written - last_run['data_written']
+        if written < 0:  # The counters restart together with the volume
+            written = data_written
+        idle = written < self.settings['min_data_written'] and time.time() - last_run.get('end_time', 0) < self.settings['max_interval']
+        return float(written), cost, idle
+
+    @staticmethod
+    def get_last_successful_run(vdisk):
+        """
+        Retrieves the most recent successful scrub run of a vDisk
+        :param vdisk: vDisk to retrieve the run for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :return: The scrub run information or None when never successfully scrubbed
+        :rtype: dict
+        """
+        scrub_info = vdisk.scrubbing_information or {}
+        runs = scrub_info.get('previous_successful_runs') or []
+        if len(runs) == 0:
+            return None
+        return runs[0]
+
+    def may_continue(self):
+        """
+        Verifies whether a new vDisk can be picked up for scrubbing
+        :return: True when the window is still open and the work unit budget is not consumed
+        :rtype: bool
+        """
+        if self.deadline is not None and time.time() >= self.deadline:
+            return False
+        with self._lock:
+            return self.work_units_left is None or self.work_units_left > 0
+
+    def consume(self, work_units):
+        """
+        Registers the work units applied for a vDisk
+        :param work_units: Amount of applied work units
+        :type work_units: int
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            if self.work_units_left is not None:
+                self.work_units_left -= work_units
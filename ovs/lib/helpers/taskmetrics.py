@@ -0,0 +1,250 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Task metrics module
+"""
+
+import os
+import time
+import pstats
+import random
+import cProfile
+import threading
+from functools import wraps
+from StringIO import StringIO
+from celery.exceptions import Retry
+from ovs.extensions.generic.configuration import Configuration
+from ovs.extensions.generic.histogram import HistogramAggregator
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+
+
+class TaskMetrics(HistogramAggregator):
+    """
+    Instruments the celery tasks executed through ovs_task
+    Per task name, following phases are recorded in latency histograms:
+     - queue: Time between publishing the task and the start of its execution
+     - ensure_single_wait: Time the current invocation spent waiting for other tasks in the ensure single queue
+     - ensure_single_queued: Time between queueing the task in the ensure single queue and its start, including the
+                             time it was parked (retried) and redelivered
+     - run: Time spent executing the task (without the ensure single wait of the current invocation)
+     - outcome_<outcome>: Run time per outcome (success, failure, retry, discarded, callback, waited)
+    Selected tasks can be profiled with cProfile. Configuration (optional) is read from /ovs/framework/tasks|profiling:
+    {'tasks': [<task name>, ...],
+     'sample_rate': 1.0}
+    The profiles are kept in the volatile store for PROFILE_TTL seconds, the last MAX_PROFILES of them are listed.
+    """
+    WORKERS_KEY = 'ovs_task_metrics_workers'
+    WORKER_KEY = 'ovs_task_metrics_worker_{0}'
+    SENT_KEY = 'ovs_task_sent_{0}'
+    SENT_TTL = 24 * 60 * 60
+    PROFILES_KEY = 'ovs_task_profiles'
+    PROFILE_KEY = 'ovs_task_profile_{0}'
+    PROFILE_TTL = 24 * 60 * 60
+    PROFILE_LINES = 100
+    MAX_PROFILES = 50
+    CONFIG_KEY = '/ovs/framework/tasks|profiling'
+    CONFIG_TTL = 60
+
+    _logger = Logger('lib')
+    _lock = threading.Lock()
+    _histograms = {}
+    _last_push = None
+    _worker_id = None
+    _context = threading.local()
+    _config = None
+    _config_loaded = None
+
+    @classmethod
+    def register_sent(cls, task_id):
+        """
+        Registers the time a task was published, to calculate its queue latency when it starts
+        The registration is removed when the task starts. SENT_TTL only cleans up tasks which never start
+        :param task_id: Identifier of the published task
+        :type task_id: str
+        :return: None
+        :rtype: NoneType
+        """
+        VolatileFactory.get_client().set(TaskMetrics.SENT_KEY.format(task_id), time.time(), TaskMetrics.SENT_TTL)
+
+    @classmethod
+    def add_wait(cls, duration, queued=None):
+        """
+        Registers the time the current task had to wait in the ensure single queue
+        :param duration: Waiting time of the current invocation in seconds
+        :type duration: float
+        :param queued: Time in seconds since the task was queued in the ensure single queue, over all invocations
+        :type queued: float
+        :return: None
+        :rtype: NoneType
+        """
+        context = getattr(cls._context, 'current', None)
+        if context is not None:
+            context['wait'] += duration
+            if queued is not None:
+                context['queued'] = queued
+
+    @classmethod
+    def set_outcome(cls, outcome):
+        """
+        Registers the outcome of the current task if it differs from success (e.g. discarded by the ensure single decorator)
+        :param outcome: Outcome of the task
+        :type outcome: str
+        :return: None
+        :rtype: NoneType
+        """
+        context = getattr(cls._context, 'current', None)
+        if context is not None:
+            context['outcome'] = outcome
+
+    @classmethod
+    def instrument(cls, task_name, f):
+        """
+        Wraps a task function to record its metrics
+        :param task_name: Name of the task
+        :type task_name: str
+        :param f: Task function
+        :type f: callable
+        :return: The wrapped function
+        :rtype: callable
+        """
+        @wraps(f)
+        def new_function(*args, **kwargs):
+            """
+            Wrapped function
+            :param args: Arguments without default values
+            :param kwargs: Arguments with default values
+            """
+            start = time.time()
+            queue_time = cls._get_queue_time(start)
+            context = {'wait': 0.0, 'queued': None, 'outcome': None}
+            previous = getattr(cls._context, 'current', None)  # Tasks can be executed inline by other tasks
+            cls._context.current = context
+            profiler = cls._get_profiler(task_name)
+            outcome = 'failure'
+            try:
+                if profiler is not None:
+                    output = profiler.runcall(f, *args, **kwargs)
+                else:
+                    output = f(*args, **kwargs)
+                outcome = context['outcome'] or 'success'
+                return output
+            except Retry:
+                outcome = 'retry'
+                raise
+            finally:
+                cls._context.current = previous
+                duration = time.time() - start
+                run_time = max(0.0, duration - context['wait'])
+                values = {'run': run_time,
+                          'outcome_{0}'.format(outcome): run_time}
+                if context['wait'] > 0:
+                    values['ensure_single_wait'] = context['wait']
+                if context['queued'] is not None:
+                    values['ensure_single_queued'] = context['queued']
+                if queue_time is not None:
+                    values['queue'] = queue_time
+                try:
+                    cls.record_values(task_name, values)
+                    if profiler is not None:
+                        cls._store_profile(task_name, profiler, duration, outcome)
+                except Exception:
+                    cls._logger.exception('Could not record the metrics of task {0}'.format(task_name))
+
+        return new_function
+
+    @classmethod
+    def get_profiles(cls):
+        """
+        Lists the stored profiles
+        :return: Profile information (without the profile output), most recent first
+        :rtype: list
+        """
+        return list(reversed(VolatileFactory.get_client().get(TaskMetrics.PROFILES_KEY, [])))
+
+    @classmethod
+    def get_profile(cls, profile_id):
+        """
+        Retrieves a stored profile
+        :param profile_id: Identifier of the profile
+        :type profile_id: str
+        :return: Profile information, including the output of the profiler. None if the profile expired
+        :rtype: dict
+        """
+        return VolatileFactory.get_client().get(TaskMetrics.PROFILE_KEY.format(profile_id))
+
+    @classmethod
+    def _get_queue_time(cls, now):
+        """
+        Calculates the time the current celery task spent in the queue
+        """
+        if os.environ.get('RUNNING_UNITTESTS') == 'True':
+            return None
+        try:
+            from celery import current_task
+            task_id = getattr(getattr(current_task, 'request', None), 'id', None)
+            if task_id is None:
+                return None  # Executed inline
+            client = VolatileFactory.get_client()
+            key = TaskMetrics.SENT_KEY.format(task_id)
+            sent = client.get(key)
+            if sent is None:
+                return None
+            client.delete(key)
+            return max(0.0, now - sent)
+        except Exception:
+            cls._logger.exception('Could not calculate the queue time')
+            return None
+
+    @classmethod
+    def _get_profiler(cls, task_name):
+        """
+        Returns a profiler if the given task has to be profiled
+        """
+        now = time.time()
+        if cls._config_loaded is None or now - cls._config_loaded > TaskMetrics.CONFIG_TTL:
+            cls._config_loaded = now
+            try:
+                cls._config = Configuration.get(TaskMetrics.CONFIG_KEY) if Configuration.exists(TaskMetrics.CONFIG_KEY) else {}
+            except Exception:
+                cls._logger.exception('Could not load the task profiling configuration')
+                cls._config = {}
+        if task_name not in cls._config.get('tasks', []) or random.random() >= cls._config.get('sample_rate', 1.0):
+            return None
+        return cProfile.Profile()
+
+    @classmethod
+    def _store_profile(cls, task_name, profiler, duration, outcome):
+        """
+        Stores the output of a profiler in the volatile store
+        """
+        stream = StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TaskMetrics.PROFILE_LINES)
+        now = time.time()
+        info = {'id': '{0}_{1}_{2}'.format(task_name, int(now * 1000), os.getpid()),
+                'task_name': task_name,
+                'timestamp': now,
+                'duration': duration,
+                'outcome': outcome}
+        client = VolatileFactory.get_client()
+        client.set(TaskMetrics.PROFILE_KEY.format(info['id']), dict(info, output=stream.getvalue()), TaskMetrics.PROFILE_TTL)
+        with volatile_mutex(TaskMetrics.PROFILES_KEY):
+            profiles = [profile for profile in client.get(TaskMetrics.PROFILES_KEY, []) if now - profile['timestamp'] < TaskMetrics.PROFILE_TTL]
+            profiles.append(info)
+            client.set(TaskMetrics.PROFILES_KEY, profiles[-TaskMetrics.MAX_PROFILES:])
@@ -26,6 +26,8 @@ import random
 import string
 import inspect
 import subprocess
+from Queue import Empty, Queue
+from threading import Thread
 from celery.schedules import crontab
 from ovs.extensions.generic.configuration import Configuration
 from ovs_extensions.generic.interactive import Interactive
@@ -38,6 +40,7 @@ class Toolbox(object):
     Generic class for various methods
     """
     _function_pointers = {}
+    _logger = Logger('lib')
 
     regex_ip = re.compile('^(((25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?))$')
     regex_guid = re.compile('^[a-f0-9]{8}-(?:[a-f0-9]{4}-){3}[a-f0-9]{12}$')
@@ -100,6 +103,47 @@ class Toolbox(object):
             fct(**kwargs)
         return functions_found
 
+    @staticmethod
+    def run_parallel(function, work_items, amount, name='worker', logger=None):
+        """
+        Executes a function for every work item, using at most 'amount' threads
+        An exception raised for a work item is logged and does not stop the processing of the other work items
+        :param function: Function to execute for every work item
+        :type function: callable
+        :param work_items: Work items to process
+        :type work_items: list
+        :param amount: Maximum amount of threads
+        :type amount: int
+        :param name: Prefix for the names of the threads
+        :type name: str
+        :param logger: Logger to log the exceptions with (defaults to the Toolbox logger)
+        :type logger: ovs.extensions.generic.logger.Logger
+        :return: None
+        :rtype: NoneType
+        """
+        if logger is None:
+            logger = Toolbox._logger
+        queue = Queue()
+        for item in work_items:
+            queue.put(item)
+
+        def _worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    function(item)
+                except Exception:
+                    logger.exception('Error while processing work item {0}'.format(item))
+
+        threads = [Thread(target=_worker, name='{0}_{1}'.format(name, index)) for index in xrange(min(amount, len(work_items)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
     @staticmethod
     def get_hash(length=16):
         """
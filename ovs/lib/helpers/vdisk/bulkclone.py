@@ -0,0 +1,285 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Bulk clone module
+"""
+
+import time
+from threading import Lock
+from ovs.dal.hybrids.vdisk import VDisk
+from ovs.dal.hybrids.vpool import VPool
+from ovs.dal.lists.vdisklist import VDiskList
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.storageserver.storagedriver import MDSMetaDataBackendConfig, MDSNodeConfig
+from ovs.lib.helpers.toolbox import Toolbox
+
+
+class BulkCloner(object):
+    """
+    Creates a set of clones from a vTemplate or from a snapshot of a vDisk
+    The clones are spread over the StorageDrivers of the vPool, favoring the StorageDrivers owning the least volumes.
+    The clone calls are executed concurrently (limited cluster-wide and per StorageDriver), the clones are added to the
+    model in batches and the MDS safety and DTL checkups are executed once all clones are created.
+    """
+    MAX_PARALLEL = 32
+    MAX_PARALLEL_PER_STORAGEDRIVER = 4
+    MAX_PARALLEL_CHECKUP = 8
+    MODEL_BATCH_SIZE = 50
+
+    _logger = Logger('lib')
+
+    def __init__(self, vdisk_guid, names, snapshot_id=None, storagerouter_guids=None, pagecache_ratio=None, cache_quota=None):
+        """
+        :param vdisk_guid: Guid of the vTemplate or vDisk to clone
+        :type vdisk_guid: str
+        :param names: Names of the clones (can be paths or user friendly names)
+        :type names: list
+        :param snapshot_id: ID of the snapshot to clone from. A new snapshot is created when omitted. Ignored for vTemplates
+        :type snapshot_id: str
+        :param storagerouter_guids: Guids of the StorageRouters to spread the clones over. All StorageRouters of the vPool when omitted
+        :type storagerouter_guids: list
+        :param pagecache_ratio: Ratio of the page cache size (compared to a 100% cache)
+        :type pagecache_ratio: float
+        :param cache_quota: Max disk space the new clones can consume for caching (both fragment as block) purposes (in Bytes)
+        :type cache_quota: dict
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        self.vdisk = VDisk(vdisk_guid)
+        self.vpool = self.vdisk.vpool
+        self.snapshot_id = snapshot_id
+        self.pagecache_ratio = pagecache_ratio
+        self.cache_quota = cache_quota
+        self.is_template = self.vdisk.is_vtemplate
+        self._lock = Lock()
+
+        # Validations
+        if len(names) == 0:
+            raise ValueError('No names provided')
+        if len(set(names)) != len(names):
+            raise ValueError('The provided names are not unique')
+        self.devicenames = dict((name, VDiskController.clean_devicename(name)) for name in names)
+        if len(set(self.devicenames.values())) != len(names):
+            raise ValueError('Some of the provided names result in the same device name')
+        existing = set(vdisk.devicename for vdisk in self.vpool.vdisks)
+        duplicates = sorted(name for name, devicename in self.devicenames.iteritems() if devicename in existing)
+        if len(duplicates) > 0:
+            raise RuntimeError('vDisks with names {0} already exist on vPool {1}'.format(', '.join(duplicates), self.vpool.name))
+        if pagecache_ratio is not None:
+            if not 0.0 < pagecache_ratio <= 1:
+                raise RuntimeError('Parameter pagecache_ratio must be 0 < x <= 1')
+        if cache_quota is not None:
+            for quota_type in VPool.CACHES.values():
+                quota = cache_quota.get(quota_type)
+                if quota is not None:
+                    if not 0.1 * 1024.0 ** 3 <= quota <= 1024 ** 4:
+                        raise ValueError('Parameter cache_quota must be between 0.1 GiB and 1024 GiB')
+        self.names = list(names)
+        self.storagedrivers = self._get_storagedrivers(storagerouter_guids)
+
+    def _get_storagedrivers(self, storagerouter_guids):
+        """
+        Retrieves the StorageDrivers to create the clones on, together with their MDS backend config
+        :return: Dict with per StorageDriver ID the StorageDriver and its MDS backend config
+        :rtype: dict
+        """
+        from ovs.lib.mdsservice import MDSServiceController
+
+        storagedrivers = {}
+        for storagedriver in self.vpool.storagedrivers:
+            if storagerouter_guids is not None and storagedriver.storagerouter_guid not in storagerouter_guids:
+                continue
+            mds_service = MDSServiceController.get_preferred_mds(storagedriver.storagerouter, self.vpool)[0]
+            if mds_service is None:
+                BulkCloner._logger.warning('Could not find a MDS service for StorageRouter {0}'.format(storagedriver.storagerouter.name))
+                continue
+            # noinspection PyArgumentList
+            backend_config = MDSMetaDataBackendConfig([MDSNodeConfig(address=str(mds_service.service.storagerouter.ip),
+                                                                     port=mds_service.service.ports[0])])
+            storagedrivers[storagedriver.storagedriver_id] = {'storagedriver': storagedriver,
+                                                             'backend_config': backend_config}
+        if len(storagedrivers) == 0:
+            raise RuntimeError('Could not find a StorageRouter with a MDS service to create the clones on')
+        return storagedrivers
+
+    def distribute(self):
+        """
+        Assigns every clone to a StorageDriver, favoring the StorageDrivers owning the least volumes
+        :return: List of names per StorageDriver ID
+        :rtype: dict
+        """
+        loads = dict((storagedriver_id, 0) for storagedriver_id in self.storagedrivers)
+        for registration in self.vpool.objectregistry_client.get_all_registrations():
+            node_id = str(registration.node_id())
+            if node_id in loads:
+                loads[node_id] += 1
+        distribution = dict((storagedriver_id, []) for storagedriver_id in self.storagedrivers)
+        for name in self.names:
+            storagedriver_id = min(loads, key=lambda sd_id: (loads[sd_id], sd_id))
+            loads[storagedriver_id] += 1
+            distribution[storagedriver_id].append(name)
+        return distribution
+
+    def execute(self):
+        """
+        Creates all clones
+        :return: Per name the information about the clone (vdisk_guid, name, backingdevice) or the error
+        :rtype: dict
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        if self.is_template is False:
+            self._prepare_snapshot()
+        distribution = self.distribute()
+        start = time.time()
+        volumes = {}
+        errors = {}
+
+        def _clone(storagedriver_id, name):
+            info = self.storagedrivers[storagedriver_id]
+            devicename = self.devicenames[name]
+            try:
+                if self.is_template is True:
+                    volume_id = self.vdisk.storagedriver_client.create_clone_from_template(target_path=devicename,
+                                                                                          metadata_backend_config=info['backend_config'],
+                                                                                          parent_volume_id=str(self.vdisk.volume_id),
+                                                                                          node_id=str(storagedriver_id))
+                else:
+                    volume_id = self.vdisk.storagedriver_client.create_clone(target_path=devicename,
+                                                                             metadata_backend_config=info['backend_config'],
+                                                                             parent_volume_id=str(self.vdisk.volume_id),
+                                                                             parent_snapshot_id=str(self.snapshot_id),
+                                                                             node_id=str(storagedriver_id))
+            except Exception as ex:
+                BulkCloner._logger.error('Cloning {0} to new vDisk {1} failed: {2}'.format(self.vdisk.name, name, str(ex)))
+                with self._lock:
+                    errors[name] = str(ex)
+                return
+            try:
+                self.vdisk.storagedriver_client.schedule_backend_sync(volume_id=volume_id, req_timeout_secs=10)
+            except Exception:
+                # If this would fail, it doesn't matter because this is only a workaround for this: https://github.com/openvstorage/volumedriver/issues/148
+                BulkCloner._logger.exception('Scheduling backend sync for clone {0} failed'.format(volume_id))
+            with self._lock:
+                volumes[name] = str(volume_id)
+
+        work = []
+        for storagedriver_id, names in distribution.iteritems():
+            for index in xrange(BulkCloner.MAX_PARALLEL_PER_STORAGEDRIVER):
+                work.append([(storagedriver_id, name) for name in names[index::BulkCloner.MAX_PARALLEL_PER_STORAGEDRIVER]])
+        Toolbox.run_parallel(lambda items: [_clone(*item) for item in items], [item for item in work if len(item) > 0], BulkCloner.MAX_PARALLEL, name='bulk_clone', logger=BulkCloner._logger)
+        BulkCloner._logger.info('Bulk clone of {0} - Created {1} volumes, {2} failures in {3:.2f}s'.format(self.vdisk.name, len(volumes), len(errors), time.time() - start))
+
+        new_vdisks = self._save(volumes)
+        self._checkup(new_vdisks.values())
+        if len(new_vdisks) > 0:
+            try:
+                VDiskController.dtl_checkup(vdisk_guids=[new_vdisk.guid for new_vdisk in new_vdisks.itervalues()])
+            except Exception:
+                BulkCloner._logger.exception('DTL checkup of the clones of {0} failed'.format(self.vdisk.name))
+
+        results = dict((name, {'error': error}) for name, error in errors.iteritems())
+        for name, new_vdisk in new_vdisks.iteritems():
+            results[name] = {'vdisk_guid': new_vdisk.guid,
+                             'name': new_vdisk.name,
+                             'backingdevice': self.devicenames[name]}
+        return results
+
+    def _prepare_snapshot(self):
+        """
+        Creates the snapshot to clone from when required and waits until it is synced to the backend
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        if self.snapshot_id is not None:
+            VDiskController._wait_for_snapshot_to_be_synced_to_backend(vdisk_guid=self.vdisk.guid, snapshot_id=self.snapshot_id)
+            return
+        metadata = {'label': '',
+                    'is_consistent': False,
+                    'timestamp': str(int(time.time())),
+                    'is_automatic': True}
+        self.snapshot_id = VDiskController.create_snapshot(vdisk_guid=self.vdisk.guid, metadata=metadata)
+        try:
+            VDiskController._wait_for_snapshot_to_be_synced_to_backend(vdisk_guid=self.vdisk.guid, snapshot_id=self.snapshot_id)
+        except RuntimeError:
+            try:
+                VDiskController.delete_snapshot(vdisk_guid=self.vdisk.guid, snapshot_id=self.snapshot_id)
+            except Exception:
+                pass
+            raise RuntimeError('Could not find created snapshot in time')
+
+    def _save(self, volumes):
+        """
+        Adds the created volumes to the model, in batches of MODEL_BATCH_SIZE while holding their event mutexes
+        :param volumes: Volume ID per name
+        :type volumes: dict
+        :return: vDisk per name
+        :rtype: dict
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        new_vdisks = {}
+        names = sorted(volumes)
+        for index in xrange(0, len(names), BulkCloner.MODEL_BATCH_SIZE):
+            batch = names[index:index + BulkCloner.MODEL_BATCH_SIZE]
+            mutexes = []
+            try:
+                for volume_id in sorted(volumes[name] for name in batch):
+                    mutex = volatile_mutex(VDiskController._VOLDRV_EVENT_KEY.format(volume_id))
+                    mutex.acquire(wait=30)
+                    mutexes.append(mutex)
+                existing = dict((str(vdisk.volume_id), vdisk) for vdisk in VDiskList.get_in_volume_ids([volumes[name] for name in batch]))
+                for name in batch:
+                    volume_id = volumes[name]
+                    new_vdisk = existing.get(volume_id)
+                    if new_vdisk is None:
+                        new_vdisk = VDisk()
+                        new_vdisk.size = self.vdisk.size
+                        new_vdisk.vpool = self.vpool
+                        new_vdisk.volume_id = volume_id
+                        new_vdisk.devicename = self.devicenames[name]
+                        new_vdisk.description = name
+                        new_vdisk.cache_quota = self.vdisk.cache_quota if self.cache_quota is None else self.cache_quota
+                    new_vdisk.name = name
+                    new_vdisk.parent_vdisk = self.vdisk
+                    if self.is_template is False:
+                        new_vdisk.parentsnapshot = self.snapshot_id
+                    new_vdisk.pagecache_ratio = self.pagecache_ratio if self.pagecache_ratio is not None else self.vdisk.pagecache_ratio
+                    new_vdisk.save()
+                    new_vdisks[name] = new_vdisk
+            finally:
+                for mutex in reversed(mutexes):
+                    mutex.release()
+        return new_vdisks
+
+    def _checkup(self, vdisks):
+        """
+        Configures the metadata page cache, the MDS safety and the cache quota of the clones concurrently
+        """
+        from ovs.lib.mdsservice import MDSServiceController
+        from ovs.lib.vdisk import VDiskController
+
+        def _checkup_vdisk(vdisk):
+            try:
+                VDiskController._set_vdisk_metadata_pagecache_size(vdisk)
+                MDSServiceController.ensure_safety(vdisk_guid=vdisk.guid)
+            except Exception:
+                BulkCloner._logger.exception('Error during vDisk checkup of {0}'.format(vdisk.name))
+            VDiskController._set_vdisk_cache_quota(vdisk)
+
+        Toolbox.run_parallel(_checkup_vdisk, vdisks, BulkCloner.MAX_PARALLEL_CHECKUP, name='bulk_clone', logger=BulkCloner._logger)
@@ -0,0 +1,409 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+DTL placement module
+"""
+
+import random
+from threading import Lock
+from ovs.dal.lists.domainlist import DomainList
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.sshclient import SSHClient, UnableToConnectException
+from ovs_extensions.generic.toolbox import ExtensionsToolbox
+from ovs_extensions.generic.volatilemutex import NoLockAvailableException
+from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.services.servicefactory import ServiceFactory
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.extensions.storageserver.storagedriver import DTLConfig, DTLConfigMode, StorageDriverClient
+from ovs.lib.helpers.toolbox import Toolbox
+
+
+class DTLPlanner(object):
+    """
+    Calculates and applies the DTL configuration of a set of vDisks
+    DTL allocation rules:
+        - First priority to StorageRouters located in the vDisk's StorageRouter's Recovery Domain
+        - Second priority to StorageRouters located in the vDisk's StorageRouter's Regular Domain
+        - If Domains configured, but no StorageRouters are found matching any of the Domains on the vDisk's StorageRouter, a random SR in the same vPool is chosen
+        - If no Domains configured on the vDisk StorageRouter, any other StorageRouter on which the vPool has been extended is chosen
+    Within a priority, the StorageRouter serving the least DTLs is chosen. A valid DTL target is never moved.
+    The DTL targets are registered per vPool after applying, so a checkup of only some vDisks balances against the
+    targets of the other vDisks of their vPools, as known by the previous checkups.
+
+    The current DTL configurations are gathered concurrently. The plan is calculated for all vDisks at once, based on a
+    Domain and StorageRouter map which is built once. Only the changes are applied: concurrently for different
+    StorageDrivers, sequentially for a single StorageDriver. Only vDisks which change are locked.
+    """
+    MAX_PARALLEL_GATHER = 8
+    MAX_PARALLEL_APPLY = 8
+    LOCK_ATTEMPTS = 4
+    LOCK_KEY = 'dtl_checkup_{0}'
+    TARGETS_KEY = 'ovs_dtl_targets_{0}'  # DTL target StorageRouter guid per vDisk guid of a vPool
+    TARGETS_LOCK_KEY = 'dtl_targets_{0}'
+
+    _logger = Logger('lib')
+
+    def __init__(self, vdisks, storagerouters_to_exclude=None):
+        """
+        :param vdisks: vDisks to check the DTL configuration for
+        :type vdisks: list
+        :param storagerouters_to_exclude: StorageRouter guids to exclude from possible targets
+        :type storagerouters_to_exclude: list
+        """
+        if storagerouters_to_exclude is None:
+            storagerouters_to_exclude = []
+        self.vdisks = list(vdisks)
+        self.errors_found = False
+        self._excluded = set(storagerouter if isinstance(storagerouter, basestring) else storagerouter.guid for storagerouter in storagerouters_to_exclude)
+        self._lock = Lock()
+        self._service_manager = ServiceFactory.get_manager()
+        self._domain_storagerouters = {}
+        self._storagerouter_domains = {}
+        self._vpools = {}
+        self._dtl_services = {}
+        self._loads = {}
+        self._targets = {}
+
+    def plan(self):
+        """
+        Calculates the DTL changes for all vDisks
+        :return: List of changes, every change is a dict with the vDisk, its StorageDriver ID and the DTL config to set
+        :rtype: list
+        """
+        self._build_domain_map()
+        states = self._gather()
+        self._seed_loads(states)
+        for state in states:
+            target = state['current_target']
+            self._targets.setdefault(state['vdisk'].vpool_guid, {})[state['vdisk'].guid] = None if target is None else target.storagerouter_guid
+            if target is not None:
+                loads = self._loads.setdefault(state['vdisk'].vpool_guid, {})
+                loads[target.storagerouter_guid] = loads.get(target.storagerouter_guid, 0) + 1
+
+        changes = []
+        for state in states:
+            vdisk = state['vdisk']
+            try:
+                change = self._plan_vdisk(state)
+            except Exception:
+                self.errors_found = True
+                DTLPlanner._logger.exception('Something went wrong configuring the DTL for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
+                continue
+            if change is not None:
+                changes.append(change)
+        DTLPlanner._logger.info('DTL checkup - {0} of {1} vDisks require a DTL reconfiguration'.format(len(changes), len(self.vdisks)))
+        return changes
+
+    def apply(self, changes):
+        """
+        Applies the DTL changes
+        :param changes: The changes as calculated by the plan
+        :type changes: list
+        :return: None
+        :rtype: NoneType
+        """
+        per_storagedriver = {}
+        for change in changes:
+            per_storagedriver.setdefault(change['storagedriver_id'], []).append(change)
+
+        def _apply(storagedriver_changes):
+            pending = storagedriver_changes
+            for attempt in xrange(DTLPlanner.LOCK_ATTEMPTS):
+                retries = []
+                for change in pending:
+                    vdisk = change['vdisk']
+                    try:
+                        with volatile_mutex(DTLPlanner.LOCK_KEY.format(vdisk.guid), wait=attempt * 10 + 1):
+                            vdisk.storagedriver_client.set_manual_dtl_config(change['volume_id'], change['dtl_config'], req_timeout_secs=10)
+                            if change['disable'] is False:
+                                vdisk.has_manual_dtl = False  # As soon as DTL checkup changes DTL settings, its no longer manual
+                                vdisk.save()
+                            vdisk.invalidate_dynamics(['dtl_status'])
+                        with self._lock:
+                            self._targets[vdisk.vpool_guid][vdisk.guid] = change['target_guid']
+                    except NoLockAvailableException:
+                        DTLPlanner._logger.info('    Could not acquire lock for vDisk {0}, retrying later'.format(vdisk.name))
+                        retries.append(change)
+                    except Exception:
+                        self.errors_found = True
+                        DTLPlanner._logger.exception('Something went wrong configuring the DTL for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
+                pending = retries
+                if len(pending) == 0:
+                    return
+            self.errors_found = True
+            DTLPlanner._logger.error('vDisks with guids {0} could not be checked'.format(', '.join([change['vdisk'].guid for change in pending])))
+
+        Toolbox.run_parallel(_apply, per_storagedriver.values(), DTLPlanner.MAX_PARALLEL_APPLY, name='dtl_planner', logger=DTLPlanner._logger)
+        self._register_targets()
+
+    def _seed_loads(self, states):
+        """
+        Seeds the DTL loads per vPool with the registered targets of the vDisks which are not part of this checkup
+        vDisks which were never checked up before are not known, so the loads are an approximation until the next full checkup
+        """
+        persistent = PersistentFactory.get_client()
+        checked = set(state['vdisk'].guid for state in states)
+        for vpool_guid, vpool_info in self._vpools.iteritems():
+            registered = list(persistent.get_multi([DTLPlanner.TARGETS_KEY.format(vpool_guid)], must_exist=False))[0] or {}
+            vdisk_guids = set(vpool_info['vpool'].vdisks_guids)
+            loads = self._loads.setdefault(vpool_guid, {})
+            for vdisk_guid, storagerouter_guid in registered.iteritems():
+                if vdisk_guid not in checked and vdisk_guid in vdisk_guids:
+                    loads[storagerouter_guid] = loads.get(storagerouter_guid, 0) + 1
+
+    def _register_targets(self):
+        """
+        Registers the DTL targets of the checked vDisks, leaving out the vDisks which no longer exist
+        """
+        persistent = PersistentFactory.get_client()
+        for vpool_guid, targets in self._targets.iteritems():
+            key = DTLPlanner.TARGETS_KEY.format(vpool_guid)
+            try:
+                with volatile_mutex(DTLPlanner.TARGETS_LOCK_KEY.format(vpool_guid), wait=30):
+                    registered = list(persistent.get_multi([key], must_exist=False))[0] or {}
+                    vdisk_guids = set(self._vpools[vpool_guid]['vpool'].vdisks_guids)
+                    registered = dict((vdisk_guid, storagerouter_guid) for vdisk_guid, storagerouter_guid in registered.iteritems() if vdisk_guid in vdisk_guids)
+                    for vdisk_guid, storagerouter_guid in targets.iteritems():
+                        if storagerouter_guid is None:
+                            registered.pop(vdisk_guid, None)
+                        else:
+                            registered[vdisk_guid] = storagerouter_guid
+                    persistent.set(key, registered)
+            except Exception:
+                DTLPlanner._logger.exception('Registering the DTL targets of vPool {0} failed'.format(vpool_guid))
+
+    def _build_domain_map(self):
+        """
+        Maps every Domain on the StorageRouters using it as primary Domain and every StorageRouter on its Recovery and Regular Domains
+        """
+        for domain in DomainList.get_domains():
+            self._domain_storagerouters[domain.guid] = set()
+            for junction in domain.storagerouters:
+                recovery, regular = self._storagerouter_domains.setdefault(junction.storagerouter_guid, (set(), set()))
+                if junction.backup is True:
+                    recovery.add(domain.guid)
+                else:
+                    regular.add(domain.guid)
+                    self._domain_storagerouters[domain.guid].add(junction.storagerouter_guid)
+
+    def _get_vpool_info(self, vpool):
+        """
+        Retrieves the configuration and the StorageDrivers of a vPool, loading them only once
+        """
+        with self._lock:
+            if vpool.guid not in self._vpools:
+                config = vpool.configuration
+                ExtensionsToolbox.verify_required_params(required_params={'dtl_mode': (str, StorageDriverClient.VPOOL_DTL_MODE_MAP.keys()),
+                                                                          'dtl_enabled': (bool, None),
+                                                                          'dtl_config_mode': (str, [StorageDriverClient.VOLDRV_DTL_MANUAL_MODE, StorageDriverClient.VOLDRV_DTL_AUTOMATIC_MODE])},
+                                                         actual_params=config)
+                storagedrivers = {}
+                for storagedriver in vpool.storagedrivers:
+                    storagedrivers.setdefault(storagedriver.storagerouter_guid, storagedriver)
+                self._vpools[vpool.guid] = {'vpool': vpool,
+                                            'config': config,
+                                            'storagedrivers': storagedrivers,
+                                            'storage_ips': dict((storagedriver.storage_ip, storagedriver) for storagedriver in vpool.storagedrivers)}
+            return self._vpools[vpool.guid]
+
+    def _gather(self):
+        """
+        Gathers the current DTL configuration of all vDisks concurrently
+        """
+        states = []
+
+        def _gather_vdisk(vdisk):
+            try:
+                DTLPlanner._logger.info('    Verifying vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
+                vdisk.invalidate_dynamics(['storagedriver_id', 'storagerouter_guid'])
+                if vdisk.storagedriver_client is None:
+                    DTLPlanner._logger.warning('    VDisk {0} with guid {1} does not have a storagedriver client'.format(vdisk.name, vdisk.guid))
+                    return
+                vpool_info = self._get_vpool_info(vdisk.vpool)
+                volume_id = str(vdisk.volume_id)
+                try:
+                    current_dtl_config = vdisk.storagedriver_client.get_dtl_config(volume_id, req_timeout_secs=5)
+                    current_dtl_config_mode = vdisk.storagedriver_client.get_dtl_config_mode(volume_id, req_timeout_secs=5)
+                except Exception:
+                    # Can occur when a volume has not been stolen yet from a dead node
+                    DTLPlanner._logger.exception('    VDisk {0} with guid {1}: Failed to retrieve the DTL configuration from storage driver'.format(vdisk.name, vdisk.guid))
+                    self.errors_found = True
+                    return
+                state = {'vdisk': vdisk,
+                         'volume_id': volume_id,
+                         'vpool_info': vpool_info,
+                         'storagedriver_id': vdisk.storagedriver_id,
+                         'storagerouter_guid': vdisk.storagerouter_guid,
+                         'current_dtl_config': current_dtl_config,
+                         'current_dtl_config_mode': current_dtl_config_mode,
+                         'current_target': None if current_dtl_config is None else vpool_info['storage_ips'].get(current_dtl_config.host)}
+                with self._lock:
+                    states.append(state)
+            except Exception:
+                self.errors_found = True
+                DTLPlanner._logger.exception('Something went wrong configuring the DTL for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
+
+        Toolbox.run_parallel(_gather_vdisk, self.vdisks, DTLPlanner.MAX_PARALLEL_GATHER, name='dtl_planner', logger=DTLPlanner._logger)
+        return sorted(states, key=lambda s: s['vdisk'].guid)
+
+    def _get_possible_targets(self, state):
+        """
+        Retrieves the guids of the StorageRouters which could serve as DTL target for a vDisk, ordered by priority
+        Equivalent of VDiskController._retrieve_possible_dtl_targets, using the Domain map instead of querying the Domains
+        :return: List of 3 sets: StorageRouters in the Recovery Domains, in the Regular Domains and all other StorageRouters of the vPool
+        :rtype: list
+        """
+        this_sr_guid = state['storagerouter_guid']
+        other_storagerouters = set(state['vpool_info']['storagedrivers']) - set([this_sr_guid])
+        recovery, regular = self._storagerouter_domains.get(this_sr_guid, (set(), set()))
+        primary = set()
+        secondary = set()
+        for domain_guid in recovery:
+            primary.update(self._domain_storagerouters.get(domain_guid, set()))
+        for domain_guid in regular:
+            secondary.update(self._domain_storagerouters.get(domain_guid, set()))
+        primary = primary.intersection(other_storagerouters)
+        secondary = secondary.difference(primary).intersection(other_storagerouters)
+
+        domain_guids = [junction.domain_guid for junction in state['vdisk'].domains_dtl]
+        if len(domain_guids) > 0:
+            manual_srs = set()
+            for domain_guid in domain_guids:
+                manual_srs.update(self._domain_storagerouters.get(domain_guid, set()))
+            primary = manual_srs.intersection(primary)
+            secondary = manual_srs.intersection(secondary)
+            other_storagerouters = manual_srs.intersection(other_storagerouters)
+        return [primary, secondary, other_storagerouters]
+
+    def _has_dtl_service(self, storagerouter, vpool):
+        """
+        Verifies whether the DTL service of the vPool is running on a StorageRouter, checking every StorageRouter only once
+        """
+        key = (storagerouter.guid, vpool.guid)
+        if key not in self._dtl_services:
+            self._dtl_services[key] = False
+            try:
+                root_client = SSHClient(endpoint=storagerouter, username='root')
+                service_name = 'dtl_{0}'.format(vpool.name)
+                if self._service_manager.has_service(service_name, client=root_client) is True and self._service_manager.get_service_status(service_name, client=root_client) == 'active':
+                    self._dtl_services[key] = True
+                else:
+                    DTLPlanner._logger.warning('    DTL service on Storage Router with IP {0} is not reachable'.format(storagerouter.ip))
+            except UnableToConnectException:
+                DTLPlanner._logger.warning('    Storage Router with IP {0} is not reachable'.format(storagerouter.ip))
+        return self._dtl_services[key]
+
+    def _plan_vdisk(self, state):
+        """
+        Determines the DTL change for a single vDisk
+        :return: The change or None if the DTL configuration is correct
+        :rtype: dict or NoneType
+        """
+        vdisk = state['vdisk']
+        vpool_info = state['vpool_info']
+        vpool = vpool_info['vpool']
+        vpool_config = vpool_info['config']
+        dtl_vpool_enabled = vpool_config['dtl_enabled']
+        dtl_vpool_config_mode = vpool_config['dtl_config_mode']
+        current_dtl_config = state['current_dtl_config']
+        current_dtl_config_mode = state['current_dtl_config_mode']
+        current_target = state['current_target']
+        change = {'vdisk': vdisk,
+                  'volume_id': state['volume_id'],
+                  'storagedriver_id': state['storagedriver_id'],
+                  'dtl_config': None,
+                  'target_guid': None,
+                  'disable': False}
+
+        # Checks for disabled DTLs
+        if dtl_vpool_enabled is False and current_dtl_config is None:
+            if current_dtl_config_mode == DTLConfigMode.AUTOMATIC:
+                DTLPlanner._logger.info('    DTL is globally disabled for vPool {0} with guid {1}. Setting to MANUAL mode for vDisk {2}'.format(vpool.name, vpool.guid, vdisk.name))
+                change['disable'] = True
+                return change
+            return None
+        if current_dtl_config_mode == DTLConfigMode.MANUAL and current_dtl_config is None and vdisk.has_manual_dtl is True:
+            DTLPlanner._logger.info('    DTL is disabled for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
+            return None
+
+        # Verify manual DTL
+        importances = self._get_possible_targets(state)
+        if vdisk.has_manual_dtl is True:
+            DTLPlanner._logger.info('    VDisk {0} with guid {1} has a manual DTL configuration'.format(vdisk.name, vdisk.guid))
+            correct = False
+            for possible_storagerouters in importances[:2]:  # Only allow current_target in primary or secondary for manual DTL
+                if len(possible_storagerouters) > 0:
+                    if current_target is not None and current_target.storagerouter_guid in possible_storagerouters:
+                        correct = True
+                    break
+            if correct is True:
+                DTLPlanner._logger.info('    VDisk {0} with guid {1} manual DTL configuration is valid'.format(vdisk.name, vdisk.guid))
+            else:
+                DTLPlanner._logger.warning('OVS_WARNING: VDisk {0} with guid {1} manual DTL configuration is no longer valid ({2})'.format(vdisk.name, vdisk.guid, current_dtl_config))
+            return None
+
+        # Determine new targets
+        new_targets = []
+        for index, possible_storagerouters in enumerate(importances):
+            DTLPlanner._logger.info('    Checking {0} StorageRouters'.format('primary' if index == 0 else 'secondary' if index == 1 else 'all vPool related'))
+            for storagerouter_guid in possible_storagerouters:
+                if storagerouter_guid in self._excluded:
+                    continue
+                storagedriver = vpool_info['storagedrivers'][storagerouter_guid]
+                if self._has_dtl_service(storagedriver.storagerouter, vpool) is True:
+                    new_targets.append(storagerouter_guid)
+            if len(new_targets) > 0:  # StorageRouters with highest possible priority found
+                break
+
+        # Verify reconfiguration required
+        if current_dtl_config is None:
+            DTLPlanner._logger.info('        No DTL configuration found, but there are Storage Routers available')
+        elif current_dtl_config_mode == DTLConfigMode.AUTOMATIC:
+            DTLPlanner._logger.info('        DTL configuration set to AUTOMATIC, switching to MANUAL')
+        elif dtl_vpool_config_mode == DTLConfigMode.MANUAL and dtl_vpool_enabled is True:
+            DTLPlanner._logger.info('        DTL configuration set to MANUAL, but static host provided ... overruling')
+        elif current_target is None:
+            DTLPlanner._logger.info('        DTL configuration set to MANUAL, but no StorageRouter found ... correcting')
+        elif len(new_targets) == 0:
+            DTLPlanner._logger.info('        DTL configuration set to MANUAL, but no new StorageRouter found ... setting to STANDALONE')
+        elif current_target.storagerouter_guid not in new_targets:
+            DTLPlanner._logger.info('        DTL configuration is not optimal, updating to new location')
+        elif current_dtl_config.port != current_target.ports['dtl']:
+            DTLPlanner._logger.info('        Configured port does not match expected port ({0} vs {1})'.format(current_dtl_config.port, current_target.ports['dtl']))
+        else:
+            return None
+
+        # Reconfigure the DTL
+        if len(new_targets) == 0:
+            DTLPlanner._logger.info('        DTL config that will be set -->  None')
+        else:
+            loads = self._loads.setdefault(vpool.guid, {})
+            if current_target is not None and current_target.storagerouter_guid in new_targets:
+                target_guid = current_target.storagerouter_guid
+            else:
+                target_guid = min(new_targets, key=lambda guid: (loads.get(guid, 0), random.random()))
+                loads[target_guid] = loads.get(target_guid, 0) + 1
+                if current_target is not None and loads.get(current_target.storagerouter_guid, 0) > 0:
+                    loads[current_target.storagerouter_guid] -= 1
+            change['target_guid'] = target_guid
+            storagedriver = vpool_info['storagedrivers'][target_guid]
+            dtl_ip = str(storagedriver.storage_ip)
+            dtl_port = storagedriver.ports['dtl']
+            dtl_mode = vpool_config['dtl_mode'] if current_dtl_config is None else StorageDriverClient.REVERSE_DTL_MODE_MAP[current_dtl_config.mode]
+            change['dtl_config'] = DTLConfig(dtl_ip, dtl_port, StorageDriverClient.VDISK_DTL_MODE_MAP[dtl_mode])
+            DTLPlanner._logger.info('        DTL config that will be set -->  Host: {0}, Port: {1}, Mode: {2}'.format(dtl_ip, dtl_port, dtl_mode))
+        return change
@@ -0,0 +1,438 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+vDisk migration module
+"""
+
+import copy
+import time
+import uuid
+import random
+from Queue import Empty, Queue
+from threading import Thread
+from ovs_extensions.storage.exceptions import AssertException
+from ovs.dal.exceptions import ObjectNotFoundException
+from ovs.dal.hybrids.storagerouter import StorageRouter
+from ovs.dal.hybrids.vdisk import VDisk
+from ovs.dal.hybrids.vpool import VPool
+from ovs.dal.lists.vdisklist import VDiskList
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.extensions.storageserver.storagedriver import VolumeRestartInProgressException
+from ovs.lib.helpers.repeatingtimer import RepeatingTimer
+from ovs.lib.messaging import MessageController
+
+
+class MigrationSlots(object):
+    """
+    Registry of the slots held by the running vDisk migrations, shared by all migration tasks
+    The registry ([<slot>, ...]) is updated with compare-and-swap transactions, so no additional lock is required.
+    Every slot holds a lease which is extended by a heartbeat of the task owning it. Slots of which the lease expired
+    (e.g. the worker died) are left out when reading the registry and purged on the next update.
+    """
+    LEASE_TIME = 60
+    HEARTBEAT_INTERVAL = 15
+    MAX_ATTEMPTS = 20
+
+    _logger = Logger('lib')
+
+    def __init__(self, key):
+        """
+        :param key: Persistent key holding the registry
+        :type key: str
+        """
+        self.key = key
+        self._persistent = PersistentFactory.get_client()
+
+    def get(self):
+        """
+        Retrieves the slots of which the lease did not expire
+        :return: The slots
+        :rtype: list
+        """
+        return MigrationSlots._purge(list(self._persistent.get_multi([self.key], must_exist=False))[0])
+
+    def acquire(self, slot, available):
+        """
+        Registers a slot if the registry leaves room for it
+        :param slot: Slot to register, identified by its 'id'
+        :type slot: dict
+        :param available: Function verifying whether the current slots leave room for the slot
+        :type available: callable
+        :return: True if the slot was registered
+        :rtype: bool
+        """
+        acquired = []
+
+        def _acquire(slots):
+            del acquired[:]
+            if available(slots) is True:
+                slots.append(dict(slot, lease_until=time.time() + MigrationSlots.LEASE_TIME))
+                acquired.append(slot['id'])
+            return slots
+
+        self._update(_acquire)
+        return len(acquired) > 0
+
+    def renew(self, slot_id):
+        """
+        Extends the lease of a slot
+        :param slot_id: Identifier of the slot
+        :type slot_id: str
+        :return: None
+        :rtype: NoneType
+        """
+        def _renew(slots):
+            for slot in slots:
+                if slot['id'] == slot_id:
+                    slot['lease_until'] = time.time() + MigrationSlots.LEASE_TIME
+            return slots
+
+        self._update(_renew)
+
+    def release(self, slot_id):
+        """
+        Removes a slot from the registry
+        :param slot_id: Identifier of the slot
+        :type slot_id: str
+        :return: None
+        :rtype: NoneType
+        """
+        self._update(lambda slots: [slot for slot in slots if slot['id'] != slot_id])
+
+    def heartbeat(self, slot_id):
+        """
+        Starts a heartbeat which keeps the lease of a slot alive. Stop it by calling cancel() on the returned timer
+        :param slot_id: Identifier of the slot
+        :type slot_id: str
+        :return: The running heartbeat
+        :rtype: ovs.lib.helpers.repeatingtimer.RepeatingTimer
+        """
+        def _beat():
+            if timer.finished.is_set():
+                return
+            try:
+                self.renew(slot_id)
+            except Exception:
+                MigrationSlots._logger.exception('Migration slots - Could not renew the lease of {0}'.format(slot_id))
+
+        timer = RepeatingTimer(MigrationSlots.HEARTBEAT_INTERVAL, _beat)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    @staticmethod
+    def _purge(slots):
+        now = time.time()
+        return [slot for slot in slots or [] if slot['lease_until'] >= now]
+
+    def _update(self, modifier):
+        """
+        Updates the registry using a compare-and-swap transaction. The registry is removed once it holds no slots
+        :param modifier: Function receiving a copy of the current slots (with expired slots purged) and returning the new slots.
+                         The function can be called multiple times.
+        :type modifier: callable
+        :return: None
+        :rtype: NoneType
+        """
+        for attempt in xrange(MigrationSlots.MAX_ATTEMPTS):
+            current = list(self._persistent.get_multi([self.key], must_exist=False))[0]
+            slots = modifier(copy.deepcopy(MigrationSlots._purge(current)))
+            if slots == (current or []):
+                return
+            transaction = self._persistent.begin_transaction()
+            self._persistent.assert_value(self.key, current, transaction=transaction)
+            if len(slots) == 0:
+                self._persistent.delete(self.key, must_exist=False, transaction=transaction)
+            else:
+                self._persistent.set(self.key, slots, transaction=transaction)
+            try:
+                self._persistent.apply_transaction(transaction)
+                return
+            except AssertException:
+                time.sleep(random.randint(0, 5 * (attempt + 1)) / 100.0)
+        raise RuntimeError('Migration slots - Could not update the registry after {0} attempts'.format(MigrationSlots.MAX_ATTEMPTS))
+
+
+class MigrationScheduler(object):
+    """
+    Migrates a set of vDisks to their target StorageRouters
+    The migrations are executed concurrently, limited cluster-wide, per source and per target StorageRouter. The limits
+    are shared by all running migration tasks: every running migration holds a slot in the MigrationSlots registry.
+    The least active and smallest vDisks are migrated first. Migrations failing because the volume is restarting are
+    retried with an exponential backoff. Progress is reported through the messaging layer. The MDS safety and DTL
+    checkups of the migrated vDisks are executed as one batch once all migrations are finished.
+    """
+    MAX_PARALLEL = 8
+    MAX_PER_SOURCE = 2
+    MAX_PER_TARGET = 2
+    MAX_ATTEMPTS = 5
+    BACKOFF = 2
+    POLL_INTERVAL = 0.5
+    MESSAGE_TYPE = 'vdisk_migration'
+    SLOTS_KEY = 'ovs_vdisk_migration_slots'
+
+    _logger = Logger('lib')
+
+    def __init__(self, moves, force=False):
+        """
+        :param moves: Target StorageRouter guid per vDisk guid
+        :type moves: dict
+        :param force: Indicates whether to force the migrations or not (forcing can lead to data loss)
+        :type force: bool
+        :raises ObjectNotFoundException: When a vDisk or StorageRouter does not exist
+        :raises RuntimeError: When the vPool of a vDisk is not extended to its target StorageRouter
+        """
+        self.force = force
+        self.id = str(uuid.uuid4())
+        self.results = {}
+        self._moves = []
+        self._slots = MigrationSlots(key=MigrationScheduler.SLOTS_KEY)
+        storagerouters = {}
+        for vdisk_guid, target_storagerouter_guid in moves.iteritems():
+            try:
+                vdisk = VDisk(vdisk_guid)
+            except ObjectNotFoundException:
+                MigrationScheduler._logger.exception('No valid VDisk has been found with provided guid {0}'.format(vdisk_guid))
+                raise
+            if target_storagerouter_guid not in storagerouters:
+                try:
+                    storagerouters[target_storagerouter_guid] = StorageRouter(target_storagerouter_guid)
+                except ObjectNotFoundException:
+                    MigrationScheduler._logger.exception('No valid StorageRouter has been found with provided guid {0}'.format(target_storagerouter_guid))
+                    raise
+            storagedrivers = [sd for sd in storagerouters[target_storagerouter_guid].storagedrivers if sd.vpool_guid == vdisk.vpool_guid]
+            if len(storagedrivers) == 0:
+                err_msg = 'Failed to find the matching StorageDriver for vdisk {0}'.format(vdisk.name)
+                MigrationScheduler._logger.error(err_msg)
+                raise RuntimeError(err_msg)
+            try:
+                activity = vdisk.statistics.get('data_transferred_ps', 0)
+            except Exception:
+                activity = 0
+            self._moves.append({'vdisk': vdisk,
+                                'source': vdisk.storagerouter_guid,
+                                'target': target_storagerouter_guid,
+                                'storagedriver': storagedrivers[0],
+                                'order': (activity, vdisk.size),
+                                'attempts': 0,
+                                'not_before': 0,
+                                'slot': None,
+                                'heartbeat': None,
+                                'thread': None})
+        self._moves.sort(key=lambda m: m['order'])
+
+    @staticmethod
+    def plan_evacuation(storagerouter_guid, vpool_guid=None):
+        """
+        Calculates the migrations to move all vDisks away from a StorageRouter
+        Every vDisk is moved to the StorageRouter of its vPool which owns the least volumes at that point
+        :param storagerouter_guid: Guid of the StorageRouter to evacuate
+        :type storagerouter_guid: str
+        :param vpool_guid: Only evacuate the vDisks of this vPool
+        :type vpool_guid: str
+        :return: Target StorageRouter guid per vDisk guid
+        :rtype: dict
+        """
+        storagerouter = StorageRouter(storagerouter_guid)
+        vpools = [VPool(vpool_guid)] if vpool_guid is not None else [sd.vpool for sd in storagerouter.storagedrivers]
+        moves = {}
+        for vpool in vpools:
+            storagedrivers = dict((sd.storagedriver_id, sd) for sd in vpool.storagedrivers)
+            sources = [sd_id for sd_id, sd in storagedrivers.iteritems() if sd.storagerouter_guid == storagerouter_guid]
+            loads = dict((sd_id, 0) for sd_id, sd in storagedrivers.iteritems() if sd.storagerouter_guid != storagerouter_guid)
+            if len(sources) == 0:
+                continue
+            if len(loads) == 0:
+                raise RuntimeError('vPool {0} is not extended to any other StorageRouter'.format(vpool.name))
+            volume_ids = []
+            for registration in vpool.objectregistry_client.get_all_registrations():
+                node_id = str(registration.node_id())
+                if node_id in sources:
+                    volume_ids.append(str(registration.object_id()))
+                elif node_id in loads:
+                    loads[node_id] += 1
+            for vdisk in VDiskList.get_in_volume_ids(volume_ids):
+                target_id = min(loads, key=lambda sd_id: (loads[sd_id], sd_id))
+                loads[target_id] += 1
+                moves[vdisk.guid] = storagedrivers[target_id].storagerouter_guid
+        return moves
+
+    def execute(self):
+        """
+        Executes all migrations
+        :return: The result per vDisk guid (success, error and amount of attempts)
+        :rtype: dict
+        """
+        pending = list(self._moves)
+        running = []
+        finished = Queue()
+        self._report(pending, running)
+
+        def _migrate(_move):
+            vdisk = _move['vdisk']
+            try:
+                vdisk.storagedriver_client.migrate(str(vdisk.volume_id), str(_move['storagedriver'].storagedriver_id), self.force)
+                finished.put((_move, None))
+            except Exception as ex:
+                finished.put((_move, ex))
+
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                now = time.time()
+                slots = None
+                for move in list(pending):
+                    if move['not_before'] > now:
+                        continue
+                    if slots is None:
+                        slots = self._slots.get()
+                    if MigrationScheduler._slot_available(slots, move) is False or self._acquire_slot(move) is False:
+                        continue
+                    slots.append({'source': move['source'], 'target': move['target']})
+                    pending.remove(move)
+                    running.append(move)
+                    move['attempts'] += 1
+                    MigrationScheduler._logger.info('Starting moval of VDisk {0}'.format(move['vdisk'].guid))
+                    move['thread'] = Thread(target=_migrate, args=(move,), name='vdisk_migration_{0}'.format(move['vdisk'].guid))
+                    move['thread'].daemon = True
+                    move['thread'].start()
+                try:
+                    move, exception = finished.get(timeout=MigrationScheduler.POLL_INTERVAL)
+                except Empty:
+                    continue
+                running.remove(move)
+                self._release_slot(move)
+                vdisk = move['vdisk']
+                if isinstance(exception, VolumeRestartInProgressException) and move['attempts'] < MigrationScheduler.MAX_ATTEMPTS:
+                    backoff = MigrationScheduler.BACKOFF * 2 ** (move['attempts'] - 1)
+                    MigrationScheduler._logger.warning('vDisk {0} is restarting, retrying the move in {1}s'.format(vdisk.name, backoff))
+                    move['not_before'] = time.time() + backoff
+                    pending.append(move)
+                    continue
+                self._register_result(move, exception)
+                self._report(pending, running)
+        except Exception:
+            # The started migrations continue in the volumedriver, so they are awaited to record their outcome and free their slots
+            MigrationScheduler._logger.exception('vDisk migration {0} - Scheduling failed, waiting for {1} running migrations'.format(self.id, len(running)))
+            for move in running:
+                if move['thread'] is not None:
+                    move['thread'].join()
+            while not finished.empty():
+                move, exception = finished.get_nowait()
+                self._release_slot(move)
+                self._register_result(move, exception)
+            raise
+        finally:
+            # Slots which could not be freed expire once their heartbeat stops
+            for move in self._moves:
+                if move['heartbeat'] is not None:
+                    move['heartbeat'].cancel()
+                    move['heartbeat'] = None
+
+        self._post_migrate()
+        return self.results
+
+    def _register_result(self, move, exception):
+        """
+        Records the outcome of a migration
+        """
+        vdisk = move['vdisk']
+        if exception is not None:
+            MigrationScheduler._logger.error('Failed to move vDisk {0}: {1}'.format(vdisk.name, exception))
+        self.results[vdisk.guid] = {'success': exception is None,
+                                    'error': None if exception is None else str(exception),
+                                    'attempts': move['attempts']}
+
+    @staticmethod
+    def _slot_available(slots, move):
+        """
+        Verifies whether the given slots leave room for a migration
+        """
+        return len(slots) < MigrationScheduler.MAX_PARALLEL and \
+            len([slot for slot in slots if slot['source'] == move['source']]) < MigrationScheduler.MAX_PER_SOURCE and \
+            len([slot for slot in slots if slot['target'] == move['target']]) < MigrationScheduler.MAX_PER_TARGET
+
+    def _acquire_slot(self, move):
+        """
+        Registers a slot for a migration if the cluster-wide limits allow it, and keeps its lease alive
+        :return: True if the slot was acquired
+        :rtype: bool
+        """
+        slot_id = '{0}_{1}_{2}'.format(self.id, move['vdisk'].guid, move['attempts'])
+        slot = {'id': slot_id,
+                'task_id': self.id,
+                'vdisk_guid': move['vdisk'].guid,
+                'source': move['source'],
+                'target': move['target']}
+        if self._slots.acquire(slot, lambda slots: MigrationScheduler._slot_available(slots, move)) is False:
+            return False
+        move['slot'] = slot_id
+        move['heartbeat'] = self._slots.heartbeat(slot_id)
+        return True
+
+    def _release_slot(self, move):
+        """
+        Frees the slot of a finished migration
+        """
+        if move['heartbeat'] is not None:
+            move['heartbeat'].cancel()
+            move['heartbeat'] = None
+        if move['slot'] is not None:
+            try:
+                self._slots.release(move['slot'])
+            except Exception:
+                MigrationScheduler._logger.exception('Could not free the migration slot of vDisk {0}, it is freed once its lease expires'.format(move['vdisk'].name))
+            move['slot'] = None
+
+    def _post_migrate(self):
+        """
+        Executes the MDS safety and DTL checkups of all migrated vDisks
+        """
+        from ovs.lib.mdsservice import MDSServiceController
+        from ovs.lib.vdisk import VDiskController
+
+        migrated = [move['vdisk'] for move in self._moves if self.results.get(move['vdisk'].guid, {}).get('success') is True]
+        if len(migrated) == 0:
+            return
+        for vdisk in migrated:
+            try:
+                vdisk.invalidate_dynamics(['storagedriver_id', 'storagerouter_guid'])
+                MDSServiceController.ensure_safety(vdisk_guid=vdisk.guid)
+            except Exception:
+                MigrationScheduler._logger.exception('Executing post-migrate actions failed for vDisk {0}'.format(vdisk.name))
+        try:
+            VDiskController.dtl_checkup.delay(vdisk_guids=[vdisk.guid for vdisk in migrated])
+        except Exception:
+            MigrationScheduler._logger.exception('Scheduling the DTL checkup of the migrated vDisks failed')
+
+    def _report(self, pending, running):
+        """
+        Reports the progress through the messaging layer
+        """
+        succeeded = len([result for result in self.results.itervalues() if result['success'] is True])
+        progress = {'id': self.id,
+                    'total': len(self._moves),
+                    'pending': len(pending),
+                    'running': len(running),
+                    'succeeded': succeeded,
+                    'failed': len(self.results) - succeeded}
+        MigrationScheduler._logger.info('vDisk migration {0} - {1}/{2} vDisks moved, {3} failed'.format(self.id, succeeded, progress['total'], progress['failed']))
+        try:
+            MessageController.fire(MessageController.Type.EVENT, {'type': MigrationScheduler.MESSAGE_TYPE,
+                                                                  'metadata': progress})
+        except Exception:
+            MigrationScheduler._logger.exception('Could not report the progress of vDisk migration {0}'.format(self.id))
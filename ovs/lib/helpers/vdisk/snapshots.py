@@ -0,0 +1,252 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+vDisk snapshot catalog module
+"""
+
+import time
+import pickle
+from datetime import datetime
+from ovs.extensions.generic.logger import Logger
+from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.extensions.storageserver.storagedriver import SnapshotNotFoundException
+
+
+class SnapshotCatalog(object):
+    """
+    Persistent catalog of the snapshots of a vDisk
+    The catalog keeps the snapshot IDs in the order the volumedriver lists them, together with the parsed snapshot
+    information. It is maintained incrementally when snapshots are created or deleted through the framework. When reading
+    the catalog, the snapshot IDs are listed again and only the information of new snapshots and of snapshots which are
+    not yet in the backend is retrieved. A full reconciliation, which also refreshes the stored sizes, happens when the
+    catalog does not exist yet, when asked for and periodically.
+    Catalog layout: {'ids': [<snapshot id>, ...], 'snapshots': {<snapshot id>: <snapshot info or None>}, 'reconciled': <timestamp>}
+    """
+    CATALOG_KEY = 'ovs_vdisk_snapshots_{0}'
+    LOCK_KEY = 'snapshot_catalog_{0}'
+    LOCK_WAIT = 60
+
+    _logger = Logger('lib')
+
+    @staticmethod
+    def get(vdisk):
+        """
+        Retrieves the information of all snapshots of a vDisk
+        :param vdisk: vDisk to retrieve the snapshots for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :return: The information of the snapshots, in the order listed by the volumedriver
+        :rtype: list
+        """
+        catalog = SnapshotCatalog._load(vdisk)
+        if catalog is None:
+            return []
+        return [catalog['snapshots'][snapshot_id] for snapshot_id in catalog['ids'] if catalog['snapshots'][snapshot_id] is not None]
+
+    @staticmethod
+    def get_ids(vdisk):
+        """
+        Retrieves the IDs of all snapshots of a vDisk
+        :param vdisk: vDisk to retrieve the snapshot IDs for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :return: The snapshot IDs, in the order listed by the volumedriver
+        :rtype: list
+        """
+        catalog = SnapshotCatalog._load(vdisk)
+        if catalog is None:
+            return []
+        return list(catalog['ids'])
+
+    @staticmethod
+    def add(vdisk, snapshots):
+        """
+        Registers newly created snapshots of a vDisk
+        :param vdisk: vDisk the snapshots were created for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :param snapshots: Metadata per snapshot ID, in order of creation
+        :type snapshots: list[tuple]
+        :return: None
+        :rtype: NoneType
+        """
+        persistent = PersistentFactory.get_client()
+        key = SnapshotCatalog.CATALOG_KEY.format(vdisk.guid)
+        with volatile_mutex(SnapshotCatalog.LOCK_KEY.format(vdisk.guid), wait=SnapshotCatalog.LOCK_WAIT):
+            if persistent.exists(key) is False:
+                return  # The catalog will be built on first use
+            catalog = persistent.get(key)
+            for snapshot_id, metadata in snapshots:
+                if snapshot_id not in catalog['snapshots']:
+                    catalog['ids'].append(snapshot_id)
+                catalog['snapshots'][snapshot_id] = SnapshotCatalog._build_info(snapshot_id=snapshot_id,
+                                                                                metadata=metadata,
+                                                                                in_backend=False,
+                                                                                stored=0)
+            persistent.set(key, catalog)
+
+    @staticmethod
+    def remove(vdisk, snapshot_ids):
+        """
+        Unregisters deleted snapshots of a vDisk
+        :param vdisk: vDisk the snapshots were deleted from
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :param snapshot_ids: IDs of the deleted snapshots
+        :type snapshot_ids: list
+        :return: None
+        :rtype: NoneType
+        """
+        persistent = PersistentFactory.get_client()
+        key = SnapshotCatalog.CATALOG_KEY.format(vdisk.guid)
+        with volatile_mutex(SnapshotCatalog.LOCK_KEY.format(vdisk.guid), wait=SnapshotCatalog.LOCK_WAIT):
+            if persistent.exists(key) is False:
+                return
+            catalog = persistent.get(key)
+            for snapshot_id in snapshot_ids:
+                if snapshot_id in catalog['snapshots']:
+                    catalog['ids'].remove(snapshot_id)
+                    del catalog['snapshots'][snapshot_id]
+            persistent.set(key, catalog)
+
+    @staticmethod
+    def clear(vdisk_guid):
+        """
+        Removes the catalog of a vDisk
+        :param vdisk_guid: Guid of the vDisk
+        :type vdisk_guid: str
+        :return: None
+        :rtype: NoneType
+        """
+        persistent = PersistentFactory.get_client()
+        key = SnapshotCatalog.CATALOG_KEY.format(vdisk_guid)
+        with volatile_mutex(SnapshotCatalog.LOCK_KEY.format(vdisk_guid), wait=SnapshotCatalog.LOCK_WAIT):
+            if persistent.exists(key) is True:
+                persistent.delete(key)
+
+    @staticmethod
+    def reconcile(vdisk, refresh=False):
+        """
+        Reconciles the catalog of a vDisk with the snapshots known by the volumedriver
+        The information of snapshots already in the catalog and in the backend is reused, unless a refresh is requested
+        :param vdisk: vDisk to reconcile the catalog for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :param refresh: Retrieve the information of all snapshots again (e.g. to update their stored size)
+        :type refresh: bool
+        :return: The reconciled catalog
+        :rtype: dict
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        persistent = PersistentFactory.get_client()
+        key = SnapshotCatalog.CATALOG_KEY.format(vdisk.guid)
+        with volatile_mutex(SnapshotCatalog.LOCK_KEY.format(vdisk.guid), wait=SnapshotCatalog.LOCK_WAIT):
+            current = persistent.get(key) if persistent.exists(key) is True else {'snapshots': {}}
+            catalog = {'ids': [],
+                       'snapshots': {},
+                       'reconciled': time.time()}
+            for snapshot_id in VDiskController.list_snapshot_ids(vdisk=vdisk):
+                info = current['snapshots'].get(snapshot_id)
+                if refresh is True or info is None or info['in_backend'] is False:
+                    try:
+                        info = SnapshotCatalog._fetch_info(vdisk, snapshot_id)
+                    except SnapshotNotFoundException:
+                        continue
+                catalog['ids'].append(snapshot_id)
+                catalog['snapshots'][snapshot_id] = info
+            persistent.set(key, catalog)
+        return catalog
+
+    @staticmethod
+    def _load(vdisk):
+        """
+        Loads the catalog of a vDisk, building it when it does not exist yet
+        The snapshot IDs are listed on every load, so snapshots created or deleted outside of the framework are picked up.
+        Only the information of new snapshots and of snapshots which are not yet in the backend is retrieved
+        """
+        from ovs.lib.vdisk import VDiskController
+
+        if not vdisk.volume_id or not vdisk.vpool:
+            return None
+        persistent = PersistentFactory.get_client()
+        key = SnapshotCatalog.CATALOG_KEY.format(vdisk.guid)
+        if persistent.exists(key) is False:
+            return SnapshotCatalog.reconcile(vdisk)
+        catalog = persistent.get(key)
+        snapshot_ids = list(VDiskController.list_snapshot_ids(vdisk=vdisk))
+        updates = {}
+        missing = set()
+        for snapshot_id in snapshot_ids:
+            info = catalog['snapshots'].get(snapshot_id)
+            if snapshot_id in catalog['snapshots'] and (info is None or info['in_backend'] is True):
+                continue
+            try:
+                updates[snapshot_id] = SnapshotCatalog._fetch_info(vdisk, snapshot_id)
+            except SnapshotNotFoundException:
+                missing.add(snapshot_id)  # Deleted in the meantime
+        if snapshot_ids == catalog['ids'] and len(missing) == 0 and all(catalog['snapshots'].get(snapshot_id) == info for snapshot_id, info in updates.iteritems()):
+            return catalog
+        with volatile_mutex(SnapshotCatalog.LOCK_KEY.format(vdisk.guid), wait=SnapshotCatalog.LOCK_WAIT):
+            if persistent.exists(key) is False:
+                return SnapshotCatalog.reconcile(vdisk)
+            current = persistent.get(key)
+            catalog = {'ids': [],
+                       'snapshots': {},
+                       'reconciled': current.get('reconciled')}
+            for snapshot_id in snapshot_ids:
+                if snapshot_id in updates:
+                    info = updates[snapshot_id]
+                elif snapshot_id in current['snapshots']:
+                    info = current['snapshots'][snapshot_id]
+                else:
+                    continue  # Deleted through the framework in the meantime
+                catalog['ids'].append(snapshot_id)
+                catalog['snapshots'][snapshot_id] = info
+            persistent.set(key, catalog)
+        return catalog
+
+    @staticmethod
+    def _fetch_info(vdisk, snapshot_id):
+        """
+        Retrieves the information of a snapshot from the volumedriver
+        """
+        snapshot = vdisk.storagedriver_client.info_snapshot(str(vdisk.volume_id), snapshot_id, req_timeout_secs=2)
+        if snapshot.metadata:
+            metadata = pickle.loads(snapshot.metadata)
+            if not isinstance(metadata, dict):
+                return None
+        else:
+            metadata = {'timestamp': time.mktime(datetime.strptime(snapshot.timestamp.strip(), '%c').timetuple()),
+                        'label': snapshot_id,
+                        'is_consistent': False,
+                        'is_automatic': False,
+                        'is_sticky': False}
+        return SnapshotCatalog._build_info(snapshot_id=snapshot_id,
+                                           metadata=metadata,
+                                           in_backend=snapshot.in_backend,
+                                           stored=int(snapshot.stored))
+
+    @staticmethod
+    def _build_info(snapshot_id, metadata, in_backend, stored):
+        """
+        Builds the information of a snapshot as exposed by the vDisk 'snapshots' dynamic
+        """
+        return {'guid': snapshot_id,
+                'timestamp': metadata['timestamp'],
+                'label': metadata['label'],
+                'is_consistent': metadata['is_consistent'],
+                'is_automatic': metadata.get('is_automatic', True),
+                'is_sticky': metadata.get('is_sticky', False),
+                'in_backend': in_backend,
+                'stored': stored}
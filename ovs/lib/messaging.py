@@ -17,6 +17,7 @@
 """
 Messaging module
 """
+import time
 from functools import wraps
 from ovs_extensions.generic.filemutex import file_mutex
 from ovs.extensions.generic.logger import Logger
@@ -58,6 +59,10 @@ class MessageController(object):
     clients. It covers a long-polling scenario providing a realtime-alike experience.
     """
     TIMEOUT = 300
+    GAP_TIMEOUT = 5
+    MAX_BACKLOG = 1000
+    MESSAGE_KEY = 'msg_message_{0}'
+    SEQUENCE_KEY = 'msg_sequence'
     _cache = VolatileFactory.get_client()
     _logger = Logger('lib')
 
@@ -114,16 +119,34 @@ class MessageController(object):
     def get_messages(subscriber_id, message_id):
         """
         Gets all messages pending for a given subscriber, from a given message id
+        Only the messages newer than the given message id are fetched. A message of which the id is handed out
+        but which is not (yet) stored, is waited for until a later message is older than GAP_TIMEOUT.
+        The sequence can be reset (e.g. evicted from or restarted together with the volatile store). A subscriber which is
+        ahead of the sequence is considered to have missed the reset and receives all messages from the start again.
         """
         try:
             subscriptions = MessageController._cache.get('msg_subscriptions_{0}'.format(subscriber_id), [])
-            all_messages = MessageController._cache.get('msg_messages', [])
+            last_message_id = MessageController.last_message_id()
+            if message_id > last_message_id:
+                MessageController._logger.info('Message sequence was reset, restarting subscriber {0} from the start'.format(subscriber_id))
+                message_id = 0
+            first_message_id = max(message_id, last_message_id - MessageController.MAX_BACKLOG) + 1
+            entry_ids = range(first_message_id, last_message_id + 1)
+            keys = [MessageController.MESSAGE_KEY.format(entry_id) for entry_id in entry_ids]
+            if hasattr(MessageController._cache, 'get_multi'):
+                stored = MessageController._cache.get_multi(keys) or {}
+            else:
+                stored = dict((key, MessageController._cache.get(key)) for key in keys)
+            entries = [(entry_id, stored.get(key)) for entry_id, key in zip(entry_ids, keys)]
+            now = time.time()
             messages = []
-            last_message_id = 0
-            for message in all_messages:
-                if message['id'] > last_message_id:
-                    last_message_id = message['id']
-                if message['id'] > message_id and message['type'] in subscriptions:
+            for index, (entry_id, message) in enumerate(entries):
+                if message is None:
+                    if not any(later_message is not None and later_message['time'] < now - MessageController.GAP_TIMEOUT
+                               for _, later_message in entries[index + 1:]):
+                        return messages, entry_id - 1
+                    continue
+                if message['type'] in subscriptions:
                     messages.append(message)
             return messages, last_message_id
         except Exception:
@@ -131,18 +154,22 @@ class MessageController(object):
             raise
 
     @staticmethod
-    @synchronized()
     def fire(message_type, body):
         """
         Adds a new message to the messaging queue
-        """
-        last_message_id = max([m['id'] for m in MessageController._cache.get('msg_messages', [])] + [0])
-        message = {'id': last_message_id + 1,
+        The message id is taken from an atomic sequence and every message is stored under its own key,
+        so no lock is required and the size of the written value does not grow with the amount of messages
+        The sequence itself has no expiry, but it can still be evicted. See get_messages for how subscribers handle a reset
+        """
+        MessageController._cache.add(MessageController.SEQUENCE_KEY, 0)
+        message_id = MessageController._cache.incr(MessageController.SEQUENCE_KEY)
+        if isinstance(message_id, bool) or message_id is None:  # Not every volatile store returns the new value
+            message_id = MessageController._cache.get(MessageController.SEQUENCE_KEY)
+        message = {'id': message_id,
                    'type': message_type,
-                   'body': body}
-        messages = MessageController._cache.get('msg_messages', [])
-        messages.append(message)
-        MessageController._cache.set('msg_messages', messages, MessageController.TIMEOUT)
+                   'body': body,
+                   'time': time.time()}
+        MessageController._cache.set(MessageController.MESSAGE_KEY.format(message_id), message, MessageController.TIMEOUT)
 
     @staticmethod
     def last_message_id():
@@ -150,7 +177,7 @@ class MessageController(object):
         Gets the last messageid
         """
         try:
-            return max([m['id'] for m in MessageController._cache.get('msg_messages', [])] + [0])
+            return MessageController._cache.get(MessageController.SEQUENCE_KEY, 0)
         except Exception:
             MessageController._logger.exception('Error loading last message id')
             raise
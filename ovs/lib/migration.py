@@ -661,6 +661,20 @@ class MigrationController(object):
             except:
                 MigrationController._logger.exception('Integration of mds_catch_up failed')
 
+        ###################################################
+        # The scheduled scrub moved from execute_scrub to execute_scheduled_scrub: take over a customized schedule (or disabling)
+        scheduled_scrub_migration_key = '/ovs/framework/migration|scheduled_scrub'
+        if Configuration.get(key=scheduled_scrub_migration_key, default=False) is False:
+            try:
+                celery_key = '/ovs/framework/scheduling/celery'
+                scheduling_config = Configuration.get(key=celery_key, default={})
+                if 'ovs.generic.execute_scrub' in scheduling_config and 'ovs.generic.execute_scheduled_scrub' not in scheduling_config:
+                    scheduling_config['ovs.generic.execute_scheduled_scrub'] = scheduling_config['ovs.generic.execute_scrub']
+                    Configuration.set(key=celery_key, value=scheduling_config)
+                Configuration.set(key=scheduled_scrub_migration_key, value=True)
+            except Exception:
+                MigrationController._logger.exception('Migration of the scrub schedule failed')
+
         ###################################################
         # The components need to register themselves to avoid throwing the configuration away
         for storagerouter in StorageRouterList.get_storagerouters():
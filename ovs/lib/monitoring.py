@@ -20,11 +20,10 @@ MonitoringController module
 from ovs.dal.hybrids.vdisk import VDisk
 from ovs.dal.lists.storagedriverlist import StorageDriverList
 from ovs.dal.lists.storagerouterlist import StorageRouterList
-from ovs_extensions.api.client import OVSClient
+from ovs.extensions.generic.clientpool import OVSClientPool
 from ovs.extensions.generic.logger import Logger
 from ovs_extensions.generic.remote import remote
 from ovs.extensions.generic.sshclient import SSHClient
-from ovs.extensions.storage.volatilefactory import VolatileFactory
 from ovs.extensions.storageserver.storagedriver import StorageDriverConfiguration
 from ovs.lib.helpers.decorators import ovs_task
 from ovs.lib.helpers.toolbox import Schedule
@@ -89,11 +88,11 @@ class MonitoringController(object):
                 alba_backend_host = connection_info['host']
                 alba_backend_guid = backend_info['alba_backend_guid']
                 if alba_backend_guid not in alba_guid_size_map:
-                    ovs_client = OVSClient.get_instance(connection_info=connection_info, cache_store=VolatileFactory.get_client())
+                    ovs_client = OVSClientPool.get_instance(connection_info=connection_info)
                     try:
                         alba_guid_size_map[alba_backend_guid] = {'name': alba_backend_name,
                                                                  'backend_ip': alba_backend_host,
-                                                                 'total_size': ovs_client.get('/alba/backends/{0}/'.format(alba_backend_guid), params={'contents': 'usages'})['usages']['size'],
+                                                                 'total_size': ovs_client.call('get', '/alba/backends/{0}/'.format(alba_backend_guid), params={'contents': 'usages'})['usages']['size'],
                                                                  'requested_size': 0}
                     except Exception:
                         MonitoringController._logger.exception('Failed to retrieve ALBA Backend info for {0} on host {1}'.format(alba_backend_name, alba_backend_host))
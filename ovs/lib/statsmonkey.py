@@ -28,6 +28,7 @@ from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
 from ovs_extensions.monitoring.statsmonkey import StatsMonkey
 from ovs.lib.helpers.decorators import ovs_task
+from ovs.lib.helpers.taskmetrics import TaskMetrics
 from ovs.lib.helpers.toolbox import Schedule
 from ovs.lib.mdsservice import MDSServiceController
 
@@ -39,6 +40,7 @@ class StatsMonkeyController(StatsMonkey):
         * get_stats_mds
         * get_stats_vpools
         * get_stats_storagerouters
+        * get_stats_tasks
     """
     _logger = Logger(name='lib')
     _dynamic_dependencies = {'get_stats_vpools': {VPool: ['statistics']},  # The statistics being retrieved depend on the caching timeouts of these properties
@@ -153,3 +155,27 @@ class StatsMonkeyController(StatsMonkey):
                 errors = True
                 cls._logger.exception('Retrieving statistics for vPool {0} failed'.format(vpool.name))
         return errors, stats
+
+    @classmethod
+    def get_stats_tasks(cls):
+        """
+        Retrieve the queue time, ensure single wait time, run time and outcomes of the celery tasks
+        """
+        if cls._config is None:
+            cls.validate_and_retrieve_config()
+
+        stats = []
+        errors = False
+        environment = cls._config['environment']
+        try:
+            for task_name, phases in TaskMetrics.get_metrics().iteritems():
+                for phase, summary in phases.iteritems():
+                    stats.append({'tags': {'task_name': task_name,
+                                           'phase': phase,
+                                           'environment': environment},
+                                  'fields': cls._convert_to_float_values(dict((key, value) for key, value in summary.iteritems() if value is not None)),
+                                  'measurement': 'task'})
+        except Exception:
+            errors = True
+            cls._logger.exception('Retrieving task metrics failed')
+        return errors, stats
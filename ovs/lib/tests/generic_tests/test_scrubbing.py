@@ -18,8 +18,10 @@
 Generic test module
 """
 import re
+import time
 import unittest
-from threading import Event
+from datetime import datetime
+from threading import Event, Lock
 from ovs.dal.hybrids.diskpartition import DiskPartition
 from ovs.dal.hybrids.vdisk import VDisk
 from ovs.dal.lists.storagerouterlist import StorageRouterList
@@ -33,7 +35,10 @@ from ovs_extensions.services.mockups.systemd import SystemdMock
 from ovs.extensions.services.servicefactory import ServiceFactory
 from ovs.extensions.storageserver.tests.mockups import LockedClient
 from ovs.lib.generic import GenericController
+from ovs.lib.helpers.decorators import ENSURE_SINGLE_KEY
+from ovs.lib.helpers.ensuresingle import EnsureSingleCoordinator
 from ovs.lib.helpers.generic.scrubber import Scrubber, ScrubShared, StackWorker
+from ovs.lib.helpers.generic.scrubscheduler import ScrubScheduler
 from ovs.lib.graphite import GraphiteController
 
 
@@ -1028,6 +1033,120 @@ class ScrubTestCase(unittest.TestCase):
         for vdisk, scrub_status in vdisk_scrub_status_unregistration:
             self.assertFalse(scrub_status, 'VDisk should have been marked that it is not being scrubbed')
 
+    def test_work_unit_concurrency(self):
+        """
+        1 vPool, 1 vDisk with 10 work units, 1 scrub role
+        Validate that the work units of a vDisk are scrubbed concurrently (2 per proxy) and that their results are applied in order
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'vdisks': [(1, 1, 1, 1)],  # (<id>, <storagedriver_id>, <vpool_id>, <mds_service_id>)
+             'mds_services': [(1, 1)],  # (<id>, <storagedriver_id>)
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)]}  # (<id>, <vpool_id>, <storagerouter_id>)
+        )
+        vdisk = structure['vdisks'][1]
+        work_units = range(10)
+        lock = Lock()
+        second_started = Event()
+        scrubbing = []
+        concurrency = []
+        applied = []
+
+        def _scrub(locked_client, work_unit, **kwargs):
+            _ = locked_client, kwargs
+            with lock:
+                scrubbing.append(work_unit)
+                concurrency.append(len(scrubbing))
+            if work_unit == 0:
+                second_started.wait(5)  # Only returns before the timeout when work unit 1 is scrubbed concurrently
+            elif work_unit == 1:
+                second_started.set()
+            with lock:
+                scrubbing.remove(work_unit)
+            return work_unit
+
+        def _apply_scrubbing_result(locked_client, scrubbing_work_result):
+            _ = locked_client
+            applied.append(scrubbing_work_result)
+
+        LockedClient.scrub_controller = {'possible_threads': None,
+                                         'volumes': {vdisk.volume_id: {'success': True,
+                                                                       'scrub_work': work_units}},
+                                         'waiter': Waiter(1)}
+        original_scrub = LockedClient.__dict__['scrub']
+        original_apply = LockedClient.__dict__['apply_scrubbing_result']
+        LockedClient.scrub = _scrub
+        LockedClient.apply_scrubbing_result = _apply_scrubbing_result
+        try:
+            GenericController.execute_scrub()
+        finally:
+            LockedClient.scrub = original_scrub
+            LockedClient.apply_scrubbing_result = original_apply
+        self.assertTrue(expr=second_started.is_set(), msg='Work units were not scrubbed concurrently')
+        self.assertEqual(first=max(concurrency), second=2)
+        self.assertEqual(first=applied, second=work_units)
+
+    def test_scrub_scheduling(self):
+        """
+        1 vPool, 3 vDisks
+        Validate the off-peak windows, the cost/benefit ordering, the skipping of idle vDisks and the work unit budget
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'vdisks': [(1, 1, 1, 1), (2, 1, 1, 1), (3, 1, 1, 1)],  # (<id>, <storagedriver_id>, <vpool_id>, <mds_service_id>)
+             'mds_services': [(1, 1)],  # (<id>, <storagedriver_id>)
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)]}  # (<id>, <vpool_id>, <storagerouter_id>)
+        )
+        vdisks = structure['vdisks']
+
+        # Off-peak windows, including one passing midnight
+        settings = {'windows': [[22, 2]]}
+        self.assertEqual(first=ScrubScheduler.get_window_end(settings=settings, now=datetime(2018, 1, 1, 23, 30)),
+                         second=time.mktime(datetime(2018, 1, 2, 2).timetuple()))
+        self.assertEqual(first=ScrubScheduler.get_window_end(settings=settings, now=datetime(2018, 1, 1, 1, 30)),
+                         second=time.mktime(datetime(2018, 1, 1, 2).timetuple()))
+        self.assertIsNone(ScrubScheduler.get_window_end(settings=settings, now=datetime(2018, 1, 1, 12)))
+
+        # vDisk 1 was never scrubbed, vDisk 2 had a lot of data written since its last scrub, vDisk 3 hardly any
+        data_written = {vdisks[1].guid: 0,
+                        vdisks[2].guid: 1024 ** 3,
+                        vdisks[3].guid: 1024 ** 2}
+        for vdisk_id in [2, 3]:
+            vdisk = vdisks[vdisk_id]
+            vdisk.scrubbing_information = {'previous_successful_runs': [{'end_time': time.time(),
+                                                                         'duration': 10,
+                                                                         'data_written': 0,
+                                                                         'work_units': 5}]}
+            vdisk.save()
+        original_fetch_statistics = VDisk.fetch_statistics
+        VDisk.fetch_statistics = lambda vd: {'data_written': data_written[vd.guid], 'stored': 1024 ** 3}
+        try:
+            order = [vdisk.guid for vdisk in ScrubScheduler().prioritize([vdisks[3], vdisks[2], vdisks[1]])]
+            self.assertListEqual(list1=order, list2=[vdisks[1].guid, vdisks[2].guid, vdisks[3].guid])
+            order = [vdisk.guid for vdisk in ScrubScheduler(continuous=True).prioritize([vdisks[3], vdisks[2], vdisks[1]])]
+            self.assertListEqual(list1=order, list2=[vdisks[1].guid, vdisks[2].guid])
+        finally:
+            VDisk.fetch_statistics = original_fetch_statistics
+
+        # Work unit budget
+        Configuration.set(ScrubScheduler.SETTINGS_KEY, {'windows': [[0, 24]], 'work_unit_budget': 10})
+        scheduler = ScrubScheduler(continuous=True)
+        self.assertTrue(scheduler.may_continue())
+        scheduler.consume(10)
+        self.assertFalse(scheduler.may_continue())
+        self.assertTrue(ScrubScheduler(continuous=False).may_continue())
+
+        # A scrub does not start while a scheduled scrub is running
+        coordinator = EnsureSingleCoordinator(key='{0}_ovs.generic.execute_scheduled_scrub'.format(ENSURE_SINGLE_KEY), mode='DEFAULT')
+        coordinator.update(lambda value: {'mode': 'DEFAULT', 'values': [{'task_id': 'scheduled', 'timestamp': 'scheduled', 'lease_until': EnsureSingleCoordinator.lease()}]})
+        try:
+            with self.assertRaises(RuntimeError):
+                GenericController.execute_scrub(vdisk_guids=[vdisks[1].guid], manual=True)
+        finally:
+            coordinator.remove(timestamp='scheduled')
+
     @staticmethod
     def generate_scrub_related_info(structure, proxy_amount=1, skip_threads_for=None):
         """
@@ -250,6 +250,40 @@ class SnapshotTestCase(unittest.TestCase):
                                                               'is_consistent': True,
                                                               'timestamp': str(ts)})
 
+    def test_dry_run(self):
+        """
+        Validates whether a dry run of GenericController.delete_snapshots() reports the snapshots to delete without deleting them
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'vdisks': [(1, 1, 1, 1)],  # (<id>, <storagedriver_id>, <vpool_id>, <mds_service_id>)
+             'mds_services': [(1, 1)],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)]}  # (<id>, <vpool_id>, <storagerouter_id>)
+        )
+        vdisk_1 = structure['vdisks'][1]
+        [dynamic for dynamic in vdisk_1._dynamics if dynamic.name == 'snapshots'][0].timeout = 0
+
+        base = datetime.datetime.now().date()
+        base_timestamp = self._make_timestamp(base, datetime.timedelta(1))
+        hour = 60 * 60
+        for h in [6, 12, 18]:
+            VDiskController.create_snapshot(vdisk_guid=vdisk_1.guid,
+                                            metadata={'label': 'snapshot_{0}:00'.format(h),
+                                                      'is_consistent': True,
+                                                      'timestamp': str(base_timestamp + (hour * h))})
+        snapshot_ids = list(vdisk_1.snapshot_ids)
+        delete_timestamp = self._make_timestamp(base, datetime.timedelta(1) * 3) + 60 * 30
+        plan = GenericController.delete_snapshots(timestamp=delete_timestamp, dry_run=True)
+        self.assertEqual(first=sorted(plan['vdisks'][vdisk_1.guid]['snapshots']),
+                         second=sorted(snapshot['guid'] for snapshot in vdisk_1.snapshots if snapshot['label'] != 'snapshot_18:00'),
+                         msg='Expected all but the most recent consistent snapshot to be planned for deletion')
+        self.assertEqual(first=plan['progress']['snapshots_planned'], second=2)
+        self.assertEqual(first=sorted(vdisk_1.snapshot_ids), second=sorted(snapshot_ids), msg='A dry run should not delete any snapshot')
+
+        GenericController.delete_snapshots(timestamp=delete_timestamp)
+        self.assertEqual(first=[snapshot['label'] for snapshot in vdisk_1.snapshots], second=['snapshot_18:00'])
+
     ##################
     # HELPER METHODS #
     ##################
@@ -25,7 +25,9 @@ from threading import Event, Thread
 from ovs.dal.tests.helpers import DalHelper
 from ovs_extensions.generic.threadhelpers import Waiter
 # noinspection PyProtectedMember
-from ovs.lib.helpers.decorators import Decorators, _ensure_single, ovs_task
+from ovs.lib.helpers.decorators import Decorators, ENSURE_SINGLE_KEY, _ensure_single, ovs_task
+from ovs.lib.helpers.ensuresingle import EnsureSingleCoordinator
+from ovs.lib.helpers.toolbox import Toolbox
 
 
 class Helpers(unittest.TestCase):
@@ -524,6 +526,99 @@ class Helpers(unittest.TestCase):
         self.assertEqual(first=raise_info.exception.message,
                          second='The decorator ensure_single can only be applied to bound tasks (with bind=True argument)')
 
+    def test_ensure_single_expired_lease(self):
+        """
+        Validates whether queue entries of which the lease expired (e.g. crashed workers) no longer block new tasks
+        """
+        @ovs_task(name='lease_test', ensure_single_info={'mode': 'CHAINED'})
+        def _function(arg1):
+            _ = arg1
+
+        key = '{0}_lease_test'.format(ENSURE_SINGLE_KEY)
+        self.persistent.set(key, {'mode': 'CHAINED',
+                                  'values': [{'kwargs': {'arg1': 'crashed'},
+                                              'task_id': 'crashed_task_id',
+                                              'timestamp': '0_crashed',
+                                              'queued_at': time.time() - 120,
+                                              'lease_until': time.time() - 60}]})
+        thread = Thread(target=Helpers._execute_delayed_or_inline, name='lease_test', args=(_function, False), kwargs={'arg1': 'arg'})
+        thread.start()
+        thread.join()
+        self.assertEqual(first=Decorators.unittest_thread_info_by_name['lease_test'][0],
+                         second='FINISHED')
+        self.assertIsNone(list(self.persistent.get_multi([key], must_exist=False))[0])
+        Decorators._clean()
+
+    def test_ensure_single_parking(self):
+        """
+        Validates whether a queued asynchronous task is parked (retried with a countdown) while waiting for its turn
+        - The parked task keeps its entry, leased for longer than a lease renewed by a heartbeat
+        - Renewing a lease does not wake up the waiting tasks
+        - The redelivered task finds its entry back and executes when it is at the head of the queue
+        """
+        executed = []
+
+        @_ensure_single(task_name='parking_test', mode='CHAINED')
+        def _function(arg1):
+            executed.append(arg1)
+
+        key = '{0}_parking_test'.format(ENSURE_SINGLE_KEY)
+        coordinator = EnsureSingleCoordinator(key=key, mode='CHAINED')
+        self.persistent.set(key, {'mode': 'CHAINED',
+                                  'values': [{'kwargs': {'arg1': 'executing'},
+                                              'task_id': 'executing_task_id',
+                                              'timestamp': '0_executing',
+                                              'queued_at': time.time(),
+                                              'lease_until': EnsureSingleCoordinator.lease()}]})
+        task = ParkableTask(task_id='parked_task_id')
+        Decorators.unittest_parking = True
+        try:
+            with self.assertRaises(ParkableTask.Parked):
+                _function(task, arg1='parked')
+            self.assertEqual(first=task.countdowns, second=[EnsureSingleCoordinator.PARK_INTERVAL])
+            self.assertEqual(first=executed, second=[])
+            values = coordinator.get()['values']
+            self.assertEqual(first=[value['task_id'] for value in values], second=['executing_task_id', 'parked_task_id'])
+            self.assertGreater(values[1]['lease_until'], EnsureSingleCoordinator.lease())
+
+            # Renewing a lease does not wake up waiters
+            generation = coordinator.generation()
+            self.assertTrue(coordinator.renew(timestamp='0_executing'))
+            self.assertEqual(first=coordinator.generation(), second=generation)
+
+            # Redelivered while still not at the head of the queue
+            with self.assertRaises(ParkableTask.Parked):
+                _function(task, arg1='parked')
+            self.assertEqual(first=len(task.countdowns), second=2)
+            self.assertEqual(first=len(coordinator.get()['values']), second=2)
+
+            # Redelivered after the executing task finished
+            coordinator.remove(timestamp='0_executing')
+            self.assertNotEqual(first=coordinator.generation(), second=generation)
+            _function(task, arg1='parked')
+            self.assertEqual(first=len(task.countdowns), second=2)
+            self.assertEqual(first=executed, second=['parked'])
+            self.assertIsNone(coordinator.get())
+        finally:
+            Decorators._clean()
+
+    def test_run_parallel(self):
+        """
+        Validates whether all work items are processed in parallel, even when processing some of them fails
+        """
+        processed = []
+        lock = threading.Lock()
+
+        def _process(item):
+            if item % 3 == 0:
+                raise RuntimeError('Failure for item {0}'.format(item))
+            with lock:
+                processed.append(item)
+
+        Toolbox.run_parallel(_process, range(10), 4, name='run_parallel_test')
+        self.assertEqual(first=sorted(processed), second=[1, 2, 4, 5, 7, 8])
+        Toolbox.run_parallel(_process, [], 4)
+
     def test_selective_cache_clearing(self):
         """
         Validates whether the clear cache logic only discards keys for tasks that are not running (anymore)
@@ -600,6 +695,29 @@ class Helpers(unittest.TestCase):
         Helpers._wait_for(condition=_check_condition('FINISHED', 'async_test_3_2_delayed'))
 
 
+class ParkableTask(object):
+    """
+    Bound celery task as passed to a function decorated with ensure single, which can be parked
+    """
+    class Parked(Exception):
+        """
+        Raised by retry, like celery's Retry exception
+        """
+        pass
+
+    def __init__(self, task_id):
+        self.request = type('Request', (object,), {'id': task_id, 'is_eager': False})()
+        self.countdowns = []
+
+    def retry(self, countdown, max_retries):
+        """
+        Registers the countdown and returns the exception to raise
+        """
+        _ = max_retries
+        self.countdowns.append(countdown)
+        return ParkableTask.Parked()
+
+
 class Callback(object):
     """
     Class containing call back functions used by the _ensure_single decorator
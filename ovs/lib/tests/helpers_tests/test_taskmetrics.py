@@ -0,0 +1,85 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Task metrics test module
+"""
+import unittest
+from ovs.dal.tests.helpers import DalHelper
+from ovs.lib.helpers.taskmetrics import TaskMetrics
+
+
+class TaskMetricsTest(unittest.TestCase):
+    """
+    This test class will validate the instrumentation of the celery tasks
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        TaskMetrics._histograms = {}
+        TaskMetrics._last_push = None
+        TaskMetrics._config = {}
+        TaskMetrics._config_loaded = None
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        DalHelper.teardown()
+
+    def test_instrument(self):
+        """
+        Validates whether the run time, ensure single wait and outcome of a task are recorded
+        """
+        def _task(fail):
+            TaskMetrics.add_wait(0.0001)
+            if fail is True:
+                raise RuntimeError('Failure')
+            TaskMetrics.set_outcome('discarded')
+            return 'output'
+
+        task = TaskMetrics.instrument(task_name='test.task', f=_task)
+        self.assertEqual(task(fail=False), 'output')
+        with self.assertRaises(RuntimeError):
+            task(fail=True)
+
+        metrics = TaskMetrics.get_metrics()
+        self.assertIn('test.task', metrics)
+        phases = metrics['test.task']
+        self.assertEqual(phases['run']['count'], 2)
+        self.assertEqual(phases['ensure_single_wait']['count'], 2)
+        self.assertEqual(phases['outcome_discarded']['count'], 1)
+        self.assertEqual(phases['outcome_failure']['count'], 1)
+        self.assertNotIn('queue', phases)
+        self.assertNotIn('ensure_single_queued', phases)
+
+    def test_parked_wait(self):
+        """
+        Validates whether the wait of a redelivered (parked) task since it was first queued does not reduce its run time
+        """
+        def _task():
+            TaskMetrics.add_wait(0.0001, queued=3600)
+            return 'output'
+
+        task = TaskMetrics.instrument(task_name='test.parked', f=_task)
+        self.assertEqual(task(), 'output')
+        phases = TaskMetrics.get_metrics()['test.parked']
+        self.assertEqual(phases['ensure_single_queued']['count'], 1)
+        self.assertEqual(phases['ensure_single_wait']['count'], 1)
+        self.assertEqual(phases['run']['count'], 1)
+        self.assertLess(phases['ensure_single_wait']['max'], 3600)
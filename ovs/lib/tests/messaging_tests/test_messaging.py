@@ -0,0 +1,96 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Test module for the MessageController
+"""
+import time
+import unittest
+from ovs.dal.tests.helpers import DalHelper
+from ovs.lib.messaging import MessageController
+
+
+class MessagingTest(unittest.TestCase):
+    """
+    This test class will validate the messaging functionality
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup(fake_sleep=True)
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        DalHelper.teardown(fake_sleep=True)
+
+    def test_fire_and_get(self):
+        """
+        Validates whether subscribers only receive the messages newer than their cursor and of their subscribed types
+        """
+        self.assertEqual(MessageController.last_message_id(), 0)
+        MessageController.subscribe(1, [MessageController.Type.TASK_COMPLETE])
+        MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_1')
+        MessageController.fire(MessageController.Type.EVENT, {'type': 'event_1'})
+        MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_2')
+        self.assertEqual(MessageController.last_message_id(), 3)
+
+        messages, last_message_id = MessageController.get_messages(1, 0)
+        self.assertEqual(last_message_id, 3)
+        self.assertEqual([message['body'] for message in messages], ['task_1', 'task_2'])
+        messages, last_message_id = MessageController.get_messages(1, 1)
+        self.assertEqual(last_message_id, 3)
+        self.assertEqual([message['body'] for message in messages], ['task_2'])
+        messages, last_message_id = MessageController.get_messages(1, 3)
+        self.assertEqual(last_message_id, 3)
+        self.assertEqual(messages, [])
+
+    def test_message_gap(self):
+        """
+        Validates whether a message id which is handed out but not yet stored holds back the cursor,
+        until later messages are older than the gap timeout
+        """
+        MessageController.subscribe(1, [MessageController.Type.TASK_COMPLETE])
+        MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_1')
+        MessageController._cache.incr(MessageController.SEQUENCE_KEY)  # Id 2 is handed out, but never stored
+        MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_3')
+
+        messages, last_message_id = MessageController.get_messages(1, 0)
+        self.assertEqual(last_message_id, 1)
+        self.assertEqual([message['body'] for message in messages], ['task_1'])
+
+        time.sleep(MessageController.GAP_TIMEOUT + 1)
+        messages, last_message_id = MessageController.get_messages(1, last_message_id)
+        self.assertEqual(last_message_id, 3)
+        self.assertEqual([message['body'] for message in messages], ['task_3'])
+
+    def test_sequence_reset(self):
+        """
+        Validates whether a subscriber which is ahead of the sequence (e.g. after the sequence got evicted) receives the new messages
+        """
+        MessageController.subscribe(1, [MessageController.Type.TASK_COMPLETE])
+        for index in xrange(3):
+            MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_{0}'.format(index))
+        _, last_message_id = MessageController.get_messages(1, 0)
+        self.assertEqual(last_message_id, 3)
+
+        MessageController._cache.delete(MessageController.SEQUENCE_KEY)
+        MessageController.fire(MessageController.Type.TASK_COMPLETE, 'task_after_reset')
+        messages, last_message_id = MessageController.get_messages(1, last_message_id)
+        self.assertEqual(last_message_id, 1)
+        self.assertEqual([message['body'] for message in messages], ['task_after_reset'])
@@ -33,7 +33,9 @@ from ovs.dal.tests.helpers import DalHelper
 from ovs_extensions.log.logger import Logger
 from ovs.extensions.generic.sshclient import SSHClient
 from ovs.extensions.services.servicefactory import ServiceFactory
+from ovs.extensions.storage.persistentfactory import PersistentFactory
 from ovs.extensions.storageserver.storagedriver import DTLConfig, DTLConfigMode, DTLMode
+from ovs.lib.helpers.vdisk.dtl import DTLPlanner
 from ovs.lib.vdisk import VDiskController
 
 
@@ -642,3 +644,57 @@ class DTLCheckup(unittest.TestCase):
                                            validations=[{'key': 'host', 'value': [sr.storagedrivers[0].storage_ip for sr in storagerouters.values()]},
                                                         {'key': 'port', 'value': 3},
                                                         {'key': 'mode', 'value': DTLMode.SYNCHRONOUS}])
+
+    def test_dtl_balancing(self):
+        """
+        Validates whether the DTL targets of the vDisks of a vPool are balanced over the possible StorageRouters
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'vdisks': [(1, 1, 1, 1), (2, 1, 1, 1), (3, 1, 1, 1), (4, 1, 1, 1)],  # (<id>, <storagedriver_id>, <vpool_id>, <mds_service_id>)
+             'mds_services': [(1, 1)],  # (<id>, <storagedriver_id>)
+             'storagerouters': [1, 2, 3],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2), (3, 1, 3)]}  # (<id>, <vpool_id>, <sr_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagerouters = structure['storagerouters']
+
+        self._roll_out_dtl_services(vpool=vpool, storagerouters=storagerouters)
+        VDiskController.dtl_checkup(vpool_guid=vpool.guid)
+        hosts = dict((vdisk.guid, vdisk.storagedriver_client.get_dtl_config(vdisk.volume_id).host) for vdisk in structure['vdisks'].values())
+        self.assertListEqual(list1=sorted(hosts.values()),
+                             list2=sorted([storagerouters[2].storagedrivers[0].storage_ip] * 2 + [storagerouters[3].storagedrivers[0].storage_ip] * 2))
+
+        # A subsequent checkup does not move any DTL
+        VDiskController.dtl_checkup(vpool_guid=vpool.guid)
+        for vdisk in structure['vdisks'].values():
+            self.assertEqual(first=vdisk.storagedriver_client.get_dtl_config(vdisk.volume_id).host, second=hosts[vdisk.guid])
+
+    def test_dtl_balancing_subset(self):
+        """
+        Validates whether a checkup of only some vDisks balances against the DTL targets of the other vDisks of the vPool
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'vdisks': [(1, 1, 1, 1), (2, 1, 1, 1), (3, 1, 1, 1), (4, 1, 1, 1), (5, 1, 1, 1), (6, 1, 1, 1)],  # (<id>, <storagedriver_id>, <vpool_id>, <mds_service_id>)
+             'mds_services': [(1, 1)],  # (<id>, <storagedriver_id>)
+             'storagerouters': [1, 2, 3],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2), (3, 1, 3)]}  # (<id>, <vpool_id>, <sr_id>)
+        )
+        vpool = structure['vpools'][1]
+        vdisks = structure['vdisks']
+        storagerouters = structure['storagerouters']
+        storage_ips = [storagerouters[2].storagedrivers[0].storage_ip, storagerouters[3].storagedrivers[0].storage_ip]
+
+        self._roll_out_dtl_services(vpool=vpool, storagerouters=storagerouters)
+        for vdisk_ids, expected in [([1, 2, 3], [1, 2]),
+                                    ([4], [2, 2]),
+                                    ([5, 6], [3, 3])]:
+            VDiskController.dtl_checkup(vdisk_guids=[vdisks[vdisk_id].guid for vdisk_id in vdisk_ids])
+            hosts = [vdisk.storagedriver_client.get_dtl_config(vdisk.volume_id) for vdisk in vdisks.values()]
+            amounts = sorted(len([host for host in hosts if host is not None and host.host == storage_ip]) for storage_ip in storage_ips)
+            self.assertListEqual(list1=amounts, list2=expected)
+        # The registered targets match the configured ones
+        storagerouter_guids = dict((storagerouter.storagedrivers[0].storage_ip, storagerouter.guid) for storagerouter in storagerouters.values())
+        self.assertDictEqual(d1=PersistentFactory.get_client().get(DTLPlanner.TARGETS_KEY.format(vpool.guid)),
+                             d2=dict((vdisk.guid, storagerouter_guids[vdisk.storagedriver_client.get_dtl_config(vdisk.volume_id).host]) for vdisk in vdisks.values()))
@@ -23,7 +23,7 @@ from ovs.dal.hybrids.vdisk import VDisk
 from ovs.dal.lists.vdisklist import VDiskList
 from ovs.dal.tests.helpers import DalHelper
 from ovs.extensions.storageserver.storagedriver import MDSMetaDataBackendConfig, MDSNodeConfig
-from ovs.extensions.storageserver.tests.mockups import StorageRouterClient
+from ovs.extensions.storageserver.tests.mockups import ObjectRegistryClient, StorageRouterClient
 from ovs.lib.vdisk import VDiskController
 
 
@@ -195,6 +195,121 @@ class VDiskEventsTest(unittest.TestCase):
         with self.assertRaises(ObjectNotFoundException):
             vdisk.save()
 
+    def test_sync_stale_confirmation(self):
+        """
+        Validates whether the sync only removes vDisks which are absent in both the initial and the confirming snapshot
+        of the object registry
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedriver = structure['storagedrivers'][1]
+        vdisk_1 = VDisk(VDiskController.create_new('one', 1024 ** 3, storagedriver.guid))
+        vdisk_2 = VDisk(VDiskController.create_new('two', 1024 ** 3, storagedriver.guid))
+        vdisk_3 = VDisk()
+        vdisk_3.volume_id = 'foo'
+        vdisk_3.name = 'foo'
+        vdisk_3.devicename = 'foo.raw'
+        vdisk_3.size = 1024 ** 3
+        vdisk_3.vpool = vpool
+        vdisk_3.save()
+
+        # The registration of vDisk 2 is missed by the initial snapshot (e.g. while its registration is being updated)
+        snapshots = []
+        hidden = set([str(vdisk_2.volume_id)])
+        original_registrations = ObjectRegistryClient.__dict__['get_all_registrations']
+
+        def _get_all_registrations(self):
+            registrations = [entry for entry in original_registrations(self) if str(entry.object_id()) not in hidden]
+            hidden.clear()
+            snapshots.append([str(entry.object_id()) for entry in registrations])
+            return registrations
+
+        ObjectRegistryClient.get_all_registrations = _get_all_registrations
+        try:
+            VDiskController.sync_with_reality()
+        finally:
+            ObjectRegistryClient.get_all_registrations = original_registrations
+        self.assertEqual(len(snapshots), 2)
+        self.assertNotIn(str(vdisk_2.volume_id), snapshots[0])
+        self.assertIn(str(vdisk_2.volume_id), snapshots[1])
+        self.assertEqual(sorted(vdisk.guid for vdisk in VDiskList.get_vdisks()), sorted([vdisk_1.guid, vdisk_2.guid]))
+        with self.assertRaises(ObjectNotFoundException):
+            vdisk_3.save()
+
+        # Without stale vDisks, the registry is only read once
+        del snapshots[:]
+        ObjectRegistryClient.get_all_registrations = _get_all_registrations
+        try:
+            VDiskController.sync_with_reality()
+        finally:
+            ObjectRegistryClient.get_all_registrations = original_registrations
+        self.assertEqual(len(snapshots), 1)
+        self.assertEqual(len(VDiskList.get_vdisks()), 2)
+
+    def test_sync_late_parent(self):
+        """
+        Validates whether the sync links a clone to its parent when the parent is added to the model concurrently
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedriver = structure['storagedrivers'][1]
+        parent = VDisk(VDiskController.create_new('parent', 1024 ** 3, storagedriver.guid))
+        clone = VDisk(VDiskController.clone(parent.guid, 'clone')['vdisk_guid'])
+        parent_volume_id = str(parent.volume_id)
+        clone_volume_id = str(clone.volume_id)
+        for vdisk in [clone, parent]:
+            for mds_service in vdisk.mds_services:
+                mds_service.delete()
+            vdisk.delete()
+        self.assertEqual(len(VDiskList.get_vdisks()), 0)
+
+        # The parent is registered after the registry snapshot of the sync was taken and is added to the model by its
+        # volumedriver event right after the sync resolved the parents of the vDisks to add
+        added = []
+        original_registrations = ObjectRegistryClient.__dict__['get_all_registrations']
+        original_get_in_volume_ids = VDiskList.__dict__['get_in_volume_ids']
+
+        def _get_all_registrations(self):
+            return [entry for entry in original_registrations(self) if str(entry.object_id()) != parent_volume_id]
+
+        def _get_in_volume_ids(volume_ids):
+            if parent_volume_id in volume_ids and len(added) == 0:
+                added.append(None)
+            elif len(added) == 1:
+                new_vdisk = VDisk()
+                new_vdisk.volume_id = parent_volume_id
+                new_vdisk.name = 'parent'
+                new_vdisk.devicename = '/parent.raw'
+                new_vdisk.size = 1024 ** 3
+                new_vdisk.vpool = vpool
+                new_vdisk.save()
+                added.append(new_vdisk)
+            return original_get_in_volume_ids.__func__(volume_ids)
+
+        ObjectRegistryClient.get_all_registrations = _get_all_registrations
+        VDiskList.get_in_volume_ids = staticmethod(_get_in_volume_ids)
+        try:
+            VDiskController.sync_with_reality()
+        finally:
+            ObjectRegistryClient.get_all_registrations = original_registrations
+            VDiskList.get_in_volume_ids = original_get_in_volume_ids
+        self.assertEqual(len(added), 2)
+        new_parent = added[1]
+        new_clone = VDiskList.get_vdisk_by_volume_id(clone_volume_id)
+        self.assertIsNotNone(new_clone)
+        self.assertEqual(new_clone.parent_vdisk_guid, new_parent.guid)
+        self.assertEqual(sorted(vdisk.guid for vdisk in VDiskList.get_vdisks()), sorted([new_parent.guid, new_clone.guid]))
+
     def test_folder_renames(self):
         """
         Validates whether folder renames are correctly processed
@@ -233,3 +348,33 @@ class VDiskEventsTest(unittest.TestCase):
         self.assertEqual(vdisk1.devicename, '/foo/one.raw')
         self.assertEqual(vdisk2.devicename, '/foo/two.raw')
         self.assertEqual(vdisk3.devicename, '/three.raw')
+
+    def test_resize_multiple(self):
+        """
+        Validates whether a batch of coalesced resize events is processed, skipping the volumes which no longer exist
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedriver = structure['storagedrivers'][1]
+        mds_service = structure['mds_services'][1]
+        # noinspection PyArgumentList
+        backend_config = MDSMetaDataBackendConfig([MDSNodeConfig(address=str(mds_service.service.storagerouter.ip),
+                                                                 port=mds_service.service.ports[0])])
+        size = 1024 ** 3
+        srclient = StorageRouterClient(vpool.guid, None)
+        events = []
+        for index in xrange(3):
+            devicename = '/test_{0}.raw'.format(index)
+            volume_id = srclient.create_volume(devicename, backend_config, size, storagedriver.storagedriver_id)
+            events.append({'volume_id': volume_id,
+                           'volume_size': size,
+                           'volume_path': devicename,
+                           'storagedriver_id': storagedriver.storagedriver_id})
+        srclient.unlink('/test_2.raw')
+        VDiskController.resize_multiple_from_voldrv(events=events)
+        self.assertEqual(sorted(vdisk.devicename for vdisk in vpool.vdisks), ['/test_0.raw', '/test_1.raw'])
@@ -0,0 +1,187 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Test module for waiting on volumedriver events
+"""
+import time
+import unittest
+from threading import Lock, Thread
+from ovs.dal.hybrids.vdisk import VDisk
+from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.rabbitmq import eventwaiter
+from ovs.extensions.rabbitmq.eventwaiter import VolumeEventWaiter
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+from ovs.lib.vdisk import VDiskController
+
+
+class VolumeEventWaiterTest(unittest.TestCase):
+    """
+    This test class will validate the volume event waiter and the snapshot sync waiting which builds on it
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        self._reset_waiter()
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        self._reset_waiter()
+        DalHelper.teardown()
+
+    @staticmethod
+    def _reset_waiter():
+        VolumeEventWaiter._sequence = None
+        VolumeEventWaiter._last_read = 0
+
+    @staticmethod
+    def _notify_later(delay, volume_id):
+        def _notify():
+            time.sleep(delay)
+            VolumeEventWaiter.notify(volume_id)
+        thread = Thread(target=_notify)
+        thread.start()
+        return thread
+
+    def test_notify(self):
+        """
+        Validates whether notifying increments the sequence of the volume and leaves other volumes untouched
+        """
+        self.assertEqual(VolumeEventWaiter.get_sequence('volume_1'), 0)
+        VolumeEventWaiter.notify('volume_1')
+        VolumeEventWaiter.notify('volume_1')
+        VolumeEventWaiter.notify('volume_2')
+        self.assertEqual(VolumeEventWaiter.get_sequence('volume_1'), 2)
+        self.assertEqual(VolumeEventWaiter.get_sequence('volume_2'), 1)
+        self.assertEqual(VolumeEventWaiter.get_sequence('volume_3'), 0)
+        self.assertEqual(VolatileFactory.get_client().get(VolumeEventWaiter.SEQUENCE_KEY), 3)
+
+    def test_wait(self):
+        """
+        Validates whether a waiter returns immediately for missed events and is woken up by a new event of its volume
+        """
+        since = VolumeEventWaiter.get_sequence('volume_1')
+        VolumeEventWaiter.notify('volume_1')
+        start = time.time()
+        self.assertTrue(VolumeEventWaiter.wait(volume_id='volume_1', since=since, timeout=10))
+        self.assertLess(time.time() - start, 1)
+
+        since = VolumeEventWaiter.get_sequence('volume_1')
+        thread = self._notify_later(0.5, 'volume_1')
+        start = time.time()
+        self.assertTrue(VolumeEventWaiter.wait(volume_id='volume_1', since=since, timeout=10))
+        self.assertLess(time.time() - start, 5)
+        thread.join()
+
+    def test_timeout(self):
+        """
+        Validates whether a waiter times out when only other volumes have events
+        """
+        since = VolumeEventWaiter.get_sequence('volume_1')
+        thread = self._notify_later(0.2, 'volume_2')
+        start = time.time()
+        self.assertFalse(VolumeEventWaiter.wait(volume_id='volume_1', since=since, timeout=1))
+        self.assertGreaterEqual(time.time() - start, 1)
+        thread.join()
+        self.assertFalse(VolumeEventWaiter.wait(volume_id='volume_1', since=since, timeout=0))
+
+    def test_shared_poll(self):
+        """
+        Validates whether concurrent waiters share the reads of the global sequence and only read the sequence of their
+        volume when the global sequence changed
+        """
+        reads = {'global': 0, 'volume': 0}
+        reads_lock = Lock()
+        volatile = VolatileFactory.get_client()
+
+        class _CountingClient(object):
+            def __getattr__(self, item):
+                return getattr(volatile, item)
+
+            @staticmethod
+            def get(key, default=None):
+                with reads_lock:
+                    reads['global' if key == VolumeEventWaiter.SEQUENCE_KEY else 'volume'] += 1
+                return volatile.get(key, default)
+
+        class _CountingFactory(object):
+            @staticmethod
+            def get_client():
+                return _CountingClient()
+
+        amount = 10
+        duration = 1
+        results = []
+        original_factory = eventwaiter.VolatileFactory
+        eventwaiter.VolatileFactory = _CountingFactory
+        try:
+            threads = [Thread(target=lambda: results.append(VolumeEventWaiter.wait(volume_id='volume_1', since=0, timeout=duration)))
+                       for _ in xrange(amount)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.time() - start
+        finally:
+            eventwaiter.VolatileFactory = original_factory
+        self.assertEqual(results, [False] * amount)
+        # One read of the global sequence per poll interval for all waiters together (plus some slack)
+        self.assertLessEqual(reads['global'], elapsed / VolumeEventWaiter.POLL_INTERVAL + amount)
+        # Without any events, every waiter reads the sequence of its volume only once
+        self.assertEqual(reads['volume'], amount)
+
+    def test_snapshot_sync_schedule(self):
+        """
+        Validates whether the sync state of a snapshot is verified with a linearly increasing interval without events
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        storagedriver = structure['storagedrivers'][1]
+        vdisk = VDisk(VDiskController.create_new(volume_name='vdisk_1', volume_size=1024 ** 3, storagedriver_guid=storagedriver.guid))
+
+        checks = []
+        timeouts = []
+
+        def _is_synced(vdisk_guid, snapshot_id):
+            _ = vdisk_guid, snapshot_id
+            checks.append(True)
+            return len(checks) == 6
+
+        def _wait(volume_id, since, timeout):
+            _ = volume_id, since
+            timeouts.append(timeout)
+            return False
+
+        original_synced = VDiskController.__dict__['is_volume_synced_up_to_snapshot']
+        original_wait = VolumeEventWaiter.__dict__['wait']
+        VDiskController.is_volume_synced_up_to_snapshot = staticmethod(_is_synced)
+        VolumeEventWaiter.wait = staticmethod(_wait)
+        try:
+            VDiskController._wait_for_snapshot_to_be_synced_to_backend(vdisk_guid=vdisk.guid, snapshot_id='snapshot_1')
+        finally:
+            VDiskController.is_volume_synced_up_to_snapshot = original_synced
+            VolumeEventWaiter.wait = original_wait
+        self.assertEqual(len(checks), 6)
+        self.assertEqual(timeouts, [1, 2, 3, 4, 5])
@@ -18,13 +18,16 @@
 Test module for vDisk functionality
 """
 import time
+import pickle
 import unittest
+from threading import Event, Lock
 from ovs.dal.hybrids.vdisk import VDisk
+from ovs.dal.lists.vdisklist import VDiskList
 from ovs.dal.tests.helpers import DalHelper
 from ovs.extensions.generic.sshclient import SSHClient
 from ovs_extensions.generic.threadhelpers import Waiter
 from ovs.extensions.services.servicefactory import ServiceFactory
-from ovs.extensions.storageserver.tests.mockups import LockedClient
+from ovs.extensions.storageserver.tests.mockups import LockedClient, StorageRouterClient
 from ovs.lib.helpers.generic.scrubber import ScrubShared
 from ovs.lib.generic import GenericController
 from ovs.lib.vdisk import VDiskController
@@ -109,6 +112,70 @@ class VDiskTest(unittest.TestCase):
                              second=snapshot[key],
                              msg='Value for key "{0}" does not match reality. Expected: {1}  -  Reality: {2}'.format(key, value, snapshot[key]))
 
+    def test_create_snapshots(self):
+        """
+        Test the bulk create snapshots functionality
+            - Create vDisks on 2 StorageDrivers
+            - Create a snapshot for all of them, including an unknown vDisk, and validate the results and timings
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1, 2],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1), (2, 2)]}  # (<id>, <storagedriver_id>)
+        )
+        storagedrivers = structure['storagedrivers']
+        vdisks = [VDisk(VDiskController.create_new(volume_name='vdisk_{0}'.format(index), volume_size=1024 ** 3, storagedriver_guid=storagedrivers[index % 2 + 1].guid))
+                  for index in xrange(6)]
+        outcome = VDiskController.create_snapshots(vdisk_guids=[vdisk.guid for vdisk in vdisks] + ['unknown'],
+                                                   metadata={'timestamp': int(time.time()),
+                                                             'label': 'label1',
+                                                             'is_consistent': True,
+                                                             'is_automatic': True,
+                                                             'is_sticky': False},
+                                                   timings=True)
+        self.assertFalse(expr=outcome['results']['unknown'][0], msg='Snapshot creation for an unknown vDisk should fail')
+        for vdisk in vdisks:
+            self.assertTrue(expr=outcome['results'][vdisk.guid][0], msg='Snapshot creation failed for vDisk {0}'.format(vdisk.name))
+            self.assertEqual(first=vdisk.snapshot_ids, second=[outcome['results'][vdisk.guid][1]])
+        self.assertEqual(first=sorted(item['amount'] for item in outcome['timings']['storagedrivers'].itervalues()), second=[3, 3])
+
+        # The amount of concurrent snapshot creations is limited in total and per StorageDriver
+        owners = dict((str(vdisk.volume_id), vdisk.storagedriver_id) for vdisk in vdisks)
+        lock = Lock()
+        running = {}
+        maximum = {'total': 0}
+        original_create = StorageRouterClient.__dict__['create_snapshot']
+
+        def _create_snapshot(client, volume_id, snapshot_id, metadata, req_timeout_secs=None):
+            with lock:
+                owner = owners[volume_id]
+                running[owner] = running.get(owner, 0) + 1
+                maximum['total'] = max(maximum['total'], sum(running.values()))
+                maximum[owner] = max(maximum.get(owner, 0), running[owner])
+            Event().wait(0.1)
+            with lock:
+                running[owner] -= 1
+            original_create(client, volume_id, snapshot_id, metadata, req_timeout_secs)
+
+        original_limits = VDiskController._SNAPSHOT_CONCURRENCY, VDiskController._SNAPSHOT_CONCURRENCY_TOTAL
+        VDiskController._SNAPSHOT_CONCURRENCY = 2
+        VDiskController._SNAPSHOT_CONCURRENCY_TOTAL = 3
+        StorageRouterClient.create_snapshot = _create_snapshot
+        try:
+            results = VDiskController.create_snapshots(vdisk_guids=[vdisk.guid for vdisk in vdisks],
+                                                       metadata={'timestamp': int(time.time()),
+                                                                 'label': 'label2',
+                                                                 'is_consistent': True,
+                                                                 'is_automatic': True,
+                                                                 'is_sticky': False})
+        finally:
+            StorageRouterClient.create_snapshot = original_create
+            VDiskController._SNAPSHOT_CONCURRENCY, VDiskController._SNAPSHOT_CONCURRENCY_TOTAL = original_limits
+        self.assertTrue(expr=all(result[0] is True for result in results.itervalues()))
+        self.assertEqual(first=maximum['total'], second=3)
+        self.assertEqual(first=max(maximum[vdisk.storagedriver_id] for vdisk in vdisks), second=2)
+
     def test_delete_snapshot(self):
         """
         Test the delete snapshot functionality
@@ -224,6 +291,81 @@ class VDiskTest(unittest.TestCase):
         self.assertEquals(results[vdisk.guid]['error'], 'One or more snapshots could not be removed')
         self.assertRegexpMatches(results[vdisk.guid]['results'][snapshot_id][1], '^Snapshot (.*?) has [0-9]+ volume(.?) cloned from it, cannot remove$')
 
+    def test_snapshot_catalog(self):
+        """
+        Validates whether the snapshot catalog is maintained incrementally and only retrieves the snapshot information
+        of new snapshots from the volumedriver
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        storagedriver = structure['storagedrivers'][1]
+
+        vdisk = VDisk(VDiskController.create_new(volume_name='vdisk_1', volume_size=1024 ** 4, storagedriver_guid=storagedriver.guid))
+        snapshots = []
+        for i in xrange(3):
+            snapshots.append(VDiskController.create_snapshot(vdisk_guid=vdisk.guid, metadata={'label': 'label{0}'.format(i),
+                                                                                              'timestamp': int(time.time()) + i,
+                                                                                              'is_automatic': True,
+                                                                                              'is_consistent': True}))
+        self.assertEqual(first=sorted(snapshot['guid'] for snapshot in vdisk.snapshots), second=sorted(snapshots))
+
+        info_calls = []
+        info_snapshot = vdisk.storagedriver_client.info_snapshot
+
+        def _info_snapshot(*args, **kwargs):
+            info_calls.append(args[1])
+            return info_snapshot(*args, **kwargs)
+        vdisk.storagedriver_client.info_snapshot = _info_snapshot
+
+        # Known snapshots which are in the backend are not retrieved again
+        vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+        self.assertEqual(first=len(vdisk.snapshots), second=3)
+        self.assertEqual(first=info_calls, second=[])
+
+        # A new snapshot is retrieved once, until it is in the backend
+        snapshots.append(VDiskController.create_snapshot(vdisk_guid=vdisk.guid, metadata={'label': 'label3',
+                                                                                          'timestamp': int(time.time()) + 3,
+                                                                                          'is_automatic': False,
+                                                                                          'is_consistent': True}))
+        vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+        self.assertEqual(first=vdisk.snapshot_ids[-1], second=snapshots[3])
+        self.assertEqual(first=vdisk.snapshots[-1]['is_automatic'], second=False)
+        vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+        self.assertEqual(first=len(vdisk.snapshots), second=4)
+        self.assertEqual(first=info_calls, second=[snapshots[3]])
+
+        # Deleting snapshots updates the catalog
+        VDiskController.delete_snapshots({vdisk.guid: [snapshots[0]]})
+        self.assertEqual(first=sorted(vdisk.snapshot_ids), second=sorted(snapshots[1:]))
+
+        # Snapshots created or removed outside of the framework are picked up on the next read, only retrieving the new ones
+        del info_calls[:]
+        vdisk.storagedriver_client.delete_snapshot(volume_id=vdisk.volume_id, snapshot_id=snapshots[1])
+        vdisk.storagedriver_client.create_snapshot(volume_id=vdisk.volume_id, snapshot_id='external',
+                                                   metadata=pickle.dumps({'label': 'external', 'timestamp': int(time.time()) + 4, 'is_consistent': True}))
+        vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+        self.assertEqual(first=sorted(vdisk.snapshot_ids), second=sorted(snapshots[2:] + ['external']))
+        self.assertEqual(first=len(vdisk.snapshots), second=3)
+        self.assertEqual(first=info_calls, second=['external'])
+
+        # The reconciliation refreshes the information of all snapshots
+        vdisk.storagedriver_client.delete_snapshot(volume_id=vdisk.volume_id, snapshot_id='external')
+        del info_calls[:]
+        VDiskController.reconcile_snapshot_catalogs()
+        self.assertEqual(first=sorted(info_calls), second=sorted(snapshots[2:]))
+        self.assertEqual(first=sorted(vdisk.snapshot_ids), second=sorted(snapshots[2:]))
+        self.assertEqual(first=len(vdisk.snapshots), second=2)
+
+        # Clones are looked up through the parentsnapshot index
+        clone = VDisk(VDiskController.clone(vdisk_guid=vdisk.guid, name='clone', snapshot_id=snapshots[2])['vdisk_guid'])
+        clones = VDiskList.get_by_parentsnapshot(snapshots[2])
+        self.assertEqual(first=[vd.guid for vd in clones], second=[clone.guid])
+        self.assertEqual(first=clones.from_index, second='full')
+
     def test_delete_snapshot_scrubbing_lock(self):
         """
         Tests the skip-if-scrubbed logic
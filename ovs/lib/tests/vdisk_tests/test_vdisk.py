@@ -18,8 +18,10 @@
 Test module for vDisk functionality
 """
 import time
+import hashlib
 import unittest
 from collections import OrderedDict
+from threading import Event, Lock, Thread
 from ovs.dal.exceptions import ObjectNotFoundException
 from ovs.dal.hybrids.j_mdsservice import MDSService
 from ovs.dal.hybrids.j_vdiskdomain import VDiskDomain
@@ -30,7 +32,10 @@ from ovs.dal.lists.vdisklist import VDiskList
 from ovs.dal.tests.helpers import DalHelper
 from ovs.extensions.generic.sshclient import SSHClient
 from ovs.extensions.services.servicefactory import ServiceFactory
+from ovs.extensions.storage.persistentfactory import PersistentFactory
+from ovs.extensions.storageserver.storagedriver import VolumeRestartInProgressException
 from ovs.extensions.storageserver.tests.mockups import StorageRouterClient
+from ovs.lib.helpers.vdisk.migration import MigrationScheduler, MigrationSlots
 from ovs.lib.vdisk import VDiskController
 
 
@@ -448,6 +453,42 @@ class VDiskTest(unittest.TestCase):
         self.assertTrue(expr=len(vdisk2.child_vdisks) == 0, msg='Expected to find 0 children after clone failure')
         StorageRouterClient.synced = True
 
+    def test_clone_multiple(self):
+        """
+        Test the bulk clone functionality
+            - Clone a vDisk using a name pattern and verify the clones are spread over the StorageRouters
+            - Attempt to clone again using an already used name
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1, 2],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1), (2, 2)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedrivers = structure['storagedrivers']
+        storagerouters = structure['storagerouters']
+        self._roll_out_dtl_services(vpool=vpool, storagerouters=storagerouters)
+
+        vdisk1 = VDisk(VDiskController.create_new(volume_name='vdisk_1', volume_size=1024 ** 3, storagedriver_guid=storagedrivers[1].guid))
+        results = VDiskController.clone_multiple(vdisk_guid=vdisk1.guid, name_pattern='desktop-{0:02d}', amount=5)
+        self.assertListEqual(list1=sorted(results), list2=['desktop-01', 'desktop-02', 'desktop-03', 'desktop-04', 'desktop-05'])
+        self.assertEqual(first=len(VDiskList.get_vdisks()), second=6)
+        self.assertEqual(first=len(vdisk1.snapshot_ids), second=1)
+        clones = VDiskList.get_by_parentsnapshot(vdisk1.snapshot_ids[0])
+        self.assertEqual(first=sorted(clone.guid for clone in clones), second=sorted(result['vdisk_guid'] for result in results.itervalues()))
+        owners = {}
+        for clone in clones:
+            self.assertEqual(first=clone.parent_vdisk_guid, second=vdisk1.guid)
+            owners[clone.storagedriver_id] = owners.get(clone.storagedriver_id, 0) + 1
+        # Including the original vDisk, both StorageDrivers own 3 volumes
+        self.assertDictEqual(d1=owners, d2={storagedrivers[1].storagedriver_id: 2,
+                                            storagedrivers[2].storagedriver_id: 3})
+
+        with self.assertRaises(RuntimeError):
+            VDiskController.clone_multiple(vdisk_guid=vdisk1.guid, names=['desktop-06', 'desktop-01'])
+        self.assertEqual(first=len(VDiskList.get_vdisks()), second=6)
+
     def test_list_volumes(self):
         """
         Test the list volumes functionality
@@ -569,6 +610,178 @@ class VDiskTest(unittest.TestCase):
         VDiskController.migrate_from_voldrv(volume_id=vdisk.volume_id, new_owner_id=storagedrivers[2].storagedriver_id)
         self.assertEqual(vdisk.storagedriver_id, storagedrivers[2].storagedriver_id)
 
+    def test_move_multiple(self):
+        """
+        Test moving multiple vDisks and evacuating a StorageRouter
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1, 2, 3],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2), (3, 1, 3)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1), (2, 2), (3, 3)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedrivers = structure['storagedrivers']
+        storagerouters = structure['storagerouters']
+        self._roll_out_dtl_services(vpool=vpool, storagerouters=storagerouters)
+
+        vdisks = [VDisk(VDiskController.create_new(volume_name='vdisk_{0}'.format(i), volume_size=1024 ** 3, storagedriver_guid=storagedrivers[1].guid)) for i in xrange(4)]
+        results = VDiskController.move_multiple(vdisk_guids=[vdisk.guid for vdisk in vdisks], target_storagerouter_guid=storagerouters[2].guid)
+        self.assertEqual(first=sorted(results), second=sorted(vdisk.guid for vdisk in vdisks))
+        self.assertTrue(expr=all(result['success'] is True for result in results.itervalues()))
+        for vdisk in vdisks:
+            vdisk.invalidate_dynamics('storagedriver_id')
+            self.assertEqual(first=vdisk.storagedriver_id, second=storagedrivers[2].storagedriver_id)
+
+        # Evacuating StorageRouter 2 spreads its vDisks over the other StorageRouters
+        VDiskController.evacuate(storagerouter_guid=storagerouters[2].guid)
+        owners = {}
+        for vdisk in vdisks:
+            vdisk.invalidate_dynamics('storagedriver_id')
+            owners[vdisk.storagedriver_id] = owners.get(vdisk.storagedriver_id, 0) + 1
+        self.assertDictEqual(d1=owners,
+                             d2={storagedrivers[1].storagedriver_id: 2,
+                                 storagedrivers[3].storagedriver_id: 2})
+
+    def test_move_multiple_throttling(self):
+        """
+        Test whether concurrently running vDisk migrations share the cluster-wide limits and retry restarting volumes
+            - Run 2 migration tasks at once and verify the limits are never exceeded by both tasks together
+            - Retry a migration of a restarting volume and give up after MAX_ATTEMPTS
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1, 2, 3],
+             'storagedrivers': [(1, 1, 1), (2, 1, 2), (3, 1, 3)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1), (2, 2), (3, 3)]}  # (<id>, <storagedriver_id>)
+        )
+        vpool = structure['vpools'][1]
+        storagedrivers = structure['storagedrivers']
+        storagerouters = structure['storagerouters']
+        self._roll_out_dtl_services(vpool=vpool, storagerouters=storagerouters)
+        vdisks = [VDisk(VDiskController.create_new(volume_name='vdisk_{0}'.format(i), volume_size=1024 ** 3, storagedriver_guid=storagedrivers[1].guid)) for i in xrange(6)]
+
+        lock = Lock()
+        running = {}
+        maximum = {'total': 0}
+        failures = {}
+        original_migrate = StorageRouterClient.__dict__['migrate']
+
+        def _migrate(client, volume_id, node_id, force_restart, req_timeout_secs=None):
+            with lock:
+                if failures.get(volume_id, 0) > 0:
+                    failures[volume_id] -= 1
+                    raise VolumeRestartInProgressException('Volume {0} is restarting'.format(volume_id))
+                running[node_id] = running.get(node_id, 0) + 1
+                maximum['total'] = max(maximum['total'], sum(running.values()))
+                maximum[node_id] = max(maximum.get(node_id, 0), running[node_id])
+            Event().wait(0.2)
+            with lock:
+                running[node_id] -= 1
+            original_migrate(client, volume_id, node_id, force_restart, req_timeout_secs)
+
+        original_limits = MigrationScheduler.MAX_PARALLEL, MigrationScheduler.MAX_PER_SOURCE, MigrationScheduler.MAX_PER_TARGET, MigrationScheduler.MAX_ATTEMPTS, MigrationScheduler.BACKOFF
+        MigrationScheduler.MAX_PARALLEL = 3
+        MigrationScheduler.MAX_PER_SOURCE = 3
+        MigrationScheduler.MAX_PER_TARGET = 2
+        MigrationScheduler.MAX_ATTEMPTS = 3
+        MigrationScheduler.BACKOFF = 0
+        StorageRouterClient.migrate = _migrate
+        try:
+            # Each task alone could run 2 migrations, both tasks together may only run 3
+            results = {}
+            schedulers = [MigrationScheduler(moves=dict((vdisk.guid, storagerouters[2].guid) for vdisk in vdisks[:3])),
+                          MigrationScheduler(moves=dict((vdisk.guid, storagerouters[3].guid) for vdisk in vdisks[3:]))]
+            threads = [Thread(target=lambda _scheduler: results.update(_scheduler.execute()), args=(scheduler,)) for scheduler in schedulers]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(first=sorted(results), second=sorted(vdisk.guid for vdisk in vdisks))
+            self.assertTrue(expr=all(result['success'] is True and result['attempts'] == 1 for result in results.itervalues()))
+            self.assertLessEqual(a=maximum['total'], b=3)
+            self.assertLessEqual(a=maximum[storagedrivers[2].storagedriver_id], b=2)
+            self.assertLessEqual(a=maximum[storagedrivers[3].storagedriver_id], b=2)
+            self.assertFalse(expr=PersistentFactory.get_client().exists(MigrationScheduler.SLOTS_KEY))
+
+            # A restarting volume is retried, a volume which keeps restarting fails after MAX_ATTEMPTS
+            failures[str(vdisks[0].volume_id)] = 1
+            failures[str(vdisks[1].volume_id)] = 10
+            results = MigrationScheduler(moves={vdisks[0].guid: storagerouters[1].guid,
+                                                vdisks[1].guid: storagerouters[1].guid}).execute()
+            self.assertDictEqual(d1=results[vdisks[0].guid],
+                                 d2={'success': True, 'error': None, 'attempts': 2})
+            self.assertFalse(expr=results[vdisks[1].guid]['success'])
+            self.assertEqual(first=results[vdisks[1].guid]['attempts'], second=3)
+            self.assertIn(member='is restarting', container=results[vdisks[1].guid]['error'])
+            self.assertFalse(expr=PersistentFactory.get_client().exists(MigrationScheduler.SLOTS_KEY))
+
+            # A failing migration does not hide the results of the other vDisks
+            failures[str(vdisks[2].volume_id)] = 10
+            results = VDiskController.move_multiple(vdisk_guids=[vdisks[2].guid, vdisks[3].guid], target_storagerouter_guid=storagerouters[1].guid)
+            self.assertFalse(expr=results[vdisks[2].guid]['success'])
+            self.assertTrue(expr=results[vdisks[3].guid]['success'])
+
+            # Slots of which the lease expired are left out and purged
+            slots = MigrationSlots(key=MigrationScheduler.SLOTS_KEY)
+            PersistentFactory.get_client().set(MigrationScheduler.SLOTS_KEY, [{'id': 'dead', 'source': 'sr_1', 'target': 'sr_2', 'lease_until': time.time() - 1}])
+            self.assertEqual(first=slots.get(), second=[])
+            self.assertTrue(expr=slots.acquire({'id': 'alive', 'source': 'sr_1', 'target': 'sr_2'}, lambda _slots: len(_slots) == 0))
+            self.assertFalse(expr=slots.acquire({'id': 'other', 'source': 'sr_1', 'target': 'sr_2'}, lambda _slots: len(_slots) == 0))
+            self.assertEqual(first=[slot['id'] for slot in PersistentFactory.get_client().get(MigrationScheduler.SLOTS_KEY)], second=['alive'])
+            slots.release('alive')
+            self.assertFalse(expr=PersistentFactory.get_client().exists(MigrationScheduler.SLOTS_KEY))
+        finally:
+            StorageRouterClient.migrate = original_migrate
+            MigrationScheduler.MAX_PARALLEL, MigrationScheduler.MAX_PER_SOURCE, MigrationScheduler.MAX_PER_TARGET, MigrationScheduler.MAX_ATTEMPTS, MigrationScheduler.BACKOFF = original_limits
+        for vdisk in vdisks[:1] + vdisks[2:]:
+            vdisk.invalidate_dynamics('storagedriver_id')
+        self.assertEqual(first=vdisks[0].storagedriver_id, second=storagedrivers[1].storagedriver_id)
+        self.assertEqual(first=vdisks[2].storagedriver_id, second=storagedrivers[2].storagedriver_id)
+        self.assertEqual(first=vdisks[5].storagedriver_id, second=storagedrivers[3].storagedriver_id)
+
+    def test_parentsnapshot_index(self):
+        """
+        Test whether only vDisks with a parent snapshot are indexed on their parent snapshot
+            - vDisks without parent snapshot do not create an index entry for None, but can still be looked up
+            - Changing and clearing the parent snapshot updates the index
+        """
+        structure = DalHelper.build_dal_structure(
+            {'vpools': [1],
+             'storagerouters': [1],
+             'storagedrivers': [(1, 1, 1)],  # (<id>, <vpool_id>, <storagerouter_id>)
+             'mds_services': [(1, 1)]}  # (<id>, <storagedriver_id>)
+        )
+        storagedriver = structure['storagedrivers'][1]
+        persistent = PersistentFactory.get_client()
+        index_key = 'ovs_index_vdisk|parentsnapshot|{0}'
+        vdisks = [VDisk(VDiskController.create_new(volume_name='vdisk_{0}'.format(i), volume_size=1024 ** 3, storagedriver_guid=storagedriver.guid)) for i in xrange(3)]
+        self.assertFalse(expr=persistent.exists(index_key.format(hashlib.sha1(str(None)).hexdigest())))
+
+        vdisks[1].parentsnapshot = 'snapshot_1'
+        vdisks[1].save()
+        vdisks[2].parentsnapshot = 'snapshot_1'
+        vdisks[2].save()
+        self.assertEqual(first=len(persistent.get(index_key.format(hashlib.sha1('snapshot_1').hexdigest()))), second=2)
+        self.assertEqual(first=sorted(vdisk.guid for vdisk in VDiskList.get_by_parentsnapshot('snapshot_1')),
+                         second=sorted([vdisks[1].guid, vdisks[2].guid]))
+        self.assertEqual(first=[vdisk.guid for vdisk in VDiskList.get_by_parentsnapshot(None)], second=[vdisks[0].guid])
+        self.assertEqual(first=sorted(vdisk.guid for vdisk in VDiskList.get_by_parentsnapshots(['snapshot_1', None])),
+                         second=sorted(vdisk.guid for vdisk in vdisks))
+
+        vdisks[1].parentsnapshot = 'snapshot_2'
+        vdisks[1].save()
+        vdisks[2].parentsnapshot = None
+        vdisks[2].save()
+        self.assertFalse(expr=persistent.exists(index_key.format(hashlib.sha1('snapshot_1').hexdigest())))
+        self.assertFalse(expr=persistent.exists(index_key.format(hashlib.sha1(str(None)).hexdigest())))
+        self.assertEqual(first=[vdisk.guid for vdisk in VDiskList.get_by_parentsnapshot('snapshot_2')], second=[vdisks[1].guid])
+        self.assertEqual(first=sorted(vdisk.guid for vdisk in VDiskList.get_by_parentsnapshot(None)),
+                         second=sorted([vdisks[0].guid, vdisks[2].guid]))
+
+        VDiskController.delete(vdisk_guid=vdisks[1].guid)
+        self.assertFalse(expr=persistent.exists(index_key.format(hashlib.sha1('snapshot_2').hexdigest())))
+
     def test_event_resize_from_volumedriver(self):
         """
         Test resize from volumedriver event
@@ -25,6 +25,8 @@ import time
 import uuid
 import pickle
 import random
+from threading import BoundedSemaphore, Lock
+from ovs.dal.datalist import DataList
 from ovs.dal.exceptions import ObjectNotFoundException
 from ovs.dal.hybrids.domain import Domain
 from ovs.dal.hybrids.j_vdiskdomain import VDiskDomain
@@ -39,15 +41,19 @@ from ovs.dal.lists.vpoollist import VPoolList
 from ovs_extensions.constants.framework import REMOTE_CONFIG_BACKEND_INI
 from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
-from ovs.extensions.generic.sshclient import SSHClient, UnableToConnectException
+from ovs.extensions.generic.sshclient import SSHClient
 from ovs_extensions.generic.toolbox import ExtensionsToolbox
-from ovs_extensions.generic.volatilemutex import NoLockAvailableException
 from ovs.extensions.generic.volatilemutex import volatile_mutex
+from ovs.extensions.rabbitmq.eventwaiter import VolumeEventWaiter
 from ovs.extensions.services.servicefactory import ServiceFactory
-from ovs.extensions.storageserver.storagedriver import DTLConfig, DTLConfigMode, is_connection_failure, LOG_LEVEL_MAPPING, MDSMetaDataBackendConfig, \
+from ovs.extensions.storageserver.storagedriver import DTLConfig, is_connection_failure, LOG_LEVEL_MAPPING, MDSMetaDataBackendConfig, \
                                                        MDSNodeConfig, StorageDriverClient, StorageDriverConfiguration, VolumeRestartInProgressException
 from ovs.lib.helpers.decorators import log, ovs_task
 from ovs.lib.helpers.toolbox import Schedule, Toolbox
+from ovs.lib.helpers.vdisk.bulkclone import BulkCloner
+from ovs.lib.helpers.vdisk.dtl import DTLPlanner
+from ovs.lib.helpers.vdisk.migration import MigrationScheduler
+from ovs.lib.helpers.vdisk.snapshots import SnapshotCatalog
 from ovs.lib.mdsservice import MDSServiceController
 from volumedriver.storagerouter import storagerouterclient, VolumeDriverEvents_pb2
 
@@ -57,6 +63,11 @@ class VDiskController(object):
     Contains all BLL regarding VDisks
     """
     _VOLDRV_EVENT_KEY = 'voldrv_event_vdisk_{0}'
+    _SNAPSHOT_CONCURRENCY = 4  # Amount of concurrent snapshot creations per StorageDriver
+    _SNAPSHOT_CONCURRENCY_TOTAL = 16  # Amount of concurrent snapshot creations over all StorageDrivers
+    _SYNC_BATCH_SIZE = 25  # Amount of vDisks added to the model while holding their event mutexes
+    _SNAPSHOT_SYNC_TIMEOUT = 300  # Maximum amount of seconds to wait for a snapshot to be synced to the backend
+    _RECONCILE_CONCURRENCY = 8  # Amount of snapshot catalogs reconciled concurrently
     _logger = Logger('lib')
     _log_level = LOG_LEVEL_MAPPING[_logger.getEffectiveLevel()]
 
@@ -97,6 +108,7 @@ class VDiskController(object):
             mds_service.delete()
         for domain_junction in vdisk.domains_dtl:
             domain_junction.delete()
+        SnapshotCatalog.clear(vdisk_guid=vdisk.guid)
         vdisk.delete()
 
     @staticmethod
@@ -134,6 +146,16 @@ class VDiskController(object):
             if vdisk.objectregistry_client.find(str(vdisk.volume_id)) is None:
                 VDiskController._logger.warning('Volume {0} does not exist anymore.'.format(vdisk.volume_id))
                 VDiskController.clean_vdisk_from_model(vdisk)
+        VDiskController._set_vdisk_cache_quota(vdisk)
+
+    @staticmethod
+    def _set_vdisk_cache_quota(vdisk):
+        """
+        Applies the fragment and block cache quota of a vDisk on its ALBA namespace
+        :param vdisk: The vDisk to apply the cache quota for
+        :type vdisk: ovs.dal.hybrids.vdisk.VDisk
+        :return: None
+        """
         command = None
         try:
             # This should belong in the Alba plugin together with Alba Proxies...
@@ -282,6 +304,43 @@ class VDiskController(object):
         :return: None
         """
         storagedriver = StorageDriverList.get_by_storagedriver_id(storagedriver_id)
+        VDiskController._resize_from_voldrv(volume_id=volume_id, volume_size=volume_size, volume_path=volume_path, storagedriver=storagedriver)
+
+    @staticmethod
+    @ovs_task(name='ovs.vdisk.resize_multiple_from_voldrv')
+    @log('VOLUMEDRIVER_TASK')
+    def resize_multiple_from_voldrv(events):
+        """
+        Resize multiple vDisks
+        Triggered by batches of coalesced volumedriver messages on the queue
+        :param events: Arguments of the individual resize_from_voldrv events (volume_id, volume_size, volume_path, storagedriver_id)
+        :type events: list
+        :raises RuntimeError: When processing any of the events failed
+        :return: None
+        :rtype: NoneType
+        """
+        storagedrivers = {}
+        failures = []
+        for event in events:
+            storagedriver_id = event['storagedriver_id']
+            if storagedriver_id not in storagedrivers:
+                storagedrivers[storagedriver_id] = StorageDriverList.get_by_storagedriver_id(storagedriver_id)
+            try:
+                VDiskController._resize_from_voldrv(volume_id=event['volume_id'],
+                                                    volume_size=event['volume_size'],
+                                                    volume_path=event['volume_path'],
+                                                    storagedriver=storagedrivers[storagedriver_id])
+            except Exception:
+                VDiskController._logger.exception('Processing the resize of volume {0} failed'.format(event['volume_id']))
+                failures.append(event['volume_id'])
+        if len(failures) > 0:
+            raise RuntimeError('Processing the resize failed for volumes: {0}'.format(', '.join(failures)))
+
+    @staticmethod
+    def _resize_from_voldrv(volume_id, volume_size, volume_path, storagedriver):
+        """
+        Processes the resize (or creation) of a single volume
+        """
         vpool = storagedriver.vpool
         with volatile_mutex(VDiskController._VOLDRV_EVENT_KEY.format(volume_id), wait=30):
             if vpool.objectregistry_client.find(str(volume_id)) is None:
@@ -320,14 +379,37 @@ class VDiskController(object):
         :type new_owner_id: unicode
         :return: None
         """
-        sd = StorageDriverList.get_by_storagedriver_id(storagedriver_id=new_owner_id)
-        vdisk = VDiskList.get_vdisk_by_volume_id(volume_id=volume_id)
-        if vdisk is not None:
-            VDiskController._logger.info('Migration - Guid {0} - ID {1} - Detected migration for vDisk {2}'.format(vdisk.guid, vdisk.volume_id, vdisk.name))
-            if sd is not None:
-                VDiskController._logger.info('Migration - Guid {0} - ID {1} - Storage Router {2} is the new owner of vDisk {3}'.format(vdisk.guid, vdisk.volume_id, sd.storagerouter.name, vdisk.name))
+        VDiskController.migrate_multiple_from_voldrv(events=[{'volume_id': volume_id, 'new_owner_id': new_owner_id}])
+
+    @staticmethod
+    @ovs_task(name='ovs.vdisk.migrate_multiple_from_voldrv')
+    @log('VOLUMEDRIVER_TASK')
+    def migrate_multiple_from_voldrv(events):
+        """
+        Triggered when volumes have changed owner (Clean migrations or stolen due to other reasons)
+        Triggered by batches of coalesced volumedriver messages. The MDS checkup is executed once for the whole batch
+        :param events: Arguments of the individual migrate_from_voldrv events (volume_id, new_owner_id)
+        :type events: list
+        :return: None
+        :rtype: NoneType
+        """
+        storagedrivers = {}
+        vdisks = []
+        for event in events:
+            new_owner_id = event['new_owner_id']
+            if new_owner_id not in storagedrivers:
+                storagedrivers[new_owner_id] = StorageDriverList.get_by_storagedriver_id(storagedriver_id=new_owner_id)
+            sd = storagedrivers[new_owner_id]
+            vdisk = VDiskList.get_vdisk_by_volume_id(volume_id=event['volume_id'])
+            if vdisk is not None:
+                VDiskController._logger.info('Migration - Guid {0} - ID {1} - Detected migration for vDisk {2}'.format(vdisk.guid, vdisk.volume_id, vdisk.name))
+                if sd is not None:
+                    VDiskController._logger.info('Migration - Guid {0} - ID {1} - Storage Router {2} is the new owner of vDisk {3}'.format(vdisk.guid, vdisk.volume_id, sd.storagerouter.name, vdisk.name))
+                vdisks.append(vdisk)
+        if len(vdisks) > 0:
             MDSServiceController.mds_checkup()
-            VDiskController.dtl_checkup(vdisk_guid=vdisk.guid)
+            for vdisk in vdisks:
+                VDiskController.dtl_checkup(vdisk_guid=vdisk.guid)
 
     @staticmethod
     @ovs_task(name='ovs.vdisk.rename_from_voldrv')
@@ -484,6 +566,46 @@ class VDiskController(object):
                 'name': new_vdisk.name,
                 'backingdevice': devicename}
 
+    @staticmethod
+    @ovs_task(name='ovs.vdisk.clone_multiple')
+    def clone_multiple(vdisk_guid, names=None, name_pattern=None, amount=None, start=1, snapshot_id=None, storagerouter_guids=None, pagecache_ratio=None, cache_quota=None):
+        """
+        Create multiple clones of a vTemplate or of a snapshot of a vDisk
+        The clones are spread over the StorageRouters and created concurrently, see BulkCloner
+        :param vdisk_guid: Guid of the vTemplate or vDisk to clone
+        :type vdisk_guid: str
+        :param names: Names of the clones (can be paths or user friendly names)
+        :type names: list
+        :param name_pattern: Pattern to generate the names of the clones, formatted with the sequence number (e.g. 'desktop-{0:03d}')
+        :type name_pattern: str
+        :param amount: Amount of clones to create using the name pattern
+        :type amount: int
+        :param start: First sequence number to use in the name pattern
+        :type start: int
+        :param snapshot_id: ID of the snapshot to clone from. A new snapshot is created when omitted. Ignored for vTemplates
+        :type snapshot_id: str
+        :param storagerouter_guids: Guids of the StorageRouters to spread the clones over. All StorageRouters of the vPool when omitted
+        :type storagerouter_guids: list
+        :param pagecache_ratio: Ratio of the page cache size (compared to a 100% cache)
+        :type pagecache_ratio: float
+        :param cache_quota: Max disk space the new clones can consume for caching (both fragment as block) purposes (in Bytes)
+        :type cache_quota: dict
+        :return: Per name the information about the clone (vdisk_guid, name, backingdevice) or the error
+        :rtype: dict
+        """
+        if (names is None) == (name_pattern is None):
+            raise ValueError('Either names or a name pattern should be provided')
+        if name_pattern is not None:
+            if not isinstance(amount, int) or amount <= 0:
+                raise ValueError('A positive amount should be provided together with a name pattern')
+            names = [name_pattern.format(number) for number in xrange(start, start + amount)]
+        return BulkCloner(vdisk_guid=vdisk_guid,
+                          names=names,
+                          snapshot_id=snapshot_id,
+                          storagerouter_guids=storagerouter_guids,
+                          pagecache_ratio=pagecache_ratio,
+                          cache_quota=cache_quota).execute()
+
     @staticmethod
     def list_snapshot_ids(vdisk):
         """
@@ -497,7 +619,7 @@ class VDiskController(object):
         try:
             return vdisk.storagedriver_client.list_snapshots(volume_id, req_timeout_secs=10)
         except VolumeRestartInProgressException:
-            time.sleep(0.5)
+            VolumeEventWaiter.wait(volume_id=volume_id, since=VolumeEventWaiter.get_sequence(volume_id), timeout=0.5)
             return vdisk.storagedriver_client.list_snapshots(volume_id, req_timeout_secs=10)
 
     @staticmethod
@@ -522,29 +644,52 @@ class VDiskController(object):
 
     @staticmethod
     @ovs_task(name='ovs.vdisk.create_snapshots')
-    def create_snapshots(vdisk_guids, metadata):
+    def create_snapshots(vdisk_guids, metadata, timings=False):
         """
         Create vDisk snapshots
+        The vDisks are grouped per owning StorageDriver. At most _SNAPSHOT_CONCURRENCY_TOTAL vDisks are handled at the
+        same time, of which at most _SNAPSHOT_CONCURRENCY per StorageDriver
         :param vdisk_guids: Guid of the vDisks
         :type vdisk_guids: list
         :param metadata: Dictionary of metadata
         :type metadata: dict
-        :return: ID of the newly created snapshot
+        :param timings: Return timing information together with the results
+        :type timings: bool
+        :return: Per vDisk guid [True, <snapshot id>] or [False, <error>].
+                 With timings: {'results': <results>, 'timings': {'total': <s>, 'grouping': <s>, 'storagedrivers': {<storagedriver id>: {'amount': <n>, 'duration': <s>}}}}
         :rtype: dict
         """
         if not isinstance(metadata, dict):
             raise ValueError('Expected metadata as dict, got {0} instead'.format(type(metadata)))
+        start = time.time()
         consistent = metadata.get('is_consistent', False)
+        snapshot_metadata = metadata
         metadata = pickle.dumps(metadata)
         results = {}
+        groups = {}
+        seen = set()
         for guid in vdisk_guids:
+            if guid in seen:
+                continue
+            seen.add(guid)
             try:
                 vdisk = VDisk(guid)
+            except Exception as ex:
+                results[guid] = [False, ex.message]
+                continue
+            try:
+                storagedriver_id = vdisk.storagedriver_id
+            except Exception:
+                storagedriver_id = None  # The creation will report the actual error
+            groups.setdefault(storagedriver_id, []).append(vdisk)
+        grouping_duration = time.time() - start
+
+        def _create(vdisk):
+            try:
                 snapshot_ids = VDiskController.list_snapshot_ids(vdisk=vdisk)
                 if len(snapshot_ids) > 0:
                     if VDiskController.is_volume_synced_up_to_snapshot(vdisk_guid=vdisk.guid, snapshot_id=snapshot_ids[-1]) is False:  # Most recent last in list
-                        results[guid] = [False, 'Previously created snapshot did not make it to the backend yet']
-                        continue
+                        return [False, 'Previously created snapshot did not make it to the backend yet']
 
                 VDiskController._logger.info('Create {0} snapshot for vDisk {1}'.format('consistent' if consistent is True else 'inconsistent', vdisk.name))
                 snapshot_id = str(uuid.uuid4())
@@ -552,10 +697,42 @@ class VDiskController(object):
                                                            snapshot_id=str(snapshot_id),
                                                            metadata=metadata,
                                                            req_timeout_secs=10)
-                vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
-                results[guid] = [True, snapshot_id]
+                return [True, snapshot_id]
             except Exception as ex:
-                results[guid] = [False, ex.message]
+                return [False, ex.message]
+
+        def _process(work_item):
+            storagedriver_id, vdisk = work_item
+            with semaphores[storagedriver_id]:
+                result = _create(vdisk)
+            with lock:
+                results[vdisk.guid] = result
+                storagedriver_timings[storagedriver_id]['duration'] = time.time() - processing_start
+
+        lock = Lock()
+        semaphores = dict((storagedriver_id, BoundedSemaphore(VDiskController._SNAPSHOT_CONCURRENCY)) for storagedriver_id in groups)
+        storagedriver_timings = dict((storagedriver_id, {'amount': len(vdisks), 'duration': 0.0}) for storagedriver_id, vdisks in groups.iteritems())
+        # The StorageDrivers are interleaved, so the threads are spread over them instead of waiting for the same StorageDriver
+        work_items = []
+        for index in xrange(max([len(vdisks) for vdisks in groups.itervalues()] or [0])):
+            work_items.extend((storagedriver_id, vdisks[index]) for storagedriver_id, vdisks in groups.iteritems() if index < len(vdisks))
+        processing_start = time.time()
+        Toolbox.run_parallel(_process, work_items, VDiskController._SNAPSHOT_CONCURRENCY_TOTAL, name='create_snapshots', logger=VDiskController._logger)
+
+        for vdisks in groups.itervalues():
+            for vdisk in vdisks:
+                if results[vdisk.guid][0] is True:
+                    try:
+                        SnapshotCatalog.add(vdisk=vdisk, snapshots=[(results[vdisk.guid][1], snapshot_metadata)])
+                    except Exception:
+                        VDiskController._logger.exception('Registering the new snapshot of vDisk {0} failed, rebuilding its snapshot catalog'.format(vdisk.name))
+                        SnapshotCatalog.clear(vdisk_guid=vdisk.guid)
+                    vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+        if timings is True:
+            return {'results': results,
+                    'timings': {'total': time.time() - start,
+                                'grouping': grouping_duration,
+                                'storagedrivers': storagedriver_timings}}
         return results
 
     @staticmethod
@@ -611,12 +788,25 @@ class VDiskController(object):
                     results[vdisk_guid] = [False, msg]
                 continue
 
+            # The snapshots and clones are looked up once for all snapshots to delete, using the snapshot catalog and the parentsnapshot index
+            current_snapshot_ids = None
+            reconciled = False
+            clones = {}
+            deleted = []
             for snapshot_id in set(snapshot_ids):
                 try:
-                    if snapshot_id not in VDiskController.list_snapshot_ids(vdisk=vdisk):
+                    if current_snapshot_ids is None:
+                        current_snapshot_ids = set(SnapshotCatalog.get_ids(vdisk=vdisk))
+                        for clone in VDiskList.get_by_parentsnapshots(list(set(snapshot_ids))):
+                            clones[clone.parentsnapshot] = clones.get(clone.parentsnapshot, 0) + 1
+                    if snapshot_id not in current_snapshot_ids and reconciled is False:
+                        # The catalog might be outdated
+                        current_snapshot_ids = set(SnapshotCatalog.reconcile(vdisk=vdisk)['ids'])
+                        reconciled = True
+                    if snapshot_id not in current_snapshot_ids:
                         raise RuntimeError('Snapshot {0} does not belong to vDisk {1}'.format(snapshot_id, vdisk.name))
 
-                    nr_clones = len(VDiskList.get_by_parentsnapshot(snapshot_id))
+                    nr_clones = clones.get(snapshot_id, 0)
                     if nr_clones > 0:
                         raise RuntimeError('Snapshot {0} has {1} volume{2} cloned from it, cannot remove'.format(snapshot_id, nr_clones, '' if nr_clones == 1 else 's'))
 
@@ -624,6 +814,7 @@ class VDiskController(object):
                     vdisk.storagedriver_client.delete_snapshot(volume_id=str(vdisk.volume_id),
                                                                snapshot_id=str(snapshot_id),
                                                                req_timeout_secs=10)
+                    deleted.append(snapshot_id)
                     result = [True, snapshot_id]
                 except Exception as ex:
                     result = [False, ex.message]
@@ -631,11 +822,35 @@ class VDiskController(object):
                 if result[0] is False:
                     results[vdisk_guid].update({'success': False,
                                                 'error': 'One or more snapshots could not be removed'})
+            if len(deleted) > 0:
+                try:
+                    SnapshotCatalog.remove(vdisk=vdisk, snapshot_ids=deleted)
+                except Exception:
+                    VDiskController._logger.exception('Unregistering the deleted snapshots of vDisk {0} failed, rebuilding its snapshot catalog'.format(vdisk.name))
+                    SnapshotCatalog.clear(vdisk_guid=vdisk.guid)
             vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
             if backwards_compat is True:
                 results[vdisk_guid] = results[vdisk_guid]['results'][snapshot_ids[0]]
         return results
 
+    @staticmethod
+    @ovs_task(name='ovs.vdisk.reconcile_snapshot_catalogs', schedule=Schedule(minute='45', hour='*/4'), ensure_single_info={'mode': 'DEFAULT'})
+    def reconcile_snapshot_catalogs():
+        """
+        Reconciles the snapshot catalogs of all vDisks with the volumedriver, refreshing the information of all snapshots
+        The vDisks are reconciled concurrently, as every snapshot requires a call to the volumedriver
+        :return: None
+        :rtype: NoneType
+        """
+        def _reconcile(_vdisk):
+            try:
+                SnapshotCatalog.reconcile(vdisk=_vdisk, refresh=True)
+                _vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
+            except Exception:
+                VDiskController._logger.exception('Reconciling the snapshot catalog of vDisk {0} failed'.format(_vdisk.name))
+
+        Toolbox.run_parallel(_reconcile, list(VDiskList.get_vdisks()), VDiskController._RECONCILE_CONCURRENCY, name='reconcile_snapshot_catalog', logger=VDiskController._logger)
+
     @staticmethod
     @ovs_task(name='ovs.vdisk.set_as_template')
     def set_as_template(vdisk_guid):
@@ -660,48 +875,9 @@ class VDiskController(object):
         except Exception:
             VDiskController._logger.exception('Failed to convert vDisk {0} into vTemplate'.format(vdisk.name))
             raise Exception('Converting vDisk {0} into vTemplate failed'.format(vdisk.name))
+        SnapshotCatalog.reconcile(vdisk=vdisk)  # Only the most recent snapshot is kept
         vdisk.invalidate_dynamics(['is_vtemplate', 'info', 'snapshots', 'snapshot_ids'])
 
-    @staticmethod
-    def _move(vdisk_guid, target_storagerouter_guid, force=False):
-        try:
-            vdisk = VDisk(vdisk_guid)
-        except ObjectNotFoundException:
-            VDiskController._logger.exception('No valid VDisk has been found with provided guid {0}'.format(vdisk_guid))
-            raise
-        storagedriver = None
-        try:
-            storagerouter = StorageRouter(target_storagerouter_guid)
-        except ObjectNotFoundException:
-            VDiskController._logger.exception('No valid StorageRouter has been found with provided guid {0}'.format(target_storagerouter_guid))
-            raise
-
-        for sd in storagerouter.storagedrivers:
-            if sd.vpool == vdisk.vpool:
-                storagedriver = sd
-                break
-
-        if storagedriver is None:
-            err_msg = 'Failed to find the matching StorageDriver for vdisk {0}'.format(vdisk.name)
-            VDiskController._logger.exception(err_msg)
-            raise RuntimeError(err_msg)
-
-        VDiskController._logger.info('Starting moval of VDisk {0}'.format(vdisk_guid))
-        try:
-            vdisk.storagedriver_client.migrate(object_id=str(vdisk.volume_id),
-                                               node_id=str(storagedriver.storagedriver_id),
-                                               force_restart=force)
-        except Exception:
-            err_msg = 'Failed to move vDisk {0}'.format(vdisk.name)
-            VDiskController._logger.exception(err_msg)
-            raise Exception(err_msg)
-
-        try:
-            MDSServiceController.ensure_safety(vdisk_guid=vdisk.guid)
-            VDiskController.dtl_checkup.delay(vdisk_guid=vdisk.guid)
-        except Exception:
-            VDiskController._logger.exception('Executing post-migrate actions failed for vDisk {0}'.format(vdisk.name))
-
     @staticmethod
     @ovs_task(name='ovs.vdisk.move')
     def move(vdisk_guid, target_storagerouter_guid, force=False):
@@ -715,23 +891,44 @@ class VDiskController(object):
         :type force: bool
         :return: None
         """
-        VDiskController._move(vdisk_guid, target_storagerouter_guid, force=force)
+        result = MigrationScheduler(moves={vdisk_guid: target_storagerouter_guid}, force=force).execute()[vdisk_guid]
+        if result['success'] is False:
+            raise Exception('Failed to move vDisk {0}: {1}'.format(VDisk(vdisk_guid).name, result['error']))
 
     @staticmethod
     @ovs_task(name='ovs.vdisk.move_multiple')
     def move_multiple(vdisk_guids, target_storagerouter_guid, force=False):
         """
         Move list of vDisks to the specified StorageRouter
+        The vDisks are moved concurrently, see MigrationScheduler
         :param vdisk_guids: Guids of the vDisk to move
         :type vdisk_guids: list
         :param target_storagerouter_guid: Guid of the StorageRouter to move the vDisk to
         :type target_storagerouter_guid: str
         :param force: Indicates whether to force the migration or not (forcing can lead to data loss)
         :type force: bool
-        :return: None
+        :return: The result per vDisk guid (success, error and amount of attempts)
+        :rtype: dict
         """
-        for vdisk_guid in vdisk_guids:
-            VDiskController._move(vdisk_guid, target_storagerouter_guid, force)
+        return MigrationScheduler(moves=dict((vdisk_guid, target_storagerouter_guid) for vdisk_guid in vdisk_guids), force=force).execute()
+
+    @staticmethod
+    @ovs_task(name='ovs.vdisk.evacuate', ensure_single_info={'mode': 'DEFAULT'})
+    def evacuate(storagerouter_guid, vpool_guid=None, force=False):
+        """
+        Move all vDisks away from a StorageRouter, spreading them over the other StorageRouters of their vPool
+        :param storagerouter_guid: Guid of the StorageRouter to evacuate
+        :type storagerouter_guid: str
+        :param vpool_guid: Only evacuate the vDisks of this vPool
+        :type vpool_guid: str
+        :param force: Indicates whether to force the migration or not (forcing can lead to data loss)
+        :type force: bool
+        :return: The result per vDisk guid (success, error and amount of attempts)
+        :rtype: dict
+        """
+        moves = MigrationScheduler.plan_evacuation(storagerouter_guid=storagerouter_guid, vpool_guid=vpool_guid)
+        VDiskController._logger.info('Evacuating {0} vDisks from StorageRouter {1}'.format(len(moves), storagerouter_guid))
+        return MigrationScheduler(moves=moves, force=force).execute()
 
     @staticmethod
     @ovs_task(name='ovs.vdisk.rollback')
@@ -752,7 +949,8 @@ class VDiskController(object):
         snapshotguid = snapshots[0]['guid']
         VDiskController._wait_for_snapshot_to_be_synced_to_backend(vdisk_guid=vdisk.guid, snapshot_id=snapshotguid)
         vdisk.storagedriver_client.rollback_volume(str(vdisk.volume_id), str(snapshotguid))
-        vdisk.invalidate_dynamics(['snapshots'])
+        SnapshotCatalog.reconcile(vdisk=vdisk)  # The snapshots created after the rollback snapshot are removed
+        vdisk.invalidate_dynamics(['snapshots', 'snapshot_ids'])
         return True
 
     @staticmethod
@@ -1162,14 +1360,15 @@ class VDiskController(object):
 
     @staticmethod
     @ovs_task(name='ovs.vdisk.dtl_checkup', schedule=Schedule(minute='15', hour='0,4,8,12,16,20'), ensure_single_info={'mode': 'DEDUPED'})
-    def dtl_checkup(vpool_guid=None, vdisk_guid=None, storagerouters_to_exclude=None):
+    def dtl_checkup(vpool_guid=None, vdisk_guid=None, storagerouters_to_exclude=None, vdisk_guids=None):
         """
-        Check DTL for all volumes, for all volumes of a vPool or for 1 specific volume
+        Check DTL for all volumes, for all volumes of a vPool, for a list of volumes or for 1 specific volume
         DTL allocation rules:
             - First priority to StorageRouters located in the vDisk's StorageRouter's Recovery Domain
             - Second priority to StorageRouters located in the vDisk's StorageRouter's Regular Domain
             - If Domains configured, but no StorageRouters are found matching any of the Domains on the vDisk's StorageRouter, a random SR in the same vPool is chosen
             - If no Domains configured on the vDisk StorageRouter, any other StorageRouter on which the vPool has been extended is chosen
+        The DTL targets of all vDisks are planned at once, balancing the DTLs over the StorageRouters (see DTLPlanner)
 
         :param vpool_guid: vPool to check the DTL configuration of all its vDisks
         :type vpool_guid: str
@@ -1177,15 +1376,13 @@ class VDiskController(object):
         :type vdisk_guid: str
         :param storagerouters_to_exclude: Storage Router Guids to exclude from possible targets
         :type storagerouters_to_exclude: list
+        :param vdisk_guids: vDisks to check their DTL configuration
+        :type vdisk_guids: list
         :return: None
         :rtype: NoneType
         """
-        service_manager = ServiceFactory.get_manager()
-
-        if vpool_guid is not None and vdisk_guid is not None:
-            raise ValueError('vPool and vDisk are mutually exclusive')
-        if storagerouters_to_exclude is None:
-            storagerouters_to_exclude = []
+        if len([argument for argument in [vpool_guid, vdisk_guid, vdisk_guids] if argument is not None]) > 1:
+            raise ValueError('vPool, vDisk and vDisks are mutually exclusive')
 
         VDiskController._logger.info('DTL checkup started')
         vdisk = None
@@ -1203,187 +1400,13 @@ class VDiskController(object):
                 VDiskController._logger.warning('    vPool with guid {0} no longer available in model, skipping this iteration'.format(vpool_guid))
                 return
 
-        errors_found = False
-        root_client_map = {}
-        vdisks = VDiskList.get_vdisks() if vdisk is None and vpool is None else vpool.vdisks if vpool is not None else [vdisk]
-        iteration = 0
-        while len(vdisks) > 0:
-            time_to_wait_for_lock = iteration * 10 + 1
-            iteration += 1
-            if time_to_wait_for_lock > 40:
-                VDiskController._logger.error('vDisks with guids {0} could not be checked'.format(', '.join([vdisk.guid for vdisk in vdisks])))
-                errors_found = True
-                break
-            vdisks_copy = list(vdisks)
-            for vdisk in vdisks_copy:
-                try:
-                    ####################
-                    # GATHER INFORMATION
-                    VDiskController._logger.info('    Verifying vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
-                    vdisk.invalidate_dynamics(['storagedriver_client', 'storagerouter_guid'])
-                    if vdisk.storagedriver_client is None:
-                        vdisks.remove(vdisk)
-                        VDiskController._logger.warning('    VDisk {0} with guid {1} does not have a storagedriver client'.format(vdisk.name, vdisk.guid))
-                        continue
-
-                    vpool = vdisk.vpool
-                    lock_key = 'dtl_checkup_{0}'.format(vdisk.guid)
-                    vpool_config = vpool.configuration
-                    ExtensionsToolbox.verify_required_params(required_params={'dtl_mode': (str, StorageDriverClient.VPOOL_DTL_MODE_MAP.keys()),
-                                                                              'dtl_enabled': (bool, None),
-                                                                              'dtl_config_mode': (str, [StorageDriverClient.VOLDRV_DTL_MANUAL_MODE, StorageDriverClient.VOLDRV_DTL_AUTOMATIC_MODE])},
-                                                             actual_params=vpool_config)
-
-                    volume_id = str(vdisk.volume_id)
-                    dtl_vpool_enabled = vpool_config['dtl_enabled']
-                    dtl_vpool_config_mode = vpool_config['dtl_config_mode']
-                    try:
-                        current_dtl_config = vdisk.storagedriver_client.get_dtl_config(volume_id, req_timeout_secs=5)
-                        current_dtl_config_mode = vdisk.storagedriver_client.get_dtl_config_mode(volume_id, req_timeout_secs=5)
-                    except Exception:
-                        # Can occur when a volume has not been stolen yet from a dead node
-                        VDiskController._logger.exception('    VDisk {0} with guid {1}: Failed to retrieve the DTL configuration from storage driver'.format(vdisk.name, vdisk.guid))
-                        errors_found = True
-                        vdisks.remove(vdisk)
-                        continue
-
-                    ##########################
-                    # CHECKS FOR DISABLED DTLs
-                    if dtl_vpool_enabled is False and current_dtl_config is None:
-                        if current_dtl_config_mode == DTLConfigMode.AUTOMATIC:
-                            VDiskController._logger.info('    DTL is globally disabled for vPool {0} with guid {1}. Setting to MANUAL mode for vDisk {2}'.format(vpool.name, vpool.guid, vdisk.name))
-                            try:
-                                with volatile_mutex(lock_key, wait=time_to_wait_for_lock):
-                                    vdisk.storagedriver_client.set_manual_dtl_config(volume_id, None, req_timeout_secs=10)
-                                    vdisk.invalidate_dynamics(['dtl_status'])
-                            except NoLockAvailableException:
-                                VDiskController._logger.info('    Could not acquire lock while trying to set MANUAL mode for vDisk {0}, continuing with next vDisk'.format(vdisk.name))
-                                continue
-                        vdisks.remove(vdisk)
-                        continue
-                    elif current_dtl_config_mode == DTLConfigMode.MANUAL and current_dtl_config is None and vdisk.has_manual_dtl is True:
-                        VDiskController._logger.info('    DTL is disabled for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
-                        vdisks.remove(vdisk)
-                        continue
-
-                    ##########################
-                    # DETERMINE CURRENT TARGET
-                    current_target = None
-                    if current_dtl_config is not None:
-                        sds = [sd for sd in vpool.storagedrivers if sd.storage_ip == current_dtl_config.host]
-                        if len(sds) > 0:
-                            current_target = sds[0]
-
-                    ###################
-                    # VERIFY MANUAL DTL
-                    importances = VDiskController._retrieve_possible_dtl_targets(vdisk=vdisk)
-                    if vdisk.has_manual_dtl is True:
-                        VDiskController._logger.info('    VDisk {0} with guid {1} has a manual DTL configuration'.format(vdisk.name, vdisk.guid))
-                        if current_dtl_config is None:
-                            VDiskController._logger.info('    VDisk {0} with guid {1} has a manually disabled DTL'.format(vdisk.name, vdisk.guid))
-                            vdisks.remove(vdisk)
-                            continue
-
-                        correct = False
-                        for possible_storagerouters in importances[:2]:  # Only allow current_target in primary or secondary for manual DTL
-                            if len(possible_storagerouters) > 0:
-                                if current_target.storagerouter in possible_storagerouters:
-                                    correct = True
-                                break
-                        if correct is True:
-                            VDiskController._logger.info('    VDisk {0} with guid {1} manual DTL configuration is valid'.format(vdisk.name, vdisk.guid))
-                        else:
-                            VDiskController._logger.warning('OVS_WARNING: VDisk {0} with guid {1} manual DTL configuration is no longer valid ({2})'.format(vdisk.name, vdisk.guid, current_dtl_config))
-                        vdisks.remove(vdisk)
-                        continue
-
-                    ######################
-                    # DETERMINE NEW TARGET
-                    new_targets = []
-                    for index, possible_storagerouters in enumerate(importances):
-                        VDiskController._logger.info('    Checking {0} StorageRouters'.format('primary' if index == 0 else 'secondary' if index == 1 else 'all vPool related'))
-                        for storagerouter in possible_storagerouters:
-                            if storagerouter in storagerouters_to_exclude:
-                                continue
-                            if storagerouter not in root_client_map:
-                                root_client_map[storagerouter] = None
-                                try:
-                                    root_client = SSHClient(endpoint=storagerouter, username='root')
-                                    service_name = 'dtl_{0}'.format(vpool.name)
-                                    if service_manager.has_service(service_name, client=root_client) is True and service_manager.get_service_status(service_name, client=root_client) == 'active':
-                                        root_client_map[storagerouter] = root_client
-                                    else:
-                                        VDiskController._logger.warning('    DTL service on Storage Router with IP {0} is not reachable'.format(storagerouter.ip))
-                                except UnableToConnectException:
-                                    VDiskController._logger.warning('    Storage Router with IP {0} of vDisk {1} is not reachable'.format(storagerouter.ip, vdisk.name))
-                            if root_client_map[storagerouter] is not None:
-                                new_targets.append(storagerouter)
-                        if len(new_targets) > 0:  # StorageRouters with highest possible priority found
-                            break
-
-                    #################################
-                    # VERIFY RECONFIGURATION REQUIRED
-                    reconfigure_required = False
-                    if current_dtl_config is None:
-                        VDiskController._logger.info('        No DTL configuration found, but there are Storage Routers available')
-                        reconfigure_required = True
-                    elif current_dtl_config_mode == DTLConfigMode.AUTOMATIC:
-                        VDiskController._logger.info('        DTL configuration set to AUTOMATIC, switching to MANUAL')
-                        reconfigure_required = True
-                    elif dtl_vpool_config_mode == DTLConfigMode.MANUAL and dtl_vpool_enabled is True:
-                        VDiskController._logger.info('        DTL configuration set to MANUAL, but static host provided ... overruling')
-                        reconfigure_required = True
-                    elif current_target is None:
-                        VDiskController._logger.info('        DTL configuration set to MANUAL, but no StorageRouter found ... correcting')
-                        reconfigure_required = True
-                    elif current_target is not None and len(new_targets) == 0:
-                        VDiskController._logger.info('        DTL configuration set to MANUAL, but no new StorageRouter found ... setting to STANDALONE')
-                        reconfigure_required = True
-                    elif current_target.storagerouter not in new_targets:
-                        VDiskController._logger.info('        DTL configuration is not optimal, updating to new location')
-                        reconfigure_required = True
-                    elif current_dtl_config.port != current_target.ports['dtl']:
-                        VDiskController._logger.info('        Configured port does not match expected port ({0} vs {1})'.format(current_dtl_config.port, current_target.ports['dtl']))
-                        reconfigure_required = True
-
-                    if reconfigure_required is False:
-                        vdisks.remove(vdisk)
-                        continue
-
-                    #####################
-                    # RECONFIGURE THE DTL
-                    if len(new_targets) == 0:
-                        dtl_config = None
-                        VDiskController._logger.info('        DTL config that will be set -->  None')
-                    else:
-                        sds = [sd for sd in vpool.storagedrivers if sd.storagerouter == new_targets[0]]
-                        if len(sds) == 0:
-                            VDiskController._logger.error('Could not retrieve related storagedriver')
-                            errors_found = True
-                            vdisks.remove(vdisk)
-                            continue
-
-                        sd = sds[0]
-                        dtl_ip = str(sd.storage_ip)
-                        dtl_port = sd.ports['dtl']
-                        dtl_mode = vpool_config['dtl_mode'] if current_dtl_config is None else StorageDriverClient.REVERSE_DTL_MODE_MAP[current_dtl_config.mode]
-                        dtl_config = DTLConfig(dtl_ip, dtl_port, StorageDriverClient.VDISK_DTL_MODE_MAP[dtl_mode])
-                        VDiskController._logger.info('        DTL config that will be set -->  Host: {0}, Port: {1}, Mode: {2}'.format(dtl_ip, dtl_port, dtl_mode))
-                    try:
-                        with volatile_mutex(lock_key, wait=time_to_wait_for_lock):
-                            vdisk.storagedriver_client.set_manual_dtl_config(volume_id, dtl_config, req_timeout_secs=10)
-                            vdisk.has_manual_dtl = False  # As soon as DTL checkup changes DTL settings, its no longer manual
-                            vdisk.save()
-                            vdisk.invalidate_dynamics(['dtl_status'])
-                            vdisks.remove(vdisk)
-                    except NoLockAvailableException:
-                        VDiskController._logger.info('    Could not acquire lock, continuing with next vDisk')
-                except Exception:
-                    errors_found = True
-                    VDiskController._logger.exception('Something went wrong configuring the DTL for vDisk {0} with guid {1}'.format(vdisk.name, vdisk.guid))
-                    vdisks.remove(vdisk)
-
-        if errors_found is True:
+        if vdisk_guids is not None:
+            vdisks = DataList(VDisk, guids=list(vdisk_guids))
+        else:
+            vdisks = VDiskList.get_vdisks() if vdisk is None and vpool is None else vpool.vdisks if vpool is not None else [vdisk]
+        planner = DTLPlanner(vdisks=vdisks, storagerouters_to_exclude=storagerouters_to_exclude)
+        planner.apply(planner.plan())
+        if planner.errors_found is True:
             VDiskController._logger.error('DTL checkup ended with errors')
             raise Exception('DTL checkup failed with errors. Please check logging for more information')
         VDiskController._logger.info('DTL checkup ended')
@@ -1496,82 +1519,171 @@ class VDiskController(object):
     def sync_with_reality(vpool_guid=None):
         """
         Syncs vDisks in the model with reality
+        The volume IDs in the model are compared with a single snapshot of the object registry. Missing vDisks are
+        prepared without holding any lock and are added in batches, stale vDisks are only removed when they are absent
+        in both the initial and a confirming registry snapshot.
         :param vpool_guid: Optional vPool guid. All vPools if omitted
         :type vpool_guid: str or None
         :return: None
         :rtype: NoneType
         """
-        from ovs.extensions.storageserver.storagedriver import FeatureNotAvailableException
-
         if vpool_guid is None:
             vpools = VPoolList.get_vpools()
         else:
             vpools = [VPool(vpool_guid)]
         for vpool in vpools:
-            vdisks = dict((str(vdisk.volume_id), vdisk) for vdisk in vpool.vdisks)
-            parent_children_map = {}
-            for entry in vpool.objectregistry_client.get_all_registrations():
-                volume_id = entry.object_id()
-                if volume_id not in vdisks:
-                    with volatile_mutex(VDiskController._VOLDRV_EVENT_KEY.format(volume_id), wait=30):
-                        new_vdisk = VDiskList.get_vdisk_by_volume_id(volume_id)
-                        if new_vdisk is None:
-                            VDiskController._logger.info('OVS_WARNING: Adding vDisk to model. ID: {0}'.format(volume_id))
-                            new_vdisk = VDisk()
-                            new_vdisk.volume_id = volume_id
-                            new_vdisk.vpool = vpool
-                            try:
-                                fsmetadata_client = new_vdisk.fsmetadata_client
-                                devicename = fsmetadata_client.lookup(volume_id)
-                                name = VDiskController.extract_volumename(devicename)
-                            except FeatureNotAvailableException:
-                                VDiskController._logger.exception('Could not load device name from StorageDriver')
-                                devicename = '/{0}.raw'.format(volume_id)
-                                name = volume_id
-                            new_vdisk.name = name
-                            new_vdisk.size = new_vdisk.info['volume_size']
-                            new_vdisk.devicename = devicename
-                            new_vdisk.description = name
-                            new_vdisk.pagecache_ratio = 1.0
-                            new_vdisk.metadata = {'lba_size': new_vdisk.info['lba_size'],
-                                                  'cluster_multiplier': new_vdisk.info['cluster_multiplier']}
-                            VDiskController._logger.info('vDisk {0} - has parent func {1}'.format(new_vdisk.name, hasattr(entry, 'parent')))
-                            if hasattr(entry, 'parent'):   # Older releases do not have this option
-                                # Parent is a volume ID
-                                parent_id = entry.parent()  # type: str
-                                VDiskController._logger.info('vDisk {0} - has parent with vol id {1}'.format(new_vdisk.name, parent_id))
-                                if parent_id:
-                                    VDiskController._logger.info('vDisk {0} - has parent with vol id {1}'.format(new_vdisk.name, parent_id))
-                                    if parent_id not in parent_children_map:
-                                        parent_children_map[parent_id] = []
-                                    parent_children_map[parent_id].append(new_vdisk)
-                            new_vdisk.save()
-                            VDiskController.vdisk_checkup(new_vdisk)
-
-                else:
-                    del vdisks[volume_id]
-            # All child vdisks should be saved at this point
-            for parent_id, child_vdisks in parent_children_map.iteritems():
-                for child_vdisk in child_vdisks:
-                    if not child_vdisk.parent_vdisk:
-                        child_vdisk.parent_vdisk = VDiskList.get_vdisk_by_volume_id(parent_id)
-                        child_vdisk.save()
-            for volume_id, vdisk in vdisks.iteritems():
+            # The model is read before the registry, so a volume that is added meanwhile can never be considered stale
+            modeled = dict((str(vdisk.volume_id), vdisk) for vdisk in vpool.vdisks)
+            registrations = dict((str(entry.object_id()), entry) for entry in vpool.objectregistry_client.get_all_registrations())
+
+            missing = set(registrations) - set(modeled)
+            if len(missing) > 0:
+                # vDisks which are known in the model, but not (yet) linked to this vPool, are not added again
+                missing -= set(str(vdisk.volume_id) for vdisk in VDiskList.get_in_volume_ids(list(missing)))
+            if len(missing) > 0:
+                VDiskController._add_vdisks_from_registrations(vpool=vpool,
+                                                               registrations=dict((volume_id, registrations[volume_id]) for volume_id in missing))
+
+            stale = set(modeled) - set(registrations)
+            if len(stale) > 0:
+                stale -= set(str(entry.object_id()) for entry in vpool.objectregistry_client.get_all_registrations())
+            for volume_id in stale:
+                vdisk = modeled[volume_id]
                 with volatile_mutex(VDiskController._VOLDRV_EVENT_KEY.format(volume_id), wait=30):
-                    if vpool.objectregistry_client.find(str(volume_id)) is None:
-                        VDiskController._logger.info('OVS_WARNING: Removing vDisk from model. ID: {0} - Guid: {1}'.format(volume_id, vdisk.guid))
-                        VDiskController.clean_vdisk_from_model(vdisk)
+                    VDiskController._logger.info('OVS_WARNING: Removing vDisk from model. ID: {0} - Guid: {1}'.format(volume_id, vdisk.guid))
+                    VDiskController.clean_vdisk_from_model(vdisk)
+
+    @staticmethod
+    def _add_vdisks_from_registrations(vpool, registrations):
+        """
+        Adds the vDisks for the given object registrations to the model
+        Gathering the information from the StorageDriver happens without holding any lock. Afterwards the vDisks are
+        saved in batches of _SYNC_BATCH_SIZE, holding the event mutexes of the batch to guard against concurrent
+        volumedriver events. Parents are always added before their children.
+        :param vpool: vPool the registrations belong to
+        :type vpool: ovs.dal.hybrids.vpool.VPool
+        :param registrations: Object registrations to add, per volume ID
+        :type registrations: dict
+        :return: None
+        :rtype: NoneType
+        """
+        from ovs.extensions.storageserver.storagedriver import FeatureNotAvailableException
+
+        parent_ids = {}
+        for volume_id, entry in registrations.iteritems():
+            if hasattr(entry, 'parent'):  # Older releases do not have this option
+                parent_id = entry.parent()  # Parent is a volume ID
+                if parent_id:
+                    parent_ids[volume_id] = str(parent_id)
+
+        def _get_depth(_volume_id):
+            depth = 0
+            seen = set()
+            while _volume_id in parent_ids and _volume_id not in seen:
+                seen.add(_volume_id)
+                _volume_id = parent_ids[_volume_id]
+                depth += 1
+            return depth
+
+        fsmetadata_client = None
+        new_vdisks = []
+        for volume_id in sorted(registrations, key=_get_depth):
+            new_vdisk = VDisk()
+            new_vdisk.volume_id = volume_id
+            new_vdisk.vpool = vpool
+            try:
+                if fsmetadata_client is None:
+                    fsmetadata_client = new_vdisk.fsmetadata_client
+                devicename = fsmetadata_client.lookup(volume_id)
+                name = VDiskController.extract_volumename(devicename)
+            except FeatureNotAvailableException:
+                VDiskController._logger.exception('Could not load device name from StorageDriver')
+                devicename = '/{0}.raw'.format(volume_id)
+                name = volume_id
+            try:
+                info = new_vdisk.info
+            except Exception:
+                VDiskController._logger.exception('vDisk {0} - Could not load the volume information'.format(volume_id))
+                continue
+            new_vdisk.name = name
+            new_vdisk.size = info['volume_size']
+            new_vdisk.devicename = devicename
+            new_vdisk.description = name
+            new_vdisk.pagecache_ratio = 1.0
+            new_vdisk.metadata = {'lba_size': info['lba_size'],
+                                  'cluster_multiplier': info['cluster_multiplier']}
+            new_vdisks.append(new_vdisk)
+
+        # Parents which are not added by this sync, are resolved in bulk
+        known = dict((str(vdisk.volume_id), vdisk) for vdisk in VDiskList.get_in_volume_ids(list(set(parent_ids.values()) - set(registrations))))
+        saved = []
+        for index in xrange(0, len(new_vdisks), VDiskController._SYNC_BATCH_SIZE):
+            batch = new_vdisks[index:index + VDiskController._SYNC_BATCH_SIZE]
+            mutexes = []
+            try:
+                for volume_id in sorted(new_vdisk.volume_id for new_vdisk in batch):
+                    mutex = volatile_mutex(VDiskController._VOLDRV_EVENT_KEY.format(volume_id))
+                    mutex.acquire(wait=30)
+                    mutexes.append(mutex)
+                existing = dict((str(vdisk.volume_id), vdisk) for vdisk in VDiskList.get_in_volume_ids([new_vdisk.volume_id for new_vdisk in batch]))
+                known.update(existing)
+                for new_vdisk in batch:
+                    volume_id = new_vdisk.volume_id
+                    if volume_id in existing:
+                        continue
+                    VDiskController._logger.info('OVS_WARNING: Adding vDisk to model. ID: {0}'.format(volume_id))
+                    parent_id = parent_ids.get(volume_id)
+                    if parent_id is not None:
+                        VDiskController._logger.info('vDisk {0} - has parent with vol id {1}'.format(new_vdisk.name, parent_id))
+                        new_vdisk.parent_vdisk = known.get(parent_id)
+                    new_vdisk.save()
+                    known[volume_id] = new_vdisk
+                    saved.append(new_vdisk)
+            finally:
+                for mutex in reversed(mutexes):
+                    mutex.release()
+
+        # Parents which were added concurrently (e.g. by a volumedriver event) are linked afterwards
+        unlinked = [vdisk for vdisk in saved if vdisk.volume_id in parent_ids and vdisk.parent_vdisk_guid is None]
+        if len(unlinked) > 0:
+            parents = dict((str(vdisk.volume_id), vdisk) for vdisk in VDiskList.get_in_volume_ids(list(set(parent_ids[vdisk.volume_id] for vdisk in unlinked))))
+            for vdisk in unlinked:
+                parent = parents.get(parent_ids[vdisk.volume_id])
+                if parent is not None:
+                    vdisk.parent_vdisk = parent
+                    vdisk.save()
+
+        for new_vdisk in saved:
+            VDiskController.vdisk_checkup(new_vdisk)
 
     @staticmethod
     def _wait_for_snapshot_to_be_synced_to_backend(vdisk_guid, snapshot_id):
-        tries = 25  # 5 minutes
-        while VDiskController.is_volume_synced_up_to_snapshot(vdisk_guid=vdisk_guid, snapshot_id=snapshot_id) is False and tries > 0:
-            sleep_amount = 25 - tries
-            time.sleep(sleep_amount)
-            tries -= 1
-            VDiskController._logger.info('Waiting for snapshot to be synced, waited {0} second{1}'.format(sleep_amount, '' if sleep_amount == 1 else 's'))
-        if tries == 0:
-            raise RuntimeError('Snapshot {0} of volume {1} still not synced to backend, not waiting any longer'.format(snapshot_id, vdisk_guid))
+        """
+        Waits until a snapshot is synced to the backend
+        The sync state is verified again whenever the volumedriver reports an event for the volume. Without events, it is
+        verified with a linearly increasing interval of 1, 2, 3, ... seconds, matching the schedule used before events were
+        available
+        :param vdisk_guid: Guid of the vDisk
+        :type vdisk_guid: str
+        :param snapshot_id: ID of the snapshot
+        :type snapshot_id: str
+        :raises RuntimeError: When the snapshot is not synced within _SNAPSHOT_SYNC_TIMEOUT seconds
+        :return: None
+        :rtype: NoneType
+        """
+        volume_id = str(VDisk(vdisk_guid).volume_id)
+        start = time.time()
+        interval = 1
+        while True:
+            since = VolumeEventWaiter.get_sequence(volume_id)
+            if VDiskController.is_volume_synced_up_to_snapshot(vdisk_guid=vdisk_guid, snapshot_id=snapshot_id) is True:
+                return
+            remaining = VDiskController._SNAPSHOT_SYNC_TIMEOUT - (time.time() - start)
+            if remaining <= 0:
+                raise RuntimeError('Snapshot {0} of volume {1} still not synced to backend, not waiting any longer'.format(snapshot_id, vdisk_guid))
+            if VolumeEventWaiter.wait(volume_id=volume_id, since=since, timeout=min(interval, remaining)) is False:
+                interval += 1
+            VDiskController._logger.info('Waiting for snapshot to be synced, waited {0:.1f} seconds'.format(time.time() - start))
 
     @staticmethod
     def _set_vdisk_metadata_pagecache_size(vdisk):
@@ -19,7 +19,6 @@ Contains various decorator
 """
 
 import os
-import re
 import json
 import math
 import time
@@ -30,7 +29,9 @@ from functools import wraps
 from rest_framework import status
 from rest_framework.request import Request
 from api.backend.toolbox import ApiToolbox
-from api.helpers import OVSResponse
+from api.helpers import OVSResponse, RateLimiter
+from api.middleware import OVSMiddleware
+from api.requestlogger import RequestLogger
 from ovs.dal.datalist import DataList
 from ovs.dal.dataobject import DataObject
 from ovs.dal.exceptions import ObjectNotFoundException
@@ -38,10 +39,8 @@ from ovs.dal.helpers import DalToolbox
 from ovs.dal.lists.userlist import UserList
 from ovs.dal.lists.storagerouterlist import StorageRouterList
 from ovs_extensions.api.exceptions import HttpForbiddenException, HttpNotAcceptableException, HttpNotFoundException,\
-    HttpTooManyRequestsException, HttpUnauthorizedException, HttpUpgradeNeededException
+    HttpUnauthorizedException, HttpUpgradeNeededException
 from ovs.extensions.generic.logger import Logger
-from ovs.extensions.generic.volatilemutex import volatile_mutex
-from ovs.extensions.storage.volatilefactory import VolatileFactory
 
 if os.environ.get('RUNNING_UNITTESTS') == 'True':
     from api.backend.serializers.mockups import FullSerializer
@@ -100,7 +99,6 @@ def load(object_type=None, min_version=settings.VERSION[0], max_version=settings
     Parameter discovery decorator
     """
     logger = Logger('api')
-    regex = re.compile('^(.*; )?version=(?P<version>([0-9]+|\*)?)(;.*)?$')
 
     def wrap(f):
         """
@@ -157,7 +155,7 @@ def load(object_type=None, min_version=settings.VERSION[0], max_version=settings
                 validation_mandatory_vars = []
                 validation_optional_vars = []
             # Check version
-            version_match = regex.match(request.META['HTTP_ACCEPT'])
+            version_match = OVSMiddleware.VERSION_REGEX.match(request.META['HTTP_ACCEPT'])
             if version_match is not None:
                 version = version_match.groupdict()['version']
             else:
@@ -576,32 +574,11 @@ def limit(amount, per, timeout):
             """
             request = _find_request(args)
 
-            now = time.time()
             key = 'ovs_api_limit_{0}.{1}_{2}'.format(
                 f.__module__, f.__name__,
                 request.META['HTTP_X_REAL_IP']
             )
-            client = VolatileFactory.get_client()
-            with volatile_mutex(key):
-                rate_info = client.get(key, {'calls': [],
-                                             'timeout': None})
-                active_timeout = rate_info['timeout']
-                if active_timeout is not None:
-                    if active_timeout > now:
-                        logger.warning('Call {0} is being throttled with a wait of {1}'.format(key, active_timeout - now))
-                        raise HttpTooManyRequestsException(error='rate_limit_timeout',
-                                                           error_description='Rate limit timeout ({0}s remaining)'.format(round(active_timeout - now, 2)))
-                    else:
-                        rate_info['timeout'] = None
-                rate_info['calls'] = [call for call in rate_info['calls'] if call > (now - per)] + [now]
-                calls = len(rate_info['calls'])
-                if calls > amount:
-                    rate_info['timeout'] = now + timeout
-                    client.set(key, rate_info)
-                    logger.warning('Call {0} is being throttled with a wait of {1}'.format(key, timeout))
-                    raise HttpTooManyRequestsException(error='rate_limit_reached',
-                                                       error_description='Rate limit reached ({0} in last {1}s)'.format(calls, per))
-                client.set(key, rate_info)
+            RateLimiter(key, amount=amount, per=per, timeout=timeout).register_call(logger)
             return f(*args, **kwargs)
 
         return new_function
@@ -611,9 +588,11 @@ def limit(amount, per, timeout):
 def log(log_slow=True):
     """
     Task logger
+    Only a configurable subset of the request is captured, serializing and writing happens asynchronously
     :param log_slow: Indicates whether a slow call should be logged
     """
     logger = Logger('api')
+    request_logger = RequestLogger.get_instance('api')
 
     def wrap(f):
         """
@@ -632,22 +611,7 @@ def log(log_slow=True):
             method_args = method_args[method_args.index(request) + 1:]
 
             # Log the call
-            metadata = {'meta': dict((str(key), str(value)) for key, value in request.META.iteritems()),
-                        'request': dict((str(key), str(value)) for key, value in request.REQUEST.iteritems()),
-                        'cookies': dict((str(key), str(value)) for key, value in request.COOKIES.iteritems())}
-            # Stripping password traces
-            for mtype in metadata:
-                for key in metadata[mtype]:
-                    if 'password' in key:
-                        metadata[mtype][key] = '**********************'
-            logger.info('[{0}.{1}] - {2} - {3} - {4} - {5}'.format(
-                f.__module__,
-                f.__name__,
-                getattr(request, 'client').user_guid if hasattr(request, 'client') else None,
-                json.dumps(method_args),
-                json.dumps(kwargs),
-                json.dumps(metadata)
-            ))
+            request_logger.log(function=f, request=request, args=method_args, kwargs=kwargs)
             logging_duration = time.time() - logging_start
 
             # Call the function
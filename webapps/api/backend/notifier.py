@@ -0,0 +1,102 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Message notifier module
+"""
+
+import gevent
+from gevent.event import Event
+from ovs.extensions.generic.logger import Logger
+from ovs.lib.messaging import MessageController
+
+
+class MessageNotifier(object):
+    """
+    Per-process notifier for new messages on the message bus
+    A single greenlet follows the last message id of the bus and wakes up all greenlets waiting for new messages,
+    instead of every long-polling client polling the bus by itself. The greenlet stops when nobody is waiting.
+    """
+    POLL_INTERVAL = 0.2
+    IDLE_TIMEOUT = 60
+
+    _logger = Logger('api')
+    _event = Event()
+    _subscriber = None
+    _last_message_id = None
+    _waiters = 0
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the last message id on the bus as known by this process
+        :return: The last message id
+        :rtype: int
+        """
+        cls._ensure_subscriber()
+        if cls._last_message_id is None:
+            cls._last_message_id = MessageController.last_message_id()
+        return cls._last_message_id
+
+    @classmethod
+    def wait(cls, reference, timeout):
+        """
+        Blocks the calling greenlet until the last message id on the bus differs from the given reference
+        :param reference: Last message id known by the caller
+        :type reference: int
+        :param timeout: Maximum amount of seconds to wait
+        :type timeout: float
+        :return: True if the last message id changed, False on timeout
+        :rtype: bool
+        """
+        if cls.current() != reference:
+            return True
+        if timeout <= 0:
+            return False
+        event = cls._event
+        cls._waiters += 1
+        try:
+            event.wait(timeout)
+        finally:
+            cls._waiters -= 1
+        return cls._last_message_id != reference
+
+    @classmethod
+    def _ensure_subscriber(cls):
+        """
+        Starts the subscriber greenlet if it is not running
+        """
+        if cls._subscriber is None or cls._subscriber.dead:
+            cls._subscriber = gevent.spawn(cls._follow)
+
+    @classmethod
+    def _follow(cls):
+        """
+        Follows the message bus and wakes up the waiting greenlets when new messages arrive
+        """
+        idle = 0
+        while idle < MessageNotifier.IDLE_TIMEOUT:
+            try:
+                last_message_id = MessageController.last_message_id()
+                if last_message_id != cls._last_message_id:
+                    cls._last_message_id = last_message_id
+                    event, cls._event = cls._event, Event()
+                    event.set()
+            except Exception:
+                cls._logger.exception('Error following the message bus')
+            idle = 0 if cls._waiters > 0 else idle + MessageNotifier.POLL_INTERVAL
+            gevent.sleep(MessageNotifier.POLL_INTERVAL)
+        cls._last_message_id = None  # Not followed anymore, so this value can no longer be trusted
@@ -18,12 +18,16 @@
 Contains the MessageViewSet
 """
 
+import json
+import time
 import gevent
+from django.http import StreamingHttpResponse
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import link, action
 from api.backend.decorators import required_roles, load, log
+from api.backend.notifier import MessageNotifier
 from ovs.lib.messaging import MessageController
 
 
@@ -35,6 +39,8 @@ class MessagingViewSet(viewsets.ViewSet):
     prefix = r'messages'
     base_name = 'messages'
     skip_spec = True
+    STREAM_DURATION = 300
+    STREAM_HEARTBEAT = 15
 
     @log()
     @required_roles(['read'])
@@ -61,22 +67,39 @@ class MessagingViewSet(viewsets.ViewSet):
         return Response(MessageController.subscriptions(pk), status=status.HTTP_200_OK)
 
     @staticmethod
-    def _wait(subscriber_id, message_id):
-        messages = []
-        last_message_id = 0
-        counter = 0
-        while len(messages) == 0:
+    def _wait(subscriber_id, message_id, timeout=60):
+        deadline = time.time() + timeout
+        while True:
+            reference = MessageNotifier.current()
             messages, last_message_id = MessageController.get_messages(subscriber_id, message_id)
-            if len(messages) == 0:
-                counter += 1
-                if counter >= 120:  # 120 * 0.5 seconds = 60 seconds  = 1 minute
-                    break
-                gevent.sleep(.5)
+            if len(messages) > 0:
+                break
+            remaining = deadline - time.time()
+            if last_message_id < reference:
+                # A message is not yet stored on the bus, the bus itself won't notify about it
+                remaining = min(remaining, 1)
+            if not MessageNotifier.wait(reference, remaining) and time.time() >= deadline:
+                break
         if len(messages) == 0:
             last_message_id = MessageController.last_message_id()
         MessageController.reset_subscriptions(subscriber_id)
         return messages, last_message_id
 
+    @staticmethod
+    def _stream(subscriber_id, last_message_id):
+        """
+        Generates the server-sent events for a subscriber until STREAM_DURATION passed
+        """
+        end = time.time() + MessagingViewSet.STREAM_DURATION
+        while time.time() < end:
+            messages, new_last_message_id = MessagingViewSet._wait(subscriber_id, last_message_id, timeout=min(MessagingViewSet.STREAM_HEARTBEAT, end - time.time()))
+            if len(messages) == 0:
+                yield ': heartbeat\n\n'  # Comment lines keep the connection alive
+                continue
+            last_message_id = new_last_message_id
+            yield 'id: {0}\ndata: {1}\n\n'.format(last_message_id, json.dumps({'messages': messages,
+                                                                                 'last_message_id': last_message_id}))
+
     @link()
     @log(log_slow=False)
     @required_roles(['read'])
@@ -106,6 +129,30 @@ class MessagingViewSet(viewsets.ViewSet):
                          'last_message_id': last_message_id,
                          'subscriptions': MessageController.subscriptions(pk)}, status=status.HTTP_200_OK)
 
+    @link()
+    @log(log_slow=False)
+    @required_roles(['read'])
+    @load()
+    def stream(self, pk, message_id):
+        """
+        Streams messages for a given subscriber as server-sent events over a single connection
+        Every event carries the messages and the last message id. The stream ends after STREAM_DURATION seconds,
+        after which the client reconnects with the last received message id.
+        :param pk: Primary key of subscriber
+        :type pk: int
+        :param message_id: The last message_id that was already received
+        :type message_id: str
+        """
+        try:
+            pk = int(pk)
+            message_id = int(message_id)
+        except (ValueError, TypeError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(MessagingViewSet._stream(pk, message_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Prevent nginx from buffering the stream
+        return response
+
     @link()
     @log()
     @required_roles(['read'])
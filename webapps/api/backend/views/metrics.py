@@ -0,0 +1,47 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Module exposing the API metrics
+"""
+
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+from api.backend.decorators import load, log, required_roles, return_simple
+from api.metrics import ApiMetrics
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    Latency metrics of the API
+    """
+    permission_classes = (IsAuthenticated,)
+    prefix = r'metrics'
+    base_name = 'metrics'
+    return_exceptions = ['metrics.list']
+
+    @log()
+    @required_roles(['read'])
+    @return_simple()
+    @load()
+    def list(self):
+        """
+        Overview of the latency histograms per endpoint and phase, merged over all API workers
+        :return: Dict with count, sum, min, max, mean and percentiles per endpoint and phase
+        :rtype: dict
+        """
+        return ApiMetrics.get_metrics()
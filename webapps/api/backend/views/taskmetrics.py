@@ -0,0 +1,87 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Module exposing the celery task metrics and profiles
+"""
+
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+from api.backend.decorators import load, log, required_roles, return_simple
+from ovs_extensions.api.exceptions import HttpNotFoundException
+from ovs.lib.helpers.taskmetrics import TaskMetrics
+
+
+class TaskMetricsViewSet(viewsets.ViewSet):
+    """
+    Execution metrics of the celery tasks
+    """
+    permission_classes = (IsAuthenticated,)
+    prefix = r'taskmetrics'
+    base_name = 'taskmetrics'
+    return_exceptions = ['taskmetrics.list']
+
+    @log()
+    @required_roles(['read'])
+    @return_simple()
+    @load()
+    def list(self):
+        """
+        Overview of the queue time, ensure single wait time, run time and outcomes per task, merged over all workers
+        :return: Dict with count, sum, min, max, mean and percentiles per task and phase
+        :rtype: dict
+        """
+        return TaskMetrics.get_metrics()
+
+
+class TaskProfileViewSet(viewsets.ViewSet):
+    """
+    Profiles of the celery tasks for which profiling is enabled
+    """
+    permission_classes = (IsAuthenticated,)
+    prefix = r'taskprofiles'
+    base_name = 'taskprofiles'
+    return_exceptions = ['taskprofiles.list', 'taskprofiles.retrieve']
+
+    @log()
+    @required_roles(['read'])
+    @return_simple()
+    @load()
+    def list(self):
+        """
+        Overview of the stored profiles, most recent first
+        :return: List of profile information (id, task_name, timestamp, duration, outcome)
+        :rtype: list
+        """
+        return TaskMetrics.get_profiles()
+
+    @log()
+    @required_roles(['read'])
+    @return_simple()
+    @load()
+    def retrieve(self, pk):
+        """
+        Load a stored profile
+        :param pk: Profile identifier
+        :type pk: str
+        :return: Profile information, including the output of the profiler
+        :rtype: dict
+        """
+        profile = TaskMetrics.get_profile(pk)
+        if profile is None:
+            raise HttpNotFoundException(error='not_found',
+                                        error_description='Profile {0} not found or expired'.format(pk))
+        return profile
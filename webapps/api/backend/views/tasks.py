@@ -18,12 +18,12 @@
 Module for working with celery tasks
 """
 
-from celery.task.control import inspect
 from rest_framework import viewsets
 from rest_framework.decorators import link
 from rest_framework.permissions import IsAuthenticated
 from api.backend.decorators import load, log, required_roles, return_simple
 from ovs.celery_run import celery
+from ovs.extensions.celery.workerstate import WorkerState
 
 
 class TaskViewSet(viewsets.ViewSet):
@@ -39,17 +39,16 @@ class TaskViewSet(viewsets.ViewSet):
     @required_roles(['read'])
     @return_simple()
     @load()
-    def list(self):
+    def list(self, live=False):
         """
         Overview of active, scheduled, reserved and revoked tasks
+        The overview is served from the worker state aggregated from the celery events
+        :param live: Inspect all workers instead of using the aggregated worker state
+        :type live: bool
         :return: Dict of all tasks
         :rtype: dict
         """
-        inspector = inspect()
-        return {'active': inspector.active(),
-                'scheduled': inspector.scheduled(),
-                'reserved': inspector.reserved(),
-                'revoked': inspector.revoked()}
+        return WorkerState.get_tasks(live=live is True)
 
     @log()
     @required_roles(['read'])
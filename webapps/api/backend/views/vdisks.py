@@ -197,6 +197,48 @@ class VDiskViewSet(viewsets.ViewSet):
                                            pagecache_ratio=pagecache_ratio,
                                            cache_quota=cache_quota)
 
+    @action()
+    @log()
+    @required_roles(['read', 'write'])
+    @return_task()
+    @load(VDisk)
+    def clone_multiple(self, vdisk, names=None, name_pattern=None, amount=None, start=1, snapshot_id=None, storagerouter_guids=None, pagecache_ratio=None, cache_quota=None):
+        """
+        Creates multiple clones of a vTemplate or of a snapshot of a vDisk, spread over the StorageRouters
+        :param vdisk: Guid of the vTemplate or virtual disk to clone
+        :type vdisk: VDisk
+        :param names: Names for the clones (filenames or user friendly names)
+        :type names: list
+        :param name_pattern: Pattern to generate the names, formatted with the sequence number (e.g. 'desktop-{0:03d}')
+        :type name_pattern: str
+        :param amount: Amount of clones to create using the name pattern
+        :type amount: int
+        :param start: First sequence number to use in the name pattern
+        :type start: int
+        :param snapshot_id: ID of the snapshot to clone from
+        :type snapshot_id: str
+        :param storagerouter_guids: Guids of the StorageRouters to spread the clones over
+        :type storagerouter_guids: list
+        :param pagecache_ratio: Ratio (0 < x <= 1) of the pagecache size related to the size
+        :type pagecache_ratio: float
+        :param cache_quota: Maximum caching space(s) the new clones can consume (in Bytes) per cache type.
+        :type cache_quota: dict
+        :return: Asynchronous result of a CeleryTask
+        :rtype: celery.result.AsyncResult
+        """
+        if (names is None) == (name_pattern is None):
+            raise HttpNotAcceptableException(error='invalid_data',
+                                             error_description='Either names or a name pattern should be provided')
+        return VDiskController.clone_multiple.delay(vdisk_guid=vdisk.guid,
+                                                    names=names,
+                                                    name_pattern=name_pattern,
+                                                    amount=amount,
+                                                    start=start,
+                                                    snapshot_id=snapshot_id,
+                                                    storagerouter_guids=storagerouter_guids,
+                                                    pagecache_ratio=pagecache_ratio,
+                                                    cache_quota=cache_quota)
+
     @action()
     @log()
     @required_roles(['read', 'write'])
@@ -19,7 +19,11 @@
 Some helpers
 """
 
+import math
+import time
 from rest_framework.response import Response
+from ovs_extensions.api.exceptions import HttpTooManyRequestsException
+from ovs.extensions.storage.volatilefactory import VolatileFactory
 
 
 class OVSResponse(Response):
@@ -36,5 +40,63 @@ class OVSResponse(Response):
         self.timings = timings
 
     def build_timings(self):
-        self['Server-Timing'] = ','.join('{0};dur={1};desc={2}'.format(key, timing_info[0] * 1000, timing_info[1])
+        self['Server-Timing'] = ','.join('{0};dur={1};desc="{2}"'.format(key, round(timing_info[0] * 1000, 3), timing_info[1].replace('"', '\''))
                                          for key, timing_info in self.timings.iteritems())
+
+
+class RateLimiter(object):
+    """
+    Sliding window rate limiter on top of the volatile store.
+    Calls are counted in fixed buckets of `per` seconds using atomic add/incr operations. The amount of calls in
+    the sliding window is estimated by weighing the previous bucket by the part of it which still overlaps with
+    the window. No locks are taken and every call results in a fixed amount of volatile store operations.
+    """
+
+    def __init__(self, key, amount, per, timeout):
+        """
+        :param key: Key identifying the rate limited entity (e.g. call and client ip)
+        :type key: str
+        :param amount: Amount of calls allowed within the window
+        :type amount: int
+        :param per: Size of the window in seconds
+        :type per: int
+        :param timeout: Amount of seconds new calls are refused once the limit is reached
+        :type timeout: int
+        """
+        self.key = key
+        self._amount = amount
+        self._per = per
+        self._timeout = timeout
+        self._timeout_key = '{0}_timeout'.format(key)
+        self._bucket_ttl = int(math.ceil(per)) * 2 + 1  # Every bucket has to survive while it is the previous bucket
+
+    def register_call(self, logger):
+        """
+        Registers a call and validates whether it is allowed
+        :param logger: Logger to report throttled calls to
+        :type logger: ovs.extensions.generic.logger.Logger
+        :raises HttpTooManyRequestsException: When the call exceeds the limit or a timeout is active
+        :return: None
+        :rtype: NoneType
+        """
+        now = time.time()
+        client = VolatileFactory.get_client()
+        active_timeout = client.get(self._timeout_key)
+        if active_timeout is not None and active_timeout > now:
+            logger.warning('Call {0} is being throttled with a wait of {1}'.format(self.key, active_timeout - now))
+            raise HttpTooManyRequestsException(error='rate_limit_timeout',
+                                               error_description='Rate limit timeout ({0}s remaining)'.format(round(active_timeout - now, 2)))
+
+        bucket = int(now / self._per)
+        bucket_key = '{0}_{1}'.format(self.key, bucket)
+        client.add(bucket_key, 0, self._bucket_ttl)
+        client.incr(bucket_key)
+        current = client.get(bucket_key, 1)
+        previous = client.get('{0}_{1}'.format(self.key, bucket - 1), 0)
+        overlap = 1 - (now - bucket * self._per) / float(self._per)
+        calls = previous * overlap + current
+        if calls > self._amount:
+            client.set(self._timeout_key, now + self._timeout, int(math.ceil(self._timeout)) + 1)
+            logger.warning('Call {0} is being throttled with a wait of {1}'.format(self.key, self._timeout))
+            raise HttpTooManyRequestsException(error='rate_limit_reached',
+                                               error_description='Rate limit reached ({0} in last {1}s)'.format(int(math.ceil(calls)), self._per))
@@ -0,0 +1,54 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+API metrics module
+"""
+
+from threading import Lock
+from ovs.extensions.generic.histogram import HistogramAggregator, LatencyHistogram
+from ovs.extensions.generic.logger import Logger
+
+
+class ApiMetrics(HistogramAggregator):
+    """
+    Aggregates the OVSResponse timings per endpoint and phase
+    Every API worker keeps its own histograms and periodically publishes them in the volatile store.
+    The metrics of all API workers are merged when they are requested.
+    """
+    WORKERS_KEY = 'ovs_api_metrics_workers'
+    WORKER_KEY = 'ovs_api_metrics_worker_{0}'
+    IGNORED_SUFFIXES = ('_avg', '_min', '_max')  # Derived dynamic timings, the sum is tracked instead
+
+    _logger = Logger('api')
+    _lock = Lock()
+    _histograms = {}
+    _last_push = None
+    _worker_id = None
+
+    @classmethod
+    def record(cls, endpoint, timings):
+        """
+        Records the timings of a single response
+        :param endpoint: Identifier of the endpoint (e.g. 'vdisk-list|GET')
+        :type endpoint: str
+        :param timings: Timings as gathered in the OVSResponse, {phase: [duration, description]}
+        :type timings: dict
+        :return: None
+        :rtype: NoneType
+        """
+        cls.record_values(endpoint, dict((phase, timing[0]) for phase, timing in timings.iteritems()
+                                         if not phase.endswith(ApiMetrics.IGNORED_SUFFIXES)))
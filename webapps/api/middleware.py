@@ -23,6 +23,7 @@ import json
 import time
 from django.http import HttpResponse
 from api.helpers import OVSResponse
+from api.metrics import ApiMetrics
 from ovs.dal.exceptions import MissingMandatoryFieldsException
 from ovs.dal.lists.storagerouterlist import StorageRouterList
 from ovs.extensions.generic.logger import Logger
@@ -32,6 +33,12 @@ class OVSMiddleware(object):
     """
     Middleware object
     """
+    VERSION_REGEX = re.compile('^(.*; )?version=(?P<version>([0-9]+|\*)?)(;.*)?$')
+    CORS_TTL = 60  # Seconds the allowed origins are cached
+    CORS_MISS_REFRESH = 5  # Minimum amount of seconds between refreshes triggered by an unknown origin
+
+    _allowed_origins = None
+    _allowed_origins_loaded = 0
 
     def process_exception(self, request, exception):
         """
@@ -66,9 +73,8 @@ class OVSMiddleware(object):
             return HttpResponse()
         # Validate version
         path = request.path
-        regex = re.compile('^(.*; )?version=(?P<version>([0-9]+|\*)?)(;.*)?$')
         if path != '/api/' and '/api/oauth2/' not in path and '/swagger.json' not in path:
-            if 'HTTP_ACCEPT' not in request.META or regex.match(request.META['HTTP_ACCEPT']) is None:
+            if 'HTTP_ACCEPT' not in request.META or OVSMiddleware.VERSION_REGEX.match(request.META['HTTP_ACCEPT']) is None:
                 return HttpResponse(
                     json.dumps({'error': 'missing_header',
                                 'error_description': "The version required by the client should be added to the Accept header. E.g.: 'Accept: application/json; version=1'"}),
@@ -89,17 +95,47 @@ class OVSMiddleware(object):
                 # noinspection PyProtectedMember
                 response.timings['total'] = [time.time() - request._entry_time, 'Total']
             response.build_timings()
+            ApiMetrics.record(endpoint='{0}|{1}'.format(OVSMiddleware._get_endpoint(request), request.method),
+                              timings=response.timings)
         # Process CORS responses
         if 'HTTP_ORIGIN' in request.META:
             path = request.path
-            storagerouters = StorageRouterList.get_storagerouters()
-            allowed_origins = ['https://{0}'.format(storagerouter.ip) for storagerouter in storagerouters]
-            if request.META['HTTP_ORIGIN'] in allowed_origins or '/swagger.json' in path:
+            if '/swagger.json' in path or OVSMiddleware.is_allowed_origin(request.META['HTTP_ORIGIN']):
                 response['Access-Control-Allow-Origin'] = request.META['HTTP_ORIGIN']
                 response['Access-Control-Allow-Headers'] = 'x-requested-with, content-type, accept, origin, authorization'
                 response['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
         return response
 
+    @classmethod
+    def is_allowed_origin(cls, origin):
+        """
+        Checks whether the given origin is one of the StorageRouters.
+        The allowed origins are cached, so regular GUI traffic does not cause DAL queries.
+        An unknown origin refreshes the cache, but at most once every CORS_MISS_REFRESH seconds.
+        :param origin: Origin of the request (e.g. https://10.100.1.1)
+        :type origin: str
+        :return: True if the origin is allowed
+        :rtype: bool
+        """
+        age = time.time() - cls._allowed_origins_loaded
+        if cls._allowed_origins is None or age > OVSMiddleware.CORS_TTL or \
+                (origin not in cls._allowed_origins and age > OVSMiddleware.CORS_MISS_REFRESH):
+            cls._allowed_origins = frozenset('https://{0}'.format(storagerouter.ip) for storagerouter in StorageRouterList.get_storagerouters())
+            cls._allowed_origins_loaded = time.time()
+        return origin in cls._allowed_origins
+
+    @staticmethod
+    def _get_endpoint(request):
+        """
+        Returns the name of the route which handled the request. The path itself is not used as it contains guids
+        """
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return 'unresolved'
+        if resolver_match.url_name:
+            return resolver_match.url_name
+        return '{0}.{1}'.format(resolver_match.func.__module__, resolver_match.func.__name__)
+
     @staticmethod
     def is_own_httpexception(exception):
         """
@@ -18,16 +18,15 @@
 Contains various decorator
 """
 import json
-import time
 from django.contrib.auth import authenticate, login
 from django.core.handlers.wsgi import WSGIRequest
 from django.http import HttpResponse
 from functools import wraps
 from rest_framework.request import Request
-from ovs_extensions.api.exceptions import HttpForbiddenException, HttpTooManyRequestsException
+from api.helpers import RateLimiter
+from api.requestlogger import RequestLogger
+from ovs_extensions.api.exceptions import HttpForbiddenException
 from ovs.extensions.generic.logger import Logger
-from ovs.extensions.generic.volatilemutex import volatile_mutex
-from ovs.extensions.storage.volatilefactory import VolatileFactory
 
 
 def _find_request(args):
@@ -85,36 +84,11 @@ def limit(amount, per, timeout):
             """
             Wrapped function
             """
-            now = time.time()
             key = 'ovs_api_limit_{0}.{1}_{2}'.format(
                 f.__module__, f.__name__,
                 request.META['HTTP_X_REAL_IP']
             )
-            client = VolatileFactory.get_client()
-            mutex = volatile_mutex(key)
-            try:
-                mutex.acquire()
-                rate_info = client.get(key, {'calls': [],
-                                             'timeout': None})
-                active_timeout = rate_info['timeout']
-                if active_timeout is not None:
-                    if active_timeout > now:
-                        logger.warning('Call {0} is being throttled with a wait of {1}'.format(key, active_timeout - now))
-                        raise HttpTooManyRequestsException(error='rate_limit_timeout',
-                                                           error_description='Rate limit timeout ({0}s remaining)'.format(round(active_timeout - now, 2)))
-                    else:
-                        rate_info['timeout'] = None
-                rate_info['calls'] = [call for call in rate_info['calls'] if call > (now - per)] + [now]
-                calls = len(rate_info['calls'])
-                if calls > amount:
-                    rate_info['timeout'] = now + timeout
-                    client.set(key, rate_info)
-                    logger.warning('Call {0} is being throttled with a wait of {1}'.format(key, timeout))
-                    raise HttpTooManyRequestsException(error='rate_limit_reached',
-                                                       error_description='Rate limit reached ({0} in last {1}s)'.format(calls, per))
-                client.set(key, rate_info)
-            finally:
-                mutex.release()
+            RateLimiter(key, amount=amount, per=per, timeout=timeout).register_call(logger)
             return f(self, request, *args, **kwargs)
 
         return new_function
@@ -125,7 +99,7 @@ def log():
     """
     Task logger
     """
-    logger = Logger('oauth2')
+    request_logger = RequestLogger.get_instance('oauth2')
 
     def wrap(f):
         """
@@ -138,23 +112,7 @@ def log():
             Wrapped function
             """
             # Log the call
-            metadata = {'meta': dict((str(key), str(value)) for key, value in request.META.iteritems()),
-                        'request': dict((str(key), str(value)) for key, value in request.REQUEST.iteritems()),
-                        'cookies': dict((str(key), str(value)) for key, value in request.COOKIES.iteritems())}
-            # Stripping password traces
-            for mtype in metadata:
-                for key in metadata[mtype]:
-                    if 'password' in key:
-                        metadata[mtype][key] = '**********************'
-            logger.info('[{0}.{1}] - {2} - {3} - {4} - {5}'.format(
-                f.__module__,
-                f.__name__,
-                getattr(request, 'client').user_guid if hasattr(request, 'client') else None,
-                json.dumps(list(args)),
-                json.dumps(kwargs),
-                json.dumps(metadata)
-            ))
-
+            request_logger.log(function=f, request=request, args=list(args), kwargs=kwargs)
             # Call the function
             return f(self, request, *args, **kwargs)
 
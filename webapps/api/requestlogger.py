@@ -0,0 +1,212 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Request logging module
+"""
+
+import os
+import json
+import time
+from Queue import Empty, Full, Queue
+from threading import Lock, Thread
+from ovs.extensions.generic.configuration import Configuration
+from ovs.extensions.generic.logger import Logger
+
+
+class RequestLogger(object):
+    """
+    Asynchronous request logger
+    The API decorators only capture a configured subset of the request and hand it over to a bounded queue before the
+    request is handled, so requests which hang or fail are logged as well.
+    A background thread serializes the records and writes them in batches to the logging sink.
+    When the queue is saturated, records are dropped and the amount of dropped records is reported.
+    Configuration (optional) is read from /ovs/framework/webapps|request_logging:
+    {'fields': {'meta': [...], 'request': [...], 'cookies': [...]},
+     'queue_size': 10000,
+     'batch_size': 100}
+    """
+    CONFIG_KEY = '/ovs/framework/webapps|request_logging'
+    DEFAULT_FIELDS = {'meta': ['HTTP_X_REAL_IP', 'REMOTE_ADDR', 'REQUEST_METHOD', 'PATH_INFO', 'QUERY_STRING', 'HTTP_ACCEPT', 'HTTP_USER_AGENT'],
+                      'request': [],
+                      'cookies': []}
+    DEFAULT_QUEUE_SIZE = 10000
+    DEFAULT_BATCH_SIZE = 100
+    FLUSH_INTERVAL = 1
+
+    _instances = {}
+    _instances_lock = Lock()
+
+    def __init__(self, name):
+        """
+        Initializes the request logger. Use RequestLogger.get_instance to share the logger within a process
+        :param name: Name of the logger to write the records to
+        :type name: str
+        """
+        self._logger = Logger(name)
+        self._lock = Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._config = None
+        self._dropped = 0
+        self._dropped_total = 0
+        self._written = 0
+
+    @classmethod
+    def get_instance(cls, name):
+        """
+        Retrieves the request logger for the given logger name
+        :param name: Name of the logger to write the records to
+        :type name: str
+        :return: The request logger
+        :rtype: RequestLogger
+        """
+        with cls._instances_lock:
+            if name not in cls._instances:
+                cls._instances[name] = cls(name)
+            return cls._instances[name]
+
+    @property
+    def config(self):
+        """
+        Loads the request logging configuration, falling back to the defaults
+        :return: The configuration
+        :rtype: dict
+        """
+        if self._config is None:
+            config = {'fields': RequestLogger.DEFAULT_FIELDS,
+                      'queue_size': RequestLogger.DEFAULT_QUEUE_SIZE,
+                      'batch_size': RequestLogger.DEFAULT_BATCH_SIZE}
+            try:
+                if Configuration.exists(RequestLogger.CONFIG_KEY):
+                    config.update(Configuration.get(RequestLogger.CONFIG_KEY))
+            except Exception:
+                self._logger.exception('Could not load the request logging configuration, using defaults')
+            self._config = config
+        return self._config
+
+    def capture(self, request):
+        """
+        Captures the configured subset of the request. Password fields are always masked
+        :param request: The request to capture
+        :type request: django.core.handlers.wsgi.WSGIRequest or rest_framework.request.Request
+        :return: The captured fields
+        :rtype: dict
+        """
+        metadata = {}
+        fields = self.config['fields']
+        for mtype, source in [('meta', request.META),
+                              ('request', request.REQUEST),
+                              ('cookies', request.COOKIES)]:
+            names = fields.get(mtype, [])
+            if '*' in names:
+                names = source.keys()
+            captured = {}
+            for name in names:
+                if name in source:
+                    captured[str(name)] = '**********************' if 'password' in name else str(source[name])
+            metadata[mtype] = captured
+        return metadata
+
+    def log(self, function, request, args, kwargs):
+        """
+        Queues a record for a received request. This method does not block
+        :param function: The function that will handle the request
+        :type function: callable
+        :param request: The received request
+        :type request: django.core.handlers.wsgi.WSGIRequest or rest_framework.request.Request
+        :param args: Positional arguments passed to the function (without the request)
+        :type args: list
+        :param kwargs: Keyword arguments passed to the function
+        :type kwargs: dict
+        :return: None
+        :rtype: NoneType
+        """
+        record = {'call': '{0}.{1}'.format(function.__module__, function.__name__),
+                  'user': getattr(request, 'client').user_guid if hasattr(request, 'client') else None,
+                  'args': args,
+                  'kwargs': kwargs,
+                  'metadata': self.capture(request),
+                  'timestamp': time.time()}
+        if os.environ.get('RUNNING_UNITTESTS') == 'True':
+            self._write([record])
+            return
+        queue = self._get_queue()
+        try:
+            queue.put_nowait(record)
+        except Full:
+            with self._lock:
+                self._dropped += 1
+                self._dropped_total += 1
+
+    def get_statistics(self):
+        """
+        Returns statistics about the request logger of this process
+        :return: Amount of queued, dropped and written records
+        :rtype: dict
+        """
+        return {'queued': 0 if self._queue is None else self._queue.qsize(),
+                'dropped': self._dropped_total,
+                'written': self._written}
+
+    def _get_queue(self):
+        """
+        Returns the queue, starting the background writer when required (e.g. after a fork of the API worker)
+        """
+        pid = os.getpid()
+        if self._pid != pid or self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._pid != pid or self._thread is None or not self._thread.is_alive():
+                    if self._pid != pid or self._queue is None:
+                        self._queue = Queue(maxsize=self.config['queue_size'])
+                    self._pid = pid
+                    self._thread = Thread(target=self._process, name='request_logger', args=(self._queue,))
+                    self._thread.daemon = True
+                    self._thread.start()
+        return self._queue
+
+    def _process(self, queue):
+        """
+        Background writer which drains the queue in batches
+        """
+        while True:
+            try:
+                records = [queue.get(timeout=RequestLogger.FLUSH_INTERVAL)]
+            except Empty:
+                records = []
+            while records and len(records) < self.config['batch_size']:
+                try:
+                    records.append(queue.get_nowait())
+                except Empty:
+                    break
+            with self._lock:
+                dropped = self._dropped
+                self._dropped = 0
+            if dropped > 0:
+                self._logger.warning('Request logging queue saturated, dropped {0} records'.format(dropped))
+            if records:
+                try:
+                    self._write(records)
+                except Exception:
+                    self._logger.exception('Could not write {0} request records'.format(len(records)))
+
+    def _write(self, records):
+        """
+        Serializes the given records and writes them to the logging sink in a single call
+        """
+        self._logger.info('\n'.join('[{0}] - {1}'.format(record['call'], json.dumps(record, default=str)) for record in records))
+        self._written += len(records)
@@ -575,3 +575,30 @@ class Authentication(unittest.TestCase):
         response = MetadataView.as_view()(request)
         response_content = json.loads(response.content)
         self.assertDictContainsSubset(dict(result_data.items() + {'authentication_state': 'token_expired'}.items()), response_content)
+
+    def test_cors(self):
+        """
+        Validates whether CORS headers are only added for StorageRouter origins, using the cached allowed origins
+        """
+        OVSMiddleware._allowed_origins = None
+        middleware = OVSMiddleware()
+        request = self.factory.get('/', HTTP_ORIGIN='https://127.0.0.1')
+        response = middleware.process_response(request, HttpResponse())
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://127.0.0.1')
+        request = self.factory.get('/', HTTP_ORIGIN='https://127.0.0.2')
+        response = middleware.process_response(request, HttpResponse())
+        self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+
+        storagerouter = StorageRouter()
+        storagerouter.ip = '127.0.0.2'
+        storagerouter.machine_id = '2'
+        storagerouter.rdma_capable = False
+        storagerouter.name = 'storagerouter_2'
+        storagerouter.save()
+        try:
+            time.sleep(OVSMiddleware.CORS_MISS_REFRESH + 1)
+            response = middleware.process_response(request, HttpResponse())
+            self.assertEqual(response['Access-Control-Allow-Origin'], 'https://127.0.0.2')
+        finally:
+            storagerouter.delete()
+            OVSMiddleware._allowed_origins = None
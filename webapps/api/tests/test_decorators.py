@@ -25,10 +25,13 @@ import unittest
 from django.conf import settings
 from django.http import HttpResponse
 from django.test import RequestFactory
-from api.backend.decorators import limit, required_roles, return_list, return_object, return_task
+from api.backend.decorators import limit, log, required_roles, return_list, return_object, return_task
 # noinspection PyUnresolvedReferences
 from api.backend.toolbox import ApiToolbox  # Required for the tests
+from api import helpers
+from api.helpers import OVSResponse, RateLimiter
 from api.oauth2.toolbox import OAuth2Toolbox
+from api.requestlogger import RequestLogger
 from ovs.dal.datalist import DataList
 from ovs.dal.hybrids.client import Client
 from ovs.dal.hybrids.group import Group
@@ -40,6 +43,7 @@ from ovs.dal.hybrids.user import User
 from ovs.dal.lists.rolelist import RoleList
 from ovs.dal.lists.userlist import UserList
 from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.generic.logger import Logger
 from ovs_extensions.api.exceptions import \
     HttpForbiddenException, HttpNotAcceptableException, HttpNotFoundException,\
     HttpTooManyRequestsException, HttpUnauthorizedException, HttpUpgradeNeededException
@@ -206,6 +210,50 @@ class Decorators(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content, '6')
 
+    def test_ratelimit_window(self):
+        """
+        Validates the sliding window estimate of the rate limiter at the limit boundary and when the window rolls over
+        """
+        class _Clock(object):
+            now = 1000.0
+
+            @staticmethod
+            def time():
+                return _Clock.now
+
+        def _call(limiter):
+            try:
+                limiter.register_call(logger)
+                return True
+            except HttpTooManyRequestsException:
+                return False
+
+        logger = Logger('api')
+        original_time = helpers.time
+        helpers.time = _Clock
+        try:
+            # Exactly 'amount' calls are allowed within a window, the next one is throttled
+            limiter = RateLimiter('ratelimit_boundary_{0}'.format(uuid.uuid4()), amount=10, per=10, timeout=5)
+            self.assertEqual([_call(limiter) for _ in xrange(11)], [True] * 10 + [False])
+
+            # At the start of the next window, the previous window still counts completely
+            limiter = RateLimiter('ratelimit_rollover_{0}'.format(uuid.uuid4()), amount=10, per=10, timeout=5)
+            _Clock.now = 1009.0
+            self.assertEqual([_call(limiter) for _ in xrange(10)], [True] * 10)
+            _Clock.now = 1010.0
+            self.assertFalse(_call(limiter))
+            # The timeout refuses calls, without counting them
+            _Clock.now = 1014.0
+            self.assertFalse(_call(limiter))
+            # Halfway the window, half of the previous window counts (5), next to the 1 throttled call in this window
+            _Clock.now = 1015.0
+            self.assertEqual([_call(limiter) for _ in xrange(5)], [True] * 4 + [False])
+            # Once the previous window no longer overlaps, all calls are allowed again
+            _Clock.now = 1030.0
+            self.assertEqual([_call(limiter) for _ in xrange(11)], [True] * 10 + [False])
+        finally:
+            helpers.time = original_time
+
     def test_required_roles(self):
         """
         Validates whether the required_roles decorator works
@@ -370,6 +418,52 @@ class Decorators(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data, 1)
 
+    def test_log(self):
+        """
+        Validates whether the log decorator only captures the configured request fields and masks passwords
+        """
+        @log()
+        def the_function_log(input_value, *args, **kwargs):
+            """
+            Decorated function
+            """
+            _ = args, kwargs
+            return OVSResponse(input_value, timings={})
+
+        request = self.factory.post('/users/', data={'username': 'admin', 'password': 'admin'}, HTTP_X_REAL_IP='127.0.0.1')
+        response = the_function_log(1, request)
+        self.assertEqual(response.data, 1)
+        self.assertIn('logging', response.timings)
+        request_logger = RequestLogger.get_instance('api')
+        self.assertEqual(request_logger.get_statistics()['dropped'], 0)
+        written = request_logger.get_statistics()['written']
+        self.assertGreaterEqual(written, 1)
+
+        @log()
+        def the_function_log_failing(*args, **kwargs):
+            """
+            Decorated function which fails
+            """
+            _ = args, kwargs
+            raise RuntimeError('Failure')
+
+        # A request is logged before it is handled, so failing requests are logged as well
+        with self.assertRaises(RuntimeError):
+            the_function_log_failing(request)
+        self.assertEqual(request_logger.get_statistics()['written'], written + 1)
+        metadata = request_logger.capture(request)
+        self.assertEqual(metadata['meta']['HTTP_X_REAL_IP'], '127.0.0.1')
+        self.assertNotIn('SERVER_NAME', metadata['meta'])
+        self.assertEqual(metadata['request'], {})
+        request_logger._config = dict(request_logger.config, fields={'request': ['*']})
+        try:
+            metadata = request_logger.capture(request)
+            self.assertEqual(metadata['meta'], {})
+            self.assertEqual(metadata['request']['username'], 'admin')
+            self.assertNotEqual(metadata['request']['password'], 'admin')
+        finally:
+            request_logger._config = None
+
     # noinspection PyUnresolvedReferences
     def test_return_object(self):
         """
@@ -0,0 +1,133 @@
+# Copyright (C) 2018 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Messaging API test module
+"""
+import json
+import time
+import gevent
+import unittest
+from gevent.event import Event
+from api.backend.notifier import MessageNotifier
+from api.backend.views.messaging import MessagingViewSet
+from ovs.dal.tests.helpers import DalHelper
+from ovs.lib.messaging import MessageController
+
+
+class MessagingTest(unittest.TestCase):
+    """
+    The messaging test suite will validate the message notifier and the long-polling and streaming of messages
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores and the notifier on every test
+        """
+        DalHelper.setup()
+        self._reset_notifier()
+        MessageController.subscribe(1, [MessageController.Type.TASK_COMPLETE])
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        self._reset_notifier()
+        DalHelper.teardown()
+
+    @staticmethod
+    def _reset_notifier():
+        if MessageNotifier._subscriber is not None:
+            MessageNotifier._subscriber.kill()
+        MessageNotifier._subscriber = None
+        MessageNotifier._last_message_id = None
+        MessageNotifier._event = Event()
+        MessageNotifier._waiters = 0
+
+    @staticmethod
+    def _fire_later(delay, body):
+        def _fire():
+            gevent.sleep(delay)
+            MessageController.fire(MessageController.Type.TASK_COMPLETE, body)
+        return gevent.spawn(_fire)
+
+    def test_notifier_fan_out(self):
+        """
+        Validates whether all waiting greenlets are woken up by a single follower greenlet when a message arrives
+        """
+        reference = MessageNotifier.current()
+        subscriber = MessageNotifier._subscriber
+        waiters = [gevent.spawn(MessageNotifier.wait, reference, 10) for _ in xrange(5)]
+        gevent.sleep(0.1)
+        self.assertEqual(MessageNotifier._waiters, 5)
+        start = time.time()
+        self._fire_later(0, 'task_1')
+        gevent.joinall(waiters, timeout=10)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual([waiter.value for waiter in waiters], [True] * 5)
+        self.assertIs(MessageNotifier._subscriber, subscriber)  # Only one greenlet follows the bus
+        self.assertEqual(MessageNotifier._waiters, 0)
+        self.assertEqual(MessageNotifier.current(), 1)
+        # A waiter with an outdated reference returns immediately
+        self.assertTrue(MessageNotifier.wait(reference, 10))
+
+    def test_notifier_timeout(self):
+        """
+        Validates whether waiting for new messages times out when no message arrives
+        """
+        reference = MessageNotifier.current()
+        start = time.time()
+        self.assertFalse(MessageNotifier.wait(reference, 0.5))
+        self.assertGreaterEqual(time.time() - start, 0.5)
+        self.assertFalse(MessageNotifier.wait(reference, 0))
+
+    def test_wait(self):
+        """
+        Validates whether a long-polling waiter is woken up by a new message and returns nothing on timeout
+        """
+        self._fire_later(0.5, 'task_1')
+        start = time.time()
+        messages, last_message_id = MessagingViewSet._wait(1, 0, timeout=10)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual([message['body'] for message in messages], ['task_1'])
+        self.assertEqual(last_message_id, 1)
+
+        MessageController.fire(MessageController.Type.EVENT, {'type': 'not_subscribed'})
+        messages, last_message_id = MessagingViewSet._wait(1, 1, timeout=0.5)
+        self.assertEqual(messages, [])
+        self.assertEqual(last_message_id, 2)
+
+    def test_stream(self):
+        """
+        Validates whether the stream sends heartbeats while idle and events carrying the messages and last message id
+        """
+        original = MessagingViewSet.STREAM_DURATION, MessagingViewSet.STREAM_HEARTBEAT
+        MessagingViewSet.STREAM_DURATION = 3
+        MessagingViewSet.STREAM_HEARTBEAT = 0.5
+        try:
+            self._fire_later(1, 'task_1')
+            start = time.time()
+            events = list(MessagingViewSet._stream(1, 0))
+        finally:
+            MessagingViewSet.STREAM_DURATION, MessagingViewSet.STREAM_HEARTBEAT = original
+        self.assertLess(time.time() - start, 5)
+        self.assertIn(': heartbeat\n\n', events)
+        data_events = [event for event in events if event.startswith('id: ')]
+        self.assertEqual(len(data_events), 1)
+        lines = data_events[0].strip().split('\n')
+        self.assertEqual(lines[0], 'id: 1')
+        data = json.loads(lines[1][len('data: '):])
+        self.assertEqual(data['last_message_id'], 1)
+        self.assertEqual([message['body'] for message in data['messages']], ['task_1'])
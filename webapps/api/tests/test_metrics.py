@@ -0,0 +1,78 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Metrics test module
+"""
+import unittest
+from api.metrics import ApiMetrics, LatencyHistogram
+from ovs.dal.tests.helpers import DalHelper
+
+
+class Metrics(unittest.TestCase):
+    """
+    The metrics test suite will validate the latency histograms and their aggregation
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+        ApiMetrics._histograms = {}
+        ApiMetrics._last_push = None
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        DalHelper.teardown()
+
+    def test_histogram(self):
+        """
+        Validates whether the histogram percentiles stay within the expected precision
+        """
+        histogram = LatencyHistogram()
+        values = [index / 1000.0 for index in xrange(1, 1001)]  # 1ms - 1s
+        for value in values:
+            histogram.record(value)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertEqual(summary['min'], 0.001)
+        self.assertEqual(summary['max'], 1.0)
+        for percentile in [50, 90, 99]:
+            expected = values[int(len(values) * percentile / 100.0) - 1]
+            self.assertLessEqual(abs(summary['p{0}'.format(percentile)] - expected) / expected, 1.0 / LatencyHistogram.SUB_BUCKETS)
+
+        other = LatencyHistogram.deserialize(histogram.serialize())
+        other.merge(histogram)
+        self.assertEqual(other.count, 2000)
+        self.assertEqual(other.summary()['p50'], summary['p50'])
+
+    def test_aggregation(self):
+        """
+        Validates whether timings are recorded per endpoint and phase and exposed over the volatile store
+        """
+        ApiMetrics.record('vdisk-list|GET', {'fetch': [0.5, 'Fetching data'],
+                                             'dynamic_snapshots': [0.2, 'Load \'snapshots\''],
+                                             'dynamic_snapshots_avg': [0.1, 'Load \'snapshots\' (avg)']})
+        ApiMetrics.record('vdisk-list|GET', {'fetch': [1.5, 'Fetching data']})
+        metrics = ApiMetrics.get_metrics()
+        self.assertEqual(metrics.keys(), ['vdisk-list|GET'])
+        self.assertEqual(sorted(metrics['vdisk-list|GET'].keys()), ['dynamic_snapshots', 'fetch'])
+        self.assertEqual(metrics['vdisk-list|GET']['fetch']['count'], 2)
+        self.assertEqual(metrics['vdisk-list|GET']['fetch']['sum'], 2.0)
+        self.assertEqual(metrics['vdisk-list|GET']['fetch']['max'], 1.5)
@@ -0,0 +1,100 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+
+"""
+Worker state test module
+"""
+import unittest
+from ovs.dal.tests.helpers import DalHelper
+from ovs.extensions.storage.volatilefactory import VolatileFactory
+from ovs.extensions.celery.workerstate import WorkerState, WorkerStateAggregator
+
+
+class WorkerStateTest(unittest.TestCase):
+    """
+    The worker state test suite will validate the aggregation of the celery events, as served by the task API
+    """
+    def setUp(self):
+        """
+        (Re)Sets the stores on every test
+        """
+        DalHelper.setup()
+
+    def tearDown(self):
+        """
+        Clean up the unittest
+        """
+        DalHelper.teardown()
+
+    def test_events(self):
+        """
+        Validates whether the tasks move through the states based on the events
+        """
+        aggregator = WorkerStateAggregator(app=None)
+        for event in [{'type': 'worker-online', 'hostname': 'worker1'},
+                      {'type': 'task-received', 'hostname': 'worker1', 'uuid': 'task1', 'name': 'ovs.test', 'eta': None},
+                      {'type': 'task-received', 'hostname': 'worker1', 'uuid': 'task2', 'name': 'ovs.test', 'eta': '2018-01-01T00:00:00'},
+                      {'type': 'task-received', 'hostname': 'worker1', 'uuid': 'task3', 'name': 'ovs.test', 'eta': None},
+                      {'type': 'task-started', 'hostname': 'worker1', 'uuid': 'task1', 'pid': 1},
+                      {'type': 'task-revoked', 'hostname': 'worker1', 'uuid': 'task3'}]:
+            aggregator._on_event(event)
+        aggregator._flush()
+        tasks = WorkerState.get_tasks()
+        self.assertEqual([task['id'] for task in tasks['active']['worker1']], ['task1'])
+        self.assertEqual(tasks['active']['worker1'][0]['name'], 'ovs.test')
+        self.assertEqual([task['request']['id'] for task in tasks['scheduled']['worker1']], ['task2'])
+        self.assertEqual(tasks['reserved']['worker1'], [])
+        self.assertEqual(tasks['revoked']['worker1'], ['task3'])
+
+        for event in [{'type': 'task-succeeded', 'hostname': 'worker1', 'uuid': 'task1'},
+                      {'type': 'task-started', 'hostname': 'worker1', 'uuid': 'task2', 'pid': 1}]:
+            aggregator._on_event(event)
+        aggregator._flush()
+        tasks = WorkerState.get_tasks()
+        self.assertEqual([task['id'] for task in tasks['active']['worker1']], ['task2'])
+        self.assertEqual(tasks['scheduled']['worker1'], [])
+
+        aggregator._on_event({'type': 'worker-offline', 'hostname': 'worker1'})
+        aggregator._flush()
+        self.assertEqual(WorkerState.get_tasks()['active'], {})
+
+    def test_lease(self):
+        """
+        Validates whether only a single aggregator holds the lease and a lease which was not renewed in time is given up
+        """
+        volatile = VolatileFactory.get_client()
+        aggregator_1 = WorkerStateAggregator(app=None)
+        aggregator_2 = WorkerStateAggregator(app=None)
+        aggregator_2._id = '{0}_other'.format(aggregator_1._id)
+        self.assertTrue(aggregator_1._acquire_lease())
+        self.assertFalse(aggregator_2._acquire_lease())
+        self.assertTrue(aggregator_1._renew_lease())
+        self.assertFalse(aggregator_2._renew_lease())
+        self.assertEqual(volatile.get(WorkerStateAggregator.LEASE_KEY)['id'], aggregator_1._id)
+
+        # A lease which almost expired is not overwritten anymore, the holder stops aggregating
+        lease = volatile.get(WorkerStateAggregator.LEASE_KEY)
+        lease['until'] -= WorkerStateAggregator.LEASE_TIME
+        volatile.set(WorkerStateAggregator.LEASE_KEY, lease, WorkerStateAggregator.LEASE_TIME)
+        self.assertFalse(aggregator_1._renew_lease())
+
+        # Once the lease expired, another aggregator takes over and the previous holder can not take it back
+        volatile.delete(WorkerStateAggregator.LEASE_KEY)
+        self.assertTrue(aggregator_2._acquire_lease())
+        self.assertFalse(aggregator_1._renew_lease())
+        self.assertFalse(aggregator_1._acquire_lease())
+        self.assertEqual(volatile.get(WorkerStateAggregator.LEASE_KEY)['id'], aggregator_2._id)
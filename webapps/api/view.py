@@ -30,13 +30,12 @@ from api.oauth2.decorators import auto_response, limit, authenticated
 from ovs.dal.lists.backendtypelist import BackendTypeList
 from ovs.dal.lists.bearertokenlist import BearerTokenList
 from ovs.dal.lists.storagerouterlist import StorageRouterList
-from ovs_extensions.api.client import OVSClient
 from ovs_extensions.api.exceptions import HttpMethodNotAllowedException
+from ovs.extensions.generic.clientpool import OVSClientPool
 from ovs.extensions.generic.configuration import Configuration
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.system import System
 from ovs.extensions.packages.packagefactory import PackageFactory
-from ovs.extensions.storage.volatilefactory import VolatileFactory
 
 
 class MetadataView(View):
@@ -146,27 +145,30 @@ def relay(*args, **kwargs):
     ** This will translate to /apt/relay/storagerouters/
     Parameters:
     * Mandatory: ip, port, client_id, client_secret
+    * Optional: cache_ttl, amount of seconds a GET response may be served from a short-lived cache
     * All other parameters will be passed through to the specified node
+    Authenticated clients are pooled per node and credentials, so the OAuth 2 token is reused until it expires
     """
 
     @authenticated()
     @required_roles(['read'])
     @load()
-    def _relay(_, ip, port, client_id, client_secret, raw_version, request):
+    def _relay(_, ip, port, client_id, client_secret, raw_version, request, cache_ttl=None):
         path = '/{0}'.format(request.path.replace('/api/relay/', ''))
         method = request.META['REQUEST_METHOD'].lower()
-        client = OVSClient(ip, port,
-                           credentials=(client_id, client_secret),
-                           version=raw_version,
-                           raw_response=True,
-                           cache_store=VolatileFactory.get_client())
-        if not hasattr(client, method):
+        client = OVSClientPool.get_client(ip, port,
+                                          credentials=(client_id, client_secret),
+                                          version=raw_version,
+                                          raw_response=True)
+        if not hasattr(client.client, method):
             raise HttpMethodNotAllowedException(error='unavailable_call',
                                                 error_description='Method not available in relay')
-        client_kwargs = {'params': request.GET}
+        params = request.GET.copy()
+        params.pop('cache_ttl', None)  # Only used by the relay itself
+        client_kwargs = {'params': params}
         if method != 'get':
             client_kwargs['data'] = request.POST
-        call_response = getattr(client, method)(path, **client_kwargs)
+        call_response = client.call(method, path, cache_ttl=cache_ttl, **client_kwargs)
         response = HttpResponse(call_response.text,
                                 content_type='application/json',
                                 status=call_response.status_code)